@@ -0,0 +1,657 @@
+"""
+Benchmark suite for the PyCarver pipeline.
+
+Synthetic raw disk images are generated with an MBR or GPT partition
+table, a file system partition (ext4 or FAT when mkfs.ext4 or mkfs.vfat
+are installed) and a raw data partition with JPG, PNG, GIF and PDF files
+embedded at known offsets between random, text and sparse (empty)
+regions. The stages of the pipeline are then timed on images of several
+sizes: partition parsing, partition extraction, hashing, tree building
+and file carving. Stages whose tool is not installed are skipped. The
+startup time of the core and of the GUI is measured with
+`python -X importtime`, and a budget can be given to fail the run when it
+regresses. The single pass (see pipeline) is checked by carving the data
+partition from the headers it saved, which must give the same files as a
+scan; the run fails otherwise.
+
+The results (seconds, MB/s and peak RSS of each stage) are stored as JSON
+so that they can be compared across releases. Everything runs offline.
+
+Usage:
+    python benchmark.py [--sizes 16,64,256] [--layout mbr|gpt|both]
+                        [--output results.json] [--compare old.json]
+                        [--max-startup MS] [--startup-only]
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import zlib
+import random
+import struct
+import shutil
+import hashlib
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from os import path
+
+from core import mmlsParser, getFilesTree, getMd5, runTool
+from distributed import parseScalpelAudit
+from signatures import loadSignatures, removeJobConfig
+
+
+SECTOR = 512
+MB = 1024 * 1024
+
+# Modules whose import time is measured: the core without tkinter, and
+# the GUI up to the creation of the window
+STARTUP_MODULES = ("core", "main")
+STARTUP_RUNS = 5
+
+# Paths of the tools, same defaults as the application
+TOOLS = {"mmls": "/usr/bin/mmls", "dd": "/bin/dd", "md5": "/usr/bin/md5sum",
+         "scalpel": "/usr/bin/scalpel", "mkfs.ext4": "mkfs.ext4", "mkfs.vfat": "mkfs.vfat"}
+
+
+def findTool(name):
+    """
+    Helper function to find a tool, first at its default path and then in
+    the PATH.
+    :param name: name of the tool
+    :type name: str
+    :return toolPath: path of the tool or None
+    :rtype toolPath: str
+    """
+    default = TOOLS[name]
+    if path.isfile(default) and os.access(default, os.X_OK):
+        return default
+    return shutil.which(path.basename(default))
+
+
+def makeJpeg(rnd, size):
+    """
+    Make a structurally valid baseline JPEG: SOI, APP0, DQT, SOF0, DHT,
+    SOS, entropy coded data and EOI.
+    :param rnd: random generator
+    :param size: approximate size of the file
+    :type rnd: random.Random
+    :type size: int
+    :rtype: bytes
+    """
+    def segment(marker, payload):
+        return b"\xff" + bytes([marker]) + struct.pack(">H", len(payload) + 2) + payload
+
+    data = b"\xff\xd8"
+    data += segment(0xE0, b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00")
+    data += segment(0xDB, b"\x00" + bytes(rnd.randrange(1, 100) for _ in range(64)))
+    data += segment(0xC0, b"\x08\x00\x10\x00\x10\x01\x01\x11\x00")
+    data += segment(0xC4, b"\x00" + b"\x00\x01" + b"\x00" * 14 + b"\x00")
+    data += segment(0xDA, b"\x01\x01\x00\x00\x3f\x00")
+    # Entropy coded data never contains a 0xFF byte without stuffing
+    scan = bytes(rnd.randrange(0, 255) for _ in range(max(16, size - len(data) - 2)))
+    return data + scan + b"\xff\xd9"
+
+
+def makePng(rnd, size):
+    """
+    Make a PNG with valid chunk CRCs: signature, IHDR, IDAT and IEND.
+    :param rnd: random generator
+    :param size: approximate size of the file
+    :type rnd: random.Random
+    :type size: int
+    :rtype: bytes
+    """
+    def chunk(kind, payload):
+        return struct.pack(">I", len(payload)) + kind + payload + \
+               struct.pack(">I", zlib.crc32(kind + payload) & 0xffffffff)
+
+    width = max(1, int((size / 3) ** 0.5))
+    raw = b"".join(b"\x00" + bytes(rnd.randrange(256) for _ in range(width * 3)) for _ in range(width))
+    data = b"\x89PNG\r\n\x1a\n"
+    data += chunk(b"IHDR", struct.pack(">IIBBBBB", width, width, 8, 2, 0, 0, 0))
+    data += chunk(b"IDAT", zlib.compress(raw))
+    data += chunk(b"IEND", b"")
+    return data
+
+
+def makeGif(rnd, size):
+    """
+    Make a GIF89a with one image and the trailer.
+    :param rnd: random generator
+    :param size: approximate size of the file
+    :type rnd: random.Random
+    :type size: int
+    :rtype: bytes
+    """
+    data = b"GIF89a" + struct.pack("<HHBBB", 16, 16, 0x80, 0, 0) + b"\x00\x00\x00\xff\xff\xff"
+    data += b"\x2c" + struct.pack("<HHHHB", 0, 0, 16, 16, 0) + b"\x02"
+    left = max(1, size - len(data) - 2)
+    while left > 0:
+        n = min(255, left)
+        data += bytes([n]) + bytes(rnd.randrange(256) for _ in range(n))
+        left -= n + 1
+    return data + b"\x00\x3b"
+
+
+def makePdf(rnd, size):
+    """
+    Make a small PDF with an object, a cross reference table and %%EOF.
+    :param rnd: random generator
+    :param size: approximate size of the file
+    :type rnd: random.Random
+    :type size: int
+    :rtype: bytes
+    """
+    text = " ".join("word%d" % rnd.randrange(1000) for _ in range(max(1, size // 8)))
+    body = b"%PDF-1.4\n"
+    offsets = []
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>",
+               b"<< /Type /Pages /Kids [] /Count 0 >>",
+               ("<< /Length %d >>\nstream\n%s\nendstream" % (len(text), text)).encode("ascii")]
+    for n in range(len(objects)):
+        offsets.append(len(body))
+        body += b"%d 0 obj\n" % (n + 1) + objects[n] + b"\nendobj\n"
+
+    xref = len(body)
+    body += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for o in offsets:
+        body += b"%010d 00000 n \n" % o
+    body += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return body
+
+
+SAMPLES = {"jpg": makeJpeg, "png": makePng, "gif": makeGif, "pdf": makePdf}
+
+
+def writeMbr(fp, partitions):
+    """
+    Write an MBR partition table.
+    :param fp: image opened for writing
+    :param partitions: list of (start sector, number of sectors, type)
+    :type fp: file
+    :type partitions: list
+    """
+    table = b""
+    for start, count, kind in partitions:
+        table += struct.pack("<B3sB3sII", 0, b"\xfe\xff\xff", kind, b"\xfe\xff\xff", start, count)
+    table += b"\x00" * (64 - len(table))
+    fp.seek(446)
+    fp.write(table + b"\x55\xaa")
+
+
+def writeGpt(fp, partitions, sectors):
+    """
+    Write a GPT partition table (protective MBR, primary and backup
+    headers and entries).
+    :param fp: image opened for writing
+    :param partitions: list of (start sector, number of sectors, type GUID)
+    :param sectors: number of sectors of the image
+    :type fp: file
+    :type partitions: list
+    :type sectors: int
+    """
+    writeMbr(fp, [(1, min(sectors - 1, 0xffffffff), 0xEE)])
+
+    entries = b""
+    for n in range(len(partitions)):
+        start, count, kind = partitions[n]
+        name = ("part%d" % n).encode("utf-16-le")
+        entries += kind.bytes_le + uuid.uuid4().bytes_le + struct.pack("<QQQ", start, start + count - 1, 0) + \
+                   name + b"\x00" * (72 - len(name))
+    entries += b"\x00" * (128 * 128 - len(entries))
+    entriesCrc = zlib.crc32(entries) & 0xffffffff
+    diskGuid = uuid.uuid4().bytes_le
+
+    def header(current, backup, entriesLba):
+        h = struct.pack("<8sIIIIQQQQ16sQIII", b"EFI PART", 0x00010000, 92, 0, 0, current, backup,
+                        34, sectors - 34, diskGuid, entriesLba, 128, 128, entriesCrc)
+        h = h[:16] + struct.pack("<I", zlib.crc32(h) & 0xffffffff) + h[20:]
+        return h + b"\x00" * (SECTOR - len(h))
+
+    fp.seek(SECTOR)
+    fp.write(header(1, sectors - 1, 2) + entries)
+    fp.seek((sectors - 33) * SECTOR)
+    fp.write(entries + header(sectors - 1, 1, sectors - 33))
+
+
+def makeFileSystem(imagePath, offset, size):
+    """
+    Create a file system inside a partition of the image with the tools
+    installed on the machine.
+    :param imagePath: path of the image
+    :param offset: offset in bytes of the partition
+    :param size: size in bytes of the partition
+    :type imagePath: str
+    :type offset: int
+    :type size: int
+    :return fsType: the file system created or "" if none could be created
+    :rtype fsType: str
+    """
+    ext4 = findTool("mkfs.ext4")
+    if ext4:
+        res = runTool("mkfs", [ext4, "-F", "-q", "-E", "offset=%d" % offset, imagePath, "%dk" % (size // 1024)])
+        if res["ReturnCode"] == 0:
+            return "ext4"
+
+    vfat = findTool("mkfs.vfat")
+    if vfat:
+        res = runTool("mkfs", [vfat, "--offset", str(offset // SECTOR), imagePath, str(size // 1024)])
+        if res["ReturnCode"] == 0:
+            return "fat"
+
+    return ""
+
+
+def makeImage(imagePath, size, layout="mbr", seed=0):
+    """
+    Generate a synthetic disk image. The first partition holds a file
+    system, the second one raw data with embedded files. A quarter of the
+    data partition is random data, a quarter text, and the rest is left
+    sparse.
+    :param imagePath: path of the image to create
+    :param size: size of the image in bytes
+    :param layout: "mbr" or "gpt"
+    :param seed: seed of the random generator
+    :type imagePath: str
+    :type size: int
+    :type layout: str
+    :type seed: int
+    :return manifest: partitions and embedded files with their offsets
+    :rtype manifest: dict
+    """
+    rnd = random.Random(seed)
+    sectors = size // SECTOR
+    first = 2048
+    usable = sectors - first - 34
+    fsSectors = (usable * 2 // 5) // 8 * 8
+    dataStart = first + fsSectors
+    dataSectors = (usable - fsSectors) // 8 * 8
+
+    with open(imagePath, "wb") as fp:
+        fp.truncate(size)
+        if layout == "gpt":
+            linux = uuid.UUID("0fc63daf-8483-4772-8e79-3d47d8e4de47")
+            writeGpt(fp, [(first, fsSectors, linux), (dataStart, dataSectors, linux)], sectors)
+        else:
+            writeMbr(fp, [(first, fsSectors, 0x83), (dataStart, dataSectors, 0xDA)])
+
+    fsType = makeFileSystem(imagePath, first * SECTOR, fsSectors * SECTOR)
+
+    manifest = {"Image": imagePath, "Size": size, "Layout": layout, "FSType": fsType,
+                "Partitions": [{"Start": first, "Length": fsSectors},
+                               {"Start": dataStart, "Length": dataSectors}],
+                "Files": []}
+
+    dataOffset = dataStart * SECTOR
+    dataSize = dataSectors * SECTOR
+    slot = 256 * 1024
+
+    with open(imagePath, "r+b") as fp:
+        pos = dataOffset
+        end = dataOffset + dataSize
+        n = 0
+        while pos + slot <= end:
+            region = n % 4
+            if region == 0:
+                fp.seek(pos)
+                fp.write(rnd.randbytes(slot // 2))
+            elif region == 1:
+                fp.seek(pos)
+                fp.write((" ".join("evidence%d" % rnd.randrange(10000) for _ in range(slot // 20))).encode("ascii")[:slot // 2])
+
+            # Regions 2 and 3 stay sparse apart from the embedded file
+            kind = list(SAMPLES)[n % len(SAMPLES)]
+            sample = SAMPLES[kind](rnd, rnd.randrange(2048, 16 * 1024))
+            fileOffset = pos + slot // 2 + rnd.randrange(0, slot // 4) // SECTOR * SECTOR
+            fp.seek(fileOffset)
+            fp.write(sample)
+            manifest["Files"].append({"Type": kind, "Offset": fileOffset, "Length": len(sample),
+                                      "MD5": hashlib.md5(sample).hexdigest()})
+            pos += slot
+            n += 1
+
+    with open(imagePath + ".json", "w") as fp:
+        json.dump(manifest, fp, indent=2)
+
+    return manifest
+
+
+def makeTree(folder, count, rnd):
+    """
+    Create a folder hierarchy with count small files, used to benchmark
+    the building of the files tree.
+    :param folder: root folder
+    :param count: number of files
+    :param rnd: random generator
+    :type folder: str
+    :type count: int
+    :type rnd: random.Random
+    """
+    for n in range(count):
+        sub = path.join(folder, "d%d" % (n % 10), "d%d" % (n % 7), "d%d" % (n % 3))
+        os.makedirs(sub, exist_ok=True)
+        with open(path.join(sub, "f%d.bin" % n), "wb") as fp:
+            fp.write(rnd.randbytes(64))
+
+
+def peakRss():
+    """
+    Helper function to get the peak resident set size of this process and
+    of its finished children.
+    :return rss: peak RSS in KiB of (self, children)
+    :rtype rss: tuple
+    """
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def timeStage(results, name, size, layout, function, bytes=0, items=0):
+    """
+    Time a stage of the pipeline and add its result.
+    :param results: list of results
+    :param name: name of the stage
+    :param size: size of the image
+    :param layout: partition table of the image
+    :param function: function running the stage, it returns a dictionary
+                     with extra fields or a string with the reason the
+                     stage was skipped
+    :param bytes: bytes processed by the stage
+    :param items: items processed by the stage
+    :type results: list
+    :type name: str
+    :type size: int
+    :type layout: str
+    :type function: function
+    :type bytes: int
+    :type items: int
+    """
+    start = time.perf_counter()
+    extra = function()
+    seconds = time.perf_counter() - start
+    rss, childRss = peakRss()
+
+    entry = {"Stage": name, "ImageMB": size // MB, "Layout": layout}
+    if isinstance(extra, str):
+        entry["Skipped"] = extra
+    else:
+        entry.update({"Seconds": seconds, "Bytes": bytes, "Items": items,
+                      "MBps": bytes / MB / seconds if seconds and bytes else 0.0,
+                      "ItemsPerSecond": items / seconds if seconds and items else 0.0,
+                      "PeakRSSKiB": rss, "PeakChildRSSKiB": childRss})
+        entry.update(extra or {})
+
+    results.append(entry)
+    if "Skipped" in entry:
+        summary = entry["Skipped"]
+    elif items:
+        summary = "%.3fs %.1f items/s" % (seconds, entry["ItemsPerSecond"])
+    else:
+        summary = "%.3fs %.1f MB/s" % (seconds, entry["MBps"])
+    print("%-10s %-4s %6d MB  %s" % (name, layout, size // MB, summary))
+
+
+def importTime(module, runs=STARTUP_RUNS):
+    """
+    Measure the import time of a module in a new interpreter with
+    `python -X importtime`, keeping the fastest of several runs.
+    :param module: name of the module
+    :param runs: number of interpreters started
+    :type module: str
+    :type runs: int
+    :return result: Seconds (cumulative import time of the module) and
+                    Slowest (the modules taking the most time to import
+                    themselves), or a string if the module can not be
+                    imported
+    :rtype result: dict
+    """
+    best = None
+    for n in range(runs):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                              cwd=path.dirname(path.abspath(__file__)), stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, universal_newlines=True)
+        if proc.returncode:
+            return "import failed: " + proc.stderr.strip().splitlines()[-1]
+
+        # Lines are "import time: self [us] | cumulative | name"
+        times = []
+        for line in proc.stderr.splitlines():
+            fields = line.split("|")
+            if not line.startswith("import time:") or len(fields) != 3 or not fields[1].strip().isdigit():
+                continue
+            times.append((int(fields[0].split(":")[1]), int(fields[1]), fields[2].strip()))
+
+        total = [cumulative for own, cumulative, name in times if name == module]
+        if total and (best is None or total[-1] < best["Seconds"] * 1e6):
+            slowest = sorted(times, reverse=True)[:5]
+            best = {"Seconds": total[-1] / 1e6,
+                    "Slowest": [{"Module": name, "Seconds": own / 1e6} for own, cumulative, name in slowest]}
+
+    return best or "no import time for " + module
+
+
+def runStartup(results):
+    """
+    Measure the startup time of each of the STARTUP_MODULES.
+    :param results: list of results
+    :type results: list
+    """
+    for module in STARTUP_MODULES:
+        entry = {"Stage": "startup:" + module, "ImageMB": 0, "Layout": ""}
+        measured = importTime(module)
+        if isinstance(measured, str):
+            entry["Skipped"] = measured
+            summary = measured
+        else:
+            entry.update(measured)
+            summary = "%.3fs, slowest: %s" % (measured["Seconds"], measured["Slowest"][0]["Module"])
+        results.append(entry)
+        print("%-15s %s" % (entry["Stage"], summary))
+
+
+def runBenchmark(size, layout, workDir, results):
+    """
+    Run every stage of the pipeline on a synthetic image.
+    :param size: size of the image in bytes
+    :param layout: "mbr" or "gpt"
+    :param workDir: folder for the images and outputs
+    :param results: list of results
+    :type size: int
+    :type layout: str
+    :type workDir: str
+    :type results: list
+    """
+    imagePath = path.join(workDir, "bench_%s_%d.raw" % (layout, size // MB))
+    state = {}
+
+    def generate():
+        state["Manifest"] = makeImage(imagePath, size, layout)
+        return {"Layout": layout, "FSType": state["Manifest"]["FSType"]}
+
+    timeStage(results, "generate", size, layout, generate, bytes=size)
+    manifest = state["Manifest"]
+
+    def parse():
+        mmls = findTool("mmls")
+        if not mmls:
+            return "mmls not installed"
+        out = runTool("mmls", [mmls, imagePath])
+        partitions, bs = mmlsParser(out["Stdout"].splitlines())
+        return {"Partitions": len(partitions)}
+
+    timeStage(results, "parse", size, layout, parse)
+
+    partitions = manifest["Partitions"]
+    extracted = [path.join(workDir, "part%d.raw" % n) for n in range(len(partitions))]
+
+    def extract():
+        dd = findTool("dd")
+        if not dd:
+            return "dd not installed"
+        for n in range(len(partitions)):
+            runTool("dd", [dd, "if=" + imagePath, "of=" + extracted[n], "bs=%d" % SECTOR,
+                           "skip=%d" % partitions[n]["Start"], "count=%d" % partitions[n]["Length"]])
+        return {}
+
+    partBytes = sum(p["Length"] for p in partitions) * SECTOR
+    timeStage(results, "extract", size, layout, extract, bytes=partBytes)
+
+    def hashTool():
+        md5 = findTool("md5")
+        if not md5:
+            return "md5sum not installed"
+        return {"MD5": getMd5(imagePath, md5)}
+
+    timeStage(results, "hash", size, layout, hashTool, bytes=size)
+
+    def hashLib():
+        md5 = hashlib.md5()
+        with open(imagePath, "rb") as fp:
+            for block in iter(lambda: fp.read(4 * MB), b""):
+                md5.update(block)
+        return {"MD5": md5.hexdigest()}
+
+    timeStage(results, "hashlib", size, layout, hashLib, bytes=size)
+
+    treeDir = path.join(workDir, "tree_%d" % (size // MB))
+    count = max(100, size // MB * 20)
+    makeTree(treeDir, count, random.Random(size))
+
+    timeStage(results, "tree", size, layout, lambda: {"Entries": len(getFilesTree(treeDir))}, items=count)
+
+    def carve():
+        scalpel = findTool("scalpel")
+        if not scalpel:
+            return "scalpel not installed"
+        if not path.isfile(extracted[1]):
+            return "data partition not extracted"
+        configPath = loadSignatures().makeJobConfig(list(SAMPLES))
+        out = path.join(workDir, "carved_%d" % (size // MB))
+        shutil.rmtree(out, ignore_errors=True)
+        try:
+            runTool("scalpel", [scalpel, "-c", configPath, extracted[1], "-o", out])
+        finally:
+            removeJobConfig(configPath)
+
+        # Compare the carved files with the embedded ones
+        base = partitions[1]["Start"] * SECTOR
+        expected = set(f["Offset"] - base for f in manifest["Files"])
+        auditPath = path.join(out, "audit.txt")
+        found = parseScalpelAudit(auditPath) if path.isfile(auditPath) else []
+        hits = sum(1 for name, start, length in found if start in expected)
+        return {"Carved": len(found), "Embedded": len(expected), "Found": hits}
+
+    timeStage(results, "carve", size, layout, carve, bytes=partitions[1]["Length"] * SECTOR,
+              items=len(manifest["Files"]))
+
+    def singlePass():
+        # The data partition does not start at offset 0: its headers must
+        # still be saved relative to the partition
+        import carver
+        from core import singlePass as extractOnce
+        from pipeline import loadHeaders
+
+        targets = [(extracted[n] + ".once", partitions[n]["Start"] * SECTOR, partitions[n]["Length"] * SECTOR)
+                   for n in range(len(partitions))]
+        passed = extractOnce(imagePath, targets, "buffered", fileTypes=list(SAMPLES))
+        if not passed["Success"]:
+            return {"Mismatch": passed["Error"]}
+
+        dataPath = targets[1][0]
+        headers = loadHeaders(dataPath + ".headers.json", path.getsize(dataPath), list(SAMPLES))
+        out = path.join(workDir, "once_%d" % (size // MB))
+        shutil.rmtree(out, ignore_errors=True)
+        fromHeaders = carver.carveFiles(dataPath, out + "_headers", list(SAMPLES), headers=headers)
+        scanned = carver.carveFiles(dataPath, out + "_scan", list(SAMPLES))
+        for folder in (out + "_headers", out + "_scan"):
+            shutil.rmtree(folder, ignore_errors=True)
+
+        result = {"Carved": fromHeaders["Carved"], "Scanned": scanned["Carved"]}
+        if headers is None or fromHeaders["Files"] != scanned["Files"]:
+            result["Mismatch"] = "carving from the saved headers differs from a scan"
+        return result
+
+    timeStage(results, "singlePass", size, layout, singlePass, bytes=size, items=len(manifest["Files"]))
+
+    for f in extracted + [imagePath]:
+        for suffix in ("", ".once", ".once.headers.json"):
+            if path.isfile(f + suffix):
+                os.remove(f + suffix)
+    shutil.rmtree(treeDir, ignore_errors=True)
+
+
+def compareResults(old, new):
+    """
+    Print the change in throughput of every stage between two runs.
+    :param old: results of the previous run
+    :param new: results of this run
+    :type old: dict
+    :type new: dict
+    """
+    previous = {(r["Stage"], r["ImageMB"], r["Layout"]): r for r in old["Results"]}
+    print("\n%-10s %-4s %8s %12s %12s %8s" % ("Stage", "", "Size MB", "Before s", "After s", "Change"))
+    for r in new["Results"]:
+        p = previous.get((r["Stage"], r["ImageMB"], r["Layout"]))
+        if p is None or "Seconds" not in p or "Seconds" not in r:
+            continue
+        change = (r["Seconds"] - p["Seconds"]) / p["Seconds"] * 100 if p["Seconds"] else 0.0
+        print("%-10s %-4s %8d %12.3f %12.3f %+7.1f%%" % (r["Stage"], r["Layout"], r["ImageMB"], p["Seconds"],
+                                                      r["Seconds"], change))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the PyCarver pipeline on synthetic images.")
+    parser.add_argument("--sizes", default="16,64,256", help="image sizes in MB, comma separated")
+    parser.add_argument("--layout", default="both", choices=("mbr", "gpt", "both"))
+    parser.add_argument("--workdir", default=None, help="folder for the temporary images")
+    parser.add_argument("--output", default="bench_results.json", help="JSON file for the results")
+    parser.add_argument("--compare", default=None, help="JSON results of a previous run")
+    parser.add_argument("--max-startup", type=float, default=None,
+                        help="fail if importing the GUI takes more milliseconds")
+    parser.add_argument("--startup-only", action="store_true", help="only measure the startup time")
+    args = parser.parse_args(argv)
+
+    workDir = args.workdir or tempfile.mkdtemp(prefix="pycarver_bench_")
+    os.makedirs(workDir, exist_ok=True)
+    layouts = ("mbr", "gpt") if args.layout == "both" else (args.layout,)
+
+    results = []
+    runStartup(results)
+    if not args.startup_only:
+        for layout in layouts:
+            for size in args.sizes.split(","):
+                runBenchmark(int(size) * MB, layout, workDir, results)
+
+    out = {"Date": time.strftime("%Y-%m-%dT%H:%M:%S"), "Python": sys.version.split()[0],
+           "Platform": platform.platform(), "CPUs": os.cpu_count(), "Results": results}
+
+    with open(args.output, "w") as fp:
+        json.dump(out, fp, indent=2)
+    print("Results saved to " + args.output)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            compareResults(json.load(fp), out)
+
+    if not args.workdir:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    mismatches = [r for r in results if r.get("Mismatch")]
+    for r in mismatches:
+        print("%s %s %d MB: %s" % (r["Stage"], r["Layout"], r["ImageMB"], r["Mismatch"]))
+    if mismatches:
+        sys.exit(1)
+
+    if args.max_startup is not None:
+        startup = [r for r in results if r["Stage"] == "startup:main" and "Seconds" in r]
+        if startup and startup[0]["Seconds"] * 1000 > args.max_startup:
+            print("Startup took %.0f ms, more than %.0f ms" % (startup[0]["Seconds"] * 1000, args.max_startup))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
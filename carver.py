@@ -0,0 +1,231 @@
+"""
+Built-in structure aware file carver.
+
+Scalpel writes every carve up to the maximum size of its type when the
+footer is not found. This carver looks for the same headers, but infers
+the true length of each file from its structure (see formats.py) and
+writes only those bytes:
+    jpg: up to the EOI marker
+    png: up to the IEND chunk
+    gif: up to the trailer
+    pdf: up to the last %%EOF within the maximum size
+Files whose structure is broken are not written at all. The other types of
+the signature registry (signatures.py) are carved up to their footer, or
+up to their maximum size when they have none.
+
+The output folder has the same layout as the one of Scalpel (one folder
+per type and an audit.txt file), so the rest of PyCarver can read it the
+same way. With a content store (see contentstore), each file is hashed
+before it is written, and only linked when its content is already stored.
+"""
+
+import mmap
+import bisect
+from os import path, makedirs
+from datetime import datetime
+
+from formats import CHECKS, InvalidFile
+from signatures import loadSignatures
+from contentstore import detachFolder, writeManifest
+
+
+# Bytes read past the end of a range to match a header that starts in it
+HEADER_MARGIN = 256
+
+
+def findFooter(data, start, limit, footers):
+    """
+    Helper function to find the end of a file of a type without a
+    structural check, from the footers of its rules.
+    :param data: content of the partition
+    :param start: offset of the header
+    :param limit: offset where the data available for the file ends
+    :param footers: list of (footer, mode) of the type
+    :type data: mmap
+    :type start: int
+    :type limit: int
+    :type footers: list
+    :return end: offset of the end of the footer
+    :rtype end: int
+    """
+    if not footers:
+        return limit
+
+    ends = []
+    for footer, mode in footers:
+        if mode == "REVERSE":
+            pos = data.rfind(footer, start + 1, limit)
+        else:
+            pos = data.find(footer, start + 1, limit)
+        if pos >= 0:
+            ends.append(pos + len(footer))
+
+    if not ends:
+        raise InvalidFile("missing footer")
+    return min(ends)
+
+
+def carveFiles(partitionPath, outFolder, fileTypes, maxSizes=None, signatures=None, ranges=None, headers=None,
+               store=None):
+    """
+    Carve the files of the given types out of a partition.
+    :param partitionPath: path of the carved partition
+    :param outFolder: output folder
+    :param fileTypes: types of files to carve
+    :param maxSizes: maximum size of each type, to override the registry
+    :param signatures: signature registry, by default loadSignatures()
+    :param ranges: regions to search for headers, in the order to search
+                   them, as (start, end); by default the whole partition
+                   (see entropy.EntropyMap.ranges)
+    :param headers: offsets and groups of the headers found beforehand
+                    (see pipeline.HeaderStage), so the partition is not
+                    scanned again; only the headers in ranges are carved
+    :param store: content store where the files are written once, and
+                  linked in outFolder
+    :type partitionPath: str
+    :type outFolder: str
+    :type fileTypes: list
+    :type maxSizes: dict
+    :type signatures: SignatureDB
+    :type ranges: list
+    :type headers: list
+    :type store: ContentStore
+    :return result: files carved, bytes written (not counting the files
+                    already in the store) and headers rejected
+    :rtype result: dict
+    """
+    if signatures is None:
+        signatures = loadSignatures()
+
+    fileTypes = [t for t in fileTypes if t in signatures.types()]
+    sizes = {t: signatures.maxSize(t) for t in fileTypes}
+    sizes.update(maxSizes or {})
+    footers = {t: signatures.footers(t) for t in fileTypes}
+
+    result = {"Carved": 0, "Bytes": 0, "Rejected": 0, "Files": []}
+    if not fileTypes:
+        return result
+
+    # One named group per type, so a match tells its type
+    pattern = signatures.matcher(fileTypes)
+
+    makedirs(outFolder, exist_ok=True)
+    # Files linked to the store by a previous carve must not be rewritten
+    detachFolder(outFolder)
+    stored = []
+    folders = {}
+    for n in range(len(fileTypes)):
+        folders[fileTypes[n]] = path.join(outFolder, "%s-%d-0" % (fileTypes[n], n))
+
+    with open(partitionPath, "rb") as fp:
+        if path.getsize(partitionPath) == 0:
+            return result
+        data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, "MADV_SEQUENTIAL") and not ranges:
+            data.madvise(mmap.MADV_SEQUENTIAL)
+
+        try:
+            size = len(data)
+            # Carved files, sorted by offset, to skip the headers found
+            # inside them when the ranges are not in order
+            starts = []
+            ends = []
+
+            def carveAt(start, group):
+                """
+                Carve the file whose header is at start.
+                :return end: end of the file, or None if it was rejected
+                """
+                kind = signatures.groupType(group)
+                limit = min(size, start + sizes[kind])
+
+                try:
+                    if kind in CHECKS:
+                        end = CHECKS[kind](data, start, limit)
+                    else:
+                        end = findFooter(data, start, limit, footers[kind])
+                except (InvalidFile, IndexError, ValueError):
+                    result["Rejected"] += 1
+                    return None
+
+                name = "%08d.%s" % (result["Carved"], kind)
+                makedirs(folders[kind], exist_ok=True)
+                filePath = path.join(folders[kind], name)
+                new = True
+                if store is not None:
+                    digest, new = store.putBytes(data[start:end])
+                    linked = store.link(digest, filePath)
+                    stored.append({"Path": path.relpath(filePath, outFolder), "SHA256": digest,
+                                   "Size": end - start, "Linked": linked})
+                if store is None or not stored[-1]["Linked"]:
+                    with open(filePath, "wb") as out:
+                        out.write(data[start:end])
+
+                result["Files"].append((name, start, end - start))
+                result["Carved"] += 1
+                result["Bytes"] += end - start if new else 0
+                n = bisect.bisect_right(starts, start)
+                starts.insert(n, start)
+                ends.insert(n, end)
+                return end
+
+            def insideCarved(start):
+                n = bisect.bisect_right(starts, start)
+                return ends[n - 1] if n and start < ends[n - 1] else None
+
+            if headers is not None:
+                # Only the pages of the files are read
+                wanted = set(pattern.groupindex)
+                for start, group in sorted(headers):
+                    if group not in wanted or not 0 <= start < size or insideCarved(start) is not None:
+                        continue
+                    if ranges and not any(begin <= start < end for begin, end in ranges):
+                        continue
+                    carveAt(start, group)
+                ranges = []
+
+            for rangeStart, rangeEnd in [(0, size)] if ranges is None else ranges:
+                pos = rangeStart
+                while True:
+                    # A header may start at the end of the range and go on
+                    # in the next one
+                    match = pattern.search(data, pos, min(size, rangeEnd + HEADER_MARGIN))
+                    if match is None or match.start() >= rangeEnd:
+                        break
+
+                    start = match.start()
+                    skip = insideCarved(start)
+                    if skip is not None:
+                        pos = skip
+                        continue
+
+                    end = carveAt(start, match.lastgroup)
+
+                    # Files embedded in this one (e.g. thumbnails) are skipped
+                    pos = start + 1 if end is None else end
+        finally:
+            data.close()
+
+    writeAudit(outFolder, partitionPath, result)
+    if store is not None:
+        writeManifest(outFolder, stored)
+    return result
+
+
+def writeAudit(outFolder, partitionPath, result):
+    """
+    Write the audit file of the carve with the same columns as Scalpel.
+    :param outFolder: output folder
+    :param partitionPath: path of the carved partition
+    :param result: result of carveFiles
+    :type outFolder: str
+    :type partitionPath: str
+    :type result: dict
+    """
+    with open(path.join(outFolder, "audit.txt"), "w") as fp:
+        fp.write("PyCarver built-in carver, started at %s\n" % datetime.today().isoformat())
+        fp.write("Carving %s\n\n" % partitionPath)
+        fp.write("The following files were carved:\n")
+        fp.write("File\t\t  Start\t\t\tChop\t\tLength\t\tExtracted From\n")
+        for name, start, length in result["Files"]:
+            fp.write("%s\t%13d\t\tNO\t%13d\t\t%s\n" % (name, start, length, path.basename(partitionPath)))
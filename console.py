@@ -0,0 +1,128 @@
+"""
+Model of the console of PyCarver: the last lines written, in a ring
+buffer, and the lines waiting to be shown.
+
+Inserting each line in the Text widget and redrawing it made the window
+crawl as soon as a tool reported every file, and the widget kept every
+line. Here a line is only appended to the buffer, from any thread; the
+window takes the pending lines on a timer and inserts them in one go,
+and the widget never holds more than maxLines lines. The lines can be
+filtered by level and by job, the buffer keeps them all.
+
+Levels of the lines:
+    command: a command run by PyCarver ("$" lines)
+    info:    a message ("\t" lines)
+    warning: something skipped or changed
+    error:   a failure
+
+Usage:
+    console = ConsoleBuffer(maxLines=5000)
+    console.add("Partition 1 carved", "\t", job="001")
+    lines, redraw = console.take()
+"""
+
+import threading
+from collections import deque
+
+
+LEVELS = ("command", "info", "warning", "error")
+
+# Lines kept by default
+MAX_LINES = 5000
+
+
+class ConsoleBuffer:
+    """ Ring buffer of the lines of the console. """
+
+    def __init__(self, maxLines=MAX_LINES):
+        """
+        :param maxLines: number of lines kept, the oldest are dropped
+        :type maxLines: int
+        """
+        self.lock = threading.Lock()
+        self.lines = deque(maxlen=maxLines)
+        self.pending = []
+        self.redraw = False
+        self.levels = set(LEVELS)
+        self.job = None
+        self.added = 0
+
+    @property
+    def maxLines(self):
+        return self.lines.maxlen
+
+    def resize(self, maxLines):
+        """
+        Change the number of lines kept.
+        :type maxLines: int
+        """
+        with self.lock:
+            self.lines = deque(self.lines, maxlen=max(1, maxLines))
+            self.pending = []
+            self.redraw = True
+
+    def add(self, text, deli, level=None, job=None):
+        """
+        Add a line. Safe to call from any thread.
+        :param text: text of the line
+        :param deli: delimiter placed in front of the text
+        :param level: one of LEVELS, "command" for "$" lines and "info"
+                      for the others by default
+        :param job: job or partition the line is about
+        :type text: str
+        :type deli: str
+        :type level: str
+        :type job: str
+        """
+        if level is None:
+            level = "command" if deli == "$" else "info"
+        line = (deli + " " + text, level, job)
+        with self.lock:
+            self.lines.append(line)
+            self.added += 1
+            if self.redraw:
+                return
+            self.pending.append(line)
+            # More lines than the widget keeps: it is drawn again instead
+            if len(self.pending) > self.lines.maxlen:
+                self.pending = []
+                self.redraw = True
+
+    def matches(self, line):
+        """
+        Helper function to tell if a line passes the filter.
+        :type line: tuple
+        :rtype: bool
+        """
+        return line[1] in self.levels and (not self.job or (line[2] is not None and self.job in line[2]))
+
+    def setFilter(self, levels=None, job=None):
+        """
+        Show only the lines of the given levels and job. The widget is
+        drawn again on the next take.
+        :param levels: levels shown, all by default
+        :param job: part of the name of the jobs shown, all if empty
+        :type levels: iterable
+        :type job: str
+        """
+        with self.lock:
+            self.levels = set(levels or LEVELS)
+            self.job = job or None
+            self.pending = []
+            self.redraw = True
+
+    def take(self):
+        """
+        Take the lines to show since the last call.
+        :return lines: text of the lines passing the filter
+        :return redraw: True if the widget must be cleared first, the
+                        lines are then all the lines kept
+        :rtype lines: list
+        :rtype redraw: bool
+        """
+        with self.lock:
+            redraw = self.redraw
+            lines = list(self.lines) if redraw else self.pending
+            self.pending = []
+            self.redraw = False
+        return [line[0] for line in lines if self.matches(line)], redraw
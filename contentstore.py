@@ -0,0 +1,268 @@
+"""
+Content-addressed store of the recovered and carved files.
+
+tsk_recover, Scalpel and the built-in carver write their files in an
+output folder per partition and per run, so a file found in several
+partitions, or carved again, is stored once per copy. With the store,
+each content is kept once under its SHA-256, in
+<root>/<first 2 digits>/<digest>, and the output folders hold hard
+links to it: the usual layout, with the space of one copy. The files of
+each folder are listed with their digest in <folder>.objects.jsonl.
+
+The built-in carver hashes a file before writing it and only links it
+when the content is already stored. The files written by the external
+tools are added after the tool is done (see ingestFolder): the
+duplicates are replaced by links.
+
+The objects are read-only, and a folder is detached (see detachFolder)
+before a tool writes in it again, so writing a file never changes the
+copies linked elsewhere. When hard links are not possible (another file
+system, FAT...) the files are left as they are and only listed.
+
+Usage:
+    store = ContentStore("/cases/out/objects")
+    result = store.ingestFolder("/cases/out/out_002")
+    digest, new = store.putBytes(data)
+    store.link(digest, "/cases/out/carvedFiles_002/jpg-0-0/00000001.jpg")
+"""
+
+import os
+import json
+import errno
+import hashlib
+import threading
+from os import path, walk, makedirs
+
+from governor import governor
+
+
+# Folder of the store, inside the output folder
+STORE_FOLDER = "objects"
+
+# Errors of os.link when hard links are not possible
+NO_LINKS = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP)
+
+
+def manifestPath(folder):
+    """
+    Helper function to get the path of the list of the files of a folder.
+    :type folder: str
+    :rtype: str
+    """
+    return folder.rstrip(os.sep) + ".objects.jsonl"
+
+
+def detachFolder(folder):
+    """
+    Remove the links to the store from a folder, before a tool writes in
+    it again: a tool truncating a linked file would change the stored
+    content. The content stays in the store. Nothing is done if the
+    folder was never added to a store.
+    :param folder: output folder
+    :type folder: str
+    :return removed: number of links removed
+    :rtype removed: int
+    """
+    removed = 0
+    if not path.isfile(manifestPath(folder)):
+        return removed
+    for dirpath, dirnames, filenames in walk(folder):
+        for f in filenames:
+            filePath = path.join(dirpath, f)
+            try:
+                if os.lstat(filePath).st_nlink > 1:
+                    os.remove(filePath)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def writeManifest(folder, records):
+    """
+    Write the list of the files of a folder, e.g. when the files were
+    linked as they were written.
+    :param folder: output folder
+    :param records: Path (relative to the folder), SHA256, Size and
+                    Linked of each file
+    :type folder: str
+    :type records: list
+    """
+    tmpPath = manifestPath(folder) + ".tmp"
+    with open(tmpPath, "w") as out:
+        for record in records:
+            out.write(json.dumps(record) + "\n")
+    os.replace(tmpPath, manifestPath(folder))
+
+
+def hashFile(filePath):
+    """
+    Helper function to get the SHA-256 and the size of a file.
+    :rtype: tuple
+    """
+    sha = hashlib.sha256()
+    size = 0
+    with open(filePath, "rb") as fp:
+        for block in iter(lambda: fp.read(1024 * 1024), b""):
+            governor.throttle(len(block))
+            sha.update(block)
+            size += len(block)
+    return sha.hexdigest(), size
+
+
+class ContentStore:
+    """ Files stored once under their SHA-256 and linked in the folders. """
+
+    def __init__(self, root):
+        """
+        :param root: folder of the store
+        :type root: str
+        """
+        self.root = root
+        makedirs(root, exist_ok=True)
+
+    def objectPath(self, digest):
+        return path.join(self.root, digest[:2], digest)
+
+    def has(self, digest):
+        return path.isfile(self.objectPath(digest))
+
+    def tmpPath(self, digest):
+        # Several jobs may store the same content at the same time
+        return self.objectPath(digest) + ".%d.%d.tmp" % (os.getpid(), threading.get_ident())
+
+    def store(self, tmpPath, digest):
+        """
+        Helper function to move a written file in the store, read-only.
+        """
+        os.chmod(tmpPath, 0o444)
+        os.replace(tmpPath, self.objectPath(digest))
+
+    def putBytes(self, data):
+        """
+        Store a content, unless it is already stored.
+        :param data: content of the file
+        :type data: bytes
+        :return digest: SHA-256 of the content
+        :return new: False if the content was already stored
+        :rtype digest: str
+        :rtype new: bool
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        if self.has(digest):
+            return digest, False
+
+        makedirs(path.dirname(self.objectPath(digest)), exist_ok=True)
+        tmpPath = self.tmpPath(digest)
+        with open(tmpPath, "wb") as out:
+            out.write(data)
+        self.store(tmpPath, digest)
+        return digest, True
+
+    def link(self, digest, filePath):
+        """
+        Make filePath a hard link to a stored content, replacing the file
+        there if any.
+        :param digest: SHA-256 of the content
+        :param filePath: path of the link
+        :type digest: str
+        :type filePath: str
+        :return linked: False if hard links are not possible there
+        :rtype linked: bool
+        """
+        tmpPath = filePath + ".link"
+        try:
+            os.link(self.objectPath(digest), tmpPath)
+        except OSError as err:
+            if err.errno in NO_LINKS:
+                return False
+            raise
+        os.replace(tmpPath, filePath)
+        return True
+
+    def putFile(self, filePath):
+        """
+        Store the content of a file written by a tool and make the file a
+        link to it.
+        :param filePath: path of the file
+        :type filePath: str
+        :return digest: SHA-256 of the content
+        :return size: size of the file
+        :return new: False if the content was already stored
+        :return linked: False if the file could not be linked
+        :rtype digest: str
+        :rtype size: int
+        :rtype new: bool
+        :rtype linked: bool
+        """
+        digest, size = hashFile(filePath)
+        objectPath = self.objectPath(digest)
+        if self.has(digest):
+            if os.stat(filePath).st_ino == os.stat(objectPath).st_ino:
+                return digest, size, False, True
+            return digest, size, False, self.link(digest, filePath)
+
+        # The file becomes the stored copy, without copying it
+        makedirs(path.dirname(objectPath), exist_ok=True)
+        tmpPath = self.tmpPath(digest)
+        try:
+            os.link(filePath, tmpPath)
+        except OSError as err:
+            if err.errno in NO_LINKS:
+                return digest, size, True, False
+            raise
+        self.store(tmpPath, digest)
+        return digest, size, True, True
+
+    def ingestFolder(self, folder):
+        """
+        Add the files of an output folder to the store and list them in
+        the manifest of the folder. Files already linked to the store are
+        not hashed again.
+        :param folder: output folder of tsk_recover, Scalpel or the carver
+        :type folder: str
+        :return result: Files, New (contents stored), Duplicates (files
+                        whose content was already stored), Saved (bytes
+                        not stored again) and Manifest
+        :rtype result: dict
+        """
+        known = {}
+        if path.isfile(manifestPath(folder)):
+            with open(manifestPath(folder)) as fp:
+                for line in fp:
+                    record = json.loads(line)
+                    known[record["Path"]] = record
+
+        result = {"Files": 0, "New": 0, "Duplicates": 0, "Saved": 0, "Manifest": manifestPath(folder)}
+        tmpPath = manifestPath(folder) + ".tmp"
+        with open(tmpPath, "w") as out:
+            for dirpath, dirnames, filenames in walk(folder):
+                for f in sorted(filenames):
+                    filePath = path.join(dirpath, f)
+                    # The audit of Scalpel and of the carver is written again
+                    # by each carve
+                    if dirpath == folder and f == "audit.txt":
+                        continue
+                    if path.islink(filePath) or not path.isfile(filePath):
+                        continue
+                    relPath = path.relpath(filePath, folder)
+
+                    # A file still linked to its object did not change
+                    record = known.get(relPath)
+                    if record is not None and self.has(record["SHA256"]) and \
+                            os.stat(filePath).st_ino == os.stat(self.objectPath(record["SHA256"])).st_ino:
+                        out.write(json.dumps(record) + "\n")
+                        result["Files"] += 1
+                        continue
+
+                    digest, size, new, linked = self.putFile(filePath)
+                    record = {"Path": relPath, "SHA256": digest, "Size": size, "Linked": linked}
+                    out.write(json.dumps(record) + "\n")
+                    result["Files"] += 1
+                    if new:
+                        result["New"] += 1
+                    else:
+                        result["Duplicates"] += 1
+                        result["Saved"] += size if linked else 0
+        os.replace(tmpPath, manifestPath(folder))
+        return result
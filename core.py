@@ -0,0 +1,882 @@
+"""
+Core of PyCarver: the parsers of the outputs of the tools, the log, the
+tree of files and the tasks of the batch queue.
+
+This module does not use tkinter, so the carving can be scripted, run by
+the batch queue or benchmarked on a host without a display. The modules
+that are slow to import (asyncio through toolrunner, the exporters, the
+file checks and the signatures) are imported when they are first used:
+`python -X importtime -c "import core"` shows what is left.
+"""
+
+import threading
+import json
+import time
+import atexit
+from queue import Queue, Full, Empty
+from datetime import datetime
+from os import walk, sep, path, makedirs, replace, remove
+
+from metrics import metrics
+from governor import governor, MemoryBudgetExceeded
+from evidenceio import copyRange, READ_AHEAD
+
+
+def runTool(tool, cmd, timeout=None, onLine=None, stdin=None, stdoutPath=None):
+    """
+    Run an external tool with toolrunner.runTool. The runner (and
+    asyncio) is imported on the first call.
+    :param tool: name of the tool, used for its concurrency limit
+    :param cmd: command to run
+    :param stdoutPath: file where the standard output is written
+    :type tool: str
+    :type cmd: list
+    :type stdoutPath: str
+    :rtype: dict
+    """
+    from toolrunner import runTool
+    return runTool(tool, cmd, timeout=timeout, onLine=onLine, stdin=stdin, stdoutPath=stdoutPath)
+
+class Log:
+    """
+    Logging for the outputs. The records are written as JSON lines by a
+    background thread, so writing to the log never blocks the caller. If
+    the queue of records is full, new records are dropped and counted
+    instead of stalling the carving.
+    """
+    def __init__(self, logpath=None, maxBytes=10 * 1024 * 1024, backupCount=5,
+                 queueSize=10000, flushInterval=0.5):
+        """
+        Setup log path and create log based on current timestamp.
+        :param logpath: the path for the log file.
+        :param maxBytes: size of the log file before it is rotated
+        :param backupCount: number of rotated log files to keep
+        :param queueSize: maximum number of records waiting to be written
+        :param flushInterval: maximum seconds before a record is written
+        :type logpath: str
+        :type maxBytes: int
+        :type backupCount: int
+        :type queueSize: int
+        :type flushInterval: float
+        """
+        if logpath is None:
+            self.logpath = path.abspath(".")
+        else:
+            self.logpath = logpath
+
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+        self.flushInterval = flushInterval
+        # Counted by the callers and reset by the writer thread
+        self.dropped = 0
+        self.droppedLock = threading.Lock()
+
+        #create log
+        t = datetime.today().__format__("%Y-%m-%d_%H-%M-%S")
+        filename = "pycarver_"+t+".log"
+        self.logpath = path.join(self.logpath,filename)
+
+        self.file = open(self.logpath, "a")
+        self.file.write(json.dumps({"timestamp": datetime.today().isoformat(), "event": "log-created"}) + "\n")
+        self.file.flush()
+        print("--- PyCarver Log --- (Created at "+t+")\n")
+
+        self.queue = Queue(maxsize=queueSize)
+        self.thread = threading.Thread(target=self.writer, name="log-writer", daemon=True)
+        self.thread.start()
+
+        atexit.register(self.close)
+
+    def writeToLog(self, text):
+        """
+        Write something to the log with the current timestamp.
+        :param text: text to output to file
+        :type text: str
+        """
+        self.writeEvent("message", text=text)
+
+    def writeEvent(self, event, job=None, partition=None, duration=None, nbytes=None, **fields):
+        """
+        Write a structured record to the log with the current timestamp.
+        :param event: name of the event
+        :param job: job related to the event
+        :param partition: partition related to the event
+        :param duration: duration in seconds
+        :param nbytes: number of bytes processed
+        :param fields: other fields of the record
+        :type event: str
+        :type job: str
+        :type partition: str
+        :type duration: float
+        :type nbytes: int
+        """
+        record = {"timestamp": datetime.today().isoformat(), "event": event}
+        if job is not None:
+            record["job"] = job
+        if partition is not None:
+            record["partition"] = partition
+        if duration is not None:
+            record["duration"] = duration
+        if nbytes is not None:
+            record["bytes"] = nbytes
+        record.update(fields)
+
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            with self.droppedLock:
+                self.dropped += 1
+
+    def writer(self):
+        """
+        Main loop of the writer thread. Records are written in batches and
+        the file is flushed after each batch.
+        """
+        while True:
+            try:
+                records = [self.queue.get(timeout=self.flushInterval)]
+            except Empty:
+                continue
+
+            while len(records) < 1000:
+                try:
+                    records.append(self.queue.get_nowait())
+                except Empty:
+                    break
+
+            closing = records[-1] is None
+            lines = "".join(json.dumps(r, default=str) + "\n" for r in records if r is not None)
+
+            with self.droppedLock:
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                lines += json.dumps({"timestamp": datetime.today().isoformat(), "event": "records-dropped",
+                                     "count": dropped}) + "\n"
+
+            self.file.write(lines)
+            self.file.flush()
+
+            if self.file.tell() >= self.maxBytes:
+                self.rotate()
+
+            if closing:
+                self.file.close()
+                return
+
+    def rotate(self):
+        """
+        Rotate the log file: pycarver_<t>.log becomes pycarver_<t>.log.1
+        and so on, keeping backupCount files.
+        """
+        self.file.close()
+        for n in range(self.backupCount - 1, 0, -1):
+            src = "%s.%d" % (self.logpath, n)
+            if path.exists(src):
+                replace(src, "%s.%d" % (self.logpath, n + 1))
+        if self.backupCount:
+            replace(self.logpath, self.logpath + ".1")
+        else:
+            remove(self.logpath)
+        self.file = open(self.logpath, "a")
+
+    def close(self):
+        """
+        Write the pending records and close the log file.
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+
+def mmlsParser(f):
+    """
+    Helper function to parse the output of mmls.
+    :param f:   output of mmls
+    :type f:    str
+    :return info: list of json objects. Each json
+                object contains info of each partition
+                identified by mmls.
+    :return bs: block size of each partition as identified by mmls
+    :rtype info: list
+    :rtype bs: int
+    """
+
+    info = []
+    bs = -1
+
+    slotFound = False
+    partitionCounter = 0 #partitions carved
+
+    for line in f:
+        # find what the units are supposed to be
+        if "Units are in " in line:
+            bs = line[line.find("Units are in ") + len("Units are in "):line.find("-")]
+
+        line = line.strip().split(" ")
+
+        if (not slotFound):
+            if ("Slot" in line):
+                slotFound = True
+        else:
+            temp = {}
+            temp['Slot'] = line[2]
+            temp['CarvedFiles'] = "No"
+            temp["FSType"] = ""
+            temp["Path"] = ""
+            temp["Carved"] = "No"
+
+            if (line[2] == "Meta"):
+                temp["Start"] = line[8]
+                temp["End"] = line[11]
+                temp["Length"] = line[14]
+                temp["Description"] = " ".join(line[17:])
+                temp["FileSystem"] = "No"
+
+                # TODO: Add a number to distinguish between partitions
+                # with the same name
+                temp['Name'] = temp["Description"].replace(" ", "_")
+            else:
+
+                temp["Description"] = " ".join(line[14:])
+                temp["Start"] = line[5]
+                temp["End"] = line[8]
+                temp["Length"] = line[11]
+
+                if (":" in line[2]):
+                    temp["Description"] += "_fs%d"%(partitionCounter)
+                    temp["FileSystem"] = "Yes"
+
+                    partitionCounter = partitionCounter + 1
+                else:
+                    temp["FileSystem"] = "No"
+
+                temp['Name'] = temp["Description"].replace(" ", "_")
+
+
+            info.append(temp)
+
+    return info, bs
+
+
+def fsstatParser(f):
+    """
+    Helper function to parse the output of fsstat.
+    :param f: f is the output of fsstat
+    :type f: str
+    :return fsType:    This function will return the File System type of the
+                        partition.
+    :rtype fsType:  str
+    """
+    for line in f.splitlines():
+        # find the partition type:
+        indx = line.find("File System Type: ")
+        if indx > -1:
+            fsType = line[indx + len("File System Type: "):].strip()
+            return fsType
+
+
+# Estimated memory used by each entry of a tree of files
+TREE_ENTRY_BYTES = 512
+
+@metrics.timed("getFilesTree")
+def getFilesTree(path):
+    """
+    Function to get the folder hierarchy. It raises MemoryBudgetExceeded
+    if the tree does not fit in the memory budget of the governor.
+    :param path: The path of the folder to get the hierarchy of.
+    :type path: str
+    :return dir:    This function returns a Json object that contains
+                the files and folders within the specified folder
+    :rtype dir: str
+    """
+    dir = {}
+
+    # list to store the directories found
+    directories = []
+
+    # The tree is counted in the memory budget while it is built
+    reservation = governor.reserve(0, "the tree of " + path)
+
+    # Getting the files and directories in the given path
+    # This will traverse the entire folder
+    for (dirpath, dirnames, filenames) in walk(path):
+        try:
+            reservation.grow(TREE_ENTRY_BYTES * (1 + len(filenames)))
+        except MemoryBudgetExceeded:
+            reservation.release()
+            raise
+        directories.append(dirpath)
+
+        # Each directory will have an entry in the dictionary
+        # that contains a list of its files
+        dir[dirpath] = {}
+        dir[dirpath]['Files'] = []
+        for f in filenames:
+            dir[dirpath]['Files'].append(dirpath + sep + f)
+
+    directories.reverse()
+
+    # We are done with these directories
+    # They are now where they should
+    done = []
+
+    # Re positioning the directories under their parents
+    for d in directories:
+        for sub in directories:
+
+            # We are not done with this sub directory
+            if (sub not in done):
+
+                # If the sub directory starts with a parent
+                # path then we know that the subdirectory is a child
+                # of directory d
+                if (sub.startswith(d)):
+                    if (sub != d):
+                        # add the child to its parent entry
+                        # and add it to the done list
+                        dir[d][sub] = dir[sub]
+                        done.append(sub)
+
+                        # delete the child from the dir dictionary
+                        # to avoid repetitions
+                        del dir[sub]
+
+    reservation.release()
+    return dir
+
+
+def getMd5(filePath, md5Path, onError=None):
+    """
+    Helper function to calculate the md5 sum of the file in the given
+    path.
+    :param filePath: Path of the file being used in this function
+    :type filePath: str
+    :param md5Path: Path of md5sum
+    :type md5Path: str
+    :param onError: Function called with the error of md5sum, e.g. to
+                    show it in a message box
+    :type onError: function
+    :return md5: Returns the md5 sum of file in the given path
+    :rtype md5: str
+    """
+    md5 = ""
+
+    cmd = [md5Path, filePath]
+    md5Output = runTool("md5", cmd)
+
+    stdout = md5Output["Stdout"]
+    stderr = md5Output["Stderr"]
+
+    if stdout:
+        md5 = stdout.split(" ")[0]
+
+    elif onError is not None:
+        onError(stderr)
+
+    return md5
+
+# Orders in which the partitions can be carved, with their description
+CARVE_ORDERS = (("smallest", "Smallest partitions"),
+                ("filesystems", "File systems, smallest first"),
+                ("selection", "In the order they were selected"))
+
+def orderPartitions(partitions, indexes, order="smallest"):
+    """
+    Helper function to sort the partitions to carve, so the ones that
+    are quick to carve or the most useful give results first.
+    :param partitions: Partitions of the disk image, from mmlsParser
+    :type partitions: list
+    :param indexes: Positions of the partitions to carve
+    :type indexes: list
+    :param order: One of CARVE_ORDERS
+    :type order: str
+    :return indexes: the positions in the order to carve them
+    :rtype indexes: list
+    """
+    if order == "smallest":
+        return sorted(indexes, key=lambda i: int(partitions[i]["Length"]))
+    if order == "filesystems":
+        return sorted(indexes, key=lambda i: (partitions[i]["FileSystem"] != "Yes", int(partitions[i]["Length"])))
+    return list(indexes)
+
+def discoverPartitionsTask(jobQueue, job):
+    """
+    Batch task: find the partitions of a disk image with mmls and add the
+    jobs to carve, hash, recover and carve files from each partition, and
+    to index the text and the fuzzy hashes of the files. With SinglePass,
+    one singlePass job extracts and hashes all the partitions.
+    :param jobQueue: The queue running the job
+    :type jobQueue: JobQueue
+    :param job: The job being run
+    :type job: dict
+    :return result: number of partitions found
+    :rtype result: dict
+    """
+    args = job["Args"]
+    tools = args["Tools"]
+
+    diskImageOut = runTool("mmls", [tools["mmls"], args["Image"]])
+
+    if not diskImageOut["Stdout"]:
+        raise RuntimeError("mmls failed: " + diskImageOut["Stderr"])
+
+    partitions, bs = mmlsParser(diskImageOut["Stdout"].splitlines())
+
+    imageName = path.basename(args["Image"])
+    outFolder = path.join(args["Output"], imageName.replace(" ", "_"))
+    makedirs(outFolder, exist_ok=True)
+
+    # Segment hashes of the image, to verify it later. With a single pass
+    # they are computed while the partitions are extracted
+    if args.get("HashImage") and not args.get("SinglePass"):
+        jobQueue.addJob("hashImage", {"Image": args["Image"], "Output": outFolder,
+                                      "IO": args.get("IO", {"Mode": "dd", "ReadAhead": READ_AHEAD})},
+                        priority=job["Priority"], dependsOn=[job["Id"]], label=imageName)
+
+    partitionArgs = []
+    for i in range(len(partitions)):
+        partition = partitions[i]
+        if partition["Slot"] == "Meta":
+            continue
+
+        outPath = path.join(outFolder, partition["Name"].replace("/", "_") + "_" + str(i))
+        partArgs = {"Image": args["Image"], "Tools": tools, "Partition": partition, "Path": outPath,
+                    "bs": bs, "Output": outFolder, "FileTypes": args["FileTypes"], "Index": i,
+                    "IO": args.get("IO", {"Mode": "dd", "ReadAhead": READ_AHEAD})}
+        if args.get("ContentStore"):
+            # One store for the whole batch: the same file in two images
+            # is stored once
+            from contentstore import STORE_FOLDER
+            partArgs["Store"] = path.join(args["Output"], STORE_FOLDER)
+        partitionArgs.append(partArgs)
+
+    # One read of the image extracts and hashes every partition
+    if args.get("SinglePass"):
+        passId = jobQueue.addJob("singlePass", {"Image": args["Image"], "Tools": tools, "bs": bs,
+                                                "Output": outFolder, "FileTypes": args["FileTypes"],
+                                                "Partitions": partitionArgs, "HashImage": args.get("HashImage"),
+                                                "IO": args.get("IO", {"Mode": "dd", "ReadAhead": READ_AHEAD})},
+                                 priority=job["Priority"], dependsOn=[job["Id"]], label=imageName)
+
+    for partArgs in partitionArgs:
+        partition = partArgs["Partition"]
+        outPath = partArgs["Path"]
+        label = imageName + ": " + partition["Description"]
+
+        if args.get("SinglePass"):
+            carveId = passId
+        else:
+            carveId = jobQueue.addJob("carvePartition", partArgs, priority=job["Priority"],
+                                      dependsOn=[job["Id"]], label=label)
+            jobQueue.addJob("hashPartition", partArgs, priority=job["Priority"],
+                            dependsOn=[carveId], label=label)
+
+        if partition["FileSystem"] == "Yes":
+            recoverId = jobQueue.addJob("recoverFiles", partArgs, priority=job["Priority"],
+                                        dependsOn=[carveId], label=label)
+            producers = [(recoverId, "out_")]
+            if args["FileTypes"]:
+                carveFilesId = jobQueue.addJob("carveFiles", partArgs, priority=job["Priority"],
+                                               dependsOn=[carveId], label=label)
+                producers.append((carveFilesId, "carvedFiles_"))
+
+            # The text and the fuzzy hashes of the results are indexed
+            # once each tool is done
+            for producerId, prefix in producers:
+                folderArgs = dict(partArgs, Folder=path.join(outFolder, prefix + path.basename(outPath)),
+                                  Label=label)
+                if args.get("IndexText"):
+                    jobQueue.addJob("indexText", folderArgs, priority=job["Priority"],
+                                    dependsOn=[producerId], label=label)
+                if args.get("FuzzyHash"):
+                    jobQueue.addJob("fuzzyHash", folderArgs, priority=job["Priority"],
+                                    dependsOn=[producerId], label=label)
+
+    return {"Partitions": len(partitions), "bs": bs}
+
+def extractPartition(imagePath, outPath, bs, start, length, ioMode="dd", readAhead=READ_AHEAD, ddPath="/bin/dd"):
+    """
+    Helper function to copy a partition out of a disk image, with dd or
+    with one of the modes of evidenceio.
+    :param imagePath: Path of the disk image
+    :type imagePath: str
+    :param outPath: Path of the partition to write
+    :type outPath: str
+    :param bs: Block size, as given by mmls
+    :type bs: str
+    :param start: First block of the partition
+    :type start: str
+    :param length: Number of blocks of the partition
+    :type length: str
+    :param ioMode: "dd" or one of evidenceio.MODES
+    :type ioMode: str
+    :param readAhead: Size of each read, in bytes
+    :type readAhead: int
+    :param ddPath: Path of dd
+    :type ddPath: str
+    :return result: the command (for the console), Success, Duration
+                    and Error
+    :rtype result: dict
+    """
+    if ioMode == "dd":
+        cmd = [ddPath, "if=" + imagePath, "of=" + outPath, "bs=" + bs, "skip=" + start, "count=" + length]
+        carvedPart = runTool("dd", cmd)
+        success = "records" in carvedPart["Stdout"] or "records" in carvedPart["Stderr"]
+        return {"Cmd": cmd, "Success": success, "Duration": carvedPart["Duration"], "Error": carvedPart["Stderr"]}
+
+    offset, size = int(start) * int(bs), int(length) * int(bs)
+    cmd = ["copyRange", imagePath, outPath, "offset=%d" % offset, "length=%d" % size, "mode=" + ioMode,
+           "readahead=%d" % readAhead]
+    begin = time.perf_counter()
+    try:
+        copied = copyRange(imagePath, outPath, offset, size, ioMode, readAhead)
+    except (IOError, OSError, ValueError) as err:
+        return {"Cmd": cmd, "Success": False, "Duration": time.perf_counter() - begin, "Error": str(err)}
+
+    error = "" if copied == size else "copied %d of %d bytes" % (copied, size)
+    return {"Cmd": cmd, "Success": copied == size, "Duration": time.perf_counter() - begin, "Error": error}
+
+def singlePass(imagePath, targets, ioMode="fadvise", readAhead=READ_AHEAD, fileTypes=None, entropyMaps=False,
+               manifestPath=None):
+    """
+    Extract several partitions of a disk image in one read of the image
+    (see pipeline). Each partition is hashed while it is written, and
+    its entropy map and the offsets of its file headers can be saved next
+    to it, for the carver. The segment hashes of the whole image are
+    computed in the same read when a manifest path is given.
+    :param imagePath: Path of the disk image
+    :type imagePath: str
+    :param targets: (outPath, offset, length) of each partition, in bytes
+    :type targets: list
+    :param ioMode: "dd" (read as "buffered") or one of evidenceio.MODES
+    :type ioMode: str
+    :param readAhead: Size of each read, in bytes
+    :type readAhead: int
+    :param fileTypes: Types of files whose headers are saved in
+                      <outPath>.headers.json, none if empty
+    :type fileTypes: list
+    :param entropyMaps: Save the entropy map of each partition in
+                        <outPath>.emap
+    :type entropyMaps: bool
+    :param manifestPath: Path of the segment manifest of the image (see
+                         merkle), not computed if None
+    :type manifestPath: str
+    :return result: the command (for the console), Success, Duration,
+                    Error and Targets (Path, Bytes and MD5 of each
+                    partition)
+    :rtype result: dict
+    """
+    from pipeline import Pipeline, WriterStage, HashStage, SegmentStage, EntropyStage, HeaderStage
+
+    mode = ioMode if ioMode != "dd" else "buffered"
+    cmd = ["singlePass", imagePath] + ["%s@%d+%d" % target for target in targets] + ["mode=" + mode]
+    begin = time.perf_counter()
+    try:
+        pipe = Pipeline(imagePath, mode, readAhead)
+        stages = []
+        for outPath, offset, length in targets:
+            stages.append((pipe.add(WriterStage(outPath, offset, length)),
+                           pipe.add(HashStage(("md5",), offset, length))))
+            if entropyMaps:
+                pipe.add(EntropyStage(offset, length, mapPath=outPath + ".emap"))
+            if fileTypes:
+                pipe.add(HeaderStage(fileTypes, offset, length, headersPath=outPath + ".headers.json"))
+        if manifestPath is not None:
+            segments = pipe.add(SegmentStage())
+            digests = pipe.add(HashStage(("md5", "sha256")))
+        pipe.run()
+    except (IOError, OSError, ValueError) as err:
+        return {"Cmd": cmd, "Success": False, "Duration": time.perf_counter() - begin, "Error": str(err),
+                "Targets": []}
+
+    if manifestPath is not None:
+        from merkle import saveManifest
+
+        manifest = dict(segments.result, Image=path.abspath(imagePath), MD5=digests.result["md5"],
+                        SHA256=digests.result["sha256"], Created=datetime.now().isoformat(timespec="seconds"))
+        saveManifest(manifest, manifestPath)
+
+    results = [{"Path": writer.result["Path"], "Bytes": writer.result["Bytes"], "MD5": md5.result["md5"]}
+               for writer, md5 in stages]
+    short = [r["Path"] for r, (_, _, length) in zip(results, targets) if r["Bytes"] != length]
+    return {"Cmd": cmd, "Success": not short, "Duration": time.perf_counter() - begin,
+            "Error": "short partitions: " + ", ".join(short) if short else "", "Targets": results}
+
+def singlePassTask(jobQueue, job):
+    """
+    Batch task: extract and hash every partition of a disk image, and
+    hash the image in segments, in one read of the image (see
+    singlePass). The headers of the types of files to carve are saved
+    next to each partition for carveFilesTask.
+    :param jobQueue: The queue running the job
+    :type jobQueue: JobQueue
+    :param job: The job being run
+    :type job: dict
+    :return result: Path, MD5Sum and FSType of each partition, and the
+                    path of the manifest
+    :rtype result: dict
+    """
+    args = job["Args"]
+    bs = int(args["bs"])
+
+    targets = [(p["Path"], int(p["Partition"]["Start"]) * bs, int(p["Partition"]["Length"]) * bs)
+               for p in args["Partitions"]]
+    manifest = None
+    if args.get("HashImage"):
+        from merkle import manifestPath
+        manifest = manifestPath(args["Output"], args["Image"])
+
+    passed = singlePass(args["Image"], targets, args["IO"]["Mode"], args["IO"]["ReadAhead"],
+                        args["FileTypes"], manifestPath=manifest)
+
+    if not passed["Success"]:
+        raise RuntimeError("single pass failed: " + passed["Error"])
+
+    partitions = []
+    for p, target in zip(args["Partitions"], passed["Targets"]):
+        fsType = ""
+        if p["Partition"]["FileSystem"] == "Yes":
+            fsstatOut = runTool("fsstat", [args["Tools"]["fsstat"], target["Path"]])
+            if fsstatOut["Stdout"]:
+                fsType = fsstatParser(fsstatOut["Stdout"]) or ""
+        partitions.append({"Path": target["Path"], "MD5Sum": target["MD5"], "FSType": fsType})
+
+    return {"Partitions": partitions, "Manifest": manifest}
+
+def carvePartitionTask(jobQueue, job):
+    """
+    Batch task: carve one partition out of the disk image with dd (or
+    the I/O backend given in the IO argument) and find its file system
+    type with fsstat.
+    :param jobQueue: The queue running the job
+    :type jobQueue: JobQueue
+    :param job: The job being run
+    :type job: dict
+    :return result: path and file system type of the carved partition
+    :rtype result: dict
+    """
+    args = job["Args"]
+    tools = args["Tools"]
+    partition = args["Partition"]
+    io = args.get("IO", {"Mode": "dd", "ReadAhead": READ_AHEAD})
+
+    extracted = extractPartition(args["Image"], args["Path"], args["bs"], partition["Start"], partition["Length"],
+                                 io["Mode"], io["ReadAhead"], tools["dd"])
+
+    if not extracted["Success"]:
+        raise RuntimeError("extraction failed: " + extracted["Error"])
+
+    fsType = ""
+    if partition["FileSystem"] == "Yes":
+        fsstatOut = runTool("fsstat", [tools["fsstat"], args["Path"]])
+        if fsstatOut["Stdout"]:
+            fsType = fsstatParser(fsstatOut["Stdout"]) or ""
+
+    return {"Path": args["Path"], "FSType": fsType}
+
+def hashPartitionTask(jobQueue, job):
+    """
+    Batch task: calculate the md5 sum of a carved partition.
+    :param jobQueue: The queue running the job
+    :type jobQueue: JobQueue
+    :param job: The job being run
+    :type job: dict
+    :return result: md5 sum of the partition
+    :rtype result: dict
+    """
+    args = job["Args"]
+    md5Output = runTool("md5", [args["Tools"]["md5"], args["Path"]])
+
+    if not md5Output["Stdout"]:
+        raise RuntimeError("md5sum failed: " + md5Output["Stderr"])
+
+    return {"MD5Sum": md5Output["Stdout"].split(" ")[0]}
+
+def storeOf(args):
+    """
+    Helper function to get the content store of a job, if the files are
+    stored by content (see contentstore).
+    :param args: arguments of the job
+    :type args: dict
+    :rtype: ContentStore
+    """
+    if not args.get("Store"):
+        return None
+
+    from contentstore import ContentStore
+    return ContentStore(args["Store"])
+
+def recoverFilesTask(jobQueue, job):
+    """
+    Batch task: recover the deleted files of a carved partition with
+    tsk_recover, and add them to the content store if there is one.
+    :param jobQueue: The queue running the job
+    :type jobQueue: JobQueue
+    :param job: The job being run
+    :type job: dict
+    :return result: output folder and number of recovered files
+    :rtype result: dict
+    """
+    args = job["Args"]
+    out = path.join(args["Output"], "out_" + path.basename(args["Path"]))
+
+    from export import FolderWatcher
+    from contentstore import detachFolder
+
+    detachFolder(out)
+
+    # The recovered files are exported while tsk_recover writes them
+    watcher = FolderWatcher(out, out + ".jsonl", source=args["Path"])
+    watcher.start()
+    try:
+        recoveredPart = runTool("tsk", [args["Tools"]["tsk"], args["Path"], out])
+    finally:
+        exported = watcher.stop()
+
+    if not recoveredPart["Stdout"]:
+        raise RuntimeError("tsk_recover failed: " + recoveredPart["Stderr"])
+
+    store = storeOf(args)
+    stored = store.ingestFolder(out) if store is not None and path.isdir(out) else None
+
+    return {"Path": out, "Recovered": int(recoveredPart["Stdout"].split(":")[1]),
+            "Export": out + ".jsonl", "Exported": exported, "Stored": stored}
+
+def carveFilesTask(jobQueue, job):
+    """
+    Batch task: carve files from a carved partition with Scalpel. The
+    configuration file is written inside the output folder of the image
+    so several carves can run at the same time. When a single pass saved
+    the headers of the partition, they are carved with the built-in
+    carver instead. The files are added to the content store if there is
+    one.
+    :param jobQueue: The queue running the job
+    :type jobQueue: JobQueue
+    :param job: The job being run
+    :type job: dict
+    :return result: output folder and number of carved files
+    :rtype result: dict
+    """
+    args = job["Args"]
+    name = path.basename(args["Path"])
+    out = path.join(args["Output"], "carvedFiles_" + name)
+
+    from export import FolderWatcher
+    from formats import validateFile
+    from signatures import loadSignatures, removeJobConfig
+    from pipeline import loadHeaders
+    from contentstore import detachFolder
+
+    detachFolder(out)
+    store = storeOf(args)
+
+    # The headers found by a single pass are carved with the built-in
+    # carver, which reads only the files instead of scanning again
+    headers = loadHeaders(args["Path"] + ".headers.json", path.getsize(args["Path"]), args["FileTypes"])
+    if headers is not None:
+        from carver import carveFiles
+
+        watcher = FolderWatcher(out, out + ".jsonl", source=args["Path"],
+                                validator=validateFile, quarantine=out + "_quarantine")
+        watcher.start()
+        try:
+            carved = carveFiles(args["Path"], out, args["FileTypes"], headers=headers, store=store)
+        finally:
+            exported = watcher.stop()
+
+        return {"Path": out, "Carved": carved["Carved"], "Export": out + ".jsonl", "Exported": exported,
+                "Validation": watcher.stats}
+
+    # Each job has its own configuration, so carves can run in parallel
+    configPath = loadSignatures().makeJobConfig(args["FileTypes"])
+
+    cmds = [args["Tools"]["scalpel"], "-c", configPath, args["Path"], "-o", out]
+
+    # The carved files are validated and exported while Scalpel writes them
+    watcher = FolderWatcher(out, out + ".jsonl", source=args["Path"],
+                            validator=validateFile, quarantine=out + "_quarantine")
+    watcher.start()
+    try:
+        carvedFiles = runTool("scalpel", cmds)
+    finally:
+        exported = watcher.stop()
+        removeJobConfig(configPath)
+
+    stdout = carvedFiles["Stdout"]
+    stderr = carvedFiles["Stderr"]
+
+    if not stdout or "ERROR" in stderr:
+        raise RuntimeError("scalpel failed: " + stderr)
+
+    stored = store.ingestFolder(out) if store is not None and path.isdir(out) else None
+
+    return {"Path": out, "Carved": int(stdout.split("files carved = ")[1].split(",")[0]),
+            "Export": out + ".jsonl", "Exported": exported, "Validation": watcher.stats, "Stored": stored}
+
+def indexTextTask(jobQueue, job):
+    """
+    Batch task: add the text of the files of an output folder to the
+    full-text index of the image. Only the files that are new or changed
+    since the folder was last indexed are read.
+    :param jobQueue: The queue running the job
+    :type jobQueue: JobQueue
+    :param job: The job being run
+    :type job: dict
+    :return result: path of the index and number of files indexed
+    :rtype result: dict
+    """
+    args = job["Args"]
+
+    from textindex import openIndex
+
+    indexPath = path.join(args["Output"], "text_index.sqlite")
+    indexed = openIndex(indexPath).updateFolder(args["Folder"]) if path.isdir(args["Folder"]) else 0
+
+    return {"Index": indexPath, "Folder": args["Folder"], "Indexed": indexed}
+
+def fuzzyHashTask(jobQueue, job):
+    """
+    Batch task: add the fuzzy hashes of the files of an output folder to
+    the similarity index of the image.
+    :param jobQueue: The queue running the job
+    :type jobQueue: JobQueue
+    :param job: The job being run
+    :type job: dict
+    :return result: path of the index and number of files hashed
+    :rtype result: dict
+    """
+    args = job["Args"]
+
+    from fuzzyhash import openFuzzyIndex
+
+    indexPath = path.join(args["Output"], "fuzzy_index.sqlite")
+    hashed = 0
+    if path.isdir(args["Folder"]):
+        hashed = openFuzzyIndex(indexPath).updateFolder(args["Folder"], args.get("Label", ""))
+
+    return {"Index": indexPath, "Folder": args["Folder"], "Hashed": hashed}
+
+def hashImageTask(jobQueue, job):
+    """
+    Batch task: hash a disk image in segments and write its manifest in
+    the output folder of the image, with the MD5 and SHA-256 of the whole
+    image.
+    :param jobQueue: The queue running the job
+    :type jobQueue: JobQueue
+    :param job: The job being run
+    :type job: dict
+    :return result: path of the manifest, root of the segment hashes, MD5
+                    and SHA-256
+    :rtype result: dict
+    """
+    args = job["Args"]
+
+    from merkle import hashImage, saveManifest, manifestPath
+
+    # dd reads are plain reads for the hashing
+    mode = args["IO"]["Mode"] if args["IO"]["Mode"] != "dd" else "buffered"
+    manifest = hashImage(args["Image"], mode=mode, readAhead=args["IO"]["ReadAhead"])
+    outPath = manifestPath(args["Output"], args["Image"])
+    saveManifest(manifest, outPath)
+
+    return {"Manifest": outPath, "Root": manifest["Root"], "MD5": manifest["MD5"], "SHA256": manifest["SHA256"]}
@@ -0,0 +1,278 @@
+"""
+Selective recovery of the deleted files of a partition.
+
+tsk_recover writes every deleted file of a partition before any of them
+can be seen, which on a large volume means tens of GB nobody needs. Here
+the deleted entries are listed first with fls (The Sleuth Kit), whose
+body format gives the path, inode, size and times of each entry, into a
+SQLite index. The analyst filters the index and only the chosen files are
+extracted with icat, several at a time.
+
+Usage:
+    index = DeletedIndex(path.join(outFolder, "deleted_index.sqlite"))
+    index.addEntries(partitionPath, listDeleted(partitionPath, "/usr/bin/fls"))
+    entries = index.search(name="*.jpg", minSize=1024)
+    results = extractFiles(partitionPath, entries, outFolder, "/usr/bin/icat")
+"""
+
+import sqlite3
+import threading
+from os import path, makedirs, remove
+
+from toolrunner import runTool, runner
+
+
+# Fields of a line of the body format of fls -m
+BODY_FIELDS = ("MD5", "Name", "Inode", "Mode", "UID", "GID", "Size", "Atime", "Mtime", "Ctime", "Crtime")
+TIMES = ("Atime", "Mtime", "Ctime", "Crtime")
+
+# Columns of the index, in the order of the results of search
+COLUMNS = ("Id", "Partition", "Inode", "Path", "Name", "Type", "Size", "Atime", "Mtime", "Ctime", "Crtime",
+           "Realloc")
+
+
+def parseBody(line):
+    """
+    Helper function to parse a line of fls -m. The name may hold "|", so
+    the fields are split from both ends.
+    :param line: line of the body format
+    :type line: str
+    :return entry: Path, Name, Inode, Type ("r" for files, "d" for
+                   folders...), Size, the four times (None when not set)
+                   and Realloc (True if the inode is used by another
+                   file), or None for a line of another format
+    :rtype entry: dict
+    """
+    head = line.rstrip("\n").split("|", 1)
+    if len(head) != 2:
+        return None
+    fields = head[1].rsplit("|", len(BODY_FIELDS) - 2)
+    if len(fields) != len(BODY_FIELDS) - 1 or not fields[5].isdigit():
+        return None
+    record = dict(zip(BODY_FIELDS[1:], fields))
+
+    name = record["Name"]
+    realloc = name.endswith(" (deleted-realloc)")
+    for suffix in (" (deleted-realloc)", " (deleted)"):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+
+    # The mode is "<type of the name>/<type of the inode><permissions>"
+    entry = {"Path": name, "Name": name.rsplit("/", 1)[-1], "Inode": record["Inode"],
+             "Type": record["Mode"].split("/")[0] or "-", "Size": int(record["Size"]), "Realloc": realloc}
+    for t in TIMES:
+        value = record[t]
+        entry[t] = int(value) if value.isdigit() and int(value) else None
+    return entry
+
+
+def listDeleted(partitionPath, flsPath):
+    """
+    List the deleted entries of a partition with fls.
+    :param partitionPath: path of the carved partition
+    :param flsPath: path of fls
+    :type partitionPath: str
+    :type flsPath: str
+    :return entries: entries of parseBody
+    :rtype entries: list
+    """
+    out = runTool("fls", [flsPath, "-r", "-d", "-m", "/", partitionPath])
+    if out["ReturnCode"] != 0:
+        raise RuntimeError("fls failed: " + (out["Stderr"].strip() or "no output"))
+
+    entries = []
+    for line in out["Stdout"].splitlines():
+        entry = parseBody(line)
+        if entry is not None:
+            entries.append(entry)
+    return entries
+
+
+def likePattern(pattern):
+    """
+    Helper function to turn a shell pattern (*, ?) into a LIKE pattern.
+    :param pattern: pattern of names, e.g. "*.doc?"
+    :type pattern: str
+    :rtype: str
+    """
+    escaped = pattern.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped.replace("*", "%").replace("?", "_")
+
+
+class DeletedIndex:
+    """ SQLite index of the deleted entries of one or more partitions. """
+
+    def __init__(self, dbPath=":memory:"):
+        """
+        :param dbPath: path of the database, in memory by default
+        :type dbPath: str
+        """
+        self.dbPath = dbPath
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(dbPath, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS deleted (id INTEGER PRIMARY KEY, partition TEXT, inode TEXT, "
+                        "path TEXT, name TEXT, type TEXT, size INTEGER, atime INTEGER, mtime INTEGER, "
+                        "ctime INTEGER, crtime INTEGER, realloc INTEGER)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS deleted_name ON deleted (name)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS deleted_size ON deleted (size)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS deleted_mtime ON deleted (mtime)")
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def addEntries(self, partition, entries):
+        """
+        Replace the entries of a partition.
+        :param partition: path of the partition
+        :param entries: entries of listDeleted
+        :type partition: str
+        :type entries: list
+        :return count: number of entries added
+        :rtype count: int
+        """
+        rows = [(partition, e["Inode"], e["Path"], e["Name"], e["Type"], e["Size"], e["Atime"], e["Mtime"],
+                 e["Ctime"], e["Crtime"], int(e["Realloc"])) for e in entries]
+        with self.lock:
+            self.db.execute("DELETE FROM deleted WHERE partition = ?", (partition,))
+            self.db.executemany("INSERT INTO deleted (partition, inode, path, name, type, size, atime, mtime, "
+                                "ctime, crtime, realloc) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.db.commit()
+        return len(rows)
+
+    def search(self, name=None, minSize=None, maxSize=None, after=None, before=None, partition=None,
+               types=("r",), realloc=False, limit=None):
+        """
+        Get the entries matching all the given filters.
+        :param name: shell pattern of the name, case insensitive
+        :param minSize: smallest size in bytes
+        :param maxSize: largest size in bytes
+        :param after: modified at or after this time (seconds since 1970)
+        :param before: modified before this time
+        :param partition: path of the partition
+        :param types: types of entries, None for all ("r" for files)
+        :param realloc: include the entries whose inode is used again
+        :param limit: maximum number of entries
+        :type name: str
+        :type minSize: int
+        :type maxSize: int
+        :type after: int
+        :type before: int
+        :type partition: str
+        :type types: tuple
+        :type realloc: bool
+        :type limit: int
+        :return entries: dictionaries with the COLUMNS, by path
+        :rtype entries: list
+        """
+        where, params = [], []
+        if name:
+            where.append("name LIKE ? ESCAPE '\\'")
+            params.append(likePattern(name))
+        for clause, value in (("size >= ?", minSize), ("size <= ?", maxSize), ("mtime >= ?", after),
+                              ("mtime < ?", before), ("partition = ?", partition)):
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        if types:
+            where.append("type IN (%s)" % ", ".join("?" * len(types)))
+            params.extend(types)
+        if not realloc:
+            where.append("realloc = 0")
+
+        query = "SELECT * FROM deleted"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY partition, path"
+        if limit:
+            query += " LIMIT %d" % limit
+
+        with self.lock:
+            rows = self.db.execute(query, params).fetchall()
+        entries = [dict(zip(COLUMNS, row)) for row in rows]
+        for e in entries:
+            e["Realloc"] = bool(e["Realloc"])
+        return entries
+
+    def get(self, ids):
+        """
+        Get entries by their Id.
+        :param ids: Ids of the entries
+        :type ids: list
+        :rtype: list
+        """
+        entries = []
+        with self.lock:
+            for n in range(0, len(ids), 500):
+                chunk = list(ids[n:n + 500])
+                rows = self.db.execute("SELECT * FROM deleted WHERE id IN (%s)" % ", ".join("?" * len(chunk)),
+                                       chunk).fetchall()
+                entries.extend(dict(zip(COLUMNS, row)) for row in rows)
+        return entries
+
+    def count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM deleted").fetchone()[0]
+
+
+def outputPath(outFolder, entry, used):
+    """
+    Helper function to get where a deleted file is written: its path
+    under outFolder, with the inode added when two files have the same
+    path.
+    :param outFolder: output folder
+    :param entry: entry of the index
+    :param used: output paths already given
+    :type outFolder: str
+    :type entry: dict
+    :type used: set
+    :rtype: str
+    """
+    parts = [p for p in entry["Path"].split("/") if p not in ("", ".", "..")]
+    target = path.join(outFolder, *parts) if parts else path.join(outFolder, entry["Inode"])
+    if target in used:
+        base, ext = path.splitext(target)
+        target = "%s_%s%s" % (base, entry["Inode"].replace("-", "_"), ext)
+    used.add(target)
+    return target
+
+
+def extractFiles(partitionPath, entries, outFolder, icatPath, onDone=None):
+    """
+    Extract deleted files with icat -r. The files are extracted in
+    parallel, within the limits of the tool runner and of the governor.
+    :param partitionPath: path of the partition
+    :param entries: entries of the index to extract
+    :param outFolder: output folder
+    :param icatPath: path of icat
+    :param onDone: function called with each result as it finishes
+    :type partitionPath: str
+    :type entries: list
+    :type outFolder: str
+    :type icatPath: str
+    :type onDone: function
+    :return results: Path, Inode, Size, Success and Error of each entry
+    :rtype results: list
+    """
+    used = set()
+    jobs = []
+    for entry in entries:
+        target = outputPath(outFolder, entry, used)
+        makedirs(path.dirname(target), exist_ok=True)
+        future = runner.submit("icat", [icatPath, "-r", partitionPath, entry["Inode"]], stdoutPath=target)
+        jobs.append((entry, target, future))
+
+    results = []
+    for entry, target, future in jobs:
+        out = future.result()
+        success = out["ReturnCode"] == 0
+        if not success and path.isfile(target):
+            remove(target)
+        written = path.getsize(target) if path.isfile(target) else 0
+        result = {"Path": target, "Inode": entry["Inode"], "Size": written, "Success": success,
+                  "Error": "" if success else out["Stderr"].strip()}
+        results.append(result)
+        if onDone is not None:
+            onDone(result)
+    return results
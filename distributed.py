@@ -0,0 +1,554 @@
+"""
+Distributed carving for PyCarver.
+
+A coordinator splits large partitions into byte ranges and hands out
+carving and hashing tasks to workers over TCP. Workers can run on other
+machines, as long as they can read the disk image and write to the
+output folder (e.g. a shared NFS evidence store).
+
+The coordinator listens on the loopback interface unless told otherwise,
+and a worker must first send the token of the coordinator: the tasks name
+the evidence and the results go into the case index. A worker only reads
+images and writes files under the folders it was given.
+
+The protocol is one JSON object per line:
+    worker      -> coordinator: {"Type": "Hello", "Worker": name, "Token": token}
+    worker      -> coordinator: {"Type": "Get", "Worker": name}
+    coordinator -> worker:      {"Type": "Task", "Task": {...}}
+                                {"Type": "Wait"} or {"Type": "Exit"}
+    worker      -> coordinator: {"Type": "Result", "Id": id, "Result": {...},
+                                 "Error": ""}
+
+Every result is appended to the case index, a JSON lines file in the
+output folder.
+
+Usage:
+    python distributed.py worker HOST PORT TOKEN IMAGE_ROOT OUTPUT_ROOT [SCALPEL_PATH]
+"""
+
+import sys
+import hmac
+import json
+import time
+import socket
+import shutil
+import hashlib
+import secrets
+import tempfile
+import threading
+import socketserver
+from collections import deque
+from os import path, makedirs, listdir
+
+from toolrunner import runTool
+from governor import governor
+
+
+# Size of the reads done by the workers
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def splitRanges(offset, length, rangeSize, overlap=0):
+    """
+    Split a region of the disk image in byte ranges. Each range is
+    extended by overlap bytes (without going past the end of the region)
+    so that files crossing the end of a range can still be carved.
+    :param offset:      Offset in bytes of the region in the image
+    :param length:      Length in bytes of the region
+    :param rangeSize:   Size of each range
+    :param overlap:     Extra bytes read after the end of each range
+    :type offset:       int
+    :type length:       int
+    :type rangeSize:    int
+    :type overlap:      int
+    :return ranges:     list of dictionaries with Offset, Length (bytes
+                        owned by the range) and ReadLength (bytes to read)
+    :rtype ranges:      list
+    """
+    ranges = []
+    end = offset + length
+    start = offset
+    while start < end:
+        size = min(rangeSize, end - start)
+        ranges.append({"Offset": start, "Length": size,
+                       "ReadLength": min(size + overlap, end - start)})
+        start += size
+    return ranges
+
+
+def insideRoots(filePath, roots):
+    """
+    Helper function to tell if a path is inside one of the given folders,
+    once the links and ".." are resolved.
+    :param filePath: path sent by the coordinator
+    :param roots: folders allowed
+    :type filePath: str
+    :type roots: list
+    :rtype: bool
+    """
+    real = path.realpath(filePath)
+    for root in roots:
+        root = path.realpath(root)
+        if path.commonpath([real, root]) == root:
+            return True
+    return False
+
+
+def checkTask(task, imageRoots, outputRoots):
+    """
+    Refuse a task reading an image or writing files outside the folders
+    of the worker.
+    :param task: the task received from the coordinator
+    :param imageRoots: folders of the images the worker may read
+    :param outputRoots: folders the worker may write to
+    :type task: dict
+    :type imageRoots: list
+    :type outputRoots: list
+    """
+    if not insideRoots(task["Image"], imageRoots):
+        raise PermissionError("Image outside the evidence folders of the worker: " + task["Image"])
+    if "Output" in task and not insideRoots(task["Output"], outputRoots):
+        raise PermissionError("Output outside the output folders of the worker: " + task["Output"])
+
+
+def readRange(imagePath, offset, length):
+    """
+    Generator that reads a byte range of a file in chunks.
+    :param imagePath: Path of the file to read
+    :param offset: Offset in bytes of the range
+    :param length: Length in bytes of the range
+    :type imagePath: str
+    :type offset: int
+    :type length: int
+    """
+    with open(imagePath, "rb") as fp:
+        fp.seek(offset)
+        left = length
+        while left > 0:
+            data = fp.read(min(CHUNK_SIZE, left))
+            if not data:
+                break
+            governor.throttle(len(data))
+            left -= len(data)
+            yield data
+
+
+def parseScalpelAudit(auditPath):
+    """
+    Helper function to parse the audit file written by Scalpel.
+    :param auditPath: Path of audit.txt
+    :type auditPath: str
+    :return files: list of (file name, start offset, length)
+    :rtype files: list
+    """
+    files = []
+    with open(auditPath, "r", errors="replace") as fp:
+        for line in fp:
+            fields = line.split()
+            if len(fields) >= 4 and fields[1].isdigit() and fields[3].isdigit():
+                files.append((fields[0], int(fields[1]), int(fields[3])))
+    return files
+
+
+def hashRangeTask(task):
+    """
+    Worker task: calculate the md5 sum of a byte range of the image.
+    :param task: the task received from the coordinator
+    :type task: dict
+    :return result: md5 sum and number of bytes hashed
+    :rtype result: dict
+    """
+    md5 = hashlib.md5()
+    size = 0
+    for data in readRange(task["Image"], task["Offset"], task["Length"]):
+        md5.update(data)
+        size += len(data)
+    return {"MD5Sum": md5.hexdigest(), "Bytes": size}
+
+
+def carveRangeTask(task, scalpelPath):
+    """
+    Worker task: carve files from a byte range of the image with Scalpel.
+    The range is copied to a local temporary file, carved, and the files
+    starting inside the range are moved to the output folder. Files that
+    start in the overlap belong to the next range and are dropped.
+    :param task: the task received from the coordinator
+    :type task: dict
+    :param scalpelPath: Path of scalpel on the worker
+    :type scalpelPath: str
+    :return result: carved files with their offset in the image
+    :rtype result: dict
+    """
+    tmpDir = tempfile.mkdtemp(prefix="pycarver_range_")
+    try:
+        rangePath = path.join(tmpDir, "range.raw")
+        with open(rangePath, "wb") as out:
+            for data in readRange(task["Image"], task["Offset"], task["ReadLength"]):
+                out.write(data)
+
+        configPath = path.join(tmpDir, "scal.config")
+        with open(configPath, "w") as fp:
+            fp.write(task["Config"])
+
+        carveDir = path.join(tmpDir, "out")
+        cmds = [scalpelPath, "-c", configPath, rangePath, "-o", carveDir]
+        stderr = runTool("scalpel", cmds)["Stderr"]
+
+        if "ERROR" in stderr:
+            raise RuntimeError(stderr)
+
+        files = []
+        auditPath = path.join(carveDir, "audit.txt")
+        if not path.isfile(auditPath):
+            return {"Files": files}
+
+        outFolder = task["Output"]
+        makedirs(outFolder, exist_ok=True)
+
+        carved = {}
+        for sub in listdir(carveDir):
+            subPath = path.join(carveDir, sub)
+            if path.isdir(subPath):
+                for f in listdir(subPath):
+                    carved[f] = path.join(subPath, f)
+
+        for name, start, length in parseScalpelAudit(auditPath):
+            if start >= task["Length"] or name not in carved:
+                continue
+            offset = task["Offset"] + start
+            dest = path.join(outFolder, "%012d_%s" % (offset, name))
+            shutil.move(carved[name], dest)
+            files.append({"Path": dest, "Offset": offset, "Length": length})
+
+        return {"Files": files}
+    finally:
+        shutil.rmtree(tmpDir, ignore_errors=True)
+
+
+class CoordinatorHandler(socketserver.StreamRequestHandler):
+    """ Serve the requests of one connected worker. """
+
+    def handle(self):
+        coordinator = self.server.coordinator
+        assigned = {}
+
+        try:
+            # Workers without the token are dropped before any task
+            hello = json.loads(self.rfile.readline(65536).decode("utf-8") or "{}")
+            token = str(hello.get("Token", "")).encode("utf-8")
+            if hello.get("Type") != "Hello" or not hmac.compare_digest(token, coordinator.token.encode("utf-8")):
+                return
+
+            for line in self.rfile:
+                msg = json.loads(line.decode("utf-8"))
+
+                if msg["Type"] == "Result":
+                    task = assigned.pop(msg["Id"], None)
+                    coordinator.finishTask(task, msg.get("Result"), msg.get("Error", ""))
+                    continue
+
+                if msg["Type"] != "Get":
+                    continue
+
+                task = coordinator.nextTask()
+                if task is None:
+                    reply = {"Type": "Exit"} if coordinator.closed else {"Type": "Wait"}
+                else:
+                    assigned[task["Id"]] = task
+                    reply = {"Type": "Task", "Task": task}
+
+                self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+                self.wfile.flush()
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+        finally:
+            # The worker went away, its unfinished tasks are queued again
+            for task in assigned.values():
+                coordinator.requeueTask(task)
+
+
+class CoordinatorServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """ TCP server of the coordinator. """
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Coordinator:
+    """
+    Hand out the carving and hashing tasks of large partitions to workers
+    and store their results in the case index.
+    """
+
+    def __init__(self, indexPath, host="127.0.0.1", port=0, token=None):
+        """
+        Setup the coordinator.
+        :param indexPath:   Path of the case index (JSON lines)
+        :param host:        Interface to listen on, only this machine by
+                            default
+        :param port:        Port to listen on, 0 to pick a free one
+        :param token:       Secret the workers must send, a random one by
+                            default
+        :type indexPath:    str
+        :type host:         str
+        :type port:         int
+        :type token:        str
+        """
+        self.indexPath = indexPath
+        self.token = token or secrets.token_hex(16)
+        self.tasks = deque()
+        self.pending = 0
+        self.closed = False
+        self.counter = 0
+        self.lock = threading.Condition()
+        self.listeners = []
+
+        self.server = CoordinatorServer((host, port), CoordinatorHandler)
+        self.server.coordinator = self
+        self.address = self.server.server_address
+        self.thread = None
+
+    def start(self):
+        """
+        Start accepting workers in a background thread.
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def shutdown(self):
+        """
+        Stop the server. Connected workers will be told to exit.
+        """
+        with self.lock:
+            self.closed = True
+        self.server.shutdown()
+        self.server.server_close()
+
+    def addPartition(self, imagePath, offset, length, outFolder, config=None,
+                     rangeSize=1024 ** 3, overlap=16 * 1024 ** 2, label=""):
+        """
+        Split a partition of the image in byte ranges and queue a hashing
+        task for each range and, if a Scalpel configuration is given, a
+        carving task for each range.
+        :param imagePath:   Path of the disk image, as seen by the workers
+        :param offset:      Offset in bytes of the partition
+        :param length:      Length in bytes of the partition
+        :param outFolder:   Folder for the carved files, as seen by the workers
+        :param config:      Content of the Scalpel configuration file
+        :param rangeSize:   Size of each range
+        :param overlap:     Extra bytes read by carving tasks (largest file)
+        :param label:       Name of the partition in the case index
+        :type imagePath:    str
+        :type offset:       int
+        :type length:       int
+        :type outFolder:    str
+        :type config:       str
+        :type rangeSize:    int
+        :type overlap:      int
+        :type label:        str
+        :return count:      number of tasks queued
+        :rtype count:       int
+        """
+        count = 0
+        for r in splitRanges(offset, length, rangeSize):
+            self.addTask(dict(r, Type="hash", Image=imagePath, Label=label))
+            count += 1
+
+        if config:
+            for r in splitRanges(offset, length, rangeSize, overlap):
+                self.addTask(dict(r, Type="carve", Image=imagePath, Label=label,
+                                  Output=outFolder, Config=config))
+                count += 1
+
+        return count
+
+    def addTask(self, task):
+        """
+        Queue a task for the workers.
+        :param task: the task
+        :type task: dict
+        """
+        with self.lock:
+            task["Id"] = self.counter
+            self.counter += 1
+            self.tasks.append(task)
+            self.pending += 1
+            self.lock.notify_all()
+
+    def nextTask(self):
+        """
+        Get the next task to send to a worker.
+        :return task: the task or None if there is nothing to do
+        :rtype task: dict
+        """
+        with self.lock:
+            if self.tasks:
+                return self.tasks.popleft()
+        return None
+
+    def requeueTask(self, task):
+        """
+        Put back a task that a worker did not finish.
+        :param task: the task
+        :type task: dict
+        """
+        with self.lock:
+            self.tasks.appendleft(task)
+            self.lock.notify_all()
+
+    def finishTask(self, task, result, error):
+        """
+        Store the result of a task in the case index.
+        :param task: the finished task
+        :param result: result sent by the worker
+        :param error: error sent by the worker
+        :type task: dict
+        :type result: dict
+        :type error: str
+        """
+        if task is None:
+            return
+
+        entry = {"Task": task["Type"], "Label": task["Label"], "Image": task["Image"],
+                 "Offset": task["Offset"], "Length": task["Length"],
+                 "Result": result, "Error": error}
+
+        with self.lock:
+            with open(self.indexPath, "a") as fp:
+                fp.write(json.dumps(entry) + "\n")
+            self.pending -= 1
+            self.lock.notify_all()
+            listeners = list(self.listeners)
+
+        for listener in listeners:
+            listener(entry)
+
+    def wait(self, timeout=None):
+        """
+        Wait until all the queued tasks are finished.
+        :param timeout: maximum number of seconds to wait
+        :type timeout: float
+        :return done: True if every task is finished
+        :rtype done: bool
+        """
+        with self.lock:
+            return self.lock.wait_for(lambda: self.pending == 0, timeout)
+
+
+class Worker:
+    """ Pull tasks from a coordinator and run them. """
+
+    def __init__(self, host, port, token, imageRoots, outputRoots, scalpelPath="/usr/bin/scalpel", name=None,
+                 poll=1.0):
+        """
+        Setup the worker.
+        :param host: Host of the coordinator
+        :param port: Port of the coordinator
+        :param token: Token of the coordinator
+        :param imageRoots: Folders of the images the worker may read
+        :param outputRoots: Folders the worker may write the files to
+        :param scalpelPath: Path of scalpel on this machine
+        :param name: Name of the worker
+        :param poll: Seconds to wait when there are no tasks
+        :type host: str
+        :type port: int
+        :type token: str
+        :type imageRoots: list
+        :type outputRoots: list
+        :type scalpelPath: str
+        :type name: str
+        :type poll: float
+        """
+        self.host = host
+        self.port = port
+        self.token = token
+        # Not copied: the folders can be added to while the worker runs
+        self.imageRoots = imageRoots
+        self.outputRoots = outputRoots
+        self.scalpelPath = scalpelPath
+        self.name = name or socket.gethostname()
+        self.poll = poll
+        self.stopped = False
+
+    def run(self):
+        """
+        Main loop of the worker. Returns when the coordinator goes away or
+        tells the worker to exit.
+        """
+        with socket.create_connection((self.host, self.port)) as sock:
+            rfile = sock.makefile("rb")
+            wfile = sock.makefile("wb")
+
+            wfile.write((json.dumps({"Type": "Hello", "Worker": self.name, "Token": self.token}) + "\n")
+                        .encode("utf-8"))
+
+            while not self.stopped:
+                wfile.write((json.dumps({"Type": "Get", "Worker": self.name}) + "\n").encode("utf-8"))
+                wfile.flush()
+
+                line = rfile.readline()
+                if not line:
+                    return
+
+                msg = json.loads(line.decode("utf-8"))
+                if msg["Type"] == "Exit":
+                    return
+                if msg["Type"] == "Wait":
+                    time.sleep(self.poll)
+                    continue
+
+                task = msg["Task"]
+                try:
+                    checkTask(task, self.imageRoots, self.outputRoots)
+                    if task["Type"] == "hash":
+                        result, error = hashRangeTask(task), ""
+                    else:
+                        result, error = carveRangeTask(task, self.scalpelPath), ""
+                except Exception as err:
+                    result, error = None, str(err)
+
+                reply = {"Type": "Result", "Id": task["Id"], "Result": result, "Error": error}
+                wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+                wfile.flush()
+
+    def stop(self):
+        """
+        Ask the worker to stop after its current task.
+        """
+        self.stopped = True
+
+
+def startLocalWorkers(coordinator, count, imageRoots, outputRoots, scalpelPath="/usr/bin/scalpel"):
+    """
+    Start workers in threads of this process, connected to a local
+    coordinator. Useful to use the distributed mode on a single machine
+    and to test it.
+    :param coordinator: the coordinator
+    :param count: number of workers
+    :param imageRoots: Folders of the images the workers may read
+    :param outputRoots: Folders the workers may write to
+    :param scalpelPath: Path of scalpel
+    :type coordinator: Coordinator
+    :type count: int
+    :type imageRoots: list
+    :type outputRoots: list
+    :type scalpelPath: str
+    :return workers: the started workers
+    :rtype workers: list
+    """
+    workers = []
+    port = coordinator.address[1]
+    for n in range(count):
+        w = Worker("127.0.0.1", port, coordinator.token, imageRoots, outputRoots, scalpelPath,
+                   name="local-%d" % n, poll=0.2)
+        threading.Thread(target=w.run, daemon=True).start()
+        workers.append(w)
+    return workers
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 7 or sys.argv[1] != "worker":
+        print(__doc__)
+        sys.exit(1)
+
+    scalpel = sys.argv[7] if len(sys.argv) > 7 else "/usr/bin/scalpel"
+    Worker(sys.argv[2], int(sys.argv[3]), sys.argv[4], [sys.argv[5]], [sys.argv[6]], scalpel).run()
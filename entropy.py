@@ -0,0 +1,317 @@
+"""
+Block level entropy and content class map of a disk image or partition.
+
+Each block of the data gets its Shannon entropy (in bits per byte) and a
+coarse class:
+    empty:      every byte of the block is the same (zeroed or wiped)
+    text:       mostly printable characters
+    data:       anything else (file systems, executables, documents)
+    compressed: high entropy (JPEG, PNG, ZIP, ...)
+    random:     as high as random data (encrypted or wiped with noise)
+
+The map is stored as a compact file (a header, then one byte of entropy
+and one byte of class per block) so it can be drawn as a heatmap and used
+again without reading the data. The carver uses it to skip the empty and
+random regions, where no file header can be found, and to search the
+regions most likely to hold files first.
+
+The histograms are computed with NumPy when it is installed, and with
+collections.Counter otherwise.
+"""
+
+import math
+import struct
+from array import array
+from collections import Counter
+from os import path
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from metrics import metrics
+from governor import governor
+
+
+BLOCK_SIZE = 64 * 1024
+
+EMPTY, TEXT, DATA, COMPRESSED, RANDOM = range(5)
+CLASSES = ("empty", "text", "data", "compressed", "random")
+
+# Classes skipped by the carver and order in which the others are searched
+SKIP = (EMPTY, RANDOM)
+PRIORITY = (COMPRESSED, DATA, TEXT, RANDOM, EMPTY)
+
+COMPRESSED_ENTROPY = 7.2
+TEXT_RATIO = 0.9
+PRINTABLE = [9, 10, 13] + list(range(32, 127))
+
+# Entropy is stored in 1/32 of bit
+SCALE = 32
+
+MAGIC = b"PCEM"
+VERSION = 1
+HEADER = struct.Struct("<4sHIQQQ")
+
+
+def randomEntropy(blockSize):
+    """
+    Helper function to get the entropy above which a block is classed as
+    random. The entropy of random data is a bit lower than 8 bits per
+    byte on a short block, by 255 / (2 * n * ln 2) on average: the
+    threshold is twice that below 8.
+    :param blockSize: size of a block
+    :type blockSize: int
+    :rtype: float
+    """
+    return 8 - 255 / (blockSize * math.log(2))
+
+
+def classify(entropy, printable, constant, blockSize):
+    """
+    Get the class of a block.
+    :param entropy: entropy of the block in bits per byte
+    :param printable: fraction of printable characters
+    :param constant: True if every byte of the block is the same
+    :param blockSize: size of the block
+    :type entropy: float
+    :type printable: float
+    :type constant: bool
+    :type blockSize: int
+    :rtype: int
+    """
+    if constant:
+        return EMPTY
+    if entropy >= randomEntropy(blockSize):
+        return RANDOM
+    if entropy >= COMPRESSED_ENTROPY:
+        return COMPRESSED
+    if printable >= TEXT_RATIO:
+        return TEXT
+    return DATA
+
+
+def blockStats(block):
+    """
+    Get the entropy and class of one block, without NumPy.
+    :param block: content of the block
+    :type block: bytes
+    :return entropy: entropy in bits per byte
+    :return cls: class of the block
+    :rtype entropy: float
+    :rtype cls: int
+    """
+    n = len(block)
+    counts = Counter(block)
+    entropy = 0.0
+    for c in counts.values():
+        p = c / n
+        entropy -= p * math.log2(p)
+    printable = sum(counts.get(b, 0) for b in PRINTABLE) / n
+    return entropy, classify(entropy, printable, len(counts) == 1, n)
+
+
+def chunkStats(chunk, blockSize):
+    """
+    Get the entropy and class of every full block of a chunk with NumPy:
+    the histograms of all the blocks are computed with a single bincount.
+    :param chunk: content of the chunk, a multiple of blockSize
+    :param blockSize: size of a block
+    :type chunk: bytes
+    :type blockSize: int
+    :return entropies: entropy of each block
+    :return classes: class of each block
+    :rtype entropies: list
+    :rtype classes: list
+    """
+    n = len(chunk) // blockSize
+    data = numpy.frombuffer(chunk, dtype=numpy.uint8, count=n * blockSize).reshape(n, blockSize)
+    index = data.astype(numpy.uint32) + (numpy.arange(n, dtype=numpy.uint32) * 256)[:, None]
+    counts = numpy.bincount(index.ravel(), minlength=n * 256).reshape(n, 256)
+
+    p = counts / float(blockSize)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        entropies = -numpy.where(counts > 0, p * numpy.log2(p), 0.0).sum(axis=1)
+    printable = counts[:, PRINTABLE].sum(axis=1) / float(blockSize)
+    constant = counts.max(axis=1) == blockSize
+
+    classes = [classify(entropies[i], printable[i], constant[i], blockSize) for i in range(n)]
+    return entropies.tolist(), classes
+
+
+class EntropyMap:
+    """ Entropy and class of every block of a range of a file. """
+
+    def __init__(self, blockSize=BLOCK_SIZE, offset=0, length=0):
+        """
+        :param blockSize: size of a block
+        :param offset: offset of the first block in the file
+        :param length: number of bytes covered by the map
+        :type blockSize: int
+        :type offset: int
+        :type length: int
+        """
+        self.blockSize = blockSize
+        self.offset = offset
+        self.length = length
+        self.entropy = array("B")
+        self.classes = array("B")
+
+    def add(self, entropy, cls):
+        """
+        Append the entropy and class of the next block.
+        :type entropy: float
+        :type cls: int
+        """
+        self.entropy.append(min(255, int(round(entropy * SCALE))))
+        self.classes.append(cls)
+
+    def __len__(self):
+        return len(self.classes)
+
+    def entropyAt(self, i):
+        """
+        Get the entropy of a block in bits per byte.
+        :param i: index of the block
+        :type i: int
+        :rtype: float
+        """
+        return self.entropy[i] / SCALE
+
+    def summary(self):
+        """
+        Get the number of blocks of each class.
+        :return counts: class name -> number of blocks
+        :rtype counts: dict
+        """
+        counts = Counter(self.classes)
+        return {CLASSES[c]: counts.get(c, 0) for c in range(len(CLASSES))}
+
+    def ranges(self, skip=SKIP):
+        """
+        Get the regions to search for files, the runs of blocks of the same
+        class that is not skipped, in the order of PRIORITY then offset.
+        :param skip: classes to leave out
+        :type skip: tuple
+        :return ranges: list of (start, end) relative to the offset of the map
+        :rtype ranges: list
+        """
+        runs = []
+        i = 0
+        while i < len(self.classes):
+            cls = self.classes[i]
+            j = i + 1
+            while j < len(self.classes) and self.classes[j] == cls:
+                j += 1
+            if cls not in skip:
+                runs.append((PRIORITY.index(cls), i * self.blockSize,
+                             min(j * self.blockSize, self.length)))
+            i = j
+
+        runs.sort()
+        return [(start, end) for rank, start, end in runs]
+
+    def save(self, filePath):
+        """
+        Write the map to a file.
+        :param filePath: path of the map file
+        :type filePath: str
+        """
+        with open(filePath, "wb") as fp:
+            fp.write(HEADER.pack(MAGIC, VERSION, self.blockSize, self.offset, self.length, len(self)))
+            self.entropy.tofile(fp)
+            self.classes.tofile(fp)
+
+
+def loadMap(filePath):
+    """
+    Read a map written by EntropyMap.save.
+    :param filePath: path of the map file
+    :type filePath: str
+    :rtype: EntropyMap
+    """
+    with open(filePath, "rb") as fp:
+        magic, version, blockSize, offset, length, count = HEADER.unpack(fp.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not an entropy map: %s" % filePath)
+        emap = EntropyMap(blockSize, offset, length)
+        emap.entropy.fromfile(fp, count)
+        emap.classes.fromfile(fp, count)
+    return emap
+
+
+def analyse(filePath, offset=0, length=None, blockSize=BLOCK_SIZE, chunkBlocks=64):
+    """
+    Compute the map of a range of a file.
+    :param filePath: path of the disk image or partition
+    :param offset: offset of the range
+    :param length: length of the range, by default up to the end of the file
+    :param blockSize: size of a block
+    :param chunkBlocks: number of blocks read at a time
+    :type filePath: str
+    :type offset: int
+    :type length: int
+    :type blockSize: int
+    :type chunkBlocks: int
+    :rtype: EntropyMap
+    """
+    if length is None:
+        length = path.getsize(filePath) - offset
+
+    emap = EntropyMap(blockSize, offset, length)
+
+    # NumPy needs about 5 bytes per byte of the chunk for the histograms
+    chunkSize = blockSize * chunkBlocks
+    with metrics.stage("entropyMap") as m, open(filePath, "rb") as fp, \
+            governor.reserve(chunkSize * (6 if numpy is not None else 1), "entropy map of " + filePath):
+        fp.seek(offset)
+        left = length
+        while left > 0:
+            chunk = fp.read(min(left, chunkSize))
+            if not chunk:
+                break
+            governor.throttle(len(chunk))
+            left -= len(chunk)
+            m["Bytes"] += len(chunk)
+
+            full = len(chunk) - len(chunk) % blockSize
+            if numpy is not None and full:
+                for entropy, cls in zip(*chunkStats(chunk, blockSize)):
+                    emap.add(entropy, cls)
+            else:
+                for pos in range(0, full, blockSize):
+                    emap.add(*blockStats(chunk[pos:pos + blockSize]))
+
+            # Last block, shorter than the others
+            if full < len(chunk):
+                emap.add(*blockStats(chunk[full:]))
+
+        m["Items"] = len(emap)
+    emap.length = length - left
+    return emap
+
+
+def mapFor(filePath, mapPath, blockSize=BLOCK_SIZE):
+    """
+    Get the map of a whole file, from mapPath if it was computed for the
+    same size of file, or by computing and saving it.
+    :param filePath: path of the disk image or partition
+    :param mapPath: path of the map file
+    :param blockSize: size of a block
+    :type filePath: str
+    :type mapPath: str
+    :type blockSize: int
+    :rtype: EntropyMap
+    """
+    if path.isfile(mapPath):
+        try:
+            emap = loadMap(mapPath)
+            if emap.offset == 0 and emap.length == path.getsize(filePath) and emap.blockSize == blockSize:
+                return emap
+        except (ValueError, EOFError, struct.error):
+            pass
+
+    emap = analyse(filePath, blockSize=blockSize)
+    emap.save(mapPath)
+    return emap
@@ -0,0 +1,246 @@
+"""
+Reading of evidence (disk images and carved partitions) without filling
+the page cache.
+
+A single pass over a large image gains nothing from the page cache and
+evicts everything else on the host. Three modes are available:
+    buffered: plain reads, as dd does
+    fadvise:  reads announced with POSIX_FADV_SEQUENTIAL and WILLNEED
+              (the read-ahead), and dropped with DONTNEED once used
+    direct:   O_DIRECT reads into page aligned buffers, which bypass the
+              cache; falls back to fadvise where O_DIRECT is not supported
+
+The reads are double buffered: a thread reads the next chunks while the
+current one is written or scanned.
+"""
+
+import os
+import mmap
+import threading
+from queue import Queue
+
+from metrics import metrics
+from governor import governor
+
+
+MODES = ("buffered", "fadvise", "direct")
+READ_AHEAD = 8 * 1024 * 1024
+
+# O_DIRECT needs offsets and sizes aligned on the logical block size
+ALIGN = 4096
+
+
+def fadvise(fd, offset, length, advice):
+    """
+    Helper function to call posix_fadvise where it is available.
+    :param fd: file descriptor
+    :param offset: start of the range
+    :param length: length of the range
+    :param advice: name of the advice, e.g. "POSIX_FADV_DONTNEED"
+    :type fd: int
+    :type offset: int
+    :type length: int
+    :type advice: str
+    """
+    if hasattr(os, "posix_fadvise") and hasattr(os, advice):
+        try:
+            os.posix_fadvise(fd, offset, length, getattr(os, advice))
+        except OSError:
+            pass
+
+
+def dropCache(filePath):
+    """
+    Drop the cached pages of a file, e.g. after Scalpel scanned it.
+    :param filePath: path of the file
+    :type filePath: str
+    """
+    try:
+        fd = os.open(filePath, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        fadvise(fd, 0, 0, "POSIX_FADV_DONTNEED")
+    finally:
+        os.close(fd)
+
+
+class EvidenceReader:
+    """ Read a range of a file in chunks with one of the MODES. """
+
+    def __init__(self, filePath, mode="fadvise", readAhead=READ_AHEAD, buffers=2):
+        """
+        :param filePath: path of the disk image or partition
+        :param mode: one of MODES
+        :param readAhead: size of each read, and of the read-ahead
+        :param buffers: number of chunks read in advance
+        :type filePath: str
+        :type mode: str
+        :type readAhead: int
+        :type buffers: int
+        """
+        if mode not in MODES:
+            raise ValueError("Unknown I/O mode: %s" % mode)
+
+        self.filePath = filePath
+        self.readAhead = max(ALIGN, readAhead // ALIGN * ALIGN)
+        self.buffers = buffers
+        self.mode = mode
+        self.fd = None
+
+        if mode == "direct" and hasattr(os, "O_DIRECT"):
+            try:
+                self.fd = os.open(filePath, os.O_RDONLY | os.O_DIRECT)
+            except OSError:
+                self.fd = None
+        if self.fd is None:
+            self.mode = "buffered" if mode == "buffered" else "fadvise"
+            self.fd = os.open(filePath, os.O_RDONLY)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def readDirect(self, buffer, offset, length):
+        """
+        Helper function to read a range with O_DIRECT: the aligned range
+        around it is read in an aligned buffer and the range is cut out.
+        :param buffer: page aligned buffer of readAhead + 2 * ALIGN bytes
+        :param offset: start of the range
+        :param length: length of the range
+        :type buffer: mmap
+        :type offset: int
+        :type length: int
+        :rtype: bytes
+        """
+        start = offset // ALIGN * ALIGN
+        size = -(-(offset + length - start) // ALIGN) * ALIGN
+        view = memoryview(buffer)[:size]
+        try:
+            n = os.preadv(self.fd, [view], start)
+        finally:
+            view.release()
+        return buffer[offset - start:min(n, offset - start + length)]
+
+    def memory(self):
+        """
+        Memory used by read: the chunks in the queue, the one being read
+        and the one used.
+        :rtype: int
+        """
+        return self.readAhead * (self.buffers + 2)
+
+    def read(self, offset, length, reserved=False):
+        """
+        Generator of the chunks of a range. The chunks are read by a
+        thread, at most buffers chunks ahead of the consumer.
+        :param offset: start of the range
+        :param length: length of the range
+        :param reserved: the caller reserved the memory of the read (see
+                         memory) with its own, so it does not wait for a
+                         second reservation while holding the first
+        :type offset: int
+        :type length: int
+        :type reserved: bool
+        """
+        chunks = Queue(maxsize=self.buffers)
+        stop = threading.Event()
+
+        reservation = None if reserved else governor.reserve(self.memory(), "reading " + self.filePath)
+
+        def reader():
+            buffer = mmap.mmap(-1, self.readAhead + 2 * ALIGN) if self.mode == "direct" else None
+            if self.mode == "fadvise":
+                fadvise(self.fd, offset, length, "POSIX_FADV_SEQUENTIAL")
+            try:
+                pos = offset
+                end = offset + length
+                while pos < end and not stop.is_set():
+                    n = min(self.readAhead, end - pos)
+                    if self.mode == "direct":
+                        chunk = self.readDirect(buffer, pos, n)
+                    else:
+                        if self.mode == "fadvise":
+                            fadvise(self.fd, pos + n, self.readAhead, "POSIX_FADV_WILLNEED")
+                        chunk = os.pread(self.fd, n, pos)
+                    if not chunk:
+                        break
+                    governor.throttle(len(chunk))
+                    chunks.put(chunk)
+                    if self.mode == "fadvise":
+                        fadvise(self.fd, pos, len(chunk), "POSIX_FADV_DONTNEED")
+                    pos += len(chunk)
+                chunks.put(None)
+            except OSError as err:
+                chunks.put(err)
+            finally:
+                if buffer is not None:
+                    buffer.close()
+
+        thread = threading.Thread(target=reader, daemon=True)
+        thread.start()
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            # The consumer stopped early: unblocking the reader
+            stop.set()
+            while thread.is_alive():
+                while not chunks.empty():
+                    chunks.get_nowait()
+                thread.join(0.1)
+            if reservation is not None:
+                reservation.release()
+
+
+def copyRange(srcPath, dstPath, offset, length, mode="fadvise", readAhead=READ_AHEAD):
+    """
+    Copy a range of a disk image to a file, e.g. to extract a partition.
+    Reading and writing overlap, and the pages of the written file are
+    dropped from the cache as well (except in buffered mode).
+    :param srcPath: path of the disk image
+    :param dstPath: path of the file to write
+    :param offset: start of the range in bytes
+    :param length: length of the range in bytes
+    :param mode: one of MODES
+    :param readAhead: size of each read
+    :type srcPath: str
+    :type dstPath: str
+    :type offset: int
+    :type length: int
+    :type mode: str
+    :type readAhead: int
+    :return copied: number of bytes copied
+    :rtype copied: int
+    """
+    copied = 0
+    with metrics.stage("copyRange:" + mode) as m, EvidenceReader(srcPath, mode, readAhead) as reader, \
+            open(dstPath, "wb") as out:
+        for chunk in reader.read(offset, length):
+            out.write(chunk)
+            copied += len(chunk)
+
+            if mode != "buffered" and copied % (64 * readAhead) < len(chunk):
+                # Written pages can only be dropped once on disk
+                out.flush()
+                os.fdatasync(out.fileno())
+                fadvise(out.fileno(), 0, copied, "POSIX_FADV_DONTNEED")
+
+        if mode != "buffered":
+            out.flush()
+            os.fdatasync(out.fileno())
+            fadvise(out.fileno(), 0, 0, "POSIX_FADV_DONTNEED")
+        m["Bytes"] = copied
+    return copied
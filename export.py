@@ -0,0 +1,367 @@
+"""
+Streaming export of the results of PyCarver (recovered and carved files)
+as JSON lines, CSV or DFXML.
+
+The files are read from the output folder one at a time and each record
+is written as soon as it is ready, so memory use does not depend on the
+number of results. A FolderWatcher can export the files while
+tsk_recover or Scalpel are still writing them, so downstream tools can
+start ingesting before the carve finishes.
+
+An export written while the tool runs can hold several records of the
+same path, when a file changed after it was exported: the last record
+of a path supersedes the previous ones, in every format.
+"""
+
+import csv
+import json
+import time
+import hashlib
+import threading
+from os import walk, sep, path, stat, utime, remove
+from xml.sax.saxutils import escape, quoteattr
+
+from distributed import parseScalpelAudit
+from formats import addStats, dropFile, trimFile, validateFiles
+from governor import governor
+
+
+FORMATS = ("jsonl", "csv", "dfxml")
+
+# Fields of every record, in the order of the CSV columns
+FIELDS = ("Path", "Size", "Offset", "Type", "MD5", "SHA256", "Source")
+
+
+class JsonlExporter:
+    """ Write one JSON object per line. """
+
+    def __init__(self, filePath):
+        self.fp = open(filePath, "w")
+
+    def write(self, record):
+        self.fp.write(json.dumps(record) + "\n")
+        self.fp.flush()
+
+    def close(self):
+        self.fp.close()
+
+
+class CsvExporter:
+    """ Write a CSV file with a header row. """
+
+    def __init__(self, filePath):
+        self.fp = open(filePath, "w", newline="")
+        self.writer = csv.DictWriter(self.fp, fieldnames=FIELDS, extrasaction="ignore")
+        self.writer.writeheader()
+
+    def write(self, record):
+        self.writer.writerow(record)
+        self.fp.flush()
+
+    def close(self):
+        self.fp.close()
+
+
+class DfxmlExporter:
+    """ Write a Digital Forensics XML file, one fileobject per record. """
+
+    def __init__(self, filePath, source=""):
+        self.fp = open(filePath, "w")
+        self.fp.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+        self.fp.write("<dfxml xmlns='http://www.forensicswiki.org/wiki/Category:Digital_Forensics_XML' version='1.0'>\n")
+        self.fp.write("  <creator><program>PyCarver</program></creator>\n")
+        self.fp.write("  <!-- The last fileobject of a filename supersedes the previous ones -->\n")
+        if source:
+            self.fp.write("  <source><image_filename>%s</image_filename></source>\n" % escape(source))
+
+    def write(self, record):
+        lines = ["  <fileobject>",
+                 "    <filename>%s</filename>" % escape(record["Path"]),
+                 "    <filesize>%d</filesize>" % record["Size"]]
+        if record.get("Offset") not in (None, ""):
+            lines.append("    <byte_runs><byte_run img_offset=%s len=%s/></byte_runs>" %
+                         (quoteattr(str(record["Offset"])), quoteattr(str(record["Size"]))))
+        if record.get("MD5"):
+            lines.append("    <hashdigest type='md5'>%s</hashdigest>" % record["MD5"])
+        if record.get("SHA256"):
+            lines.append("    <hashdigest type='sha256'>%s</hashdigest>" % record["SHA256"])
+        lines.append("  </fileobject>")
+        self.fp.write("\n".join(lines) + "\n")
+        self.fp.flush()
+
+    def close(self):
+        self.fp.write("</dfxml>\n")
+        self.fp.close()
+
+
+def openExporter(filePath, format=None, source=""):
+    """
+    Create the exporter for a file. The format is taken from the extension
+    of the file if it is not given.
+    :param filePath: path of the export file
+    :param format: "jsonl", "csv" or "dfxml"
+    :param source: disk image the results come from
+    :type filePath: str
+    :type format: str
+    :type source: str
+    :return exporter: the exporter
+    """
+    if format is None:
+        ext = path.splitext(filePath)[1].lower().lstrip(".")
+        format = {"json": "jsonl", "xml": "dfxml"}.get(ext, ext)
+
+    if format == "jsonl":
+        return JsonlExporter(filePath)
+    if format == "csv":
+        return CsvExporter(filePath)
+    if format == "dfxml":
+        return DfxmlExporter(filePath, source)
+
+    raise ValueError("Unknown export format: %s" % format)
+
+
+def fileRecord(filePath, offset=None, source=""):
+    """
+    Build the record of a file, hashing it in chunks.
+    :param filePath: path of the file
+    :param offset: offset of the file in the partition, if known
+    :param source: partition or image the file comes from
+    :type filePath: str
+    :type offset: int
+    :type source: str
+    :return record: the record of the file
+    :rtype record: dict
+    """
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(filePath, "rb") as fp:
+        for block in iter(lambda: fp.read(1024 * 1024), b""):
+            governor.throttle(len(block))
+            md5.update(block)
+            sha256.update(block)
+            size += len(block)
+
+    ext = path.splitext(filePath)[1].lstrip(".").lower()
+    return {"Path": filePath, "Size": size, "Offset": offset if offset is not None else "",
+            "Type": ext, "MD5": md5.hexdigest(), "SHA256": sha256.hexdigest(), "Source": source}
+
+
+def scalpelOffsets(folder):
+    """
+    Helper function to get the offset of each file carved by Scalpel.
+    :param folder: output folder of Scalpel
+    :type folder: str
+    :return offsets: file name -> offset
+    :rtype offsets: dict
+    """
+    auditPath = path.join(folder, "audit.txt")
+    if not path.isfile(auditPath):
+        return {}
+    return {name: start for name, start, length in parseScalpelAudit(auditPath)}
+
+
+def iterRecords(folder, source=""):
+    """
+    Generator of the records of every file in an output folder. The
+    folder is walked lazily, so only one record is in memory at a time.
+    :param folder: output folder of tsk_recover or Scalpel
+    :param source: partition or image the files come from
+    :type folder: str
+    :type source: str
+    """
+    offsets = scalpelOffsets(folder)
+    for (dirpath, dirnames, filenames) in walk(folder):
+        for f in filenames:
+            if dirpath == folder and f == "audit.txt":
+                continue
+            yield fileRecord(dirpath + sep + f, offsets.get(f), source)
+
+
+def exportFolder(folder, filePath, format=None, source=""):
+    """
+    Export every file of an output folder.
+    :param folder: output folder of tsk_recover or Scalpel
+    :param filePath: path of the export file
+    :param format: "jsonl", "csv" or "dfxml"
+    :param source: partition or image the files come from
+    :type folder: str
+    :type filePath: str
+    :type format: str
+    :type source: str
+    :return count: number of exported files
+    :rtype count: int
+    """
+    exporter = openExporter(filePath, format, source)
+    count = 0
+    try:
+        for record in iterRecords(folder, source):
+            exporter.write(record)
+            count += 1
+    finally:
+        exporter.close()
+    return count
+
+
+class FolderWatcher(threading.Thread):
+    """
+    Export the files of an output folder while a tool is writing them.
+    Each poll exports the files last changed between the two previous
+    polls, i.e. that did not change for a whole interval. The change
+    times (ctime) are compared with the time of the file system, read
+    from a marker file next to the folder, so nothing is kept per file
+    and the memory used does not depend on the number of files.
+
+    A file that changed after it was exported (the tool was only slow to
+    write it) is exported again: a path can have several records, and the
+    last one supersedes the others. Scalpel writes its audit file at the
+    end, so the offsets are only known for the files exported after the
+    tool finished.
+
+    If a validator is given, the files are only checked and exported once
+    the tool has finished, as a file still being written would look
+    broken: the files it rejects are not exported and are moved to the
+    quarantine folder (or deleted), and the valid files are truncated to
+    their true length.
+    """
+
+    def __init__(self, folder, filePath, format=None, source="", interval=1.0,
+                 validator=None, quarantine=None):
+        """
+        :param folder: output folder being written by the tool
+        :param filePath: path of the export file
+        :param format: "jsonl", "csv" or "dfxml"
+        :param source: partition or image the files come from
+        :param interval: seconds between two polls of the folder
+        :param validator: function returning the result of
+                          formats.validateFile for a file, run in a
+                          process pool (see formats.validateFiles)
+        :param quarantine: folder for the files rejected by the validator
+        :type folder: str
+        :type filePath: str
+        :type format: str
+        :type source: str
+        :type interval: float
+        :type validator: function
+        :type quarantine: str
+        """
+        threading.Thread.__init__(self, daemon=True)
+        self.folder = folder
+        self.exporter = openExporter(filePath, format, source)
+        self.source = source
+        self.interval = interval
+        self.markPath = folder.rstrip(sep) + ".watch"
+        # The files changed before since were exported, the ones changed
+        # before previous will be by the next poll
+        self.since = None
+        self.previous = None
+        self.count = 0
+        self.validator = validator
+        self.quarantine = quarantine
+        self.stats = {}
+        self.done = threading.Event()
+
+    def clock(self):
+        """
+        Helper function to get the current time of the file system of the
+        folder, which may not be the time of this machine (NFS).
+        :rtype: int
+        """
+        try:
+            with open(self.markPath, "a"):
+                pass
+            utime(self.markPath)
+            return stat(self.markPath).st_ctime_ns
+        except OSError:
+            return time.time_ns()
+
+    def changed(self, since, before):
+        """
+        Generator of the files of the folder changed between two times.
+        :param since: first time, None for the oldest files
+        :param before: end time, None for the newest files
+        :type since: int
+        :type before: int
+        """
+        for (dirpath, dirnames, filenames) in walk(self.folder):
+            for f in filenames:
+                if dirpath == self.folder and f == "audit.txt":
+                    continue
+                filePath = dirpath + sep + f
+                try:
+                    ctime = stat(filePath).st_ctime_ns
+                except OSError:
+                    continue
+                if (since is None or ctime >= since) and (before is None or ctime < before):
+                    yield filePath
+
+    def poll(self, final=False):
+        """
+        Export the files that did not change since the previous poll.
+        :param final: export every file left, and the files that changed
+                      since they were exported; the tool has finished
+        :type final: bool
+        """
+        # Files being written must not be validated, let alone moved
+        if self.validator is not None and not final:
+            return
+
+        since, before = self.since, None
+        if not final:
+            before, self.previous = self.previous, self.clock()
+            if before is None:
+                return
+            self.since = before
+
+        offsets = scalpelOffsets(self.folder) if final else {}
+        files = self.changed(since, before)
+
+        if self.validator is None:
+            for filePath in files:
+                self.export(filePath, offsets.get(path.basename(filePath)))
+            return
+
+        for result in validateFiles(files, validator=self.validator):
+            addStats(self.stats, result)
+            if not result["Valid"]:
+                dropFile(result["Path"], self.folder, self.quarantine)
+                continue
+            self.stats[result["Type"]]["Trimmed"] += trimFile(result)
+            self.export(result["Path"], offsets.get(path.basename(result["Path"])))
+
+    def export(self, filePath, offset):
+        """
+        Helper function to write the record of a file.
+        """
+        try:
+            record = fileRecord(filePath, offset, self.source)
+        except OSError:
+            # Removed by the tool since the folder was walked
+            return
+        self.exporter.write(record)
+        self.count += 1
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            if path.isdir(self.folder):
+                self.poll()
+
+    def stop(self):
+        """
+        Stop watching, export the files left and close the export file.
+        :return count: number of records written, a file written again
+                       after it was exported has several
+        :rtype count: int
+        """
+        self.done.set()
+        self.join()
+        try:
+            if path.isdir(self.folder):
+                self.poll(final=True)
+        finally:
+            self.exporter.close()
+            try:
+                remove(self.markPath)
+            except OSError:
+                pass
+        return self.count
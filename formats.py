@@ -0,0 +1,450 @@
+"""
+Structural checks of the file types carved by PyCarver.
+
+Scalpel only looks for headers and footers, so many of the carved files
+are truncated or garbage. Each check walks the structure of its format:
+    jpg: the markers of the JPEG, up to the EOI marker
+    png: every chunk and its CRC, up to the IEND chunk
+    gif: the blocks of the GIF, up to the trailer
+    pdf: the last %%EOF, its startxref and the xref it points to
+
+The checks run in a process pool and the invalid files are moved to a
+quarantine folder (or deleted) before they are hashed and displayed.
+
+The checks also give the true length of a file, which is used to trim
+the files carved by Scalpel up to their maximum size and by the built-in
+carver (carver.py) to write only the bytes of each file.
+"""
+
+import re
+import struct
+import shutil
+import zlib
+from collections import deque
+from os import walk, sep, path, makedirs, remove, truncate, cpu_count, stat, replace
+from concurrent.futures import ProcessPoolExecutor
+
+
+class InvalidFile(Exception):
+    """ Raised by the checks when a file is not valid. """
+
+
+def checkJpeg(data, start=0, end=None):
+    """
+    Walk the markers of a JPEG file.
+    :param data: content of the file (bytes or mmap)
+    :param start: offset of the file in data
+    :param end: offset where the data available for the file ends
+    :type data: bytes
+    :type start: int
+    :type end: int
+    :return end: offset of the end of the EOI marker
+    :rtype end: int
+    """
+    size = len(data) if end is None else end
+
+    if data[start:start + 2] != b"\xff\xd8":
+        raise InvalidFile("missing SOI")
+
+    pos = start + 2
+    frame = False
+    scan = False
+
+    while pos < size:
+        if data[pos] != 0xFF:
+            raise InvalidFile("bad marker at %d" % (pos - start))
+
+        # Fill bytes before a marker
+        while pos < size and data[pos] == 0xFF:
+            pos += 1
+        if pos >= size:
+            break
+        marker = data[pos]
+        pos += 1
+
+        if marker == 0xD9:
+            if not frame or not scan:
+                raise InvalidFile("no image data")
+            return pos
+
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            continue
+
+        if pos + 2 > size:
+            break
+        length = struct.unpack(">H", data[pos:pos + 2])[0]
+        if length < 2:
+            raise InvalidFile("bad segment length at %d" % (pos - start))
+        if pos + length > size:
+            break
+
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            frame = True
+
+        pos += length
+
+        if marker == 0xDA:
+            if not frame:
+                raise InvalidFile("scan before frame")
+            scan = True
+
+            # Entropy coded data: find the next marker that is not a
+            # stuffed byte or a restart marker
+            while True:
+                pos = data.find(b"\xff", pos, size)
+                if pos < 0 or pos + 1 >= size:
+                    raise InvalidFile("truncated (missing EOI)")
+                nxt = data[pos + 1]
+                if nxt == 0x00 or 0xD0 <= nxt <= 0xD7 or nxt == 0xFF:
+                    pos += 1 if nxt == 0xFF else 2
+                    continue
+                break
+
+    raise InvalidFile("truncated (missing EOI)")
+
+
+def checkPng(data, start=0, end=None):
+    """
+    Walk the chunks of a PNG file and verify their CRC.
+    :param data: content of the file (bytes or mmap)
+    :param start: offset of the file in data
+    :param end: offset where the data available for the file ends
+    :type data: bytes
+    :type start: int
+    :type end: int
+    :return end: offset of the end of the IEND chunk
+    :rtype end: int
+    """
+    size = len(data) if end is None else end
+
+    if data[start:start + 8] != b"\x89PNG\r\n\x1a\n":
+        raise InvalidFile("missing signature")
+
+    pos = start + 8
+    first = True
+
+    while pos + 12 <= size:
+        length, kind = struct.unpack(">I4s", data[pos:pos + 8])
+        if pos + 12 + length > size:
+            break
+
+        if first and kind != b"IHDR":
+            raise InvalidFile("first chunk is not IHDR")
+        first = False
+
+        crc = struct.unpack(">I", data[pos + 8 + length:pos + 12 + length])[0]
+        if zlib.crc32(data[pos + 4:pos + 8 + length]) & 0xffffffff != crc:
+            raise InvalidFile("bad CRC in %s chunk at %d" % (kind.decode("latin-1"), pos - start))
+
+        pos += 12 + length
+        if kind == b"IEND":
+            return pos
+
+    raise InvalidFile("truncated (missing IEND)")
+
+
+def checkGif(data, start=0, end=None):
+    """
+    Walk the blocks of a GIF file.
+    :param data: content of the file (bytes or mmap)
+    :param start: offset of the file in data
+    :param end: offset where the data available for the file ends
+    :type data: bytes
+    :type start: int
+    :type end: int
+    :return end: offset of the end of the trailer
+    :rtype end: int
+    """
+    size = len(data) if end is None else end
+
+    if data[start:start + 6] not in (b"GIF87a", b"GIF89a"):
+        raise InvalidFile("missing signature")
+
+    if size - start < 13:
+        raise InvalidFile("truncated header")
+
+    flags = data[start + 10]
+    pos = start + 13
+    if flags & 0x80:
+        pos += 3 * (2 << (flags & 0x07))
+
+    def skipSubBlocks(pos):
+        while True:
+            if pos >= size:
+                raise InvalidFile("truncated (missing trailer)")
+            n = data[pos]
+            pos += 1 + n
+            if n == 0:
+                return pos
+
+    images = 0
+    while pos < size:
+        block = data[pos]
+        if block == 0x3B:
+            if not images:
+                raise InvalidFile("no image data")
+            return pos + 1
+        elif block == 0x21:
+            pos = skipSubBlocks(pos + 2)
+        elif block == 0x2C:
+            if pos + 10 > size:
+                break
+            flags = data[pos + 9]
+            pos += 10
+            if flags & 0x80:
+                pos += 3 * (2 << (flags & 0x07))
+            # LZW minimum code size, then the image data
+            pos = skipSubBlocks(pos + 1)
+            images += 1
+        else:
+            raise InvalidFile("bad block 0x%02x at %d" % (block, pos - start))
+
+    raise InvalidFile("truncated (missing trailer)")
+
+
+STARTXREF = re.compile(rb"startxref\s+(\d+)\s+%%EOF")
+OBJECT = re.compile(rb"\s*\d+\s+\d+\s+obj")
+
+
+def checkPdf(data, start=0, end=None):
+    """
+    Check the end of a PDF file: the last %%EOF before the end of the data
+    must follow a startxref pointing to a cross reference table or stream.
+    :param data: content of the file (bytes or mmap)
+    :param start: offset of the file in data
+    :param end: offset where the data available for the file ends
+    :type data: bytes
+    :type start: int
+    :type end: int
+    :return end: offset of the end of the last %%EOF line
+    :rtype end: int
+    """
+    size = len(data) if end is None else end
+
+    if data[start:start + 5] != b"%PDF-":
+        raise InvalidFile("missing header")
+
+    # A PDF updated incrementally has several %%EOF, the last one whose
+    # startxref points to a cross reference ends the file. Another PDF
+    # starting inside the data ends the search.
+    nextPdf = data.find(b"%PDF-", start + 5, size)
+    if nextPdf > 0:
+        size = nextPdf
+
+    eof = data.rfind(b"%%EOF", start, size)
+    if eof < 0:
+        raise InvalidFile("truncated (missing %%EOF)")
+
+    reason = ""
+    while eof >= 0:
+        match = None
+        for match in STARTXREF.finditer(data, max(start, eof - 64), eof + 5):
+            pass
+
+        if match is None:
+            reason = "missing startxref"
+        else:
+            xref = start + int(match.group(1))
+            if xref >= size:
+                reason = "startxref out of the file"
+            elif data[xref:xref + 4] != b"xref" and not OBJECT.match(data, xref, size):
+                reason = "startxref does not point to a cross reference"
+            else:
+                break
+
+        eof = data.rfind(b"%%EOF", start, eof)
+
+    if eof < 0:
+        raise InvalidFile(reason)
+
+    pos = eof + 5
+    if data[pos:pos + 2] == b"\r\n":
+        pos += 2
+    elif data[pos:pos + 1] in (b"\r", b"\n"):
+        pos += 1
+    return min(pos, size)
+
+
+CHECKS = {"jpg": checkJpeg, "jpeg": checkJpeg, "png": checkPng, "gif": checkGif, "pdf": checkPdf}
+
+
+def fileType(filePath):
+    """
+    Helper function to get the type of a carved file from its extension.
+    :param filePath: path of the file
+    :type filePath: str
+    :rtype: str
+    """
+    return path.splitext(filePath)[1].lstrip(".").lower()
+
+
+def validateFile(filePath):
+    """
+    Run the structural check of a file.
+    :param filePath: path of the file
+    :type filePath: str
+    :return result: dictionary with Path, Type, Valid, Reason and End
+                    (the length of the file according to its structure)
+    :rtype result: dict
+    """
+    kind = fileType(filePath)
+    result = {"Path": filePath, "Type": kind, "Valid": True, "Reason": "", "End": None}
+
+    check = CHECKS.get(kind)
+    if check is None:
+        return result
+
+    try:
+        with open(filePath, "rb") as fp:
+            data = fp.read()
+        result["End"] = check(data)
+    except InvalidFile as err:
+        result["Valid"] = False
+        result["Reason"] = str(err)
+    except (IOError, IndexError, struct.error) as err:
+        result["Valid"] = False
+        result["Reason"] = "unreadable: %s" % err
+
+    return result
+
+
+# Files checked by each task of the pool
+BATCH = 16
+
+
+def validateBatch(paths, validator=validateFile):
+    """
+    Helper function to check a batch of files in a worker process.
+    :rtype: list
+    """
+    return [validator(filePath) for filePath in paths]
+
+
+def validateFiles(paths, workers=None, validator=validateFile):
+    """
+    Run the structural checks of many files in a process pool. The paths
+    are taken as the pool needs them, so a generator of any length can
+    be given.
+    :param paths: paths of the files
+    :param workers: number of processes, by default one per CPU
+    :param validator: function checking a file, defined at the top level
+                      of a module so it can be sent to the processes
+    :type paths: iterable
+    :type workers: int
+    :type validator: function
+    :return results: generator of the results of validateFile, in order
+    """
+    workers = workers or cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        inFlight = deque()
+        batch = []
+        for filePath in paths:
+            batch.append(filePath)
+            if len(batch) == BATCH:
+                inFlight.append(pool.submit(validateBatch, batch, validator))
+                batch = []
+            # Two batches per process are enough to keep them busy
+            while len(inFlight) > 2 * workers:
+                for result in inFlight.popleft().result():
+                    yield result
+        if batch:
+            inFlight.append(pool.submit(validateBatch, batch, validator))
+        while inFlight:
+            for result in inFlight.popleft().result():
+                yield result
+
+
+def validateFolder(folder, quarantine=None, workers=None, trim=True):
+    """
+    Check every carved file of a folder. The invalid files are moved to
+    the quarantine folder, keeping their relative path, or deleted if no
+    quarantine folder is given. The valid files are truncated to the
+    length given by their structure.
+    :param folder: output folder of Scalpel
+    :param quarantine: folder for the invalid files
+    :param workers: number of processes
+    :param trim: truncate the valid files to their true length
+    :type folder: str
+    :type quarantine: str
+    :type workers: int
+    :type trim: bool
+    :return stats: type -> {"Valid": n, "Invalid": n, "Trimmed": bytes,
+                   "Reasons": {reason: n}}
+    :rtype stats: dict
+    """
+    def paths():
+        for (dirpath, dirnames, filenames) in walk(folder):
+            for f in filenames:
+                if fileType(f) in CHECKS:
+                    yield dirpath + sep + f
+
+    stats = {}
+    for result in validateFiles(paths(), workers):
+        addStats(stats, result)
+        if not result["Valid"]:
+            dropFile(result["Path"], folder, quarantine)
+        elif trim:
+            stats[result["Type"]]["Trimmed"] += trimFile(result)
+
+    return stats
+
+
+def addStats(stats, result):
+    """
+    Helper function to count a result in the validity statistics.
+    :param stats: statistics per type
+    :param result: result of validateFile
+    :type stats: dict
+    :type result: dict
+    """
+    s = stats.setdefault(result["Type"], {"Valid": 0, "Invalid": 0, "Trimmed": 0, "Reasons": {}})
+    if result["Valid"]:
+        s["Valid"] += 1
+    else:
+        s["Invalid"] += 1
+        # Offsets make every reason different, only the text is counted
+        reason = result["Reason"].split(" at ")[0]
+        s["Reasons"][reason] = s["Reasons"].get(reason, 0) + 1
+
+
+def trimFile(result):
+    """
+    Truncate a valid file to the length given by its structure.
+    :param result: result of validateFile
+    :type result: dict
+    :return trimmed: number of bytes removed
+    :rtype trimmed: int
+    """
+    if result["End"] is None:
+        return 0
+
+    size = path.getsize(result["Path"])
+    if result["End"] >= size:
+        return 0
+
+    # A file linked to the content store is copied first, so the stored
+    # content is not truncated (see contentstore)
+    if stat(result["Path"]).st_nlink > 1:
+        shutil.copyfile(result["Path"], result["Path"] + ".copy")
+        replace(result["Path"] + ".copy", result["Path"])
+
+    truncate(result["Path"], result["End"])
+    return size - result["End"]
+
+
+def dropFile(filePath, folder, quarantine=None):
+    """
+    Move an invalid file to the quarantine folder or delete it.
+    :param filePath: path of the file
+    :param folder: output folder the file is in
+    :param quarantine: folder for the invalid files
+    :type filePath: str
+    :type folder: str
+    :type quarantine: str
+    """
+    if quarantine:
+        dest = path.join(quarantine, path.relpath(filePath, folder))
+        makedirs(path.dirname(dest), exist_ok=True)
+        shutil.move(filePath, dest)
+    else:
+        remove(filePath)
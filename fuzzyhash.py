@@ -0,0 +1,486 @@
+"""
+Fuzzy hashing of the recovered and carved files, to find the files that
+are similar and not only the exact copies.
+
+The hashes are context triggered piecewise hashes in the format of ssdeep
+("blocksize:signature:signature of twice the blocksize"): the file is cut
+where a rolling hash of the last 7 bytes hits a value, so an insertion or
+a truncation only changes the pieces around it. Two hashes are compared
+with the weighted edit distance of their signatures, giving a score from
+0 to 100. The ssdeep module is used when it is installed, and a pure
+Python version of the same algorithm otherwise.
+
+Two signatures can only score above 0 when their blocksizes are equal or
+double and they share 7 characters in a row. The index stores each
+7-gram of the signatures with its blocksize, so the files compared with
+a file are the ones sharing a bucket with it, and the similarity groups
+are made without comparing every pair of files. The MD5 of each file is
+computed in the same read, so the exact copies are grouped too.
+
+Usage:
+    index = openFuzzyIndex(path.join(outFolder, "fuzzy_index.sqlite"))
+    index.updateFolder(path.join(outFolder, "out_partition"), "Linux (0x83)")
+    groups = index.groups(threshold=60)
+"""
+
+import hashlib
+import sqlite3
+import threading
+from os import walk, sep, path, stat, cpu_count
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import ssdeep
+except ImportError:
+    ssdeep = None
+
+from metrics import metrics
+
+
+# Files larger than this only get their MD5
+MAX_FUZZY_BYTES = 64 * 1024 * 1024
+
+ROLLING_WINDOW = 7
+MIN_BLOCKSIZE = 3
+SPAMSUM_LENGTH = 64
+HASH_PRIME = 0x01000193
+HASH_INIT = 0x28021967
+B64 = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+
+# Buckets holding more files than this are left out of the groups, they
+# are signatures of nearly empty or repeated content
+MAX_BUCKET = 1000
+
+# Files written at the same time are indexed in one transaction
+BATCH = 500
+
+
+def spamsum(data, blockSize):
+    """
+    Helper function to get the two signatures of data for a blocksize.
+    :param data: content of the file
+    :param blockSize: blocksize of the first signature
+    :type data: bytes
+    :type blockSize: int
+    :return sig1, sig2: signatures for blockSize and twice blockSize
+    :rtype sig1, sig2: str
+    """
+    window = [0] * ROLLING_WINDOW
+    h1 = h2 = h3 = n = 0
+    bh1 = bh2 = HASH_INIT
+    sig1, sig2 = [], []
+    max1, max2 = SPAMSUM_LENGTH - 1, SPAMSUM_LENGTH // 2 - 1
+    double = blockSize * 2
+
+    for c in data:
+        # Rolling hash of the last ROLLING_WINDOW bytes
+        h2 = (h2 - h1 + ROLLING_WINDOW * c) & 0xffffffff
+        h1 = (h1 + c - window[n]) & 0xffffffff
+        window[n] = c
+        n = n + 1 if n < ROLLING_WINDOW - 1 else 0
+        h3 = ((h3 << 5) ^ c) & 0xffffffff
+        rh = (h1 + h2 + h3) & 0xffffffff
+
+        # FNV hashes of the current pieces
+        bh1 = ((bh1 * HASH_PRIME) & 0xffffffff) ^ c
+        bh2 = ((bh2 * HASH_PRIME) & 0xffffffff) ^ c
+
+        if rh % blockSize == blockSize - 1:
+            if len(sig1) < max1:
+                sig1.append(B64[bh1 % 64])
+                bh1 = HASH_INIT
+            if rh % double == double - 1 and len(sig2) < max2:
+                sig2.append(B64[bh2 % 64])
+                bh2 = HASH_INIT
+
+    if rh:
+        sig1.append(B64[bh1 % 64])
+        sig2.append(B64[bh2 % 64])
+    return "".join(sig1), "".join(sig2)
+
+
+def fuzzyHash(data):
+    """
+    Get the fuzzy hash of data. The blocksize is guessed from the size
+    and halved until the first signature is long enough.
+    :param data: content of the file
+    :type data: bytes
+    :return hash: "blocksize:signature:signature"
+    :rtype hash: str
+    """
+    if ssdeep is not None:
+        return ssdeep.hash(data)
+
+    blockSize = MIN_BLOCKSIZE
+    while blockSize * SPAMSUM_LENGTH < len(data):
+        blockSize *= 2
+
+    while True:
+        sig1, sig2 = spamsum(data, blockSize) if data else ("", "")
+        if blockSize > MIN_BLOCKSIZE and len(sig1) < SPAMSUM_LENGTH // 2:
+            blockSize //= 2
+            continue
+        return "%d:%s:%s" % (blockSize, sig1, sig2)
+
+
+def parseHash(fuzzy):
+    """
+    Helper function to split a fuzzy hash, with the runs of more than 3
+    times the same character cut to 3 (they carry no information and
+    inflate the scores).
+    :param fuzzy: "blocksize:signature:signature"
+    :type fuzzy: str
+    :return blockSize, sig1, sig2:
+    :rtype blockSize, sig1, sig2: int, str, str
+    """
+    blockSize, sig1, sig2 = fuzzy.split(":", 2)
+    return int(blockSize), eliminateRuns(sig1), eliminateRuns(sig2.split(",")[0])
+
+
+def eliminateRuns(sig):
+    out = []
+    for c in sig:
+        if len(out) < 3 or not (c == out[-1] == out[-2] == out[-3]):
+            out.append(c)
+    return "".join(out)
+
+
+def grams(sig):
+    """
+    Helper function to get the 7-grams of a signature.
+    :type sig: str
+    :rtype: set
+    """
+    return {sig[i:i + ROLLING_WINDOW] for i in range(len(sig) - ROLLING_WINDOW + 1)}
+
+
+def editDistance(s1, s2):
+    """
+    Helper function to get the edit distance of two signatures, where an
+    insertion or a deletion costs 1 and a change costs 2 (as in ssdeep).
+    :type s1: str
+    :type s2: str
+    :rtype: int
+    """
+    previous = list(range(len(s2) + 1))
+    for i, c1 in enumerate(s1, 1):
+        current = [i]
+        for j, c2 in enumerate(s2, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (0 if c1 == c2 else 2)))
+        previous = current
+    return previous[-1]
+
+
+def scoreStrings(s1, s2, blockSize):
+    """
+    Helper function to score two signatures of the same blocksize.
+    :rtype: int
+    """
+    if len(s1) > SPAMSUM_LENGTH or len(s2) > SPAMSUM_LENGTH or not grams(s1) & grams(s2):
+        return 0
+
+    score = editDistance(s1, s2) * SPAMSUM_LENGTH // (len(s1) + len(s2))
+    score = 100 * score // SPAMSUM_LENGTH
+    if score >= 100:
+        return 0
+    score = 100 - score
+
+    # Small blocksizes give short pieces that match by chance
+    if blockSize < (99 + ROLLING_WINDOW) // ROLLING_WINDOW * MIN_BLOCKSIZE:
+        score = min(score, blockSize // MIN_BLOCKSIZE * min(len(s1), len(s2)))
+    return score
+
+
+def compare(hash1, hash2):
+    """
+    Compare two fuzzy hashes.
+    :param hash1: "blocksize:signature:signature"
+    :param hash2: "blocksize:signature:signature"
+    :type hash1: str
+    :type hash2: str
+    :return score: 0 (nothing in common) to 100 (same content)
+    :rtype score: int
+    """
+    if ssdeep is not None:
+        return ssdeep.compare(hash1, hash2)
+
+    bs1, s1a, s1b = parseHash(hash1)
+    bs2, s2a, s2b = parseHash(hash2)
+
+    if bs1 == bs2:
+        if s1a == s2a and s1a:
+            return 100
+        return max(scoreStrings(s1a, s2a, bs1), scoreStrings(s1b, s2b, bs1 * 2))
+    if bs1 == bs2 * 2:
+        return scoreStrings(s1a, s2b, bs1)
+    if bs2 == bs1 * 2:
+        return scoreStrings(s1b, s2a, bs2)
+    return 0
+
+
+def hashFile(filePath):
+    """
+    Get the MD5 and the fuzzy hash of a file in one read, in a worker
+    process.
+    :param filePath: path of the file
+    :type filePath: str
+    :return result: Path, Size, Mtime, MD5 and Fuzzy (None for the files
+                    larger than MAX_FUZZY_BYTES), or Error if the file can
+                    not be read
+    :rtype result: dict
+    """
+    result = {"Path": filePath, "Fuzzy": None}
+    try:
+        info = stat(filePath)
+        result["Size"], result["Mtime"] = info.st_size, int(info.st_mtime)
+        md5 = hashlib.md5()
+        with open(filePath, "rb") as fp:
+            if info.st_size <= MAX_FUZZY_BYTES:
+                data = fp.read()
+                md5.update(data)
+                result["Fuzzy"] = fuzzyHash(data)
+            else:
+                for block in iter(lambda: fp.read(1024 * 1024), b""):
+                    md5.update(block)
+    except OSError as err:
+        result["Error"] = str(err)
+        return result
+
+    result["MD5"] = md5.hexdigest()
+    return result
+
+
+def bucketsOf(fuzzy):
+    """
+    Helper function to get the buckets of a fuzzy hash: the 7-grams of
+    each signature with its blocksize.
+    :type fuzzy: str
+    :rtype: set of (blocksize, gram)
+    """
+    blockSize, sig1, sig2 = parseHash(fuzzy)
+    return {(blockSize, g) for g in grams(sig1)} | {(blockSize * 2, g) for g in grams(sig2)}
+
+
+class FuzzyIndex:
+    """ SQLite index of the fuzzy hashes of files, bucketed by 7-gram. """
+
+    def __init__(self, dbPath):
+        """
+        :param dbPath: path of the database
+        :type dbPath: str
+        """
+        self.dbPath = dbPath
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(dbPath, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, "
+                        "partition TEXT, size INTEGER, mtime INTEGER, md5 TEXT, fuzzy TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS files_md5 ON files (md5)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS buckets (blocksize INTEGER, gram TEXT, fileId INTEGER, "
+                        "PRIMARY KEY (blocksize, gram, fileId)) WITHOUT ROWID")
+        self.db.execute("CREATE INDEX IF NOT EXISTS buckets_file ON buckets (fileId)")
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def delete(self, fileIds):
+        """
+        Helper function to remove files from the index, the lock held.
+        :type fileIds: list
+        """
+        for fileId in fileIds:
+            self.db.execute("DELETE FROM buckets WHERE fileId = ?", (fileId,))
+            self.db.execute("DELETE FROM files WHERE id = ?", (fileId,))
+
+    def write(self, results, partition):
+        """
+        Helper function to write the hashes of files in one transaction,
+        replacing the ones of the same paths.
+        :param results: results of hashFile
+        :param partition: partition the files come from
+        :type results: list
+        :type partition: str
+        """
+        with self.lock:
+            for result in results:
+                row = self.db.execute("SELECT id FROM files WHERE path = ?", (result["Path"],)).fetchone()
+                if row is not None:
+                    self.delete(row)
+                if "Error" in result:
+                    continue
+
+                fileId = self.db.execute("INSERT INTO files (path, partition, size, mtime, md5, fuzzy) "
+                                         "VALUES (?, ?, ?, ?, ?, ?)",
+                                         (result["Path"], partition, result["Size"], result["Mtime"],
+                                          result["MD5"], result["Fuzzy"])).lastrowid
+                if result["Fuzzy"]:
+                    self.db.executemany("INSERT INTO buckets (blocksize, gram, fileId) VALUES (?, ?, ?)",
+                                        [(b, g, fileId) for b, g in bucketsOf(result["Fuzzy"])])
+            self.db.commit()
+
+    def updateFolder(self, folder, partition="", workers=None):
+        """
+        Hash the new and changed files of a folder with a process pool,
+        and remove the files deleted from it.
+        :param folder: output folder of a tool
+        :param partition: partition the files come from
+        :param workers: number of processes, by default one per CPU
+        :type folder: str
+        :type partition: str
+        :type workers: int
+        :return count: number of files hashed
+        :rtype count: int
+        """
+        files = {}
+        for (dirpath, dirnames, filenames) in walk(folder):
+            for f in filenames:
+                try:
+                    info = stat(dirpath + sep + f)
+                except OSError:
+                    continue
+                files[dirpath + sep + f] = (info.st_size, int(info.st_mtime))
+
+        prefix = folder.rstrip(sep) + sep
+        with self.lock:
+            known = {p: (i, s, m) for i, p, s, m in
+                     self.db.execute("SELECT id, path, size, mtime FROM files WHERE path >= ? AND path < ?",
+                                     (prefix, prefix[:-1] + chr(ord(sep) + 1)))}
+            self.delete([i for p, (i, s, m) in known.items() if p not in files])
+            self.db.commit()
+        paths = [p for p in files if known.get(p, (None,))[1:] != files[p]]
+        if not paths:
+            return 0
+
+        with metrics.stage("fuzzyHash") as m:
+            batch = []
+            with ProcessPoolExecutor(max_workers=workers or cpu_count()) as pool:
+                for result in pool.map(hashFile, paths, chunksize=8):
+                    batch.append(result)
+                    m["Bytes"] += result.get("Size", 0)
+                    if len(batch) >= BATCH:
+                        self.write(batch, partition)
+                        batch = []
+            self.write(batch, partition)
+            m["Items"] = len(paths)
+        return len(paths)
+
+    def similar(self, fuzzy, threshold=1):
+        """
+        Get the files similar to a fuzzy hash.
+        :param fuzzy: "blocksize:signature:signature"
+        :param threshold: smallest score
+        :type fuzzy: str
+        :type threshold: int
+        :return files: dictionaries with Path, Partition, Size, MD5 and
+                       Score, the most similar first
+        :rtype files: list
+        """
+        buckets = bucketsOf(fuzzy)
+        with self.lock:
+            ids = set()
+            for b, g in buckets:
+                ids.update(r[0] for r in self.db.execute("SELECT fileId FROM buckets WHERE blocksize = ? "
+                                                         "AND gram = ?", (b, g)))
+            rows = [self.db.execute("SELECT path, partition, size, md5, fuzzy FROM files WHERE id = ?",
+                                    (i,)).fetchone() for i in ids]
+
+        files = []
+        for p, partition, size, md5, other in rows:
+            score = compare(fuzzy, other)
+            if score >= threshold:
+                files.append({"Path": p, "Partition": partition, "Size": size, "MD5": md5, "Score": score})
+        return sorted(files, key=lambda f: -f["Score"])
+
+    def groups(self, threshold=60, crossPartition=False):
+        """
+        Get the groups of similar files. Two files are in the same group
+        when they have the same MD5, or a chain of files scoring at least
+        threshold links them. Only the pairs sharing a bucket are compared.
+        :param threshold: smallest score linking two files
+        :param crossPartition: only the groups with files of several
+                               partitions
+        :type threshold: int
+        :type crossPartition: bool
+        :return groups: lists of dictionaries with Path, Partition, Size,
+                        MD5 and Score (best score with another file of the
+                        group), the largest groups first
+        :rtype groups: list
+        """
+        with metrics.stage("fuzzyGroups") as m:
+            with self.lock:
+                files = {r[0]: r[1:] for r in
+                         self.db.execute("SELECT id, path, partition, size, md5, fuzzy FROM files")}
+                pairs = self.db.execute(
+                    "SELECT DISTINCT a.fileId, b.fileId FROM "
+                    "(SELECT blocksize, gram FROM buckets GROUP BY blocksize, gram "
+                    "HAVING COUNT(*) BETWEEN 2 AND ?) k "
+                    "JOIN buckets a ON a.blocksize = k.blocksize AND a.gram = k.gram "
+                    "JOIN buckets b ON b.blocksize = k.blocksize AND b.gram = k.gram AND b.fileId > a.fileId",
+                    (MAX_BUCKET,)).fetchall()
+
+            # Union-find of the files
+            parent = {i: i for i in files}
+            best = {}
+
+            def find(i):
+                while parent[i] != i:
+                    parent[i] = parent[parent[i]]
+                    i = parent[i]
+                return i
+
+            def link(a, b, score):
+                parent[find(a)] = find(b)
+                best[a] = max(best.get(a, 0), score)
+                best[b] = max(best.get(b, 0), score)
+
+            byMd5 = {}
+            for i, (p, partition, size, md5, fuzzy) in files.items():
+                if size and md5 in byMd5:
+                    link(i, byMd5[md5], 100)
+                byMd5.setdefault(md5, i)
+
+            for a, b in pairs:
+                if find(a) == find(b) and a in best and b in best:
+                    continue
+                score = compare(files[a][4], files[b][4])
+                if score >= threshold:
+                    link(a, b, score)
+            m["Items"] = len(pairs)
+
+        members = {}
+        for i in best:
+            members.setdefault(find(i), []).append(i)
+
+        groups = []
+        for ids in members.values():
+            group = [{"Path": files[i][0], "Partition": files[i][1], "Size": files[i][2], "MD5": files[i][3],
+                      "Score": best[i]} for i in sorted(ids, key=lambda i: files[i][0])]
+            if crossPartition and len({f["Partition"] for f in group}) < 2:
+                continue
+            groups.append(group)
+        return sorted(groups, key=lambda g: -len(g))
+
+    def count(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+
+# Indexes opened by this process, shared by the GUI and the batch jobs
+indexes = {}
+indexesLock = threading.Lock()
+
+
+def openFuzzyIndex(dbPath):
+    """
+    Get the index stored at a path, opened once per process.
+    :param dbPath: path of the database
+    :type dbPath: str
+    :rtype: FuzzyIndex
+    """
+    dbPath = path.abspath(dbPath)
+    with indexesLock:
+        if dbPath not in indexes:
+            indexes[dbPath] = FuzzyIndex(dbPath)
+        return indexes[dbPath]
@@ -0,0 +1,239 @@
+"""
+Resource governor shared by every job of PyCarver.
+
+The carve threads, the batch queue, the distributed workers and the
+external tools all take their share of the host from one governor:
+    I/O:       a token bucket limits the bytes read by PyCarver per second
+               (the reads done by the tools themselves are not counted)
+    processes: a maximum number of external tools running at the same time
+    memory:    a budget for the buffers and the in-memory trees of files
+
+The limits can be changed while PyCarver runs and the utilisation of each
+resource is shown as gauges in the Performance tab.
+
+Usage:
+    with governor.process():
+        ...
+    with governor.reserve(len(buffer)) as reservation:
+        ...
+    governor.throttle(len(data))
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+
+class MemoryBudgetExceeded(Exception):
+    """ Raised when a reservation can not grow within the memory budget. """
+
+
+def physicalMemory():
+    """
+    Helper function to get the physical memory of the host.
+    :rtype: int
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return 4 * 1024 ** 3
+
+
+class Reservation:
+    """ Memory reserved from the governor, released when done. """
+
+    def __init__(self, governor, nbytes, label):
+        self.governor = governor
+        self.nbytes = nbytes
+        self.label = label
+
+    def grow(self, nbytes):
+        """
+        Reserve more memory without waiting.
+        :param nbytes: bytes to add to the reservation
+        :type nbytes: int
+        :raises MemoryBudgetExceeded: if the budget is used
+        """
+        self.governor.grow(self, nbytes)
+
+    def release(self):
+        self.governor.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Governor:
+    """ Limits on the I/O, processes and memory used by all the jobs. """
+
+    def __init__(self, ioRate=0, processes=None, memory=None):
+        """
+        :param ioRate: bytes per second read by PyCarver, 0 for no limit
+        :param processes: maximum number of external tools running
+        :param memory: memory budget in bytes
+        :type ioRate: int
+        :type processes: int
+        :type memory: int
+        """
+        self.ioRate = ioRate
+        self.processes = processes or max(2, os.cpu_count() or 1) * 2
+        self.memory = memory or physicalMemory() // 2
+
+        self.condition = threading.Condition()
+        self.tokens = 0.0
+        self.lastRefill = time.monotonic()
+        self.running = 0
+        self.reserved = 0
+        self.reservations = set()
+        self.waiting = {"io": 0, "processes": 0, "memory": 0}
+
+        # Bytes read in the last seconds, for the current rate
+        self.history = deque()
+
+    def configure(self, ioRate=None, processes=None, memory=None):
+        """
+        Change the limits. The jobs waiting are woken up to check them.
+        :type ioRate: int
+        :type processes: int
+        :type memory: int
+        """
+        with self.condition:
+            if ioRate is not None:
+                self.ioRate = ioRate
+                self.tokens = 0.0
+            if processes is not None:
+                self.processes = max(1, processes)
+            if memory is not None:
+                self.memory = memory
+            self.condition.notify_all()
+
+    def throttle(self, nbytes):
+        """
+        Wait until nbytes can be read within the I/O limit. Reads larger
+        than one second of the limit are spread over several seconds.
+        :param nbytes: bytes about to be read, or just read
+        :type nbytes: int
+        """
+        with self.condition:
+            now = time.monotonic()
+            self.history.append((now, nbytes))
+            while self.history and self.history[0][0] < now - 5:
+                self.history.popleft()
+
+            if not self.ioRate:
+                return
+
+            self.waiting["io"] += 1
+            try:
+                left = nbytes
+                while left > 0:
+                    now = time.monotonic()
+                    # The bucket holds at most one second of tokens
+                    self.tokens = min(float(self.ioRate), self.tokens + (now - self.lastRefill) * self.ioRate)
+                    self.lastRefill = now
+                    if self.tokens > 0:
+                        take = min(left, self.tokens)
+                        self.tokens -= take
+                        left -= take
+                        continue
+                    if not self.ioRate:
+                        break
+                    self.condition.wait(min(1.0, left / float(self.ioRate)))
+            finally:
+                self.waiting["io"] -= 1
+
+    def acquireProcess(self):
+        """
+        Wait for a free slot to run an external tool.
+        """
+        with self.condition:
+            self.waiting["processes"] += 1
+            try:
+                while self.running >= self.processes:
+                    self.condition.wait()
+                self.running += 1
+            finally:
+                self.waiting["processes"] -= 1
+
+    def releaseProcess(self):
+        with self.condition:
+            self.running -= 1
+            self.condition.notify_all()
+
+    @contextmanager
+    def process(self):
+        """
+        Context manager holding a process slot.
+        """
+        self.acquireProcess()
+        try:
+            yield
+        finally:
+            self.releaseProcess()
+
+    def reserve(self, nbytes, label=""):
+        """
+        Wait until nbytes fit in the memory budget and reserve them. A
+        reservation larger than the whole budget is granted when nothing
+        else is reserved, so it can not wait forever.
+        :param nbytes: bytes to reserve
+        :param label: what the memory is for
+        :type nbytes: int
+        :type label: str
+        :rtype: Reservation
+        """
+        reservation = Reservation(self, nbytes, label)
+        with self.condition:
+            self.waiting["memory"] += 1
+            try:
+                while self.reserved and self.reserved + nbytes > self.memory:
+                    self.condition.wait()
+            finally:
+                self.waiting["memory"] -= 1
+            self.reserved += nbytes
+            self.reservations.add(reservation)
+        return reservation
+
+    def grow(self, reservation, nbytes):
+        """
+        Add memory to a reservation without waiting, see Reservation.grow.
+        """
+        with self.condition:
+            if self.reserved + nbytes > self.memory:
+                raise MemoryBudgetExceeded("%s needs more than the memory budget of %d MB" %
+                                           (reservation.label or "a job", self.memory // 1024 ** 2))
+            self.reserved += nbytes
+            reservation.nbytes += nbytes
+
+    def release(self, reservation):
+        with self.condition:
+            if reservation in self.reservations:
+                self.reservations.discard(reservation)
+                self.reserved -= reservation.nbytes
+                self.condition.notify_all()
+
+    def utilisation(self):
+        """
+        Get the current use of each resource.
+        :return usage: IOBytesPerSecond, IOLimit, Processes, ProcessLimit,
+                       MemoryReserved, MemoryBudget and the number of jobs
+                       waiting for each resource
+        :rtype usage: dict
+        """
+        with self.condition:
+            now = time.monotonic()
+            recent = sum(n for t, n in self.history if t >= now - 5)
+            return {"IOBytesPerSecond": recent / 5.0, "IOLimit": self.ioRate,
+                    "Processes": self.running, "ProcessLimit": self.processes,
+                    "MemoryReserved": self.reserved, "MemoryBudget": self.memory,
+                    "WaitingIO": self.waiting["io"], "WaitingProcesses": self.waiting["processes"],
+                    "WaitingMemory": self.waiting["memory"]}
+
+
+# Governor shared by all of PyCarver
+governor = Governor()
@@ -0,0 +1,302 @@
+"""
+Persistent job queue used by PyCarver to process many disk images.
+
+Every step of the PyCarver workflow (partition discovery, carving of
+partitions, hashing, recovery of deleted files and file carving) is
+represented by a job. Jobs have a priority, a list of jobs they depend on
+and a resource class. Each resource class ("io" or "cpu") has its own pool
+of worker threads, so I/O bound extraction and CPU bound hashing do not
+block each other.
+
+The state of the queue is saved to a JSON file every time a job changes,
+so the queue survives a restart of the application. Jobs that were
+running when the application stopped are started again.
+"""
+
+import json
+import threading
+import itertools
+from datetime import datetime
+from os import path, replace
+
+
+PENDING = "Pending"
+RUNNING = "Running"
+DONE = "Done"
+FAILED = "Failed"
+
+# Default number of worker threads for each resource class
+DEFAULT_WORKERS = {"io": 2, "cpu": 2}
+
+
+class JobQueue:
+    """ Scheduler for the jobs of a batch of disk images. """
+
+    def __init__(self, statePath, workers=None):
+        """
+        Setup the queue and load the state saved in a previous run.
+        :param statePath:   Path of the JSON file that stores the queue
+        :param workers:     Number of worker threads for each resource class
+        :type statePath:    str
+        :type workers:      dict
+        """
+        self.statePath = statePath
+        self.workers = dict(DEFAULT_WORKERS)
+        if workers is not None:
+            self.workers.update(workers)
+
+        # Task name -> {"Function": callable, "Resource": str}
+        self.tasks = {}
+
+        # Job id -> job dictionary
+        self.jobs = {}
+
+        self.lock = threading.Condition()
+        self.threads = []
+        self.running = False
+        self.counter = itertools.count()
+
+        self.load()
+
+    def registerTask(self, name, function, resource="io"):
+        """
+        Register the function that will run the jobs of a task. The
+        function is called as function(queue, job) and returns a
+        dictionary (the result of the job) that must be JSON serializable.
+        :param name:        Name of the task
+        :param function:    Function to run for each job of the task
+        :param resource:    Default resource class of the task ("io" or "cpu")
+        :type name:         str
+        :type function:     function
+        :type resource:     str
+        """
+        with self.lock:
+            self.tasks[name] = {"Function": function, "Resource": resource}
+            self.lock.notify_all()
+
+    def addJob(self, task, args, priority=0, dependsOn=None, resource=None, label=""):
+        """
+        Add a new job to the queue.
+        :param task:        Name of a registered task
+        :param args:        Arguments of the job (JSON serializable)
+        :param priority:    Jobs with higher priority run first
+        :param dependsOn:   Ids of the jobs that must be done before this one
+        :param resource:    Resource class, by default the one of the task
+        :param label:       Text to identify the job in the GUI
+        :type task:         str
+        :type args:         dict
+        :type priority:     int
+        :type dependsOn:    list
+        :type resource:     str
+        :type label:        str
+        :return jobId:      Id of the new job
+        :rtype jobId:       str
+        """
+        with self.lock:
+            if resource is None:
+                resource = self.tasks[task]["Resource"] if task in self.tasks else "io"
+
+            jobId = "%d" % next(self.counter)
+            self.jobs[jobId] = {
+                "Id": jobId,
+                "Task": task,
+                "Label": label,
+                "Args": args,
+                "Priority": priority,
+                "Resource": resource,
+                "DependsOn": list(dependsOn or []),
+                "State": PENDING,
+                "Result": None,
+                "Error": "",
+                "Created": datetime.today().isoformat(),
+                "Started": "",
+                "Finished": "",
+            }
+            self.save()
+            self.lock.notify_all()
+
+        return jobId
+
+    def getJobs(self):
+        """
+        Get a copy of all the jobs of the queue, in creation order.
+        :return jobs: list of job dictionaries
+        :rtype jobs: list
+        """
+        with self.lock:
+            jobs = [dict(j) for j in self.jobs.values()]
+        jobs.sort(key=lambda j: int(j["Id"]))
+        return jobs
+
+    def clearFinished(self):
+        """
+        Remove the jobs that are done from the queue. Failed jobs are kept
+        so that the user can see them.
+        """
+        with self.lock:
+            needed = set()
+            for job in self.jobs.values():
+                if job["State"] != DONE:
+                    needed.update(job["DependsOn"])
+
+            for jobId in list(self.jobs):
+                if self.jobs[jobId]["State"] == DONE and jobId not in needed:
+                    del self.jobs[jobId]
+            self.save()
+
+    def start(self):
+        """
+        Start the worker threads of every resource class.
+        """
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+
+        for resource, count in self.workers.items():
+            for n in range(count):
+                t = threading.Thread(target=self.worker, args=(resource,),
+                                     name="%s-worker-%d" % (resource, n), daemon=True)
+                self.threads.append(t)
+                t.start()
+
+    def stop(self, wait=True):
+        """
+        Stop the worker threads. Jobs that are running are allowed to
+        finish.
+        :param wait: wait for the worker threads to finish
+        :type wait: bool
+        """
+        with self.lock:
+            self.running = False
+            self.lock.notify_all()
+
+        if wait:
+            for t in self.threads:
+                t.join()
+        self.threads = []
+
+    def wait(self, timeout=None):
+        """
+        Wait until there are no pending or running jobs left.
+        :param timeout: maximum number of seconds to wait
+        :type timeout: float
+        :return done: True if the queue is empty of work
+        :rtype done: bool
+        """
+        with self.lock:
+            return self.lock.wait_for(self.idle, timeout)
+
+    def idle(self):
+        """
+        Helper function to know if there is no work left in the queue.
+        Must be called with the lock held.
+        """
+        return not any(j["State"] in (PENDING, RUNNING) for j in self.jobs.values())
+
+    def worker(self, resource):
+        """
+        Main loop of a worker thread. It takes the next ready job of its
+        resource class and runs it.
+        :param resource: resource class served by this worker
+        :type resource: str
+        """
+        while True:
+            with self.lock:
+                job = None
+                while self.running:
+                    job = self.nextJob(resource)
+                    if job is not None:
+                        break
+                    self.lock.wait()
+
+                if job is None:
+                    return
+
+                job["State"] = RUNNING
+                job["Started"] = datetime.today().isoformat()
+                function = self.tasks[job["Task"]]["Function"]
+                self.save()
+
+            try:
+                result = function(self, job)
+                state, error = DONE, ""
+            except Exception as err:
+                result, state, error = None, FAILED, str(err)
+
+            with self.lock:
+                job["Result"] = result
+                job["State"] = state
+                job["Error"] = error
+                job["Finished"] = datetime.today().isoformat()
+                self.save()
+                self.lock.notify_all()
+
+    def nextJob(self, resource):
+        """
+        Find the pending job with the highest priority whose dependencies
+        are done. Jobs depending on a failed job are marked as failed.
+        Must be called with the lock held.
+        :param resource: resource class of the job
+        :type resource: str
+        :return job: the job to run or None
+        :rtype job: dict
+        """
+        best = None
+        for job in self.jobs.values():
+            if job["State"] != PENDING or job["Resource"] != resource:
+                continue
+            if job["Task"] not in self.tasks:
+                continue
+
+            ready = True
+            for dep in job["DependsOn"]:
+                depState = self.jobs[dep]["State"] if dep in self.jobs else DONE
+                if depState == FAILED:
+                    job["State"] = FAILED
+                    job["Error"] = "Dependency %s failed" % dep
+                    self.lock.notify_all()
+                    ready = False
+                    break
+                if depState != DONE:
+                    ready = False
+
+            if not ready:
+                continue
+
+            if best is None or (job["Priority"], -int(job["Id"])) > (best["Priority"], -int(best["Id"])):
+                best = job
+
+        return best
+
+    def save(self):
+        """
+        Save the state of the queue to disk. The file is replaced
+        atomically, so a crash never leaves a half written state.
+        Must be called with the lock held.
+        """
+        tmpPath = self.statePath + ".tmp"
+        with open(tmpPath, "w") as fp:
+            json.dump({"Jobs": list(self.jobs.values())}, fp)
+        replace(tmpPath, self.statePath)
+
+    def load(self):
+        """
+        Load the state saved in a previous run. Jobs that were running are
+        set back to pending so they run again.
+        """
+        if not path.isfile(self.statePath):
+            return
+
+        with open(self.statePath, "r") as fp:
+            state = json.load(fp)
+
+        last = -1
+        for job in state.get("Jobs", []):
+            if job["State"] == RUNNING:
+                job["State"] = PENDING
+                job["Started"] = ""
+            self.jobs[job["Id"]] = job
+            last = max(last, int(job["Id"]))
+
+        self.counter = itertools.count(last + 1)
@@ -27,192 +27,36 @@ References:
 
 """
 
+import re
 import threading
 import json
-from queue import Queue
+import sqlite3
+import time
+from queue import Queue, Empty
+from collections import Counter
 from datetime import datetime
-from subprocess import Popen, PIPE
-from os import walk, sep, listdir, path,linesep
+from importlib.util import find_spec
+from os import walk, sep, listdir, path,linesep, makedirs
 from tkinter import ttk, messagebox
 from tkinter.ttk import Notebook, Treeview
-from tkinter.filedialog import askopenfilename, askdirectory, asksaveasfile
+from tkinter.filedialog import askopenfilename, askopenfilenames, askdirectory, asksaveasfile, asksaveasfilename
 from tkinter import *
+from jobqueue import JobQueue, PENDING, FAILED
+from metrics import metrics
+from governor import governor, MemoryBudgetExceeded
+from evidenceio import dropCache, MODES, READ_AHEAD
+from console import ConsoleBuffer, LEVELS
+from partitionstate import PartitionStore
+from contentstore import detachFolder
+# The core does not use tkinter, the modules that are slow to import
+# (distributed, export, formats, carver, entropy, unallocated and
+# signatures) are imported by the functions using them
+from core import (Log, runTool, mmlsParser, fsstatParser, getFilesTree, getMd5, TREE_ENTRY_BYTES,
+                  CARVE_ORDERS, orderPartitions, discoverPartitionsTask, extractPartition,
+                  carvePartitionTask, hashPartitionTask, recoverFilesTask, carveFilesTask, indexTextTask,
+                  fuzzyHashTask, hashImageTask, singlePass, singlePassTask)
 
 
-class Log:
-    """ Logging for the outputs. """
-    def __init__(self, logpath=None):
-        """
-        Setup log path and create log based on current timestamp.
-        :param logpath: the path for the log file.
-        :type logpath: str
-        """
-        if logpath is None:
-            self.logpath = path.abspath(".")
-        else:
-            self.logpath = logpath
-
-        #create log
-        t = datetime.today().__format__("%Y-%m-%d_%H-%M-%S")
-        filename = "pycarver_"+t+".log"
-        self.logpath = path.join(self.logpath,filename)
-
-        with open(self.logpath,"w+") as log:
-            log.write("--- PyCarver Log --- (Created at "+t+")\n"+linesep)
-        print("--- PyCarver Log --- (Created at "+t+")\n")
-
-    def writeToLog(self, text):
-        """
-        Write something to the log with the current timestamp.
-        :param text: text to output to file
-        :type text: str
-        """
-        with open(self.logpath,"a") as log:
-            log.write(datetime.today().__format__("%H:%M:%S")+": "+text+"\n"+linesep)
-
-
-def mmlsParser(f):
-    """
-    Helper function to parse the output of mmls.
-    :param f:   output of mmls
-    :type f:    str
-    :return info: list of json objects. Each json
-                object contains info of each partition
-                identified by mmls.
-    :return bs: block size of each partition as identified by mmls
-    :rtype info: list
-    :rtype bs: int
-    """
-
-    info = []
-    bs = -1
-
-    slotFound = False
-    partitionCounter = 0 #partitions carved
-
-    for line in f:
-        # find what the units are supposed to be
-        if "Units are in " in line:
-            bs = line[line.find("Units are in ") + len("Units are in "):line.find("-")]
-
-        line = line.strip().split(" ")
-
-        if (not slotFound):
-            if ("Slot" in line):
-                slotFound = True
-        else:
-            temp = {}
-            temp['Slot'] = line[2]
-            temp['CarvedFiles'] = "No"
-            temp["FSType"] = ""
-            temp["Path"] = ""
-            temp["Carved"] = "No"
-
-            if (line[2] == "Meta"):
-                temp["Start"] = line[8]
-                temp["End"] = line[11]
-                temp["Length"] = line[14]
-                temp["Description"] = " ".join(line[17:])
-                temp["FileSystem"] = "No"
-
-                # TODO: Add a number to distinguish between partitions
-                # with the same name
-                temp['Name'] = temp["Description"].replace(" ", "_")
-            else:
-
-                temp["Description"] = " ".join(line[14:])
-                temp["Start"] = line[5]
-                temp["End"] = line[8]
-                temp["Length"] = line[11]
-
-                if (":" in line[2]):
-                    temp["Description"] += "_fs%d"%(partitionCounter)
-                    temp["FileSystem"] = "Yes"
-
-                    partitionCounter = partitionCounter + 1
-                else:
-                    temp["FileSystem"] = "No"
-
-                temp['Name'] = temp["Description"].replace(" ", "_")
-
-
-            info.append(temp)
-
-    return info, bs
-
-
-def fsstatParser(f):
-    """
-    Helper function to parse the output of fsstat.
-    :param f: f is the output of fsstat
-    :type f: str
-    :return fsType:    This function will return the File System type of the
-                        partition.
-    :rtype fsType:  str
-    """
-    for line in f.splitlines():
-        # find the partition type:
-        indx = line.find("File System Type: ")
-        if indx > -1:
-            fsType = line[indx + len("File System Type: "):].strip()
-            return fsType
-
-
-def getFilesTree(path):
-    """
-    Function to get the folder hierarchy.
-    :param path: The path of the folder to get the hierarchy of.
-    :type path: str
-    :return dir:    This function returns a Json object that contains
-                the files and folders within the specified folder
-    :rtype dir: str
-    """
-    dir = {}
-
-    # list to store the directories found
-    directories = []
-
-    # Getting the files and directories in the given path
-    # This will traverse the entire folder
-    for (dirpath, dirnames, filenames) in walk(path):
-        directories.append(dirpath)
-
-        # Each directory will have an entry in the dictionary
-        # that contains a list of its files
-        dir[dirpath] = {}
-        dir[dirpath]['Files'] = []
-        for f in filenames:
-            dir[dirpath]['Files'].append(dirpath + sep + f)
-
-    directories.reverse()
-
-    # We are done with these directories
-    # They are now where they should
-    done = []
-
-    # Re positioning the directories under their parents
-    for d in directories:
-        for sub in directories:
-
-            # We are not done with this sub directory
-            if (sub not in done):
-
-                # If the sub directory starts with a parent
-                # path then we know that the subdirectory is a child
-                # of directory d
-                if (sub.startswith(d)):
-                    if (sub != d):
-                        # add the child to its parent entry
-                        # and add it to the done list
-                        dir[d][sub] = dir[sub]
-                        done.append(sub)
-
-                        # delete the child from the dir dictionary
-                        # to avoid repetitions
-                        del dir[sub]
-
-    return dir
-
 
 def addItems(tree, parent, dir, md5Path, md5=False, ):
     """
@@ -233,46 +77,26 @@ def addItems(tree, parent, dir, md5Path, md5=False, ):
     :type parent:   Treeview child
     :type dir:      Dictionary
     :type md5:      Boolean
+    :return count:  Number of items added
+    :rtype count:   int
     """
+    count = 0
     f = dir['Files']
     for i in f:
         # i is the path of each file
         vals = []
         if md5:
-            vals.append(getMd5(i, md5Path))
+            vals.append(getMd5(i, md5Path, onError=messagebox.showerror))
 
         tree.insert(parent, "end", '', text=i.split(sep)[-1], values=(vals))
+        count += 1
 
     for item in dir:
         if (item != "Files"):
             it = tree.insert(parent, "end", '', text=item.split(sep)[-1], values=([]))
-            addItems(tree, it, dir[item], md5Path, md5=md5)
+            count += 1 + addItems(tree, it, dir[item], md5Path, md5=md5)
 
-def getMd5(filePath, md5Path):
-    """
-    Helper function to calculate the md5 sum of the file in the given
-    path.
-    :param filePath: Path of the file being used in this function
-    :type filePath: str
-    :return md5: Returns the md5 sum of file in the given path
-    :rtype md5: str
-    """
-    md5 = ""
-
-    cmd = [md5Path, filePath]
-    md5Output = Popen(cmd, stdout=PIPE, stderr=PIPE)
-    stdout, stderr = md5Output.communicate()
-
-    stdout = stdout.decode("utf-8")
-    stderr = stderr.decode("utf-8")
-
-    if stdout:
-        md5 = stdout.split(" ")[0]
-
-    else:
-        messagebox.showerror(stderr)
-
-    return md5
+    return count
 
 class CarveThread(threading.Thread):
     """ Spawn thread when paritition is being carved."""
@@ -310,84 +134,105 @@ class CarveThread(threading.Thread):
         Carve the file using the created thread.
         """
         print("CarveThread started: " + self.name)
+        start = time.perf_counter()
 
         name = self.partitionsDict["Name"]
         outPath = self.path + "/" + name
 
-        self.queue.put({"text": "Attempting to carve partition " + name + "...", "deli":"\t"})
-
-        #the command that you want to run to carve the file
-        cmd = [self.app.ddPath, "if=" + self.app.imagePath, "of=" + outPath, "bs=" + self.app.bs,
-                "skip=" + self.partitionsDict["Start"], "count=" + self.partitionsDict["Length"]]
-
-        #call dd to carve the file
-        carvedPart = Popen(cmd, stdout=PIPE, stderr=PIPE)
-        self.queue.put({"text": carvedPart.args, "deli": "$"})
-        stdout, stderr = carvedPart.communicate()
-
-        stdout = stdout.decode('utf-8')
-        stderr = stderr.decode('utf-8')
-
-        success = False
-
-        if stdout:
-            if "records" in stdout:
-                self.app.insertCommand("Success!", "\t")
-                self.queue.put({"text": "Success: " + name, "deli": "\t"})
-
-                # success!
-                success = True
-
-                self.app.listOfPartitions[self.pos]["Carved"] = "Yes"
-                self.app.listOfPartitions[self.pos]["Path"] = outPath
-            else:
-                if stderr:
-                    if "records" in stdout:
-                        # success!
-                        self.queue.put({"text": "Success: " + name, "deli": "\t"})
-
-                        success = True
-                        self.app.listOfPartitions[self.pos]["Carved"] = "Yes"
-                        self.app.listOfPartitions[self.pos]["Path"] = outPath
-                else:
-                    #failed to carve
-                    self.queue.put({"text": "Failure: " + name, "deli": "\t"})
+        self.queue.put({"text": "Attempting to carve partition " + name + "...", "deli": "\t", "job": name})
+
+        md5Sum = None
+        if self.app.singlePass:
+            # One read extracts and hashes the partition, and finds the
+            # headers (and the entropy map) for the carver
+            bs = int(self.app.bs)
+            target = (outPath, int(self.partitionsDict["Start"]) * bs, int(self.partitionsDict["Length"]) * bs)
+            extracted = singlePass(self.app.imagePath, [target], self.app.ioMode, self.app.readAhead,
+                                   self.app.singlePassTypes, self.app.skipRegions)
+            if extracted["Success"]:
+                md5Sum = extracted["Targets"][0]["MD5"]
         else:
-            if stderr:
-                if "records" in stderr:
-                    self.queue.put({"text": "Success: " + name, "deli": "\t"})
+            #extract the partition with dd or with the I/O backend chosen
+            extracted = extractPartition(self.app.imagePath, outPath, self.app.bs, self.partitionsDict["Start"],
+                                         self.partitionsDict["Length"], self.app.ioMode, self.app.readAhead,
+                                         self.app.ddPath)
+        self.queue.put({"text": extracted["Cmd"], "deli": "$", "job": name})
 
-                    # success!
-                    success = True
+        success = extracted["Success"]
 
-                    self.app.listOfPartitions[self.pos]["Carved"] = "Yes"
-                    self.app.listOfPartitions[self.pos]["Path"] = outPath
-                else:
-                    # failed to carve
-                    self.queue.put({"text": "Failure: " + name, "deli": "\t"})
-            else:
-                # failed to carve
-                self.queue.put({"text": "Failure: " + name, "deli": "\t"})
+        if success:
+            self.queue.put({"text": "Success: " + name, "deli": "\t", "job": name})
 
+            self.app.partitions.update(self.pos, Carved="Yes", Path=outPath)
+        else:
+            # failed to carve
+            self.queue.put({"text": "Failure: " + name + " " + extracted["Error"], "deli": "\t", "level": "error",
+                            "job": name})
 
         if self.partitionsDict['FileSystem'] == "Yes":
-            fsType = Popen([self.app.fsstatPath, outPath], stdout=PIPE, stderr=PIPE)
-            self.queue.put({"text": fsType.args, "deli": "$"})
-            stdout, stderr = fsType.communicate()
+            cmd = [self.app.fsstatPath, outPath]
+            self.queue.put({"text": cmd, "deli": "$", "job": name})
+            fsType = runTool("fsstat", cmd)
 
-            stdout = stdout.decode("utf-8")
-            stderr = stderr.decode("utf-8")
+            stdout = fsType["Stdout"]
+            stderr = fsType["Stderr"]
 
             if stdout:
                 type = fsstatParser(stdout)
-                self.app.listOfPartitions[self.pos]["FSType"] = type
+                self.app.partitions.update(self.pos, FSType=type)
                 #note: deli is delimiter
-                self.queue.put({"text": "FSType: " + type, "deli": "\t"})
+                self.queue.put({"text": "FSType: " + type, "deli": "\t", "job": name})
+            else:
+                self.queue.put({"text": "FSType: " + stderr, "deli": "\t", "level": "error", "job": name})
+
+        # Hashing here, so the result of the partition is complete when
+        # it is published
+        if md5Sum is not None:
+            self.app.partitions.update(self.pos, MD5Sum=md5Sum)
+        elif success:
+            cmd = [self.app.md5Path, outPath]
+            self.queue.put({"text": cmd, "deli": "$", "job": name})
+            md5 = runTool("md5", cmd)
+            if md5["Stdout"]:
+                self.app.partitions.update(self.pos, MD5Sum=md5["Stdout"].split(" ")[0])
             else:
-                self.queue.put({"text": "FSType: " + stderr, "deli": "\t"})
+                self.queue.put({"text": "MD5: " + md5["Stderr"], "deli": "\t", "level": "error", "job": name})
+
+        self.app.log.writeEvent("carve-partition", job=self.name, partition=name,
+                                duration=extracted["Duration"], success=success, io=self.app.ioMode,
+                                singlePass=self.app.singlePass)
+
+        duration = time.perf_counter() - start
+        size = int(self.partitionsDict["Length"]) * int(self.app.bs) if success else 0
+        metrics.observe("CarveThread.run", duration, bytes=size)
+
+        # Letting the application publish the result of this partition
+        self.queue.put({"done": self.pos, "duration": duration})
 
         print("Done: " + name)
 
+# Maximum number of deleted files shown at once in the Deleted Files tab
+DELETED_ROWS = 10000
+
+# Maximum number of hits shown at once in the Search Hits tab
+SEARCH_ROWS = 10000
+
+# Maximum number of files shown at once in the Text Search tab
+TEXT_ROWS = 1000
+
+# Maximum number of groups shown at once in the Similar Files tab
+SIMILAR_GROUPS = 1000
+
+# Milliseconds between two updates of the console
+CONSOLE_FLUSH_MS = 100
+
+# Milliseconds between two updates of the rows of the partitions
+ROWS_FLUSH_MS = 100
+
+# Levels of the lines shown by each choice of the console filter
+CONSOLE_FILTERS = {"All": LEVELS, "Commands": ("command",), "Messages": ("info", "warning", "error"),
+                   "Warnings and errors": ("warning", "error"), "Errors": ("error",)}
+
 class App: #TODO: call this GUI???
     """
     This is the main class of the tkinter application. It contains
@@ -404,7 +249,16 @@ class App: #TODO: call this GUI???
         self.topBtnWidth = 20
 
         self.imagePath = ''
-        self.listOfPartitions = []
+
+        # Partitions of the disk image (read as listOfPartitions). The
+        # changes are queued and their rows updated by flushPartitionRows
+        self.partitions = PartitionStore()
+        self.changedPartitions = Queue()
+        self.partitions.subscribe(lambda i, fields: self.changedPartitions.put(i))
+        # Row of each partition in the summary table and in the Partitions
+        # tab
+        self.summaryRows = {}
+        self.diskRows = {}
 
         self.partitionsToUse = []
         self.carveFileTypes = []
@@ -416,6 +270,9 @@ class App: #TODO: call this GUI???
         self.md5Default = "/usr/bin/md5sum"
         self.ddDefault = "/bin/dd"
         self.fsstatDefault = "/usr/bin/fsstat"
+        self.blklsDefault = "/usr/bin/blkls"
+        self.flsDefault = "/usr/bin/fls"
+        self.icatDefault = "/usr/bin/icat"
 
         self.scalpelPath = self.scalpelDefault
         self.tskPath = self.tskDefault
@@ -423,15 +280,81 @@ class App: #TODO: call this GUI???
         self.md5Path = self.md5Default
         self.ddPath = self.ddDefault
         self.fsstatPath = self.fsstatDefault
+        self.blklsPath = self.blklsDefault
+        self.flsPath = self.flsDefault
+        self.icatPath = self.icatDefault
+
+        # File types to use with SCALPEL, with the types of the user
+        # signatures file loaded on first use (see getFileTypes)
+        self.FileTypes = None
+
+        # Check the structure of the carved files and quarantine the
+        # invalid ones
+        self.validateCarvedFiles = True
+
+        # Carve files with Scalpel instead of the built-in carver
+        self.useScalpel = False
 
-        # File types to use with SCALPEL
-        self.FileTypes = ['jpg', 'gif', 'png' ,'pdf']
+        # Order of the partitions to carve (see CARVE_ORDERS) and number
+        # of partitions carved at the same time
+        self.carveOrder = "smallest"
+        self.carveSlots = 2
+
+        # How the evidence is read: "dd" to extract the partitions with dd,
+        # or one of the modes of evidenceio that keep it out of the cache
+        self.ioMode = "dd"
+        self.readAhead = READ_AHEAD
+
+        # Carve only the unallocated space of the file systems
+        self.unallocatedOnly = False
+
+        # Skip the empty and random regions of the partitions when carving
+        # files, using their entropy map
+        self.skipRegions = False
 
         self.notesFileName = None #notes file name
 
         #contains all of the carved file trees in the carved files window
         self.carvedFilesTrees = []
 
+        # Index of the deleted files listed with fls, created when the
+        # deleted files are listed, and the tab to filter and recover them
+        self.deletedIndex = None
+        self.deletedTab = None
+        self.selectiveRecovery = True
+
+        # Index of the hits of the keyword searches and the tab showing them
+        self.hitIndex = None
+        self.searchTab = None
+
+        # Full-text index of the recovered and carved files, updated each
+        # time files are written to an output folder, and its tab
+        self.indexText = True
+        self.textIndex = None
+        self.textSearchTab = None
+
+        # Index of the fuzzy hashes of the same files, to group the
+        # similar ones, and its tab. Without the ssdeep module the hashes
+        # are computed in Python at about 1 MB/s, so it is opt-in then
+        self.fuzzyHash = find_spec("ssdeep") is not None
+        self.fuzzyIndex = None
+        self.similarTab = None
+
+        # Hash the images of the batch queue in segments, to verify them
+        # later (see merkle)
+        self.hashImages = True
+
+        # Extract, hash and scan the partitions in one read of the image
+        # instead of dd, md5sum and a scan of the carver (see pipeline).
+        # Finding headers makes the read much slower, so only the types
+        # chosen for it in the settings are looked for
+        self.singlePass = False
+        self.singlePassTypes = []
+
+        # Store the recovered and carved files once per content, and
+        # hard link them in the output folders (see contentstore)
+        self.contentStore = False
+
         # Table that will hold the partitions of the imported disk image
         # This will be displayed in the Right Frame
         self.partitionsOpenDiskTree = None
@@ -440,6 +363,27 @@ class App: #TODO: call this GUI???
         # partition found in the imported disk image
         self.partitionsTree = None
 
+        # Queue to process a batch of disk images. The state of the queue
+        # is stored next to the log so it survives a restart. The queue
+        # is started on first use, or now if jobs were left by a
+        # previous run (see getJobQueue)
+        self.jobQueuePath = path.join(path.abspath("."), "pycarver_queue.json")
+        self.jobQueue = None
+
+        # Depth of the queues shown in the Performance tab
+        metrics.gauge("jobs_pending", lambda: 0 if self.jobQueue is None else
+                      sum(1 for j in self.jobQueue.getJobs() if j["State"] == PENDING))
+        metrics.gauge("log_queue", self.log.queue.qsize)
+
+        # Live utilisation of the resource governor
+        for key in ("IOBytesPerSecond", "IOLimit", "Processes", "ProcessLimit", "MemoryReserved",
+                    "MemoryBudget", "WaitingIO", "WaitingProcesses", "WaitingMemory"):
+            metrics.gauge("governor_" + key, lambda key=key: governor.utilisation()[key])
+        self.performanceTree = None
+
+        # Table that will show the jobs of the batch queue
+        self.jobsTree = None
+
         # Setting up the main window (frame) of the application
         master.geometry("{}x{}".format(master.winfo_screenwidth(), master.winfo_screenheight() - 100))
         master.title("PyCarver")
@@ -466,6 +410,17 @@ class App: #TODO: call this GUI???
         self.consoleFrame.pack_propagate(0)
         self.consoleFrame.pack(side=BOTTOM, fill=X)
 
+        # Filter of the lines of the console, by level and by job
+        filterFrame = Frame(self.consoleFrame, bg="black")
+        self.consoleLevelVar = StringVar(value="All")
+        OptionMenu(filterFrame, self.consoleLevelVar, *CONSOLE_FILTERS).pack(fill=X)
+        Label(filterFrame, text="Job", bg="black", foreground="white").pack()
+        self.consoleJobVar = StringVar()
+        Entry(filterFrame, textvariable=self.consoleJobVar, width=14).pack()
+        filterFrame.pack(side=RIGHT, fill=Y)
+        self.consoleLevelVar.trace_add("write", self.filterConsole)
+        self.consoleJobVar.trace_add("write", self.filterConsole)
+
         # Scrollbar for the console
         scrollbar = Scrollbar(self.consoleFrame)
         scrollbar.pack(side=RIGHT, fill=Y)
@@ -479,48 +434,1203 @@ class App: #TODO: call this GUI???
 
         scrollbar.config(command=self.consoleText.yview)
 
+        # Lines of the console, shown in batches by flushConsole
+        self.console = ConsoleBuffer()
+        self.master.after(CONSOLE_FLUSH_MS, self.flushConsole)
+        self.master.after(ROWS_FLUSH_MS, self.flushPartitionRows)
+
         # Right Frame to contain top tabs
         self.rightFrame = Frame(master, bg="white")
         self.rightFrame.pack_propagate(0)
         self.rightFrame.pack(side=RIGHT, expand=TRUE, fill=BOTH)
 
-        # Where the tabs are going to be added: Tabs manager
-        self.tabControl = Notebook(self.rightFrame, name="tabControl")
-        self.tabControl.pack(expand=1, fill="both")
+        # Where the tabs are going to be added: Tabs manager
+        self.tabControl = Notebook(self.rightFrame, name="tabControl")
+        self.tabControl.pack(expand=1, fill="both")
+
+        self.addNotesTab()
+
+        # button to import initial file
+        self.insertButton = Button(self.topFrame, text="Import Disk Image",
+                                   width=self.topBtnWidth, command=self.openDiskImage)
+        self.insertButton.pack(side=LEFT, padx=10)
+
+        # Button to carve paritions
+        self.carvePartitionsButton = Button(self.topFrame, state=DISABLED,
+                                            text="Carve Partitions", width=self.topBtnWidth,
+                                            command=self.carvePartitionsWin)
+        self.carvePartitionsButton.pack(side=LEFT, padx=10)
+
+
+        # Button to recover deleted files
+        self.recoverFilesButton = Button(self.topFrame, state=DISABLED,
+                                         text="Recover Deleted Files", width=self.topBtnWidth,
+                                         command=self.recoverFilesWin)
+        self.recoverFilesButton.pack(side=LEFT, padx=10)
+
+        # Button to Carve files
+        self.carveFilesButton = Button(self.topFrame, state=DISABLED,
+                                       text="Carve Files", width=self.topBtnWidth,
+                                       command=self.carveFilesWin)
+
+        self.carveFilesButton.pack(side=LEFT, padx=10)
+
+        # Button to Carve files
+        self.settingsButton = Button(self.topFrame,
+                                       text="Settings", width=self.topBtnWidth,
+                                       command=self.settings)
+
+        self.settingsButton.pack(side=LEFT, padx=10)
+
+        # Button to process a batch of disk images
+        self.batchButton = Button(self.topFrame,
+                                  text="Batch Images", width=self.topBtnWidth,
+                                  command=self.batchImages)
+
+        self.batchButton.pack(side=LEFT, padx=10)
+
+        # Button to carve a partition with distributed workers
+        self.distributedButton = Button(self.topFrame, state=DISABLED,
+                                        text="Distributed Carve", width=self.topBtnWidth,
+                                        command=self.distributedCarveWin)
+
+        self.distributedButton.pack(side=LEFT, padx=10)
+
+        # Button to show the timing metrics of the pipeline
+        self.performanceButton = Button(self.topFrame,
+                                        text="Performance", width=self.topBtnWidth,
+                                        command=self.addPerformanceTab)
+
+        self.performanceButton.pack(side=LEFT, padx=10)
+
+        # Button to show the entropy map of the disk image
+        self.entropyButton = Button(self.topFrame, state=DISABLED,
+                                    text="Entropy Map", width=self.topBtnWidth,
+                                    command=self.entropyMap)
+
+        self.entropyButton.pack(side=LEFT, padx=10)
+
+        # Button to search the evidence for keywords and regexes
+        self.searchButton = Button(self.topFrame, state=DISABLED,
+                                   text="Search", width=self.topBtnWidth,
+                                   command=self.searchWin)
+
+        self.searchButton.pack(side=LEFT, padx=10)
+
+        # Button to search the text of the recovered and carved files
+        self.textSearchButton = Button(self.topFrame,
+                                       text="Text Search", width=self.topBtnWidth,
+                                       command=self.addTextSearchTab)
+
+        self.textSearchButton.pack(side=LEFT, padx=10)
+
+        # Button to show the groups of similar files
+        self.similarButton = Button(self.topFrame,
+                                    text="Similar Files", width=self.topBtnWidth,
+                                    command=self.addSimilarTab)
+
+        self.similarButton.pack(side=LEFT, padx=10)
+
+        # Button to hash the disk image in segments and verify it
+        self.verifyButton = Button(self.topFrame, state=DISABLED,
+                                   text="Verify Image", width=self.topBtnWidth,
+                                   command=self.verifyImageWin)
+
+        self.verifyButton.pack(side=LEFT, padx=10)
+
+        # Coordinator of the distributed workers, created on first use
+        self.coordinator = None
+        self.coordinatorQueue = Queue()
+        # Folders the local workers may read and write, one per partition
+        # distributed
+        self.distImageRoots = []
+        self.distOutputRoots = []
+
+        # Showing the jobs left from a previous run
+        if path.isfile(self.jobQueuePath) and self.getJobQueue().getJobs():
+            self.addJobsTab()
+
+    def getJobQueue(self):
+        """
+        Get the batch queue, creating and starting it on first use.
+        :rtype: JobQueue
+        """
+        if self.jobQueue is None:
+            self.jobQueue = JobQueue(self.jobQueuePath)
+            self.jobQueue.registerTask("discoverPartitions", discoverPartitionsTask, resource="io")
+            self.jobQueue.registerTask("carvePartition", carvePartitionTask, resource="io")
+            self.jobQueue.registerTask("hashPartition", hashPartitionTask, resource="cpu")
+            self.jobQueue.registerTask("recoverFiles", recoverFilesTask, resource="io")
+            self.jobQueue.registerTask("carveFiles", carveFilesTask, resource="io")
+            self.jobQueue.registerTask("indexText", indexTextTask, resource="cpu")
+            self.jobQueue.registerTask("fuzzyHash", fuzzyHashTask, resource="cpu")
+            self.jobQueue.registerTask("hashImage", hashImageTask, resource="io")
+            self.jobQueue.registerTask("singlePass", singlePassTask, resource="io")
+            self.jobQueue.start()
+        return self.jobQueue
+
+    def getFileTypes(self):
+        """
+        Get the file types that can be carved: the default ones and the
+        types added by the user in their signatures file, which is read
+        on first use.
+        :rtype: list
+        """
+        if self.FileTypes is None:
+            from signatures import loadSignatures, USER_SIGNATURES
+
+            self.FileTypes = ['jpg', 'gif', 'png' ,'pdf']
+            self.FileTypes += [t for t in loadSignatures().types(USER_SIGNATURES) if t not in self.FileTypes]
+        return self.FileTypes
+
+    def batchImages(self):
+        """
+        Function to add several disk images to the batch queue. For each
+        image, the partitions are found, carved and hashed, the deleted
+        files are recovered and the files are carved without any user
+        interaction.
+        """
+        images = askopenfilenames(title="Choose disk images")
+
+        if not images:
+            return
+
+        outFolder = askdirectory(title="Choose output folder")
+
+        if not outFolder:
+            messagebox.showerror("Error", "Please choose an output directory.")
+            return
+
+        tools = {"scalpel": self.scalpelPath, "tsk": self.tskPath, "mmls": self.mmlsPath,
+                 "md5": self.md5Path, "dd": self.ddPath, "fsstat": self.fsstatPath}
+
+        # The images are processed in the order they were selected
+        for n in range(len(images)):
+            args = {"Image": images[n], "Tools": tools, "Output": outFolder, "FileTypes": self.getFileTypes(),
+                    "IO": {"Mode": self.ioMode, "ReadAhead": self.readAhead}, "IndexText": self.indexText,
+                    "FuzzyHash": self.fuzzyHash, "HashImage": self.hashImages,
+                    "SinglePass": self.singlePass, "ContentStore": self.contentStore}
+            self.getJobQueue().addJob("discoverPartitions", args, priority=len(images) - n,
+                                 label=path.basename(images[n]))
+            self.insertCommand("Added " + images[n] + " to the batch queue", "\t")
+
+        self.addJobsTab()
+
+    def addJobsTab(self):
+        """
+        Adds a tab that shows the state of the jobs in the batch queue. The
+        table refreshes itself every second.
+        """
+        if self.jobsTree is not None:
+            self.tabControl.select(self.jobsTab)
+            return
+
+        self.jobsTab = Frame(self.tabControl, name="jobs-tab", bg="white")
+
+        # Close Tab button
+        btn = Button(self.jobsTab, text="Close Tab", command=self.closeJobsTab)
+        btn.place(relx=1, x=-15, y=2, anchor=NE)
+
+        # Clear finished jobs button
+        clearBtn = Button(self.jobsTab, text="Clear Done", command=self.jobQueue.clearFinished)
+        clearBtn.place(relx=1, x=-100, y=2, anchor=NE)
+
+        self.tabControl.add(self.jobsTab, text="Batch Queue")
+        self.tabControl.select(self.jobsTab)
+
+        self.jobsTree = Treeview(self.jobsTab, columns=("#", "Task", "Target", "State", "Result"),
+                                 show="headings", selectmode="browse", height=23)
+
+        yscrollB = Scrollbar(self.jobsTab)
+        yscrollB.pack(side=RIGHT, fill=Y)
+
+        self.jobsTree.column("#", width=50)
+        self.jobsTree.column("Task", width=150)
+        self.jobsTree.column("Target", width=300)
+        self.jobsTree.column("State", width=80)
+        self.jobsTree.column("Result", width=400)
+
+        for c in ("#", "Task", "Target", "State", "Result"):
+            self.jobsTree.heading(c, text=c)
+
+        self.jobsTree.configure(yscrollcommand=yscrollB.set)
+        self.jobsTree.pack(anchor=NW, fill=Y)
+
+        self.refreshJobsTab()
+
+    def closeJobsTab(self):
+        """
+        Close the batch queue tab. The queue keeps running.
+        """
+        self.master.after_cancel(self.jobsRefresh)
+        self.tabControl.forget(self.jobsTab)
+        self.jobsTree = None
+
+    def refreshJobsTab(self):
+        """
+        Update the rows of the batch queue table with the state of each job.
+        """
+        if self.jobsTree is None:
+            return
+
+        rows = set(self.jobsTree.get_children())
+        for job in self.jobQueue.getJobs():
+            if job["State"] == FAILED:
+                result = job["Error"]
+            else:
+                result = json.dumps(job["Result"]) if job["Result"] else ""
+
+            values = (job["Id"], job["Task"], job["Label"], job["State"], result)
+            if job["Id"] in rows:
+                self.jobsTree.item(job["Id"], values=values)
+                rows.discard(job["Id"])
+            else:
+                self.jobsTree.insert("", "end", job["Id"], values=values)
+
+        # Jobs removed from the queue
+        for it in rows:
+            self.jobsTree.delete(it)
+
+        self.jobsRefresh = self.master.after(1000, self.refreshJobsTab)
+
+    def addPerformanceTab(self):
+        """
+        Adds a tab that shows the timing metrics of every stage of the
+        pipeline. The table refreshes itself every second.
+        """
+        if self.performanceTree is not None:
+            self.tabControl.select(self.performanceTab)
+            return
+
+        self.performanceTab = Frame(self.tabControl, name="performance-tab", bg="white")
+
+        # Close Tab button
+        btn = Button(self.performanceTab, text="Close Tab", command=self.closePerformanceTab)
+        btn.place(relx=1, x=-15, y=2, anchor=NE)
+
+        # Export buttons
+        exportBtn = Button(self.performanceTab, text="Export", command=self.exportMetrics)
+        exportBtn.place(relx=1, x=-100, y=2, anchor=NE)
+
+        self.tabControl.add(self.performanceTab, text="Performance")
+        self.tabControl.select(self.performanceTab)
+
+        columns = ("Stage", "Calls", "Total (s)", "Avg (s)", "Max (s)", "MB", "MB/s", "Items/s")
+        self.performanceTree = Treeview(self.performanceTab, columns=columns, show="headings",
+                                        selectmode="browse", height=23)
+
+        for c in columns:
+            self.performanceTree.column(c, width=250 if c == "Stage" else 90)
+            self.performanceTree.heading(c, text=c)
+
+        self.performanceTree.pack(anchor=NW, fill=Y)
+
+        self.refreshPerformanceTab()
+
+    def closePerformanceTab(self):
+        """
+        Close the performance tab.
+        """
+        self.master.after_cancel(self.performanceRefresh)
+        self.tabControl.forget(self.performanceTab)
+        self.performanceTree = None
+
+    def refreshPerformanceTab(self):
+        """
+        Update the rows of the performance table.
+        """
+        if self.performanceTree is None:
+            return
+
+        snap = metrics.snapshot()
+        rows = []
+        for name in sorted(snap["Stages"]):
+            s = snap["Stages"][name]
+            rows.append((name, s["Calls"], "%.3f" % s["Seconds"], "%.3f" % s["Average"], "%.3f" % s["Max"],
+                         "%.1f" % (s["Bytes"] / 1024 ** 2), "%.1f" % s["MBps"], "%.1f" % s["ItemsPerSecond"]))
+        for name in sorted(snap["Gauges"]):
+            rows.append(("gauge: " + name, snap["Gauges"][name], "", "", "", "", "", ""))
+
+        existing = set(self.performanceTree.get_children())
+        for row in rows:
+            if row[0] in existing:
+                self.performanceTree.item(row[0], values=row)
+            else:
+                self.performanceTree.insert("", "end", row[0], values=row)
+
+        self.performanceRefresh = self.master.after(1000, self.refreshPerformanceTab)
+
+    def exportMetrics(self):
+        """
+        Save the metrics to a file, as JSON or in the Prometheus text
+        format depending on the extension chosen.
+        """
+        fileName = asksaveasfilename(title="Export metrics as:", defaultextension=".prom",
+                                     filetypes=[("Prometheus", "*.prom"), ("JSON", "*.json")])
+        if not fileName:
+            return
+
+        metrics.export(fileName)
+        self.insertCommand("Saved metrics to " + fileName, "\t")
+
+    def entropyMap(self):
+        """
+        Compute the entropy map of the disk image in a thread and show it
+        as a heatmap. The map is saved in the chosen folder and read again
+        the next time.
+        """
+        outFolder = askdirectory(title="Choose output folder")
+
+        if not outFolder:
+            messagebox.showerror("Error", "Please choose an output directory.")
+            return
+
+        mapPath = path.join(outFolder, path.basename(self.imagePath) + ".emap")
+        self.insertCommand("Computing the entropy map of " + self.imagePath, "\t")
+        self.showLoading()
+
+        result = Queue()
+
+        def run(imagePath=self.imagePath):
+            import entropy
+            try:
+                result.put(entropy.mapFor(imagePath, mapPath))
+            except (IOError, ValueError) as err:
+                result.put(err)
+
+        threading.Thread(target=run, daemon=True).start()
+        self.master.after(200, self.waitEntropyMap, result, mapPath)
+
+    def waitEntropyMap(self, result, mapPath):
+        """
+        Poll the thread computing the entropy map.
+        :param result: queue receiving the map or the error
+        :type result: Queue
+        :param mapPath: path of the map file
+        :type mapPath: str
+        """
+        try:
+            emap = result.get_nowait()
+        except Empty:
+            self.master.after(200, self.waitEntropyMap, result, mapPath)
+            return
+
+        self.hideLoading()
+        if isinstance(emap, Exception):
+            messagebox.showerror("Error", str(emap))
+            return
+
+        self.insertCommand("Saved the entropy map to " + mapPath, "\t")
+        self.log.writeEvent("entropy-map", nbytes=emap.length, path=mapPath, classes=emap.summary())
+        self.addEntropyTab(emap)
+
+    def addEntropyTab(self, emap):
+        """
+        Adds a tab with the heatmap of an entropy map: one cell per group
+        of blocks, coloured by class and brighter with the entropy.
+        :param emap: the entropy map
+        :type emap: entropy.EntropyMap
+        """
+        import entropy
+
+        colors = {entropy.EMPTY: (255, 255, 255), entropy.TEXT: (40, 160, 40), entropy.DATA: (40, 80, 200),
+                  entropy.COMPRESSED: (230, 140, 0), entropy.RANDOM: (200, 0, 0)}
+        columns, maxRows, cell = 256, 160, 4
+
+        tab = Frame(self.tabControl, bg="white")
+        btn = Button(tab, text="Close Tab", command=lambda t=str(tab): self.tabControl.forget(t))
+        btn.place(relx=1, x=-15, y=2, anchor=NE)
+
+        self.tabControl.add(tab, text="Entropy Map")
+        self.tabControl.select(tab)
+
+        # Summary and legend
+        summary = emap.summary()
+        text = "Block size %d KiB   " % (emap.blockSize // 1024)
+        text += "   ".join("%s: %.1f%%" % (name, 100.0 * summary[name] / max(1, len(emap)))
+                           for name in entropy.CLASSES)
+        Label(tab, text=text, bg="white", anchor=W).pack(anchor=NW, padx=10, pady=5)
+
+        legend = Frame(tab, bg="white")
+        legend.pack(anchor=NW, padx=10)
+        for cls in range(len(entropy.CLASSES)):
+            Label(legend, text="  ", bg="#%02x%02x%02x" % colors[cls], relief="solid",
+                  borderwidth=1).pack(side=LEFT)
+            Label(legend, text=entropy.CLASSES[cls], bg="white").pack(side=LEFT, padx=5)
+
+        # Several blocks per cell on large images, the cell shows the most
+        # common class of its blocks and their mean entropy
+        group = max(1, -(-len(emap) // (columns * maxRows)))
+        cells = -(-len(emap) // group)
+        rows = -(-cells // columns)
+
+        canvas = Canvas(tab, width=columns * cell, height=rows * cell, bg="white", highlightthickness=0)
+        canvas.pack(anchor=NW, padx=10, pady=5)
+
+        info = StringVar()
+        Label(tab, textvariable=info, bg="white", anchor=W).pack(anchor=NW, padx=10)
+
+        for n in range(cells):
+            first = n * group
+            last = min(len(emap), first + group)
+            cls = Counter(emap.classes[first:last]).most_common(1)[0][0]
+            level = sum(emap.entropy[first:last]) / float(last - first) / (8 * entropy.SCALE)
+            r, g, b = colors[cls]
+            if cls != entropy.EMPTY:
+                shade = 0.4 + 0.6 * min(1.0, level)
+                r, g, b = int(r * shade), int(g * shade), int(b * shade)
+            x, y = (n % columns) * cell, (n // columns) * cell
+            canvas.create_rectangle(x, y, x + cell, y + cell, fill="#%02x%02x%02x" % (r, g, b), width=0)
+
+        def showCell(event):
+            n = (event.y // cell) * columns + event.x // cell
+            if n >= cells:
+                return
+            first = n * group
+            last = min(len(emap), first + group)
+            info.set("Offset %d - %d: %s" % (emap.offset + first * emap.blockSize,
+                                             emap.offset + min(last * emap.blockSize, emap.length),
+                                             ", ".join(sorted(set(entropy.CLASSES[c]
+                                                                  for c in emap.classes[first:last])))))
+
+        canvas.bind("<Motion>", showCell)
+
+    def searchWin(self):
+        """
+        Pop up window to enter the keywords and regexes to search, and to
+        choose between the disk image and a carved partition.
+        """
+        window = Toplevel(self.topFrame)
+        window.protocol("WM_DELETE_WINDOW", window.destroy)
+
+        options = ["Disk image"]
+        for j in range(len(self.listOfPartitions)):
+            if self.listOfPartitions[j]['Carved'] == "Yes":
+                options.append("%d: %s"%(j, self.listOfPartitions[j]['Description']))
+
+        self.searchTargetVar = StringVar(window)
+        self.searchTargetVar.set(options[0])
+
+        Label(window, text="Search in: ").pack()
+        OptionMenu(window, self.searchTargetVar, *options).pack()
+
+        Label(window, text="Keywords (one per line):", anchor=W).pack(fill=X, padx=10)
+        self.keywordsText = Text(window, height=6, width=50)
+        self.keywordsText.pack(padx=10)
+
+        Label(window, text="Regular expressions (one per line):", anchor=W).pack(fill=X, padx=10)
+        self.regexesText = Text(window, height=4, width=50)
+        self.regexesText.pack(padx=10)
+
+        self.ignoreCaseVar = IntVar(value=1)
+        Checkbutton(window, text="Ignore case", variable=self.ignoreCaseVar, anchor=W).pack(fill=X, padx=10)
+
+        cancelButton = Button(window, text="Cancel", command=window.destroy)
+        cancelButton.pack(side=LEFT)
+
+        searchButton = Button(window, text="Search!",
+                              command=lambda s=self, window=window: self.searchEvidence(s, window))
+        searchButton.pack(side=RIGHT)
+
+        window.mainloop()
+
+    def searchEvidence(event, self, window):
+        """
+        Search the disk image or a carved partition in a thread. The hits
+        are stored in the hit index of the chosen folder and shown in the
+        Search Hits tab.
+        :param window: Pop up window of the search
+        :type window: tkinter window
+        :param event: Not used, but is the event in question
+        :type event: event
+        """
+        from search import HitIndex, searchFile
+
+        keywords = [k.strip() for k in self.keywordsText.get(1.0, END).splitlines() if k.strip()]
+        regexes = [r.strip() for r in self.regexesText.get(1.0, END).splitlines() if r.strip()]
+        ignoreCase = self.ignoreCaseVar.get() == 1
+        target = self.searchTargetVar.get()
+        window.destroy()
+
+        if not keywords and not regexes:
+            messagebox.showerror("Error", "Please enter a keyword or a regular expression.")
+            return
+
+        outFolder = askdirectory(title="Choose output folder")
+
+        if not outFolder:
+            messagebox.showerror("Error", "Please choose an output directory.")
+            return
+
+        indexPath = path.join(outFolder, "search_hits.sqlite")
+        if self.hitIndex is None or self.hitIndex.dbPath != indexPath:
+            if self.hitIndex is not None:
+                self.hitIndex.close()
+            self.hitIndex = HitIndex(indexPath)
+
+        # Hits of the image are mapped to its partitions, hits of a
+        # partition are already in it
+        if target == "Disk image":
+            source, partition, partitions = self.imagePath, None, self.listOfPartitions
+        else:
+            i = int(target.split(":")[0])
+            source, partition, partitions = self.listOfPartitions[i]["Path"], self.listOfPartitions[i]["Name"], None
+        bs = self.bs
+
+        self.insertCommand("Searching %s for %d keywords and %d regexes" % (source, len(keywords), len(regexes)), "\t")
+        self.showLoading()
+        result = Queue()
+
+        def run():
+            try:
+                self.hitIndex.clear(source)
+                count = searchFile(source, keywords, regexes, ignoreCase,
+                                   onHits=lambda hits: self.hitIndex.addHits(source, hits, partitions, bs, partition))
+                result.put(count)
+            except (IOError, OSError, ValueError, re.error) as err:
+                result.put(err)
+
+        start = time.perf_counter()
+        threading.Thread(target=run, daemon=True).start()
+        self.master.after(200, self.waitSearch, result, source, start)
+
+    def waitSearch(self, result, source, start):
+        """
+        Poll the thread searching the evidence.
+        :param result: queue receiving the number of hits or the error
+        :type result: Queue
+        :param source: path of the file searched
+        :type source: str
+        :param start: time the search started
+        :type start: float
+        """
+        try:
+            count = result.get_nowait()
+        except Empty:
+            self.master.after(200, self.waitSearch, result, source, start)
+            return
+
+        self.hideLoading()
+        if isinstance(count, Exception):
+            messagebox.showerror("Error", str(count))
+            return
+
+        duration = time.perf_counter() - start
+        self.insertCommand("%d hits in %s (%.1f s)" % (count, source, duration), "\t")
+        self.log.writeEvent("search", duration=duration, nbytes=path.getsize(source), path=source, hits=count,
+                            terms=self.hitIndex.terms())
+        self.addSearchTab()
+
+    def addSearchTab(self):
+        """
+        Adds a tab with the hits of the searches, which can be filtered by
+        term and partition.
+        """
+        if self.searchTab is not None:
+            self.tabControl.select(self.searchTab)
+            self.showHits()
+            return
+
+        self.searchTab = Frame(self.tabControl, name="search-tab", bg="white")
+
+        # Close Tab button
+        btn = Button(self.searchTab, text="Close Tab", command=self.closeSearchTab)
+        btn.place(relx=1, x=-15, y=2, anchor=NE)
+
+        self.tabControl.add(self.searchTab, text="Search Hits")
+        self.tabControl.select(self.searchTab)
+
+        # Filters of the hits
+        filterFrame = Frame(self.searchTab, bg="white")
+        self.hitTermVar = StringVar()
+        self.hitPartitionVar = StringVar()
+        for text, var in (("Term", self.hitTermVar), ("Partition", self.hitPartitionVar)):
+            Label(filterFrame, text=text, bg="white", padx=5).pack(side=LEFT)
+            Entry(filterFrame, textvariable=var, width=20).pack(side=LEFT)
+        Button(filterFrame, text="Show", command=self.showHits).pack(side=LEFT, padx=5)
+        self.hitCountVar = StringVar()
+        Label(filterFrame, textvariable=self.hitCountVar, bg="white", padx=5).pack(side=LEFT)
+        filterFrame.pack(anchor=NW, pady=30)
+
+        columns = ("Offset", "Partition", "Partition offset", "Term", "Encoding", "Context")
+        self.hitsTree = Treeview(self.searchTab, columns=columns, show="headings", height=20)
+        yscrollB = Scrollbar(self.searchTab)
+        yscrollB.pack(side=RIGHT, fill=Y)
+        yscrollB.config(command=self.hitsTree.yview)
+        self.hitsTree.configure(yscrollcommand=yscrollB.set)
+
+        for column, width in zip(columns, (110, 150, 110, 150, 70, 450)):
+            self.hitsTree.column(column, width=width)
+            self.hitsTree.heading(column, text=column)
+        self.hitsTree.pack(anchor=NW, fill=BOTH, expand=True)
+
+        self.showHits()
+
+    def closeSearchTab(self):
+        """
+        Close the Search Hits tab, the hits stay in their index.
+        """
+        self.tabControl.forget(self.searchTab)
+        self.searchTab = None
+
+    def showHits(self):
+        """
+        Show the hits matching the filters of the Search Hits tab, at most
+        SEARCH_ROWS of them.
+        """
+        hits = self.hitIndex.search(term=self.hitTermVar.get() or None,
+                                    partition=self.hitPartitionVar.get() or None, limit=SEARCH_ROWS + 1)
+
+        self.hitsTree.delete(*self.hitsTree.get_children())
+        for h in hits[:SEARCH_ROWS]:
+            self.hitsTree.insert("", "end", values=(h["Offset"], h["Partition"] or "",
+                                                    "" if h["PartitionOffset"] is None else h["PartitionOffset"],
+                                                    h["Term"], h["Encoding"], h["Context"]))
+
+        if len(hits) > SEARCH_ROWS:
+            self.hitCountVar.set("First %d hits shown, refine the filters" % SEARCH_ROWS)
+        else:
+            self.hitCountVar.set("%d hits" % len(hits))
+
+    def storeOf(self, outFolder):
+        """
+        Helper function to get the content store of an output folder, None
+        if the files are not stored by content.
+        :type outFolder: str
+        :rtype: ContentStore
+        """
+        if not self.contentStore:
+            return None
+
+        from contentstore import ContentStore, STORE_FOLDER
+        return ContentStore(path.join(outFolder, STORE_FOLDER))
+
+    def storeFolder(self, store, folder):
+        """
+        Helper function to add an output folder to the content store, run
+        by the thread of indexResults.
+        :return count: number of files in the folder
+        :rtype count: int
+        """
+        stored = store.ingestFolder(folder)
+        self.insertCommand("%d files of %s already stored, %.1f MB saved" %
+                           (stored["Duplicates"], folder, stored["Saved"] / 1024 ** 2), "\t", job=folder)
+        return stored["Files"]
+
+    def indexResults(self, folder, outFolder, partition):
+        """
+        Add the files of an output folder to the content store, the
+        full-text index and the fuzzy hash index of outFolder, in a
+        thread. Only the new and changed files are read.
+        :param folder: folder of the recovered or carved files
+        :param outFolder: folder of the store and of the indexes
+        :param partition: partition the files come from
+        :type folder: str
+        :type outFolder: str
+        :type partition: str
+        """
+        store = self.storeOf(outFolder)
+        if not self.indexText and not self.fuzzyHash and store is None:
+            return
+
+        jobs = []
+        # Stored first, so the indexes see the final files
+        if store is not None:
+            jobs.append(("Stored", lambda: self.storeFolder(store, folder)))
+        if self.indexText:
+            from textindex import openIndex
+
+            self.textIndex = openIndex(path.join(outFolder, "text_index.sqlite"))
+            jobs.append(("Indexed the text of", lambda index=self.textIndex: index.updateFolder(folder)))
+        if self.fuzzyHash:
+            from fuzzyhash import openFuzzyIndex
+
+            self.fuzzyIndex = openFuzzyIndex(path.join(outFolder, "fuzzy_index.sqlite"))
+            jobs.append(("Fuzzy hashed", lambda index=self.fuzzyIndex: index.updateFolder(folder, partition)))
+        result = Queue()
+
+        def run():
+            for text, job in jobs:
+                start = time.perf_counter()
+                try:
+                    result.put((text, job(), time.perf_counter() - start))
+                except (IOError, OSError, sqlite3.Error) as err:
+                    result.put((text, err, time.perf_counter() - start))
+            result.put(None)
+
+        threading.Thread(target=run, daemon=True).start()
+        self.master.after(200, self.waitIndexResults, result, folder)
+
+    def waitIndexResults(self, result, folder):
+        """
+        Poll the thread indexing an output folder.
+        :param result: queue receiving the number of files or the error
+                       of each index
+        :type result: Queue
+        :param folder: folder being indexed
+        :type folder: str
+        """
+        while True:
+            try:
+                item = result.get_nowait()
+            except Empty:
+                self.master.after(200, self.waitIndexResults, result, folder)
+                return
+
+            if item is None:
+                return
+
+            text, count, duration = item
+            if isinstance(count, Exception):
+                self.insertCommand("%s %s failed: %s" % (text, folder, count), "\t", "error")
+                continue
+
+            self.insertCommand("%s %d files in %s (%.1f s)" % (text, count, folder, duration), "\t")
+            self.log.writeEvent("index-results", duration=duration, path=folder, count=count, index=text)
+
+    def addTextSearchTab(self):
+        """
+        Adds a tab to search the text of the recovered and carved files.
+        When no index was made yet, an existing index can be opened.
+        """
+        if self.textSearchTab is not None:
+            self.tabControl.select(self.textSearchTab)
+            return
+
+        if self.textIndex is None:
+            indexPath = askopenfilename(title="Choose a text index", filetypes=[("Text index", "*.sqlite")])
+            if not indexPath:
+                return
+
+            from textindex import openIndex
+
+            try:
+                self.textIndex = openIndex(indexPath)
+            except sqlite3.Error as err:
+                messagebox.showerror("Error", str(err))
+                return
+
+        self.textSearchTab = Frame(self.tabControl, name="text-search-tab", bg="white")
+
+        # Close Tab button
+        btn = Button(self.textSearchTab, text="Close Tab", command=self.closeTextSearchTab)
+        btn.place(relx=1, x=-15, y=2, anchor=NE)
+
+        self.tabControl.add(self.textSearchTab, text="Text Search")
+        self.tabControl.select(self.textSearchTab)
+
+        # Query: words that must all be found, "word*" and "-word"
+        queryFrame = Frame(self.textSearchTab, bg="white")
+        Label(queryFrame, text="Words (word*, -word)", bg="white", padx=5).pack(side=LEFT)
+        self.textQueryVar = StringVar()
+        queryEntry = Entry(queryFrame, textvariable=self.textQueryVar, width=50)
+        queryEntry.pack(side=LEFT)
+        queryEntry.bind("<Return>", lambda event: self.showTextResults())
+        Button(queryFrame, text="Search", command=self.showTextResults).pack(side=LEFT, padx=5)
+        self.textCountVar = StringVar()
+        Label(queryFrame, textvariable=self.textCountVar, bg="white", padx=5).pack(side=LEFT)
+        queryFrame.pack(anchor=NW, pady=30)
+
+        columns = ("File", "Size", "Score")
+        self.textTree = Treeview(self.textSearchTab, columns=columns, show="headings", height=20)
+        yscrollB = Scrollbar(self.textSearchTab)
+        yscrollB.pack(side=RIGHT, fill=Y)
+        yscrollB.config(command=self.textTree.yview)
+        self.textTree.configure(yscrollcommand=yscrollB.set)
+
+        for column, width in zip(columns, (700, 100, 80)):
+            self.textTree.column(column, width=width)
+            self.textTree.heading(column, text=column)
+        self.textTree.pack(anchor=NW, fill=BOTH, expand=True)
+
+        stats = self.textIndex.stats()
+        self.textCountVar.set("%d files, %d terms indexed" % (stats["files"], stats["terms"]))
+
+    def closeTextSearchTab(self):
+        """
+        Close the Text Search tab, the index stays on disk.
+        """
+        self.tabControl.forget(self.textSearchTab)
+        self.textSearchTab = None
+
+    def showTextResults(self):
+        """
+        Show the files matching the query of the Text Search tab, the best
+        first, at most TEXT_ROWS of them.
+        """
+        start = time.perf_counter()
+        results = self.textIndex.search(self.textQueryVar.get(), limit=TEXT_ROWS + 1)
+        duration = time.perf_counter() - start
+
+        self.textTree.delete(*self.textTree.get_children())
+        for r in results[:TEXT_ROWS]:
+            self.textTree.insert("", "end", values=(r["Path"], r["Size"], r["Score"]))
+
+        if len(results) > TEXT_ROWS:
+            self.textCountVar.set("First %d files shown (%.3f s), refine the query" % (TEXT_ROWS, duration))
+        else:
+            self.textCountVar.set("%d files (%.3f s)" % (len(results), duration))
+        metrics.observe("textSearch", duration, items=len(results))
+
+    def addSimilarTab(self):
+        """
+        Adds a tab with the groups of similar files, by fuzzy hash, of the
+        recovered and carved files. When no files were hashed yet, an
+        existing index can be opened.
+        """
+        if self.similarTab is not None:
+            self.tabControl.select(self.similarTab)
+            return
+
+        if self.fuzzyIndex is None:
+            indexPath = askopenfilename(title="Choose a fuzzy hash index", filetypes=[("Fuzzy index", "*.sqlite")])
+            if not indexPath:
+                return
+
+            from fuzzyhash import openFuzzyIndex
+
+            try:
+                self.fuzzyIndex = openFuzzyIndex(indexPath)
+            except sqlite3.Error as err:
+                messagebox.showerror("Error", str(err))
+                return
+
+        self.similarTab = Frame(self.tabControl, name="similar-tab", bg="white")
+
+        # Close Tab button
+        btn = Button(self.similarTab, text="Close Tab", command=self.closeSimilarTab)
+        btn.place(relx=1, x=-15, y=2, anchor=NE)
+
+        self.tabControl.add(self.similarTab, text="Similar Files")
+        self.tabControl.select(self.similarTab)
+
+        # Options of the groups
+        optionsFrame = Frame(self.similarTab, bg="white")
+        Label(optionsFrame, text="Smallest score (0-100)", bg="white", padx=5).pack(side=LEFT)
+        self.similarThresholdVar = StringVar(value="60")
+        Entry(optionsFrame, textvariable=self.similarThresholdVar, width=5).pack(side=LEFT)
+        self.crossPartitionVar = IntVar(value=0)
+        Checkbutton(optionsFrame, text="Across partitions only", variable=self.crossPartitionVar,
+                    bg="white").pack(side=LEFT, padx=5)
+        Button(optionsFrame, text="Show", command=self.showSimilarGroups).pack(side=LEFT, padx=5)
+        self.similarCountVar = StringVar()
+        Label(optionsFrame, textvariable=self.similarCountVar, bg="white", padx=5).pack(side=LEFT)
+        optionsFrame.pack(anchor=NW, pady=30)
+
+        # One row per group, with its files under it
+        columns = ("Partition", "Size", "MD5", "Score")
+        self.similarTree = Treeview(self.similarTab, columns=columns, height=20)
+        yscrollB = Scrollbar(self.similarTab)
+        yscrollB.pack(side=RIGHT, fill=Y)
+        yscrollB.config(command=self.similarTree.yview)
+        self.similarTree.configure(yscrollcommand=yscrollB.set)
+
+        self.similarTree.column("#0", width=450)
+        self.similarTree.heading("#0", text="File")
+        for column, width in zip(columns, (200, 100, 250, 60)):
+            self.similarTree.column(column, width=width)
+            self.similarTree.heading(column, text=column)
+        self.similarTree.pack(anchor=NW, fill=BOTH, expand=True)
+
+        self.showSimilarGroups()
+
+    def closeSimilarTab(self):
+        """
+        Close the Similar Files tab, the hashes stay in their index.
+        """
+        self.tabControl.forget(self.similarTab)
+        self.similarTab = None
+
+    def showSimilarGroups(self):
+        """
+        Show the groups of similar files of the Similar Files tab, at most
+        SIMILAR_GROUPS of them.
+        """
+        try:
+            threshold = int(self.similarThresholdVar.get())
+        except ValueError:
+            messagebox.showerror("Error", "The score must be a number from 0 to 100.")
+            return
+
+        groups = self.fuzzyIndex.groups(threshold, crossPartition=self.crossPartitionVar.get() == 1)
+
+        self.similarTree.delete(*self.similarTree.get_children())
+        for n, group in enumerate(groups[:SIMILAR_GROUPS]):
+            partitions = sorted({f["Partition"] for f in group})
+            groupId = self.similarTree.insert("", "end", text="Group %d: %d files" % (n + 1, len(group)),
+                                              values=(", ".join(partitions), "", "", ""))
+            for f in group:
+                self.similarTree.insert(groupId, "end", text=f["Path"],
+                                        values=(f["Partition"], f["Size"], f["MD5"], f["Score"]))
+
+        if len(groups) > SIMILAR_GROUPS:
+            self.similarCountVar.set("First %d groups shown, raise the score" % SIMILAR_GROUPS)
+        else:
+            self.similarCountVar.set("%d groups of %d files hashed" % (len(groups), self.fuzzyIndex.count()))
+
+    def verifyImageWin(self):
+        """
+        Pop up window to hash the disk image in segments, or to verify it,
+        or a region of it, against the segment hashes made before.
+        """
+        window = Toplevel(self.topFrame)
+        window.protocol("WM_DELETE_WINDOW", window.destroy)
+
+        self.verifyActionVar = StringVar(window, value="hash")
+        Radiobutton(window, text="Hash the image in segments (and its MD5 and SHA-256)",
+                    variable=self.verifyActionVar, value="hash", anchor=W).pack(fill=X, padx=10)
+        Radiobutton(window, text="Verify the image against its segment hashes",
+                    variable=self.verifyActionVar, value="verify", anchor=W).pack(fill=X, padx=10)
+
+        # Region to verify, the whole image when empty
+        regionFrame = Frame(window)
+        self.verifyStartVar = StringVar()
+        self.verifyEndVar = StringVar()
+        Label(regionFrame, text="From (MB)", padx=5).pack(side=LEFT)
+        Entry(regionFrame, textvariable=self.verifyStartVar, width=10).pack(side=LEFT)
+        Label(regionFrame, text="To (MB)", padx=5).pack(side=LEFT)
+        Entry(regionFrame, textvariable=self.verifyEndVar, width=10).pack(side=LEFT)
+        regionFrame.pack(padx=10, pady=5)
+
+        cancelButton = Button(window, text="Cancel", command=window.destroy)
+        cancelButton.pack(side=LEFT)
+
+        startButton = Button(window, text="Start",
+                             command=lambda s=self, window=window: self.hashImageSegments(s, window))
+        startButton.pack(side=RIGHT)
+
+        window.mainloop()
+
+    def hashImageSegments(event, self, window):
+        """
+        Hash or verify the disk image in a thread. The segment hashes are
+        kept in a manifest in the chosen folder.
+        :param window: Pop up window of the verification
+        :type window: tkinter window
+        :param event: Not used, but is the event in question
+        :type event: event
+        """
+        from merkle import hashImage, verifyImage, saveManifest, loadManifest, manifestPath
+
+        action = self.verifyActionVar.get()
+        region = []
+        for var in (self.verifyStartVar, self.verifyEndVar):
+            value = var.get().strip()
+            if value and not value.isdigit():
+                messagebox.showerror("Error", "The region must be given in MB.")
+                return
+            region.append(int(value) * 1024 ** 2 if value else None)
+        window.destroy()
+
+        outFolder = askdirectory(title="Choose the folder of the segment hashes")
+
+        if not outFolder:
+            messagebox.showerror("Error", "Please choose an output directory.")
+            return
+
+        outPath = manifestPath(outFolder, self.imagePath)
+        if action == "verify" and not path.isfile(outPath):
+            messagebox.showerror("Error", "The image was not hashed in this folder.")
+            return
+
+        mode = self.ioMode if self.ioMode != "dd" else "buffered"
+        self.insertCommand("%s %s" % ("Hashing" if action == "hash" else "Verifying", self.imagePath), "\t")
+        self.showLoading()
+        result = Queue()
+
+        def run(imagePath=self.imagePath, readAhead=self.readAhead):
+            try:
+                if action == "hash":
+                    manifest = hashImage(imagePath, mode=mode, readAhead=readAhead)
+                    saveManifest(manifest, outPath)
+                    result.put(manifest)
+                else:
+                    result.put(verifyImage(imagePath, loadManifest(outPath), region[0] or 0, region[1]))
+            except (IOError, OSError, ValueError, MemoryBudgetExceeded) as err:
+                result.put(err)
+
+        start = time.perf_counter()
+        threading.Thread(target=run, daemon=True).start()
+        self.master.after(200, self.waitImageSegments, result, action, outPath, start)
+
+    def waitImageSegments(self, result, action, outPath, start):
+        """
+        Poll the thread hashing or verifying the disk image.
+        :param result: queue receiving the manifest, the result of the
+                       verification or the error
+        :type result: Queue
+        :param action: "hash" or "verify"
+        :type action: str
+        :param outPath: path of the manifest
+        :type outPath: str
+        :param start: time the hashing started
+        :type start: float
+        """
+        try:
+            out = result.get_nowait()
+        except Empty:
+            self.master.after(200, self.waitImageSegments, result, action, outPath, start)
+            return
+
+        self.hideLoading()
+        if isinstance(out, Exception):
+            messagebox.showerror("Error", str(out))
+            return
+
+        duration = time.perf_counter() - start
+        if action == "hash":
+            self.insertCommand("MD5: %s SHA-256: %s" % (out["MD5"], out["SHA256"]), "\t")
+            self.insertCommand("%d segments, root %s, saved to %s (%.1f s)" %
+                               (len(out["Segments"]), out["Root"], outPath, duration), "\t")
+            self.log.writeEvent("hash-image", duration=duration, nbytes=out["Size"], path=self.imagePath,
+                                md5=out["MD5"], sha256=out["SHA256"], root=out["Root"])
+            messagebox.showinfo("Image hashed", "MD5: %s\nSHA-256: %s" % (out["MD5"], out["SHA256"]))
+            return
+
+        for c in out["Changed"]:
+            self.insertCommand("Segment %d changed: bytes %d to %d" % (c["Segment"], c["Offset"],
+                                                                        c["Offset"] + c["Length"]), "\t", "warning")
+        if out["SizeChanged"]:
+            self.insertCommand("The size of the image changed", "\t", "warning")
+        self.log.writeEvent("verify-image", duration=duration, path=self.imagePath, segments=out["Checked"],
+                            changed=len(out["Changed"]), match=out["Match"])
+
+        if out["Match"]:
+            messagebox.showinfo("Image verified", "%d segments checked, the image did not change." % out["Checked"])
+        else:
+            messagebox.showerror("Image changed", "%d of %d segments changed, see the console." %
+                                 (len(out["Changed"]), out["Checked"]))
+
+    def distributedCarveWin(self):
+        """
+        Pop up window to select the partition to split between the
+        distributed workers.
+        """
+        window = Toplevel(self.topFrame)
+        window.protocol("WM_DELETE_WINDOW", window.destroy)
+
+        options = []
+        for j in range(len(self.listOfPartitions)):
+            if self.listOfPartitions[j]['Slot'] != "Meta":
+                options.append("%d: %s"%(j, self.listOfPartitions[j]['Description']))
+
+        self.distPartitionVar = StringVar(window)
+        self.distPartitionVar.set(options[0])
+
+        Label(window, text="Choose a partition: ").pack()
+        OptionMenu(window, self.distPartitionVar, *options).pack()
+
+        # Interface and port of the coordinator and number of workers on
+        # this machine. The workers of other machines need the coordinator
+        # to listen on their network, and its token
+        self.distHostVar = StringVar(window, value="127.0.0.1")
+        self.distPortVar = StringVar(window, value="5555")
+        self.distWorkersVar = StringVar(window, value="0")
+        self.distRangeVar = StringVar(window, value="1024")
+
+        for text, var in (("Listen on", self.distHostVar),
+                          ("Coordinator port", self.distPortVar),
+                          ("Local workers", self.distWorkersVar),
+                          ("Range size (MB)", self.distRangeVar)):
+            rowFrame = Frame(window)
+            Label(rowFrame, text=text, width=15, anchor=W, padx=5).pack(side=LEFT)
+            Entry(rowFrame, textvariable=var).pack(side=LEFT)
+            rowFrame.pack(padx=10)
+
+        cancelButton = Button(window, text="Cancel", command=window.destroy)
+        cancelButton.pack(side=LEFT)
+
+        startButton = Button(window, text="Distribute!",
+                             command=lambda s=self, window=window: self.distributedCarve(s, window))
+        startButton.pack(side=RIGHT)
+
+        window.mainloop()
 
-        self.addNotesTab()
+    def distributedCarve(event, self, window):
+        """
+        Function to split the selected partition in byte ranges and queue
+        the hashing and carving tasks of each range for the workers. The
+        results are written to the case index in the output folder.
+        :param window: Pop up window to select the partition
+        :type window: tkinter window
+        :param event: Not used, but is the event in question
+        :type event: event
+        """
+        window.destroy()
 
-        # button to import initial file
-        self.insertButton = Button(self.topFrame, text="Import Disk Image",
-                                   width=self.topBtnWidth, command=self.openDiskImage)
-        self.insertButton.pack(side=LEFT, padx=10)
+        from distributed import Coordinator, startLocalWorkers
+        from signatures import loadSignatures
 
-        # Button to carve paritions
-        self.carvePartitionsButton = Button(self.topFrame, state=DISABLED,
-                                            text="Carve Partitions", width=self.topBtnWidth,
-                                            command=self.carvePartitionsWin)
-        self.carvePartitionsButton.pack(side=LEFT, padx=10)
+        # The numbers of the pop up are checked before anything is started
+        port, rangeSize, workers = (self.distPortVar.get().strip(), self.distRangeVar.get().strip(),
+                                    self.distWorkersVar.get().strip())
+        if not port.isdigit() or int(port) > 65535:
+            messagebox.showerror("Error", "The port must be a number between 0 and 65535.")
+            return
+        if not rangeSize.isdigit() or int(rangeSize) == 0:
+            messagebox.showerror("Error", "The range size must be a number of MB greater than 0.")
+            return
+        if not workers.isdigit():
+            messagebox.showerror("Error", "The number of local workers must be a number.")
+            return
 
+        outFolder = askdirectory(title="Choose shared output folder")
 
-        # Button to recover deleted files
-        self.recoverFilesButton = Button(self.topFrame, state=DISABLED,
-                                         text="Recover Deleted Files", width=self.topBtnWidth,
-                                         command=self.recoverFilesWin)
-        self.recoverFilesButton.pack(side=LEFT, padx=10)
+        if not outFolder:
+            messagebox.showerror("Error", "Please choose an output directory.")
+            return
 
-        # Button to Carve files
-        self.carveFilesButton = Button(self.topFrame, state=DISABLED,
-                                       text="Carve Files", width=self.topBtnWidth,
-                                       command=self.carveFilesWin)
+        i = int(self.distPartitionVar.get().split(":")[0])
+        partition = self.listOfPartitions[i]
+        bs = int(self.bs)
 
-        self.carveFilesButton.pack(side=LEFT, padx=10)
+        if self.coordinator is None:
+            try:
+                self.coordinator = Coordinator(path.join(outFolder, "case_index.jsonl"),
+                                               host=self.distHostVar.get().strip() or "127.0.0.1",
+                                               port=int(port))
+            except OSError as err:
+                messagebox.showerror("Error", "The coordinator could not listen: %s" % err)
+                return
+            self.coordinator.listeners.append(self.coordinatorQueue.put)
+            self.coordinator.start()
+            metrics.gauge("distributed_tasks", lambda: len(self.coordinator.tasks))
+            host, port = self.coordinator.address[:2]
+            self.insertCommand("Coordinator listening on %s:%d, token of the workers: %s" %
+                               (host, port, self.coordinator.token), "\t")
+            self.master.after(500, self.showDistributedResults)
+
+        self.distImageRoots.append(path.dirname(path.abspath(self.imagePath)))
+        self.distOutputRoots.append(outFolder)
+        config = loadSignatures().scalpelConfig(self.getFileTypes())
+        count = self.coordinator.addPartition(self.imagePath, int(partition["Start"]) * bs,
+                                              int(partition["Length"]) * bs,
+                                              path.join(outFolder, "carvedFiles_" + partition["Name"]),
+                                              config=config,
+                                              rangeSize=int(rangeSize) * 1024 ** 2,
+                                              label=partition["Description"])
+
+        self.insertCommand("Queued %d tasks for partition %s" % (count, partition["Description"]), "\t")
+
+        if int(workers):
+            startLocalWorkers(self.coordinator, int(workers), self.distImageRoots, self.distOutputRoots, self.scalpelPath)
+
+    def showDistributedResults(self):
+        """
+        Show in the console the results sent by the distributed workers.
+        """
+        while not self.coordinatorQueue.empty():
+            entry = self.coordinatorQueue.get()
+            if entry["Error"]:
+                text = "Failure: %s %s @%d: %s" % (entry["Task"], entry["Label"], entry["Offset"], entry["Error"])
+            elif entry["Task"] == "hash":
+                text = "%s @%d MD5: %s" % (entry["Label"], entry["Offset"], entry["Result"]["MD5Sum"])
+            else:
+                text = "%s @%d: %d files carved" % (entry["Label"], entry["Offset"], len(entry["Result"]["Files"]))
+            self.insertCommand(text, "\t")
 
-        # Button to Carve files
-        self.settingsButton = Button(self.topFrame,
-                                       text="Settings", width=self.topBtnWidth,
-                                       command=self.settings)
+        self.master.after(500, self.showDistributedResults)
 
-        self.settingsButton.pack(side=LEFT, padx=10)
     def openDiskImage(self):
         """
         Function to open a disk image, get the partitions in the image by
@@ -537,20 +1647,27 @@ class App: #TODO: call this GUI???
             return
 
         #run mmls on the disk image
-        diskImageOut = Popen([self.mmlsPath, diskImageLocation], stdout=PIPE, stderr=PIPE)
-        self.insertCommand(diskImageOut.args, "$")
-        stdout, stderr = diskImageOut.communicate()
+        start = time.perf_counter()
+
+        cmd = [self.mmlsPath, diskImageLocation]
+        self.insertCommand(cmd, "$")
+        diskImageOut = runTool("mmls", cmd)
+        stdout, stderr = diskImageOut["Stdout"], diskImageOut["Stderr"]
 
         if stdout:
             self.imagePath = diskImageLocation
+            self.entropyButton['state'] = 'normal'
+            self.searchButton['state'] = 'normal'
+            self.verifyButton['state'] = 'normal'
 
-            out = stdout.decode("utf-8")
-            out = out.splitlines()
-            self.listOfPartitions, self.bs = mmlsParser(out)
+            out = stdout.splitlines()
+            partitions, self.bs = mmlsParser(out)
+            self.partitions.reset(partitions, Carved="No", Recovered="No", MD5Sum="")
 
             if (len(self.listOfPartitions)):
                 # Enabling the carvePartitionsButton button
                 self.carvePartitionsButton['state'] = 'normal'
+                self.distributedButton['state'] = 'normal'
 
             # Creating the partitions tab
             self.partitionsTab = Frame(self.tabControl, name="partitions-tab", bg="white")
@@ -588,14 +1705,10 @@ class App: #TODO: call this GUI???
                                              lambda event, t=self.partitionsOpenDiskTree: self.copyTextToClipboard(t))
 
             # Adding the entries to the TreeView
+            self.diskRows = {}
             for i in range(len(self.listOfPartitions)):
-                self.partitionsOpenDiskTree.insert("", "end", i, values=(i, self.listOfPartitions[i]['Description'],
-                                                                         "", ""),tags=str(i))
-
-                # setup the two fields Carved and Recovered for each parition
-                self.listOfPartitions[i]["Carved"] = "No"
-                self.listOfPartitions[i]["Recovered"] = "No"
-                self.listOfPartitions[i]["MD5Sum"] = ""
+                self.diskRows[i] = self.partitionsOpenDiskTree.insert("", "end", i, values=(
+                    i, self.listOfPartitions[i]['Description'], "", ""), tags=str(i))
 
             self.partitionsOpenDiskTree.pack(anchor=NW, fill=Y)
 
@@ -606,6 +1719,8 @@ class App: #TODO: call this GUI???
         self.makeLefthandSideTable()
         self.refreshLeftSide()
 
+        metrics.observe("openDiskImage", time.perf_counter() - start, items=len(self.listOfPartitions))
+
         #loading is done
         self.hideLoading()
 
@@ -637,6 +1752,11 @@ class App: #TODO: call this GUI???
                 c.bind("<Button-1>", lambda event, self=self, i=i: self.recoverFilesCheck(self, i))
                 c.pack()
 
+        # Listing the deleted files first, to recover only the ones chosen
+        self.selectiveRecoveryVar = IntVar(value=1 if self.selectiveRecovery else 0)
+        Checkbutton(window, text="List the deleted files first and recover the chosen ones",
+                    variable=self.selectiveRecoveryVar, anchor=W).pack(fill=X)
+
         cancelButton = Button(window, text="Cancel", command=window.destroy)
         cancelButton.pack(side=LEFT)
 
@@ -667,6 +1787,12 @@ class App: #TODO: call this GUI???
             c.bind("<Button-1>", lambda event, self=self, i=i: self.carvePartitionsCheck(self, i))
             c.pack()
 
+        # Order in which the selected partitions are carved
+        self.carveOrderVar = StringVar(value=self.carveOrder)
+        Label(window, text="Carve first:", anchor=W).pack(fill=X, padx=5)
+        for order, text in CARVE_ORDERS:
+            Radiobutton(window, text=text, variable=self.carveOrderVar, value=order, anchor=W).pack(fill=X, padx=5)
+
         cancelButton = Button(window, text="Cancel", command=window.destroy)
         cancelButton.pack(side=LEFT)
 
@@ -732,6 +1858,7 @@ class App: #TODO: call this GUI???
         :param event: Not used, but is the event in question
         :type event: event #todo: probably not correct type
         """
+        self.selectiveRecovery = self.selectiveRecoveryVar.get() == 1
         window.destroy()
 
         self.showLoading()
@@ -744,6 +1871,11 @@ class App: #TODO: call this GUI???
             self.hideLoading()
             return
 
+        if self.selectiveRecovery:
+            self.listDeletedFiles(outFolder)
+            self.hideLoading()
+            return
+
         # We recover the files for each selected partition
         for i in self.partitionsToUse:
             name = self.listOfPartitions[i]["Description"][:self.listOfPartitions[i]["Description"].find("(")].replace(" ","").replace("/","_")+\
@@ -754,26 +1886,36 @@ class App: #TODO: call this GUI???
             partitionPath = self.listOfPartitions[i]['Path']
 
             if(partitionPath == None):
-                self.insertCommand("Partition not carved. Carve the partition first and try again.", "\t")
+                self.insertCommand("Partition not carved. Carve the partition first and try again.", "\t", "error")
 
                 continue
 
             out = outFolder + "/out_" + name
             cmds = [self.tskPath, partitionPath, out]
+            detachFolder(out)
 
-            # Executing the command and getting its output
-            recoveredPart = Popen(cmds, stdout=PIPE, stderr=PIPE)
-            self.insertCommand(recoveredPart.args, "$")
-            stdout, stderr = recoveredPart.communicate()
+            # Executing the command and getting its output, the recovered
+            # files are exported while tsk_recover writes them
+            watcher = self.watchFolder(out, partitionPath)
+            self.insertCommand(cmds, "$", job=name)
+            try:
+                recoveredPart = self.runToolShown("tsk", cmds, name)
+            finally:
+                self.stopWatcher(watcher)
+            stdout, stderr = recoveredPart["Stdout"], recoveredPart["Stderr"]
 
             partitionName = self.listOfPartitions[i]["Name"]
 
             if stdout:
-                stdout = stdout.decode("utf-8")
                 filesRecovered = int(stdout.split(":")[1])
+                metrics.observe("recoverFiles", recoveredPart["Duration"], items=filesRecovered)
 
                 if filesRecovered:
-                    dir = getFilesTree(out)
+                    try:
+                        dir = getFilesTree(out)
+                    except MemoryBudgetExceeded as err:
+                        messagebox.showerror("Error", str(err))
+                        dir = {}
 
                     # Add new tab to show the output
                     self.recoverTab = Frame(self.tabControl, name="recover-tab-%s"%(partitionName), bg="white")
@@ -786,6 +1928,11 @@ class App: #TODO: call this GUI???
                                  command=lambda t=str(self.recoverTab): self.tabControl.forget(t))
                     btn.place(relx=1, x=-15, y=2, anchor=NE)
 
+                    # Export button
+                    exportBtn = Button(self.recoverTab, text="Export",
+                                       command=lambda f=out, p=partitionPath: self.exportResults(f, p))
+                    exportBtn.place(relx=1, x=-100, y=2, anchor=NE)
+
                     self.tabControl.add(self.recoverTab, text="Recovered Files")
                     self.tabControl.select(self.recoverTab)
 
@@ -804,35 +1951,241 @@ class App: #TODO: call this GUI???
 
                     tree.configure(yscrollcommand=yscrollB.set)
 
-                    self.listOfPartitions[i]["Recovered"] = "Yes"
+                    self.partitions.update(i, Recovered="Yes")
 
                     # Adding the items to the table
-                    for key in dir:
-                        parent = key.split(sep)[-1]
-                        id2 = tree.insert("", "end", key, text=parent, values=([]))
-                        addItems(tree, id2, dir[key], self.md5Path, md5=True)
+                    with metrics.stage("addItems") as m:
+                        for key in dir:
+                            parent = key.split(sep)[-1]
+                            id2 = tree.insert("", "end", key, text=parent, values=([]))
+                            m["Items"] += 1 + addItems(tree, id2, dir[key], self.md5Path, md5=True)
 
                     tree.pack(anchor=NW)
                     tree.update_idletasks()
 
+                    self.indexResults(out, outFolder, self.listOfPartitions[i]["Description"])
+
                 else:
                     messagebox.showinfo("Recovered files summary",
                                         "No deleted files were recovered for partition: " + partitionName)
 
             else:
-                self.listOfPartitions[i]["Recovered"] = "No"
+                self.partitions.update(i, Recovered="No")
                 print(stderr)
 
-            # update the pertaining info on the table
-            self.changeTreeViewRow(i)
-
         self.hideLoading()
 
+    def listDeletedFiles(self, outFolder):
+        """
+        List the deleted files of the selected partitions with fls into
+        the index of deleted files, and show them in the Deleted Files tab
+        where they can be filtered and recovered.
+        :param outFolder: Folder of the index and of the recovered files
+        :type outFolder: str
+        """
+        from deleted import DeletedIndex, listDeleted
+
+        indexPath = path.join(outFolder, "deleted_index.sqlite")
+        if self.deletedIndex is None or self.deletedIndex.dbPath != indexPath:
+            if self.deletedIndex is not None:
+                self.deletedIndex.close()
+            self.deletedIndex = DeletedIndex(indexPath)
+        self.deletedOutFolder = outFolder
+
+        for i in self.partitionsToUse:
+            partitionPath = self.listOfPartitions[i]['Path']
+            if not partitionPath:
+                self.insertCommand("Partition not carved. Carve the partition first and try again.", "\t", "error")
+                continue
+
+            self.insertCommand([self.flsPath, "-r", "-d", "-m", "/", partitionPath], "$")
+            try:
+                with metrics.stage("listDeleted") as m:
+                    entries = listDeleted(partitionPath, self.flsPath)
+                    m["Items"] = len(entries)
+            except RuntimeError as err:
+                self.insertCommand(str(err), "\t", "error")
+                continue
+
+            self.deletedIndex.addEntries(partitionPath, entries)
+            self.insertCommand("%d deleted entries in %s" % (len(entries), self.listOfPartitions[i]["Description"]),
+                               "\t")
+            self.log.writeEvent("list-deleted", partition=self.listOfPartitions[i]["Name"], count=len(entries))
+
+        self.addDeletedTab()
+
+    def addDeletedTab(self):
+        """
+        Adds a tab to filter the index of deleted files by name, size and
+        modification date, and to recover the selected files.
+        """
+        if self.deletedTab is not None:
+            self.tabControl.select(self.deletedTab)
+            self.searchDeleted()
+            return
+
+        self.deletedTab = Frame(self.tabControl, name="deleted-tab", bg="white")
+
+        # Close Tab button
+        btn = Button(self.deletedTab, text="Close Tab", command=self.closeDeletedTab)
+        btn.place(relx=1, x=-15, y=2, anchor=NE)
+
+        self.tabControl.add(self.deletedTab, text="Deleted Files")
+        self.tabControl.select(self.deletedTab)
+
+        # Filters of the index
+        filterFrame = Frame(self.deletedTab, bg="white")
+        self.deletedNameVar = StringVar()
+        self.deletedMinSizeVar = StringVar()
+        self.deletedMaxSizeVar = StringVar()
+        self.deletedAfterVar = StringVar()
+        self.deletedBeforeVar = StringVar()
+        for text, var, width in (("Name", self.deletedNameVar, 15), ("Min KB", self.deletedMinSizeVar, 8),
+                                 ("Max KB", self.deletedMaxSizeVar, 8),
+                                 ("Modified after (YYYY-MM-DD)", self.deletedAfterVar, 10),
+                                 ("before", self.deletedBeforeVar, 10)):
+            Label(filterFrame, text=text, bg="white", padx=5).pack(side=LEFT)
+            Entry(filterFrame, textvariable=var, width=width).pack(side=LEFT)
+        Button(filterFrame, text="Search", command=self.searchDeleted).pack(side=LEFT, padx=5)
+        Button(filterFrame, text="Recover Selected", command=self.recoverSelected).pack(side=LEFT, padx=5)
+        self.deletedCountVar = StringVar()
+        Label(filterFrame, textvariable=self.deletedCountVar, bg="white", padx=5).pack(side=LEFT)
+        filterFrame.pack(anchor=NW, pady=30)
+
+        # Table of the deleted files, several can be selected
+        self.deletedTree = Treeview(self.deletedTab, columns=("Size", "Modified", "Inode", "Partition"),
+                                    height=20, selectmode="extended")
+        yscrollB = Scrollbar(self.deletedTab)
+        yscrollB.pack(side=RIGHT, fill=Y)
+        yscrollB.config(command=self.deletedTree.yview)
+        self.deletedTree.configure(yscrollcommand=yscrollB.set)
+
+        self.deletedTree.column("#0", width=400)
+        self.deletedTree.heading("#0", text="Deleted file")
+        for column, width in (("Size", 100), ("Modified", 150), ("Inode", 100), ("Partition", 250)):
+            self.deletedTree.column(column, width=width)
+            self.deletedTree.heading(column, text=column)
+        self.deletedTree.pack(anchor=NW, fill=BOTH, expand=True)
+
+        self.searchDeleted()
+
+    def closeDeletedTab(self):
+        """
+        Close the Deleted Files tab, the index stays in its folder.
+        """
+        self.tabControl.forget(self.deletedTab)
+        self.deletedTab = None
+
+    def searchDeleted(self):
+        """
+        Show the deleted files matching the filters of the Deleted Files
+        tab, at most DELETED_ROWS of them.
+        """
+        try:
+            minSize = int(float(self.deletedMinSizeVar.get()) * 1024) if self.deletedMinSizeVar.get() else None
+            maxSize = int(float(self.deletedMaxSizeVar.get()) * 1024) if self.deletedMaxSizeVar.get() else None
+            after = before = None
+            if self.deletedAfterVar.get():
+                after = int(datetime.strptime(self.deletedAfterVar.get(), "%Y-%m-%d").timestamp())
+            if self.deletedBeforeVar.get():
+                before = int(datetime.strptime(self.deletedBeforeVar.get(), "%Y-%m-%d").timestamp())
+        except ValueError as err:
+            messagebox.showerror("Error", str(err))
+            return
+
+        entries = self.deletedIndex.search(name=self.deletedNameVar.get() or None, minSize=minSize,
+                                           maxSize=maxSize, after=after, before=before, limit=DELETED_ROWS + 1)
+
+        self.deletedTree.delete(*self.deletedTree.get_children())
+        for e in entries[:DELETED_ROWS]:
+            modified = datetime.fromtimestamp(e["Mtime"]).strftime("%Y-%m-%d %H:%M:%S") if e["Mtime"] else ""
+            self.deletedTree.insert("", "end", str(e["Id"]), text=e["Path"],
+                                    values=(e["Size"], modified, e["Inode"], path.basename(e["Partition"])))
+
+        if len(entries) > DELETED_ROWS:
+            self.deletedCountVar.set("First %d files shown, refine the filters" % DELETED_ROWS)
+        else:
+            self.deletedCountVar.set("%d files" % len(entries))
+
+    def recoverSelected(self):
+        """
+        Recover the files selected in the Deleted Files tab with icat, in
+        a thread. The files of each partition are written to their own
+        folder.
+        """
+        from deleted import extractFiles
+
+        ids = [int(i) for i in self.deletedTree.selection()]
+        if not ids:
+            messagebox.showerror("Error", "Please select the files to recover.")
+            return
+
+        byPartition = {}
+        for e in self.deletedIndex.get(ids):
+            byPartition.setdefault(e["Partition"], []).append(e)
+
+        self.insertCommand("Recovering %d selected files..." % len(ids), "\t")
+        self.showLoading()
+        result = Queue()
+
+        def run(outFolder=self.deletedOutFolder, icatPath=self.icatPath):
+            for partitionPath, entries in byPartition.items():
+                out = path.join(outFolder, "deleted_" + path.basename(partitionPath))
+                try:
+                    detachFolder(out)
+                    with metrics.stage("recoverSelected") as m:
+                        results = extractFiles(partitionPath, entries, out, icatPath)
+                        m["Items"] = len(results)
+                        m["Bytes"] = sum(r["Size"] for r in results)
+                    result.put((partitionPath, out, results))
+                except (IOError, OSError) as err:
+                    result.put((partitionPath, out, err))
+            result.put(None)
+
+        threading.Thread(target=run, daemon=True).start()
+        self.master.after(200, self.waitRecoverSelected, result)
+
+    def waitRecoverSelected(self, result):
+        """
+        Poll the thread recovering the selected files.
+        :param result: queue receiving the results of each partition
+        :type result: Queue
+        """
+        while True:
+            try:
+                item = result.get_nowait()
+            except Empty:
+                self.master.after(200, self.waitRecoverSelected, result)
+                return
+
+            if item is None:
+                self.hideLoading()
+                return
+
+            partitionPath, out, results = item
+            if isinstance(results, Exception):
+                self.insertCommand("Recovery failed for %s: %s" % (partitionPath, results), "\t", "error")
+                continue
+
+            failed = [r for r in results if not r["Success"]]
+            for r in failed:
+                self.insertCommand("Failure: inode %s %s" % (r["Inode"], r["Error"]), "\t", "error")
+            self.insertCommand("Recovered %d files to %s" % (len(results) - len(failed), out), "\t")
+            self.log.writeEvent("recover-selected", partition=partitionPath, count=len(results),
+                                failed=len(failed), bytes=sum(r["Size"] for r in results))
+
+            if len(failed) < len(results):
+                for i in self.partitions.find("Path", partitionPath):
+                    self.partitions.update(i, Recovered="Yes")
+                    self.indexResults(out, self.deletedOutFolder, self.listOfPartitions[i]["Description"])
+
     def carvePartitions(event, self, window):
         """
-        Function to carve the selected partitions, letting the user know
-        upon success or failure. A new thread per partition
-        will be spawned to carve each partition.
+        Function to carve the selected partitions, in the order chosen in
+        the pop up window, with at most carveSlots partitions carved at
+        the same time. A new thread per partition will be spawned to
+        carve each partition, and the result of each partition is shown
+        as soon as it is carved.
 
         :param window: Pop up window to select the partitions to carve
         :type window: tkinter window
@@ -840,92 +2193,101 @@ class App: #TODO: call this GUI???
         :type event: event
         """
 
+        self.carveOrder = self.carveOrderVar.get()
         window.destroy()
 
-        self.showLoading()
-
-        # Carve selected partitions:
-        print("Carving with dd")
-
-        cmdsQueue = Queue()
-        counter = 0
-        threads = []
-
-        succ = 0
-        err = 0
-        succMsg = "Partition(s) successfully carved:\n"
-        errMsg = "Partition(s) unsuccessfully carved:\n"
-        fsCarved = False
-
         outputFolderPath = askdirectory(title="Choose output folder")
 
         if not outputFolderPath:
             messagebox.showerror("Error", "Please choose an output folder.")
-            self.hideLoading()
             return
 
+        self.showLoading()
+
         numPartitions = len(self.partitionsToUse)
 
         self.insertCommand("Carving "+str(numPartitions)+" partitions...", "\t")
 
-        # Spawning a thread for each partition that needs to be carve
-        # Adding parallelism to gain speed
-        for i in self.partitionsToUse:
+        state = {"Pending": orderPartitions(self.listOfPartitions, self.partitionsToUse, self.carveOrder),
+                 "Running": 0, "Queue": Queue(), "Output": outputFolderPath, "Carved": [], "Failed": []}
+
+        self.startCarveThreads(state)
+        self.master.after(100, self.pollCarveThreads, state)
+
+    def startCarveThreads(self, state):
+        """
+        Start the threads of the next partitions, up to carveSlots
+        partitions at the same time.
+        :param state: state of the carve, see carvePartitions
+        :type state: dict
+        """
+        while state["Pending"] and state["Running"] < self.carveSlots:
+            i = state["Pending"].pop(0)
             partition = self.listOfPartitions[i]
-            threads.append(CarveThread(partition["Slot"], partition, self, i, outputFolderPath, cmdsQueue))
-            threads[counter].start()
+            CarveThread(partition["Slot"], partition, self, i, state["Output"], state["Queue"]).start()
+            state["Running"] += 1
 
-            counter+=1
+    def pollCarveThreads(self, state):
+        """
+        Display the commands used by the carve threads and publish the
+        partitions they finished, without blocking the window.
+        :param state: state of the carve, see carvePartitions
+        :type state: dict
+        """
+        while True:
+            try:
+                cmd = state["Queue"].get_nowait()
+            except Empty:
+                break
 
-        # Waiting for all the threads to finish
-        while threading.activeCount() > 1:
-            if cmdsQueue.empty():
-                continue
+            if "done" in cmd:
+                state["Running"] -= 1
+                self.publishPartition(cmd["done"], cmd["duration"], state)
             else:
-                cmd = cmdsQueue.get()
-                self.insertCommand(cmd['text'], cmd['deli'])
+                self.insertCommand(cmd['text'], cmd['deli'], cmd.get('level'), cmd.get('job'))
 
-        # Displaying all the used commands
-        while not cmdsQueue.empty():
-            cmd = cmdsQueue.get()
-            self.insertCommand(cmd['text'], cmd['deli'])
+        self.startCarveThreads(state)
 
-        # Checking which partitions were successfully carved and which not
-        for i in self.partitionsToUse:
-            partition = self.listOfPartitions[i] #TODO: remove this extra variable
-            if partition['Carved'] == "Yes":
-                succMsg += "  - %s \n" % (partition['Description'])
-                self.insertCommand("Partition saved in %s"%(partition['Path']), "\t")
-
-                succ += 1
-                print("path: ",partition["Path"])
-                self.listOfPartitions[i]["MD5Sum"] = getMd5(partition["Path"], self.md5Path)
-            else:
-                errMsg += "  - %s \n" % (partition['Description'])
-                err += 1
+        if state["Running"]:
+            self.master.after(100, self.pollCarveThreads, state)
+            return
 
-            # Updating the summary table
-            self.changeTreeViewRow(i)
-            self.changeTreeViewDiskPartitionsRow(i)
+        # Every partition is done
+        self.insertCommand("%d partition(s) carved, %d failed" % (len(state["Carved"]), len(state["Failed"])),
+                           "\t")
+        self.hideLoading()
 
-            if partition['FileSystem'] == "Yes":
-                fsCarved = True
+        if state["Failed"]:
+            messagebox.showerror("Carved Partitions Summary", "Partition(s) unsuccessfully carved:\n" +
+                                 "".join("  - %s \n" % d for d in state["Failed"]))
+
+    def publishPartition(self, i, duration, state):
+        """
+        Show the result of a partition that was just carved, and enable
+        the recover and carve files buttons as soon as a file system is
+        carved.
+        :param i: position of the partition in listOfPartitions
+        :type i: int
+        :param duration: seconds spent on the partition
+        :type duration: float
+        :param state: state of the carve, see carvePartitions
+        :type state: dict
+        """
+        partition = self.listOfPartitions[i]
 
-        if succ:
-            if fsCarved:
-                # If partitions were carved then we enable the
-                # recover and carve files buttons
+        if partition['Carved'] == "Yes":
+            state["Carved"].append(partition['Description'])
+            self.insertCommand("Partition %s saved in %s (%.1f s)" % (partition['Description'], partition['Path'],
+                                                                    duration), "\t")
+
+            if partition['FileSystem'] == "Yes":
                 self.recoverFilesButton['state'] = 'normal'
                 self.carveFilesButton['state'] = 'normal'
-
-            if(err):
-                messagebox.showinfo("Carved Partitions Summary", succMsg + errMsg)
-            else:
-                messagebox.showinfo("Carved Partitions Summary", succMsg)
         else:
-            messagebox.showerror("Carved Partitions Summary", errMsg)
+            state["Failed"].append(partition['Description'])
+            self.insertCommand("Partition %s could not be carved" % partition['Description'], "\t", "error")
 
-        self.hideLoading()
+        # The rows of the partition are updated by flushPartitionRows
 
     def refreshLeftSide(self):
         """
@@ -933,49 +2295,68 @@ class App: #TODO: call this GUI???
         #TODO: is this necessary?
         """
 
+        self.summaryRows = {}
         for i in range(len(self.listOfPartitions)):
-            self.partitionsTree.insert("", "end", i, values=(self.listOfPartitions[i]['Description'], 
-                "X" if self.listOfPartitions[i]['Carved'] == "Yes" else "", 
-                "X" if self.listOfPartitions[i]['Recovered'] == "Yes" else "", 
+            self.summaryRows[i] = self.partitionsTree.insert("", "end", i, values=(
+                self.listOfPartitions[i]['Description'],
+                "X" if self.listOfPartitions[i]['Carved'] == "Yes" else "",
+                "X" if self.listOfPartitions[i]['Recovered'] == "Yes" else "",
                 "X" if self.listOfPartitions[i]['CarvedFiles'] == "Yes" else ""), tags=str(i))
 
 
+    @property
+    def listOfPartitions(self):
+        """
+        The partitions of the disk image, to read. They are changed with
+        self.partitions.update.
+        """
+        return self.partitions.partitions
+
+    def flushPartitionRows(self):
+        """
+        Update the rows of the partitions changed since the last call,
+        each row once however many times it changed.
+        """
+        changed = set()
+        while True:
+            try:
+                changed.add(self.changedPartitions.get_nowait())
+            except Empty:
+                break
+
+        for i in sorted(changed):
+            self.changeTreeViewRow(i)
+            self.changeTreeViewDiskPartitionsRow(i)
+
+        self.master.after(ROWS_FLUSH_MS, self.flushPartitionRows)
+
     def changeTreeViewRow(self, i):
         """
         Change a row of the tree.
-        :param i: the index value of the item to change
-        :type i: Treeview.item #todo get real type
-        :return:
+        :param i: position of the partition in listOfPartitions
+        :type i: int
         """
-
-        childs = self.partitionsTree.get_children()
-        if not childs:
-            #no children to remove
+        if i not in self.summaryRows:
             return
-        for it in self.partitionsTree.get_children():
-            print(self.partitionsTree.item(it))
-            if i in self.partitionsTree.item(it)["tags"]:
-                print("yes!")
-                self.partitionsTree.item(it, values=(self.partitionsTree.item(it)["values"][0],
-                    "X" if self.listOfPartitions[i]['Carved'] == "Yes" else "",
-                    "X" if self.listOfPartitions[i]['Recovered'] == "Yes" else "",
-                    "X" if self.listOfPartitions[i]['CarvedFiles'] == "Yes" else ""))
-                return
+
+        partition = self.partitions.snapshot(i)
+        self.partitionsTree.item(self.summaryRows[i], values=(partition['Description'],
+            "X" if partition.get('Carved') == "Yes" else "",
+            "X" if partition.get('Recovered') == "Yes" else "",
+            "X" if partition.get('CarvedFiles') == "Yes" else ""))
 
     def changeTreeViewDiskPartitionsRow(self, i):
         """
         Change a row in the carved partitions table.
-        :param i: index value of the item to change
-        :type i: Treeview.item
+        :param i: position of the partition in listOfPartitions
+        :type i: int
         """
+        if i not in self.diskRows:
+            return
 
-        for it in self.partitionsOpenDiskTree.get_children():
-            if i in self.partitionsOpenDiskTree.item(it)["tags"]:
-                self.partitionsOpenDiskTree.item(it, values=(self.partitionsOpenDiskTree.item(it)["values"][0],
-                    self.partitionsOpenDiskTree.item(it)["values"][1],
-                    self.listOfPartitions[i]['FSType'],
-                    self.listOfPartitions[i]['MD5Sum']))
-                return
+        partition = self.partitions.snapshot(i)
+        self.partitionsOpenDiskTree.item(self.diskRows[i], values=(i, partition['Description'],
+            partition.get('FSType', ""), partition.get('MD5Sum', "")))
 
     def addNotesTab(self):
         """
@@ -1028,7 +2409,7 @@ class App: #TODO: call this GUI???
                     fp.write(str(self.notes.get(1.0, END)))  # starts from `1.0`, not `0.0`
                     self.insertCommand("Saved notes to " + self.notesFileName, "\t")
             except IOError as err:
-                self.insertCommand("Could not save notes to " + self.notesFileName + " due to: " + err, "\t")
+                self.insertCommand("Could not save notes to " + self.notesFileName + " due to: " + err, "\t", "error")
 
     def saveAsNotes(self):
         """
@@ -1041,14 +2422,14 @@ class App: #TODO: call this GUI???
 
         # asksaveasfile return `None` if dialog closed with "cancel".
         if self.notesFileName is None:
-            self.insertCommand("Could not save notes to " + tempName, "\t")
+            self.insertCommand("Could not save notes to " + tempName, "\t", "error")
             return
         try:
             # starts from `1.0`, not `0.0`
             self.notesFileName.write(str(self.notes.get(1.0, END)))
             self.notesFileName.close()
         except IOError as err:
-            self.insertCommand("Could not save notes to " + tempName + " due to: " + err, "\t")
+            self.insertCommand("Could not save notes to " + tempName + " due to: " + err, "\t", "error")
         self.notesFileName = tempName
         self.insertCommand("Saved notes to " + self.notesFileName, "\t")
 
@@ -1089,26 +2470,104 @@ class App: #TODO: call this GUI???
         for widget in frame.winfo_children():
             widget.destroy()
 
-    def insertCommand(self, cmd, deli):
+    def insertCommand(self, cmd, deli, level=None, job=None):
         """
-        Helper function to insert a new command to the console frame.
+        Helper function to insert a new command to the console frame. The
+        line is shown by the next flushConsole, so this can be called
+        from any thread and at any rate.
         :param cmd: Command to insert
         :type cmd: str
         :param deli: Delimiter that will be placed in front of the command
         :type deli: str
+        :param level: One of console.LEVELS, by default "command" for "$"
+                      and "info" for the others
+        :type level: str
+        :param job: Job or partition the line is about, for the filter
+        :type job: str
         """
         if(type(cmd) == list):
             cmd = " ".join(cmd)
 
-        #write to the command prompt
-        self.consoleText.configure(state='normal')
-        self.consoleText.insert(END, deli + " " + cmd + "\n")
-        self.consoleText.configure(state='normal')
-        self.consoleText.update_idletasks()
-        self.consoleText.see("end")
+        self.console.add(cmd, deli, level, job)
+
+        #save the command to the log (written by its own thread)
+        self.log.writeEvent("message", job=job, text=deli + " " + cmd, level=level)
+
+    def toolOutput(self, job=None):
+        """
+        Helper function to get the onLine function of runTool, adding the
+        lines written by a tool to the console while it runs.
+        :param job: Job or partition the tool works on, for the filter
+        :type job: str
+        :rtype: function
+        """
+        def onLine(stream, line):
+            line = line.strip()
+            if line:
+                self.insertCommand(line, "\t", "warning" if stream == "stderr" else "info", job)
+        return onLine
+
+    def runToolShown(self, tool, cmds, job=None):
+        """
+        Run a tool from the window and show its output in the console while
+        it runs. The window is redrawn while waiting, but it does not take
+        the clicks, as with runTool.
+        :param tool: Name of the tool
+        :param cmds: Command to run
+        :param job: Job or partition the tool works on
+        :type tool: str
+        :type cmds: list
+        :type job: str
+        :return result: see toolrunner.ToolRunner.run
+        :rtype result: dict
+        """
+        import concurrent.futures
+        from toolrunner import runner
+
+        future = runner.submit(tool, cmds, onLine=self.toolOutput(job))
+        while True:
+            try:
+                return future.result(CONSOLE_FLUSH_MS / 1000)
+            except concurrent.futures.TimeoutError:
+                self.showConsoleLines()
+                self.master.update_idletasks()
 
-        #save the command to the log
-        self.log.writeToLog(deli + " " + cmd)
+    def flushConsole(self):
+        """
+        Show the lines of the console on a timer, see showConsoleLines.
+        """
+        self.showConsoleLines()
+        self.master.after(CONSOLE_FLUSH_MS, self.flushConsole)
+
+    def showConsoleLines(self):
+        """
+        Show the lines added to the console since the last call, in one
+        insert, and drop the lines above the limit of the console. The
+        console only scrolls down if it was showing its last line.
+        """
+        lines, redraw = self.console.take()
+
+        if lines or redraw:
+            atEnd = self.consoleText.yview()[1] >= 1.0
+            self.consoleText.configure(state='normal')
+            if redraw:
+                self.consoleText.delete("1.0", END)
+            if lines:
+                self.consoleText.insert(END, "\n".join(lines) + "\n")
+
+            # The widget keeps at most the lines of the buffer
+            excess = int(self.consoleText.index("end-1c").split(".")[0]) - 1 - self.console.maxLines
+            if excess > 0:
+                self.consoleText.delete("1.0", "%d.0" % (excess + 1))
+            self.consoleText.configure(state='disabled')
+            if atEnd or redraw:
+                self.consoleText.see("end")
+
+    def filterConsole(self, *args):
+        """
+        Apply the level and job chosen in the filter of the console.
+        """
+        self.console.setFilter(CONSOLE_FILTERS[self.consoleLevelVar.get()], self.consoleJobVar.get().strip())
 
     def carveFilesWin(self):
         """
@@ -1137,11 +2596,12 @@ class App: #TODO: call this GUI???
         dropDown.pack()
 
         # Creating the checkbox button for each file system
-        for i in range(len(self.FileTypes)):
+        fileTypes = self.getFileTypes()
+        for i in range(len(fileTypes)):
             v = IntVar()
-            c = Checkbutton(window, text=self.FileTypes[i],
+            c = Checkbutton(window, text=fileTypes[i],
                             variable=v, height=1, width=30, anchor=W)
-            c.bind("<Button-1>", lambda event, self=self, i=self.FileTypes[i]: self.carveFilesCheck(self, i))
+            c.bind("<Button-1>", lambda event, self=self, i=fileTypes[i]: self.carveFilesCheck(self, i))
             c.pack()
 
         cancelButton = Button(window, text="Cancel", command=window.destroy)
@@ -1202,84 +2662,353 @@ class App: #TODO: call this GUI???
         partition = int(self.dropVar.get().split(":")[0])
         partitionPath = self.listOfPartitions[partition]['Path']
 
-        # Creating the configuration file to be used by Scalpel
-        newConfig = open("scal.config", "w")
-        scalF = open("/etc/scalpel/scalpel.conf", "r")
-        for line in scalF:
-            if any(t in line for t in self.carveFileTypes):
-                newConfig.write(line.replace("#", " "))
+        outputFileLocation = outFolder+sep+"carvedFiles_"+self.listOfPartitions[partition]["Description"]
+
+        # The carved files are exported while they are written, and the
+        # files of Scalpel validated once it is done. The built-in carver
+        # checks the structure of each file and writes only its true length
+        validate = self.validateCarvedFiles and self.useScalpel
+        watcher = self.watchFolder(outputFileLocation, partitionPath, validate)
+        try:
+            filesCarved, duration, error = self.runCarver(partitionPath, outputFileLocation)
+        except BaseException:
+            self.stopWatcher(watcher)
+            raise
+
+        # The carvers read the whole partition once, its pages are not
+        # worth keeping in the cache
+        if self.ioMode not in ("dd", "buffered"):
+            dropCache(partitionPath)
+
+        if error is not None:
+            self.stopWatcher(watcher)
+            messagebox.showerror("Error", error)
+            self.hideLoading()
+            return
 
-        scalF.close()
-        newConfig.close()
+        metrics.observe("carveFiles", duration, bytes=path.getsize(partitionPath),
+                        items=filesCarved)
 
-        outputFileLocation = outFolder+sep+"carvedFiles_"+self.listOfPartitions[partition]["Description"]
+        if filesCarved and validate:
+            self.validateCarved(partition, outFolder, outputFileLocation, filesCarved, watcher)
+            return
 
-        # Running the command and getting its output
-        cmds = [self.scalpelPath, "-c", "./scal.config", partitionPath, "-o", outputFileLocation]
-        recoveredPart = Popen(cmds, stdout=PIPE, stderr=PIPE)
-        self.insertCommand(recoveredPart.args, "$")
-        stdout, stderr = recoveredPart.communicate()
+        self.stopWatcher(watcher)
+        self.showCarvedFiles(partition, outFolder, outputFileLocation, filesCarved)
 
-        stdout = stdout.decode("utf-8")
-        stderr = stderr.decode("utf-8")
+    def showCarvedFiles(self, partition, outFolder, outputFileLocation, filesCarved, invalid=0):
+        """
+        Show the files carved out of a partition in a new tab, and index
+        them.
+        :param partition: Id of the partition
+        :param outFolder: Output folder chosen
+        :param outputFileLocation: Folder of the carved files
+        :param filesCarved: Number of files carved
+        :param invalid: Number of invalid files moved to the quarantine
+        :type partition: int
+        :type outFolder: str
+        :type outputFileLocation: str
+        :type filesCarved: int
+        :type invalid: int
+        """
+        partitionPath = self.listOfPartitions[partition]['Path']
 
-        if stdout:
-            if stderr:
-                if("ERROR" in stderr):
-                    messagebox.showerror("Error", stderr)
-                    self.hideLoading()
-                    return
-
-            filesCarved = int(stdout.split("files carved = ")[1].split(",")[0])
-
-            messagebox.showinfo("Carved Files", "%d files were carved." % (filesCarved))
-            if(filesCarved):
-                self.listOfPartitions[partition]['CarvedFiles'] = "Yes"
-                self.changeTreeViewRow(partition)
-            else:
-                self.hideLoading()
-                return
+        summary = "%d files were carved." % (filesCarved)
+        if invalid:
+            summary += "\n%d invalid files were moved to %s." % (invalid, outputFileLocation + "_quarantine")
+            filesCarved -= invalid
 
-            partitionName = self.listOfPartitions[partition]['Name']
-            carvedFilesTab = Frame(self.tabControl, name="carvedFiles-tab-%s"%(partitionName), bg="white")
+        messagebox.showinfo("Carved Files", summary)
+        if(filesCarved):
+            self.partitions.update(partition, CarvedFiles="Yes")
+        else:
+            self.hideLoading()
+            return
 
-            # Close Tab button
-            btn = Button(carvedFilesTab, text="Close Tab", command=lambda t=str(carvedFilesTab): self.tabControl.forget(t))
-            btn.place(relx=1, x=-15, y=2, anchor=NE)
+        partitionName = self.listOfPartitions[partition]['Name']
+        carvedFilesTab = Frame(self.tabControl, name="carvedFiles-tab-%s"%(partitionName), bg="white")
 
-            self.tabControl.add(carvedFilesTab, text="Carved Files")
-            self.tabControl.select(carvedFilesTab)
+        # Close Tab button
+        btn = Button(carvedFilesTab, text="Close Tab", command=lambda t=str(carvedFilesTab): self.tabControl.forget(t))
+        btn.place(relx=1, x=-15, y=2, anchor=NE)
 
+        # Export button
+        exportBtn = Button(carvedFilesTab, text="Export",
+                           command=lambda f=outputFileLocation, p=partitionPath: self.exportResults(f, p))
+        exportBtn.place(relx=1, x=-100, y=2, anchor=NE)
+
+        self.tabControl.add(carvedFilesTab, text="Carved Files")
+        self.tabControl.select(carvedFilesTab)
+
+        try:
             dir = getFilesTree(outputFileLocation)
+        except MemoryBudgetExceeded as err:
+            messagebox.showerror("Error", str(err))
+            dir = {}
 
-            # TreeView (Table)
-            tree = Treeview(carvedFilesTab, height=23, columns=1)
-            self.carvedFilesTrees.append(tree)
+        # TreeView (Table)
+        tree = Treeview(carvedFilesTab, height=23, columns=1)
+        self.carvedFilesTrees.append(tree)
 
-            yscrollB = Scrollbar(carvedFilesTab)
-            yscrollB.pack(side=RIGHT, fill=Y)
+        yscrollB = Scrollbar(carvedFilesTab)
+        yscrollB.pack(side=RIGHT, fill=Y)
 
-            tree.column("#0", width=400)
-            tree.heading("#0", text=outputFileLocation)
+        tree.column("#0", width=400)
+        tree.heading("#0", text=outputFileLocation)
 
-            tree.column("#1", width=300)
-            tree.heading("#1", text="MD5 Hash")
+        tree.column("#1", width=300)
+        tree.heading("#1", text="MD5 Hash")
 
-            tree.configure(yscrollcommand=yscrollB.set)
+        tree.configure(yscrollcommand=yscrollB.set)
 
-            # Adding the items to the table
+        # Adding the items to the table
+        with metrics.stage("addItems") as m:
             for key in dir:
                 parent = key.split(sep)[-1]
                 id2 = tree.insert("", "end", key, text=parent, values=([]))
-                addItems(tree, id2, dir[key], self.md5Path, md5=True)
+                m["Items"] += 1 + addItems(tree, id2, dir[key], self.md5Path, md5=True)
 
-            tree.pack(anchor=NW)
+        tree.pack(anchor=NW)
 
+        self.indexResults(outputFileLocation, outFolder, self.listOfPartitions[partition]["Description"])
 
-        else:
-            messagebox.showerror("Error", stderr)
+        self.hideLoading()
+
+    def validateCarved(self, partition, outFolder, outputFileLocation, filesCarved, watcher):
+        """
+        Drop the corrupt files carved by Scalpel before they are hashed and
+        shown, in a thread, and then show the others. The watcher of the
+        folder validates the files and exports the valid ones.
+        :param partition: Id of the partition
+        :param outFolder: Output folder chosen
+        :param outputFileLocation: Folder of the carved files
+        :param filesCarved: Number of files carved
+        :param watcher: Watcher of the folder, with a validator
+        :type partition: int
+        :type outFolder: str
+        :type outputFileLocation: str
+        :type filesCarved: int
+        :type watcher: export.FolderWatcher
+        """
+        result = Queue()
+
+        def run():
+            try:
+                with metrics.stage("validateFiles") as m:
+                    exported = watcher.stop()
+                    m["Items"] = sum(s["Valid"] + s["Invalid"] for s in watcher.stats.values())
+                self.insertCommand("Exported %d files of %s" % (exported, outputFileLocation), "\t")
+                result.put(watcher.stats)
+            except (IOError, OSError) as err:
+                result.put(err)
+
+        threading.Thread(target=run, daemon=True).start()
+        self.master.after(200, self.waitValidation, result, partition, outFolder, outputFileLocation, filesCarved)
+
+    def waitValidation(self, result, partition, outFolder, outputFileLocation, filesCarved):
+        """
+        Poll the thread validating the carved files, see validateCarved.
+        :param result: queue receiving the statistics or the error
+        :type result: Queue
+        """
+        try:
+            stats = result.get_nowait()
+        except Empty:
+            self.master.after(200, self.waitValidation, result, partition, outFolder, outputFileLocation,
+                              filesCarved)
+            return
+
+        invalid = 0
+        if isinstance(stats, Exception):
+            self.insertCommand("Validating %s failed: %s" % (outputFileLocation, stats), "\t", "error")
+            stats = {}
+        for t in sorted(stats):
+            self.insertCommand("%s: %d valid, %d invalid, %d bytes trimmed %s" %
+                               (t, stats[t]["Valid"], stats[t]["Invalid"], stats[t]["Trimmed"],
+                                json.dumps(stats[t]["Reasons"])), "\t")
+            invalid += stats[t]["Invalid"]
+
+        self.showCarvedFiles(partition, outFolder, outputFileLocation, filesCarved, invalid)
+
+    def watchFolder(self, folder, partitionPath, validate=False):
+        """
+        Export the files of an output folder to <folder>.jsonl while a tool
+        writes them (see export.FolderWatcher).
+        :param folder: Output folder of the tool
+        :param partitionPath: Path of the partition the files come from
+        :param validate: Validate the files once the tool is done, and move
+                         the invalid ones to <folder>_quarantine
+        :type folder: str
+        :type partitionPath: str
+        :type validate: bool
+        :rtype: export.FolderWatcher
+        """
+        from export import FolderWatcher
+        from formats import validateFile
+
+        watcher = FolderWatcher(folder, folder + ".jsonl", source=partitionPath,
+                                validator=validateFile if validate else None, quarantine=folder + "_quarantine")
+        watcher.start()
+        return watcher
+
+    def stopWatcher(self, watcher):
+        """
+        Export the files left by a tool, in a thread: the files written last
+        are read once more.
+        :type watcher: export.FolderWatcher
+        """
+        def run():
+            try:
+                exported = watcher.stop()
+                self.insertCommand("Exported %d files of %s" % (exported, watcher.folder), "\t")
+            except (IOError, OSError) as err:
+                self.insertCommand("Exporting %s failed: %s" % (watcher.folder, err), "\t", "error")
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def runCarver(self, partitionPath, outputFileLocation):
+        """
+        Carve the selected types of files out of a partition, with Scalpel
+        or with the built-in carver that writes only the true length of
+        each file.
+        :param partitionPath: Path of the carved partition
+        :type partitionPath: str
+        :param outputFileLocation: Output folder of the carved files
+        :type outputFileLocation: str
+        :return filesCarved: number of files carved
+        :return duration: seconds spent carving
+        :return error: error message or None
+        :rtype filesCarved: int
+        :rtype duration: float
+        :rtype error: str
+        """
+        from signatures import loadSignatures, removeJobConfig
+        from unallocated import intersectRanges, extractRanges, remapAudit
+
+        # Ranges of the partition to carve, None for the whole partition
+        unallocated = self.unallocatedOf(partitionPath) if self.unallocatedOnly else None
+
+        if not self.useScalpel:
+            import carver
+            import entropy
+            from pipeline import loadHeaders
+
+            self.insertCommand("Carving %s with the built-in carver" % partitionPath, "\t")
+            start = time.perf_counter()
+            try:
+                ranges = unallocated
+                if self.skipRegions:
+                    # The single pass leaves the map next to the partition
+                    mapPath = partitionPath + ".emap"
+                    if not path.isfile(mapPath):
+                        mapPath = outputFileLocation + ".emap"
+                    emap = entropy.mapFor(partitionPath, mapPath)
+                    ranges = emap.ranges()
+                    skipped = emap.length - sum(end - begin for begin, end in ranges)
+                    self.insertCommand("Skipping %.1f MB of empty and random regions" % (skipped / 1024 ** 2), "\t")
+                    if unallocated is not None:
+                        ranges = intersectRanges(ranges, unallocated)
+                # Headers found by the single pass: only the files are read
+                headers = loadHeaders(partitionPath + ".headers.json", path.getsize(partitionPath),
+                                      self.carveFileTypes)
+                if headers is not None:
+                    self.insertCommand("Using the %d headers found while extracting the partition" % len(headers),
+                                       "\t")
+                result = carver.carveFiles(partitionPath, outputFileLocation, self.carveFileTypes,
+                                           ranges=ranges, headers=headers,
+                                           store=self.storeOf(path.dirname(outputFileLocation)))
+            except (IOError, ValueError) as err:
+                return 0, 0.0, str(err)
+
+            self.insertCommand("%d files carved (%d bytes), %d headers rejected" %
+                               (result["Carved"], result["Bytes"], result["Rejected"]), "\t")
+            return result["Carved"], time.perf_counter() - start, None
+
+        # Creating the configuration file to be used by Scalpel
+        configPath = loadSignatures().makeJobConfig(self.carveFileTypes)
+
+        # Scalpel reads a file: the unallocated ranges are copied next to
+        # the configuration, in the private folder of the job
+        carvedPath = partitionPath
+        if unallocated is not None:
+            carvedPath = path.join(path.dirname(configPath), "unallocated.dd")
+            extractRanges(partitionPath, unallocated, carvedPath)
+
+        # Running the command and getting its output
+        detachFolder(outputFileLocation)
+        cmds = [self.scalpelPath, "-c", configPath, carvedPath, "-o", outputFileLocation]
+        self.insertCommand(cmds, "$")
+        try:
+            recoveredPart = self.runToolShown("scalpel", cmds, path.basename(partitionPath))
+        finally:
+            removeJobConfig(configPath)
+
+        stdout = recoveredPart["Stdout"]
+        stderr = recoveredPart["Stderr"]
+
+        if not stdout:
+            return 0, recoveredPart["Duration"], stderr
+
+        if stderr:
+            if("ERROR" in stderr):
+                return 0, recoveredPart["Duration"], stderr
+
+        # Offsets of the carved files in the partition
+        auditPath = path.join(outputFileLocation, "audit.txt")
+        if unallocated is not None and path.isfile(auditPath):
+            remapAudit(auditPath, unallocated)
+
+        filesCarved = int(stdout.split("files carved = ")[1].split(",")[0])
+        return filesCarved, recoveredPart["Duration"], None
+
+    def unallocatedOf(self, partitionPath):
+        """
+        Get the unallocated ranges of a partition, from the allocation
+        map of its file system or with blkls.
+        :param partitionPath: Path of the carved partition
+        :type partitionPath: str
+        :return ranges: list of (start, end) or None to carve the whole
+                        partition
+        :rtype ranges: list
+        """
+        from unallocated import unallocatedRanges, UnknownFileSystem
 
+        try:
+            with metrics.stage("unallocatedRanges"):
+                fsName, ranges = unallocatedRanges(partitionPath, self.blklsPath)
+        except (UnknownFileSystem, IOError, ValueError) as err:
+            self.insertCommand("No allocation map (%s), carving the whole partition" % err, "\t", "warning")
+            return None
+
+        size = path.getsize(partitionPath)
+        free = sum(end - start for start, end in ranges)
+        self.insertCommand("Carving the unallocated space only (%s): %.1f MB of %.1f MB" %
+                           (fsName, free / 1024 ** 2, size / 1024 ** 2), "\t")
+        return ranges
+
+    def exportResults(self, folder, source):
+        """
+        Export the files of an output folder with their size, offset,
+        type and digests as JSON lines, CSV or DFXML. The folder is read
+        again instead of the table, one file at a time.
+        :param folder: output folder of tsk_recover or Scalpel
+        :type folder: str
+        :param source: path of the partition the files come from
+        :type source: str
+        """
+        fileName = asksaveasfilename(title="Export results as:", defaultextension=".jsonl",
+                                     filetypes=[("JSON lines", "*.jsonl"), ("CSV", "*.csv"), ("DFXML", "*.xml")])
+        if not fileName:
+            return
 
+        from export import exportFolder
+
+        self.showLoading()
+        try:
+            count = exportFolder(folder, fileName, source=source)
+            self.insertCommand("Exported %d files to %s" % (count, fileName), "\t")
+        except (IOError, ValueError) as err:
+            messagebox.showerror("Error", str(err))
         self.hideLoading()
 
     #todo: figure out where this is getting called and put in tree
@@ -1292,7 +3021,7 @@ class App: #TODO: call this GUI???
         :type event:  event
         """
         # triggered off left button click on text_field
-        root.clipboard_clear()  # clear clipboard contents
+        self.master.clipboard_clear()  # clear clipboard contents
         textList = tree.item(tree.focus())["values"]
         line = ""
         for text in textList:
@@ -1301,7 +3030,7 @@ class App: #TODO: call this GUI???
             else:
                 line += str(text)
 
-        root.clipboard_append(line)  # append new value to clipboard
+        self.master.clipboard_append(line)  # append new value to clipboard
 
 
     def showLoading(self):
@@ -1331,6 +3060,9 @@ class App: #TODO: call this GUI???
         md5Frame = Frame(window)
         ddFrame = Frame(window)
         fsstatFrame = Frame(window)
+        blklsFrame = Frame(window)
+        flsFrame = Frame(window)
+        icatFrame = Frame(window)
 
         # Variables to hold the text in the Entries
         self.scalpelVar = StringVar()
@@ -1339,6 +3071,9 @@ class App: #TODO: call this GUI???
         self.md5Var = StringVar()
         self.ddVar = StringVar()
         self.fsstatVar = StringVar()
+        self.blklsVar = StringVar()
+        self.flsVar = StringVar()
+        self.icatVar = StringVar()
 
         # Entries to write the path of the tools
         scalpelEntry = Entry(scalpelFrame, textvariable=self.scalpelVar)
@@ -1347,6 +3082,9 @@ class App: #TODO: call this GUI???
         md5Entry = Entry(md5Frame, textvariable=self.md5Var)
         ddEntry = Entry(ddFrame, textvariable=self.ddVar)
         fsstatEntry = Entry(fsstatFrame, textvariable=self.fsstatVar)
+        blklsEntry = Entry(blklsFrame, textvariable=self.blklsVar)
+        flsEntry = Entry(flsFrame, textvariable=self.flsVar)
+        icatEntry = Entry(icatFrame, textvariable=self.icatVar)
 
         # Info text in the pop up window
         Label(window, text="Insert the path of the following tools: ").pack(side=TOP)
@@ -1360,6 +3098,9 @@ class App: #TODO: call this GUI???
         md5Label = Label(md5Frame, text="md5sum", width=10, anchor=W, padx=5)
         ddLabel = Label(ddFrame, text="dd", width=10, anchor=W, padx=5)
         fsstatLabel = Label(fsstatFrame, text="fsstat", width=10, anchor=W, padx=5)
+        blklsLabel = Label(blklsFrame, text="blkls", width=10, anchor=W, padx=5)
+        flsLabel = Label(flsFrame, text="fls", width=10, anchor=W, padx=5)
+        icatLabel = Label(icatFrame, text="icat", width=10, anchor=W, padx=5)
 
 
         # Packing and placing the Labels and Entries
@@ -1394,6 +3135,21 @@ class App: #TODO: call this GUI???
               padx=5, fg="gray").pack(side=LEFT)
         fsstatEntry.pack(side=LEFT)
 
+        blklsLabel.pack(side=LEFT)
+        Label(blklsFrame, text="(Default: %s)"%(self.blklsDefault), font=(None, 10, "italic"), width=25, anchor=W,
+              padx=5, fg="gray").pack(side=LEFT)
+        blklsEntry.pack(side=LEFT)
+
+        flsLabel.pack(side=LEFT)
+        Label(flsFrame, text="(Default: %s)"%(self.flsDefault), font=(None, 10, "italic"), width=25, anchor=W,
+              padx=5, fg="gray").pack(side=LEFT)
+        flsEntry.pack(side=LEFT)
+
+        icatLabel.pack(side=LEFT)
+        Label(icatFrame, text="(Default: %s)"%(self.icatDefault), font=(None, 10, "italic"), width=25, anchor=W,
+              padx=5, fg="gray").pack(side=LEFT)
+        icatEntry.pack(side=LEFT)
+
         # Packing the frames
         scalpelFrame.pack(padx=10)
         tskFrame.pack(padx=10)
@@ -1401,6 +3157,73 @@ class App: #TODO: call this GUI???
         md5Frame.pack(padx=10)
         ddFrame.pack(padx=10)
         fsstatFrame.pack(padx=10)
+        blklsFrame.pack(padx=10)
+        flsFrame.pack(padx=10)
+        icatFrame.pack(padx=10)
+
+        # Options of the carving of files
+        self.useScalpelVar = IntVar(value=1 if self.useScalpel else 0)
+        Checkbutton(window, text="Carve files with Scalpel instead of the built-in carver",
+                    variable=self.useScalpelVar, anchor=W).pack(padx=10, fill=X)
+        self.skipRegionsVar = IntVar(value=1 if self.skipRegions else 0)
+        Checkbutton(window, text="Skip the empty and random regions when carving files (built-in carver)",
+                    variable=self.skipRegionsVar, anchor=W).pack(padx=10, fill=X)
+        self.unallocatedOnlyVar = IntVar(value=1 if self.unallocatedOnly else 0)
+        Checkbutton(window, text="Carve files from the unallocated space only",
+                    variable=self.unallocatedOnlyVar, anchor=W).pack(padx=10, fill=X)
+        self.indexTextVar = IntVar(value=1 if self.indexText else 0)
+        Checkbutton(window, text="Index the text of the recovered and carved files",
+                    variable=self.indexTextVar, anchor=W).pack(padx=10, fill=X)
+        self.fuzzyHashVar = IntVar(value=1 if self.fuzzyHash else 0)
+        Checkbutton(window, text="Fuzzy hash the recovered and carved files to group the similar ones" +
+                    ("" if find_spec("ssdeep") else " (slow without ssdeep)"),
+                    variable=self.fuzzyHashVar, anchor=W).pack(padx=10, fill=X)
+        self.contentStoreVar = IntVar(value=1 if self.contentStore else 0)
+        Checkbutton(window, text="Store identical recovered and carved files once (hard links)",
+                    variable=self.contentStoreVar, anchor=W).pack(padx=10, fill=X)
+        self.hashImagesVar = IntVar(value=1 if self.hashImages else 0)
+        Checkbutton(window, text="Hash the images of the batch queue in segments to verify them later",
+                    variable=self.hashImagesVar, anchor=W).pack(padx=10, fill=X)
+        self.singlePassVar = IntVar(value=1 if self.singlePass else 0)
+        Checkbutton(window, text="Extract, hash and scan the partitions in a single read of the image",
+                    variable=self.singlePassVar, anchor=W).pack(padx=10, fill=X)
+        singlePassFrame = Frame(window)
+        Label(singlePassFrame, text="Headers found in the single pass (e.g. jpg,png, slower)", anchor=W,
+              padx=5).pack(side=LEFT)
+        self.singlePassTypesVar = StringVar(value=",".join(self.singlePassTypes))
+        Entry(singlePassFrame, textvariable=self.singlePassTypesVar, width=20).pack(side=LEFT)
+        singlePassFrame.pack(padx=10, fill=X)
+
+        # Options of the reads of the evidence
+        ioFrame = Frame(window)
+        Label(ioFrame, text="Read evidence with", anchor=W, padx=5).pack(side=LEFT)
+        self.ioModeVar = StringVar(value=self.ioMode)
+        OptionMenu(ioFrame, self.ioModeVar, "dd", *MODES).pack(side=LEFT)
+        Label(ioFrame, text="Read-ahead (MB)", anchor=W, padx=5).pack(side=LEFT)
+        self.readAheadVar = StringVar(value=str(self.readAhead // 1024 ** 2))
+        Entry(ioFrame, textvariable=self.readAheadVar, width=6).pack(side=LEFT)
+        ioFrame.pack(padx=10, fill=X)
+
+        # Limits of the resource governor, shared by every job
+        governorFrame = Frame(window)
+        usage = governor.utilisation()
+        self.ioLimitVar = StringVar(value=str(usage["IOLimit"] // 1024 ** 2))
+        self.processLimitVar = StringVar(value=str(usage["ProcessLimit"]))
+        self.memoryBudgetVar = StringVar(value=str(usage["MemoryBudget"] // 1024 ** 2))
+        Label(governorFrame, text="I/O limit (MB/s, 0 for none)", anchor=W, padx=5).pack(side=LEFT)
+        Entry(governorFrame, textvariable=self.ioLimitVar, width=6).pack(side=LEFT)
+        Label(governorFrame, text="Tools at once", anchor=W, padx=5).pack(side=LEFT)
+        Entry(governorFrame, textvariable=self.processLimitVar, width=4).pack(side=LEFT)
+        Label(governorFrame, text="Memory budget (MB)", anchor=W, padx=5).pack(side=LEFT)
+        Entry(governorFrame, textvariable=self.memoryBudgetVar, width=8).pack(side=LEFT)
+        governorFrame.pack(padx=10, fill=X)
+
+        # Lines kept by the console
+        consoleFrame = Frame(window)
+        Label(consoleFrame, text="Console lines", anchor=W, padx=5).pack(side=LEFT)
+        self.consoleLinesVar = StringVar(value=str(self.console.maxLines))
+        Entry(consoleFrame, textvariable=self.consoleLinesVar, width=8).pack(side=LEFT)
+        consoleFrame.pack(padx=10, fill=X)
 
         # Cancel Button
         cancelButton = Button(window, text="Cancel", command=window.destroy)
@@ -1456,8 +3279,52 @@ class App: #TODO: call this GUI???
         else:
             self.fsstatPath = self.fsstatVar.get()
 
-root = Tk()
+        # Changing blkls Path
+        if self.blklsVar.get() == "":
+            self.blklsPath = self.blklsDefault
+        else:
+            self.blklsPath = self.blklsVar.get()
 
-app = App(root)
+        # Changing fls Path
+        if self.flsVar.get() == "":
+            self.flsPath = self.flsDefault
+        else:
+            self.flsPath = self.flsVar.get()
 
-root.mainloop()
\ No newline at end of file
+        # Changing icat Path
+        if self.icatVar.get() == "":
+            self.icatPath = self.icatDefault
+        else:
+            self.icatPath = self.icatVar.get()
+
+        # Changing the carver
+        self.useScalpel = self.useScalpelVar.get() == 1
+        self.skipRegions = self.skipRegionsVar.get() == 1
+        self.unallocatedOnly = self.unallocatedOnlyVar.get() == 1
+        self.indexText = self.indexTextVar.get() == 1
+        self.fuzzyHash = self.fuzzyHashVar.get() == 1
+        self.hashImages = self.hashImagesVar.get() == 1
+        self.singlePass = self.singlePassVar.get() == 1
+        self.singlePassTypes = [t.strip() for t in self.singlePassTypesVar.get().split(",")
+                                if t.strip() in self.getFileTypes()]
+        self.contentStore = self.contentStoreVar.get() == 1
+        self.ioMode = self.ioModeVar.get()
+
+        # Changing the limits of the governor
+        if self.ioLimitVar.get().isdigit():
+            governor.configure(ioRate=int(self.ioLimitVar.get()) * 1024 ** 2)
+        if self.processLimitVar.get().isdigit() and int(self.processLimitVar.get()) > 0:
+            governor.configure(processes=int(self.processLimitVar.get()))
+        if self.memoryBudgetVar.get().isdigit() and int(self.memoryBudgetVar.get()) > 0:
+            governor.configure(memory=int(self.memoryBudgetVar.get()) * 1024 ** 2)
+        if self.readAheadVar.get().isdigit() and int(self.readAheadVar.get()) > 0:
+            self.readAhead = int(self.readAheadVar.get()) * 1024 ** 2
+        if self.consoleLinesVar.get().isdigit() and int(self.consoleLinesVar.get()) > 0:
+            self.console.resize(int(self.consoleLinesVar.get()))
+
+if __name__ == "__main__":
+    root = Tk()
+
+    app = App(root)
+
+    root.mainloop()
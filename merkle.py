@@ -0,0 +1,259 @@
+"""
+Segmented hashing of disk images, to verify them without hashing them
+again as a whole.
+
+md5sum reads and hashes an image in one thread, so verifying a large image
+takes hours. Here the image is cut in segments of SEGMENT_SIZE bytes whose
+SHA-256 are computed by a pool of threads, and combined in a Merkle tree:
+each node is the SHA-256 of its two children, up to a single root. The
+segment hashes and the root are stored in a manifest next to the results
+of the case. The MD5 and SHA-256 of the whole image are computed in the
+same read, for the reports.
+
+An image is verified again by reading its segments in parallel, the whole
+image or only a region of it, and the segments whose hash changed are
+reported with their offsets.
+
+Usage:
+    manifest = hashImage("/cases/disk.dd")
+    saveManifest(manifest, manifestPath("/cases/out", "/cases/disk.dd"))
+    result = verifyImage("/cases/disk.dd", loadManifest(...), start=0, end=2 ** 30)
+"""
+
+import os
+import json
+import hashlib
+from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+from governor import governor
+from evidenceio import EvidenceReader, READ_AHEAD
+
+
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+# Segments hashed at the same time (each reads with os.pread, and
+# hashlib releases the GIL)
+WORKERS = 4
+
+
+def manifestPath(outFolder, imagePath):
+    """
+    Helper function to get the path of the manifest of an image.
+    :param outFolder: folder of the results of the case
+    :param imagePath: path of the disk image
+    :type outFolder: str
+    :type imagePath: str
+    :rtype: str
+    """
+    return os.path.join(outFolder, os.path.basename(imagePath) + ".segments.json")
+
+
+def merkleRoot(segments):
+    """
+    Get the root of the Merkle tree of the segment hashes. A node without
+    a sibling is moved up as it is.
+    :param segments: SHA-256 of the segments, in hex
+    :type segments: list
+    :return root: SHA-256 in hex
+    :rtype root: str
+    """
+    level = [bytes.fromhex(s) for s in segments]
+    if not level:
+        return hashlib.sha256(b"").hexdigest()
+
+    while len(level) > 1:
+        nextLevel = [hashlib.sha256(level[i] + level[i + 1]).digest() for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            nextLevel.append(level[-1])
+        level = nextLevel
+    return level[0].hex()
+
+
+def hashChunks(chunks):
+    """
+    Helper function to get the SHA-256 of a segment from its chunks.
+    :type chunks: list
+    :rtype: str
+    """
+    sha = hashlib.sha256()
+    for chunk in chunks:
+        sha.update(chunk)
+    return sha.hexdigest()
+
+
+def hashImage(imagePath, segmentSize=SEGMENT_SIZE, workers=WORKERS, mode="fadvise", readAhead=READ_AHEAD,
+              onProgress=None):
+    """
+    Hash an image in segments, in one sequential read. The segments are
+    hashed by a pool of threads while the MD5 and SHA-256 of the whole
+    image are updated by two other threads, and at most 2 * workers
+    segments are held in memory.
+    :param imagePath: path of the disk image
+    :param segmentSize: size of the segments
+    :param workers: number of threads hashing segments
+    :param mode: one of the MODES of evidenceio
+    :param readAhead: size of each read
+    :param onProgress: function called with the bytes hashed and the size
+    :type imagePath: str
+    :type segmentSize: int
+    :type workers: int
+    :type mode: str
+    :type readAhead: int
+    :type onProgress: function
+    :return manifest: Image, Size, SegmentSize, Segments, Root, MD5,
+                      SHA256 and Created
+    :rtype manifest: dict
+    """
+    size = os.path.getsize(imagePath)
+    md5, sha = hashlib.md5(), hashlib.sha256()
+    segments = []
+    inFlight = deque()
+
+    def collect():
+        segment, last = inFlight.popleft()
+        segments.append(segment.result())
+        for future in last:
+            future.result()
+
+    reader = EvidenceReader(imagePath, mode, readAhead)
+    # The segments hashed and the buffers of the reader, in one reservation
+    reservation = governor.reserve(2 * workers * segmentSize + reader.memory(), "hashing " + imagePath)
+    try:
+        with metrics.stage("hashImage") as m, reader, \
+                ThreadPoolExecutor(max_workers=workers) as pool, \
+                ThreadPoolExecutor(max_workers=1) as md5Thread, ThreadPoolExecutor(max_workers=1) as shaThread:
+            chunks, done = [], 0
+            for chunk in reader.read(0, size, reserved=True):
+                # One thread per digest keeps the updates in order
+                last = (md5Thread.submit(md5.update, chunk), shaThread.submit(sha.update, chunk))
+
+                # A chunk across the end of a segment is cut without a copy
+                view = memoryview(chunk)
+                while view:
+                    piece = view[:segmentSize - done % segmentSize]
+                    chunks.append(piece)
+                    done += len(piece)
+                    view = view[len(piece):]
+
+                    if done % segmentSize == 0 or done == size:
+                        inFlight.append((pool.submit(hashChunks, chunks), last))
+                        chunks = []
+                        while len(inFlight) >= 2 * workers:
+                            collect()
+                        if onProgress is not None:
+                            onProgress(done, size)
+
+            if chunks:
+                inFlight.append((pool.submit(hashChunks, chunks), last))
+            while inFlight:
+                collect()
+            m["Bytes"] = done
+            m["Items"] = len(segments)
+    finally:
+        reservation.release()
+
+    if done != size:
+        raise IOError("Could only read %d of the %d bytes of %s" % (done, size, imagePath))
+
+    return {"Image": os.path.abspath(imagePath), "Size": size, "SegmentSize": segmentSize, "Segments": segments,
+            "Root": merkleRoot(segments), "MD5": md5.hexdigest(), "SHA256": sha.hexdigest(),
+            "Created": datetime.now().isoformat(timespec="seconds")}
+
+
+def saveManifest(manifest, filePath):
+    """
+    Write a manifest, through a temporary file so a crash does not leave
+    half of it.
+    :type manifest: dict
+    :type filePath: str
+    """
+    tmpPath = filePath + ".tmp"
+    with open(tmpPath, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmpPath, filePath)
+
+
+def loadManifest(filePath):
+    with open(filePath) as f:
+        return json.load(f)
+
+
+def hashSegment(imagePath, offset, length, readAhead=READ_AHEAD):
+    """
+    Helper function to get the SHA-256 of a segment, read with os.pread so
+    the segments can be read in parallel.
+    :rtype: str
+    """
+    sha = hashlib.sha256()
+    fd = os.open(imagePath, os.O_RDONLY)
+    try:
+        pos, end = offset, offset + length
+        while pos < end:
+            chunk = os.pread(fd, min(readAhead, end - pos), pos)
+            if not chunk:
+                break
+            governor.throttle(len(chunk))
+            sha.update(chunk)
+            pos += len(chunk)
+    finally:
+        os.close(fd)
+    return sha.hexdigest()
+
+
+def verifyImage(imagePath, manifest, start=0, end=None, workers=WORKERS, onProgress=None):
+    """
+    Verify an image, or a region of it, against its manifest. The
+    segments are read and hashed in parallel.
+    :param imagePath: path of the disk image
+    :param manifest: manifest of hashImage
+    :param start: start of the region in bytes
+    :param end: end of the region in bytes, the end of the image if None
+    :param workers: number of segments read at the same time
+    :param onProgress: function called with the segments checked and the
+                       number of segments to check
+    :type imagePath: str
+    :type manifest: dict
+    :type start: int
+    :type end: int
+    :type workers: int
+    :type onProgress: function
+    :return result: Checked (number of segments), Changed (Segment,
+                    Offset and Length of each segment that changed),
+                    SizeChanged, Root (computed again when the whole image
+                    was checked, else None) and Match
+    :rtype result: dict
+    """
+    size = manifest["Size"]
+    segmentSize = manifest["SegmentSize"]
+    end = size if end is None else min(end, size)
+    first = start // segmentSize
+    last = -(-end // segmentSize)
+    whole = first == 0 and last == len(manifest["Segments"])
+
+    sizeChanged = os.path.getsize(imagePath) != size
+    segments = list(manifest["Segments"])
+    changed = []
+
+    with metrics.stage("verifyImage") as m, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for n in range(first, last):
+            offset = n * segmentSize
+            length = min(segmentSize, size - offset)
+            futures.append((n, offset, length, pool.submit(hashSegment, imagePath, offset, length)))
+
+        for checked, (n, offset, length, future) in enumerate(futures, 1):
+            segment = future.result()
+            if segment != manifest["Segments"][n]:
+                changed.append({"Segment": n, "Offset": offset, "Length": length})
+                segments[n] = segment
+            m["Bytes"] += length
+            if onProgress is not None:
+                onProgress(checked, len(futures))
+        m["Items"] = len(futures)
+
+    root = merkleRoot(segments) if whole else None
+    return {"Checked": last - first, "Changed": changed, "SizeChanged": sizeChanged, "Root": root,
+            "Match": not changed and not sizeChanged and (root is None or root == manifest["Root"])}
@@ -0,0 +1,195 @@
+"""
+Timing metrics for the stages of the PyCarver pipeline.
+
+Each stage (opening the disk image, carving a partition, running a tool,
+building a tree of files, ...) records how many times it ran, how long
+it took and how many bytes and items it processed. Gauges report values
+such as the depth of the queues. The metrics can be exported as a
+Prometheus text file or as JSON.
+
+Usage:
+    with metrics.stage("getFilesTree") as m:
+        dir = getFilesTree(out)
+        m["Items"] = len(dir)
+"""
+
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+class Metrics:
+    """ Registry of the timing metrics of every stage. """
+
+    def __init__(self):
+        # Stage name -> {"Calls", "Seconds", "Last", "Max", "Bytes", "Items"}
+        self.stages = {}
+
+        # Gauge name -> function returning the current value
+        self.gauges = {}
+
+        self.lock = threading.Lock()
+
+    def observe(self, name, seconds, bytes=0, items=0):
+        """
+        Record one run of a stage.
+        :param name: name of the stage
+        :param seconds: duration of the run
+        :param bytes: bytes processed by the run
+        :param items: items (files, rows, ...) processed by the run
+        :type name: str
+        :type seconds: float
+        :type bytes: int
+        :type items: int
+        """
+        with self.lock:
+            s = self.stages.get(name)
+            if s is None:
+                s = self.stages[name] = {"Calls": 0, "Seconds": 0.0, "Last": 0.0,
+                                         "Max": 0.0, "Bytes": 0, "Items": 0}
+            s["Calls"] += 1
+            s["Seconds"] += seconds
+            s["Last"] = seconds
+            s["Max"] = max(s["Max"], seconds)
+            s["Bytes"] += bytes
+            s["Items"] += items
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager to time a stage. The dictionary it yields can be
+        used to set the Bytes and Items processed.
+        :param name: name of the stage
+        :type name: str
+        """
+        counts = {"Bytes": 0, "Items": 0}
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            self.observe(name, time.perf_counter() - start, counts["Bytes"], counts["Items"])
+
+    def timed(self, name):
+        """
+        Decorator to time every call of a function as a stage.
+        :param name: name of the stage
+        :type name: str
+        """
+        def decorator(function):
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return function(*args, **kwargs)
+            wrapper.__name__ = function.__name__
+            wrapper.__doc__ = function.__doc__
+            return wrapper
+        return decorator
+
+    def gauge(self, name, function):
+        """
+        Register a gauge, a value read when the metrics are exported.
+        :param name: name of the gauge
+        :param function: function returning the current value
+        :type name: str
+        :type function: function
+        """
+        with self.lock:
+            self.gauges[name] = function
+
+    def snapshot(self):
+        """
+        Get the current value of every metric.
+        :return snapshot: stages with their derived rates, and gauges
+        :rtype snapshot: dict
+        """
+        with self.lock:
+            stages = {name: dict(s) for name, s in self.stages.items()}
+            gauges = dict(self.gauges)
+
+        for s in stages.values():
+            seconds = s["Seconds"]
+            s["Average"] = seconds / s["Calls"] if s["Calls"] else 0.0
+            s["MBps"] = s["Bytes"] / seconds / 1024 ** 2 if seconds else 0.0
+            s["ItemsPerSecond"] = s["Items"] / seconds if seconds else 0.0
+
+        values = {}
+        for name, function in gauges.items():
+            try:
+                values[name] = function()
+            except Exception:
+                values[name] = None
+
+        return {"Time": time.time(), "Stages": stages, "Gauges": values}
+
+    def toJson(self):
+        """
+        Export the metrics as JSON.
+        :rtype: str
+        """
+        return json.dumps(self.snapshot(), indent=2)
+
+    def toPrometheus(self):
+        """
+        Export the metrics in the Prometheus text format.
+        :rtype: str
+        """
+        snap = self.snapshot()
+        lines = []
+
+        counters = (("pycarver_stage_calls_total", "Calls", "Number of runs of the stage"),
+                    ("pycarver_stage_seconds_total", "Seconds", "Total seconds spent in the stage"),
+                    ("pycarver_stage_bytes_total", "Bytes", "Bytes processed by the stage"),
+                    ("pycarver_stage_items_total", "Items", "Items processed by the stage"))
+
+        for metric, key, help in counters:
+            lines.append("# HELP %s %s" % (metric, help))
+            lines.append("# TYPE %s counter" % metric)
+            for name in sorted(snap["Stages"]):
+                lines.append('%s{stage="%s"} %s' % (metric, escapeLabel(name), snap["Stages"][name][key]))
+
+        lines.append("# HELP pycarver_stage_max_seconds Longest run of the stage")
+        lines.append("# TYPE pycarver_stage_max_seconds gauge")
+        for name in sorted(snap["Stages"]):
+            lines.append('pycarver_stage_max_seconds{stage="%s"} %s' % (escapeLabel(name), snap["Stages"][name]["Max"]))
+
+        lines.append("# HELP pycarver_gauge Current value of a gauge")
+        lines.append("# TYPE pycarver_gauge gauge")
+        for name in sorted(snap["Gauges"]):
+            if snap["Gauges"][name] is not None:
+                lines.append('pycarver_gauge{name="%s"} %s' % (escapeLabel(name), snap["Gauges"][name]))
+
+        return "\n".join(lines) + "\n"
+
+    def export(self, filePath):
+        """
+        Write the metrics to a file. Files ending in .json are written as
+        JSON, any other file in the Prometheus text format.
+        :param filePath: path of the file
+        :type filePath: str
+        """
+        with open(filePath, "w") as fp:
+            if filePath.endswith(".json"):
+                fp.write(self.toJson())
+            else:
+                fp.write(self.toPrometheus())
+
+    def reset(self):
+        """
+        Forget the recorded stages. Gauges are kept.
+        """
+        with self.lock:
+            self.stages = {}
+
+
+def escapeLabel(value):
+    """
+    Helper function to escape the value of a Prometheus label.
+    :param value: the value
+    :type value: str
+    :rtype: str
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Metrics shared by all of PyCarver
+metrics = Metrics()
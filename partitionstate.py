@@ -0,0 +1,102 @@
+"""
+State of the partitions of the disk image open in PyCarver, shared by
+the window and the threads carving and recovering them.
+
+The carve threads used to write into the dictionaries of the partitions
+while the window read them, and every change was shown by going through
+all the rows of the tables to find the one of the partition. Here every
+change goes through update, under a lock, and is published to the
+listeners with the fields that changed. The window queues the ids and
+updates their rows in batches, on its own thread, through a mapping
+from partition id to row.
+
+The dictionaries can still be read directly (as listOfPartitions), but
+they are only written by PartitionStore.
+
+Usage:
+    store = PartitionStore()
+    store.subscribe(lambda i, fields: changed.put(i))
+    store.reset(partitions, Carved="No", Recovered="No", MD5Sum="")
+    store.update(2, Carved="Yes", Path="/cases/out/002")
+"""
+
+import threading
+
+
+class PartitionStore:
+    """ Thread-safe list of the partitions, publishing their changes. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.partitions = []
+        self.listeners = []
+
+    def __len__(self):
+        return len(self.partitions)
+
+    def __getitem__(self, i):
+        return self.partitions[i]
+
+    def reset(self, partitions, **defaults):
+        """
+        Replace the partitions, e.g. when a disk image is opened. The
+        listeners are not called: the tables are made again.
+        :param partitions: partitions of the image, from mmlsParser
+        :param defaults: fields set on every partition
+        :type partitions: list
+        """
+        for partition in partitions:
+            partition.update(defaults)
+        with self.lock:
+            self.partitions = partitions
+
+    def subscribe(self, listener):
+        """
+        Call a function on every change. It is called on the thread making
+        the change, so it should only queue the change.
+        :param listener: function called with the id of the partition and
+                         the fields that changed
+        :type listener: function
+        """
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self.listeners.remove(listener)
+
+    def update(self, i, **fields):
+        """
+        Change fields of a partition, from any thread. The listeners are
+        only called if a value changed.
+        :param i: id of the partition (its position in the list)
+        :param fields: new values of the fields
+        :type i: int
+        :return changed: the fields that changed
+        :rtype changed: dict
+        """
+        with self.lock:
+            partition = self.partitions[i]
+            changed = {k: v for k, v in fields.items() if partition.get(k) != v}
+            partition.update(changed)
+
+        if changed:
+            for listener in list(self.listeners):
+                listener(i, changed)
+        return changed
+
+    def snapshot(self, i):
+        """
+        Get a copy of a partition, consistent with the last update.
+        :type i: int
+        :rtype: dict
+        """
+        with self.lock:
+            return dict(self.partitions[i])
+
+    def find(self, key, value):
+        """
+        Get the ids of the partitions whose field has the given value.
+        :type key: str
+        :rtype: list
+        """
+        with self.lock:
+            return [i for i, p in enumerate(self.partitions) if p.get(key) == value]
@@ -0,0 +1,541 @@
+"""
+Single read of the evidence, shared by every analysis.
+
+Each tool used to read the same bytes again: dd to extract a partition,
+md5sum to hash it, Scalpel to scan it, the entropy map... Here one reader
+goes through the disk image once and every chunk is handed to the stages
+registered on the pipeline:
+    WriterStage:  writes a range of the image, e.g. a partition
+    HashStage:    MD5 / SHA-1 / SHA-256 of a range
+    SegmentStage: segment hashes and Merkle root of the image (see merkle)
+    EntropyStage: entropy map of a range (see entropy)
+    HeaderStage:  offsets of the file headers of a range, so the carver
+                  only reads the files (see carver)
+    KeywordStage: keyword and regex hits (see search)
+Each stage runs in its own thread and receives the chunks, shared and not
+copied, through a queue of depth chunks. A stage that falls behind fills
+its queue and blocks the reader, so the memory used stays within
+(depth + 2) chunks whatever the speed of the stages. The time spent by
+each stage is recorded as the metric "pipeline:<stage>", to see which
+one bounds the pass.
+
+Usage:
+    pipe = Pipeline(imagePath)
+    writer = pipe.add(WriterStage(partitionPath, offset, length))
+    md5 = pipe.add(HashStage(("md5",), offset, length))
+    pipe.run()
+    md5.result["md5"]
+"""
+
+import os
+import json
+import hashlib
+import threading
+from queue import Queue
+from time import perf_counter
+
+from metrics import metrics
+from governor import governor
+from evidenceio import EvidenceReader, READ_AHEAD, fadvise
+
+
+# Chunks queued for each stage
+DEPTH = 4
+
+
+class Stage:
+    """ Consumer of the chunks of a range of the evidence. """
+
+    name = "stage"
+
+    def __init__(self, offset=0, length=None):
+        """
+        :param offset: start of the range in the evidence
+        :param length: length of the range, by default up to the end
+        :type offset: int
+        :type length: int
+        """
+        self.offset = offset
+        self.length = length
+        self.result = None
+
+    def bind(self, size):
+        """
+        Helper function called with the size of the evidence before the
+        first chunk.
+        :type size: int
+        """
+        if self.length is None:
+            self.length = size - self.offset
+        self.length = max(0, min(self.length, size - self.offset))
+
+    def feed(self, chunkOffset, chunk):
+        """
+        Pass the part of a chunk of the evidence in the range to process.
+        :param chunkOffset: offset of the chunk in the evidence
+        :param chunk: content of the chunk
+        :type chunkOffset: int
+        :type chunk: bytes
+        """
+        start = max(chunkOffset, self.offset)
+        end = min(chunkOffset + len(chunk), self.offset + self.length)
+        if start < end:
+            self.process(start - self.offset, memoryview(chunk)[start - chunkOffset:end - chunkOffset])
+
+    def process(self, pos, data):
+        """
+        Process the next bytes of the range.
+        :param pos: offset of data in the range
+        :param data: the bytes, in order
+        :type pos: int
+        :type data: memoryview
+        """
+        raise NotImplementedError
+
+    def finish(self):
+        """
+        Called after the last chunk.
+        :return result: result of the stage, kept in self.result
+        """
+        return None
+
+
+class WriterStage(Stage):
+    """ Write a range of the evidence to a file, e.g. a partition. """
+
+    name = "writer"
+
+    # Written pages are dropped from the cache every SYNC_BYTES
+    SYNC_BYTES = 512 * 1024 * 1024
+
+    def __init__(self, outPath, offset=0, length=None, dropPages=True):
+        """
+        :param outPath: path of the file to write
+        :param dropPages: drop the written pages from the cache
+        :type outPath: str
+        :type dropPages: bool
+        """
+        Stage.__init__(self, offset, length)
+        self.outPath = outPath
+        self.dropPages = dropPages
+        self.out = open(outPath, "wb")
+        self.written = 0
+
+    def process(self, pos, data):
+        self.out.write(data)
+        self.written += len(data)
+        if self.dropPages and self.written % self.SYNC_BYTES < len(data):
+            self.sync()
+
+    def sync(self):
+        # Written pages can only be dropped once on disk
+        self.out.flush()
+        os.fdatasync(self.out.fileno())
+        fadvise(self.out.fileno(), 0, self.written, "POSIX_FADV_DONTNEED")
+
+    def finish(self):
+        try:
+            if self.dropPages:
+                self.sync()
+        finally:
+            self.out.close()
+        return {"Path": self.outPath, "Bytes": self.written}
+
+
+class HashStage(Stage):
+    """ Digests of a range of the evidence. """
+
+    name = "hash"
+
+    def __init__(self, algorithms=("md5",), offset=0, length=None):
+        """
+        :param algorithms: names of hashlib algorithms
+        :type algorithms: tuple
+        """
+        Stage.__init__(self, offset, length)
+        self.hashes = {a: hashlib.new(a) for a in algorithms}
+
+    def process(self, pos, data):
+        for h in self.hashes.values():
+            h.update(data)
+
+    def finish(self):
+        return {a: h.hexdigest() for a, h in self.hashes.items()}
+
+
+class SegmentStage(Stage):
+    """ SHA-256 of the segments of the evidence and their Merkle root. """
+
+    name = "segments"
+
+    def __init__(self, segmentSize=None):
+        """
+        :param segmentSize: size of the segments, merkle.SEGMENT_SIZE by
+                            default
+        :type segmentSize: int
+        """
+        from merkle import SEGMENT_SIZE
+
+        Stage.__init__(self)
+        self.segmentSize = segmentSize or SEGMENT_SIZE
+        self.segments = []
+        self.sha = hashlib.sha256()
+        self.filled = 0
+
+    def process(self, pos, data):
+        while data:
+            piece = data[:self.segmentSize - self.filled]
+            self.sha.update(piece)
+            self.filled += len(piece)
+            data = data[len(piece):]
+            if self.filled == self.segmentSize:
+                self.segments.append(self.sha.hexdigest())
+                self.sha = hashlib.sha256()
+                self.filled = 0
+
+    def finish(self):
+        from merkle import merkleRoot
+
+        if self.filled:
+            self.segments.append(self.sha.hexdigest())
+        return {"Size": self.length, "SegmentSize": self.segmentSize, "Segments": self.segments,
+                "Root": merkleRoot(self.segments)}
+
+
+class EntropyStage(Stage):
+    """
+    Entropy map of a range of the evidence. The map starts at offset 0, as
+    the map of the extracted range (e.g. the partition file) would.
+    """
+
+    name = "entropy"
+
+    def __init__(self, offset=0, length=None, blockSize=None, mapPath=None):
+        """
+        :param blockSize: size of a block, entropy.BLOCK_SIZE by default
+        :param mapPath: path where the map is saved, if given
+        :type blockSize: int
+        :type mapPath: str
+        """
+        import entropy
+
+        Stage.__init__(self, offset, length)
+        self.entropy = entropy
+        self.blockSize = blockSize or entropy.BLOCK_SIZE
+        self.mapPath = mapPath
+        self.emap = None
+        self.carry = b""
+
+    def process(self, pos, data):
+        if self.emap is None:
+            self.emap = self.entropy.EntropyMap(self.blockSize, 0, self.length)
+
+        # A block across two chunks is joined first
+        if self.carry:
+            need = self.blockSize - len(self.carry)
+            self.carry += bytes(data[:need])
+            data = data[need:]
+            if len(self.carry) < self.blockSize:
+                return
+            self.emap.add(*self.entropy.blockStats(self.carry))
+            self.carry = b""
+
+        full = len(data) - len(data) % self.blockSize
+        if self.entropy.numpy is not None and full:
+            for e, cls in zip(*self.entropy.chunkStats(data[:full], self.blockSize)):
+                self.emap.add(e, cls)
+        else:
+            for p in range(0, full, self.blockSize):
+                self.emap.add(*self.entropy.blockStats(data[p:p + self.blockSize]))
+        self.carry = bytes(data[full:])
+
+    def finish(self):
+        if self.emap is None:
+            self.emap = self.entropy.EntropyMap(self.blockSize, 0, self.length)
+        if self.carry:
+            self.emap.add(*self.entropy.blockStats(self.carry))
+        if self.mapPath:
+            self.emap.save(self.mapPath)
+        return self.emap
+
+
+class HeaderStage(Stage):
+    """
+    Offsets of the file headers of a range of the evidence, with the group
+    of every type matching at each offset (see signatures.groupName). The
+    offsets are relative to the start of the range, as in the extracted
+    partition.
+    """
+
+    name = "headers"
+
+    def __init__(self, fileTypes, offset=0, length=None, signatures=None, headersPath=None):
+        """
+        :param fileTypes: types of files
+        :param signatures: signature registry, by default loadSignatures()
+        :param headersPath: path where the headers are saved, if given
+                            (see loadHeaders)
+        :type fileTypes: list
+        :type signatures: SignatureDB
+        :type headersPath: str
+        """
+        from carver import HEADER_MARGIN
+        from signatures import loadSignatures, groupName
+
+        Stage.__init__(self, offset, length)
+        signatures = signatures or loadSignatures()
+        self.fileTypes = [t for t in fileTypes if t in signatures.types()]
+        self.pattern = signatures.matcher(self.fileTypes) if self.fileTypes else None
+        self.typePatterns = [(groupName(t), signatures.matcher([t])) for t in self.fileTypes]
+        self.margin = HEADER_MARGIN
+        self.headersPath = headersPath
+        self.headers = []
+        self.carry = b""
+        self.carryStart = 0
+
+    def scan(self, buf, bufStart, limit):
+        """
+        Helper function to find the headers starting before limit in buf.
+        """
+        pos = 0
+        while True:
+            match = self.pattern.search(buf, pos)
+            if match is None or match.start() >= limit:
+                return
+            start = match.start()
+            for group, pattern in self.typePatterns:
+                if pattern.match(buf, start):
+                    self.headers.append((bufStart + start, group))
+            pos = start + 1
+
+    def process(self, pos, data):
+        if self.pattern is None:
+            return
+        # A short chunk (the last one) is kept with the carry
+        if len(data) <= self.margin:
+            if not self.carry:
+                self.carryStart = pos
+            self.carry += bytes(data)
+            return
+        # The last bytes of the previous chunk are kept to match a header
+        # across two chunks: they are searched with the head of this one
+        if self.carry:
+            self.scan(self.carry + bytes(data[:self.margin]), self.carryStart, len(self.carry))
+        limit = len(data) - self.margin
+        self.scan(data, pos, limit)
+        self.carry = bytes(data[limit:])
+        self.carryStart = pos + limit
+
+    def finish(self):
+        if self.pattern is not None and self.carry:
+            self.scan(self.carry, self.carryStart, len(self.carry))
+        if self.headersPath:
+            with open(self.headersPath, "w") as f:
+                json.dump({"Size": self.length, "Types": self.fileTypes, "Headers": self.headers}, f)
+        return self.headers
+
+
+def loadHeaders(headersPath, size, fileTypes):
+    """
+    Read the headers saved by a HeaderStage, if they were found for a
+    range of this size and for all the given types.
+    :param headersPath: path of the headers file
+    :param size: size of the partition
+    :param fileTypes: types of files to carve
+    :type headersPath: str
+    :type size: int
+    :type fileTypes: list
+    :return headers: list of (offset, group), or None
+    :rtype headers: list
+    """
+    try:
+        with open(headersPath) as f:
+            saved = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if saved.get("Size") != size or not set(fileTypes) <= set(saved.get("Types", [])):
+        return None
+    return [tuple(h) for h in saved["Headers"]]
+
+
+class KeywordStage(Stage):
+    """ Keyword and regex hits of a range of the evidence. """
+
+    name = "keywords"
+
+    def __init__(self, keywords, regexes=(), ignoreCase=True, offset=0, length=None, onHits=None):
+        """
+        :param keywords: literal keywords
+        :param regexes: regular expressions
+        :param ignoreCase: search without case
+        :param onHits: function called with the hits of each chunk, as
+                       (offset in the evidence, term, encoding, context)
+        :type keywords: list
+        :type regexes: list
+        :type ignoreCase: bool
+        :type onHits: function
+        """
+        from search import compileTerms, OVERLAP, CONTEXT
+
+        Stage.__init__(self, offset, length)
+        self.keywords, self.regexes = tuple(k for k in keywords if k), tuple(r for r in regexes if r)
+        self.ignoreCase = ignoreCase
+        # Checking the regexes before the pass
+        compileTerms(self.keywords, self.regexes, ignoreCase)
+        self.overlap, self.context = OVERLAP, CONTEXT
+        self.onHits = onHits
+        self.count = 0
+        self.carry = b""
+        self.carryStart = 0
+        self.next = 0
+
+    def scan(self, buf, bufStart, last):
+        """
+        Helper function to pass on the hits of buf starting from next to
+        last.
+        """
+        from search import scanBuffer
+
+        first = self.next - bufStart
+        if last > first:
+            hits = scanBuffer(buf, self.offset + bufStart, first, last, len(buf), self.keywords, self.regexes,
+                              self.ignoreCase, self.context)
+            self.count += len(hits)
+            if hits and self.onHits is not None:
+                self.onHits(hits)
+            self.next = bufStart + last
+
+    def process(self, pos, data):
+        head = self.context + self.overlap
+        # A short chunk (the last one) is kept with the carry
+        if len(data) <= head:
+            if not self.carry:
+                self.carryStart = pos
+            self.carry += bytes(data)
+            return
+        # The last bytes of the previous chunk are kept to match a hit
+        # across two chunks and for the context of the hits at the start
+        # of this one: the hits starting there are searched with the head
+        # of this chunk, the others in the chunk itself
+        if self.carry:
+            self.scan(self.carry + bytes(data[:head]), self.carryStart, len(self.carry) + self.context)
+        self.scan(data, pos, len(data) - self.overlap)
+        keep = len(data) - head
+        self.carry, self.carryStart = bytes(data[keep:]), pos + keep
+
+    def finish(self):
+        if self.carry:
+            self.scan(self.carry, self.carryStart, len(self.carry))
+        return self.count
+
+
+class Pipeline:
+    """ One sequential read of a file, fanned out to the stages. """
+
+    def __init__(self, filePath, mode="fadvise", readAhead=READ_AHEAD, depth=DEPTH):
+        """
+        :param filePath: path of the disk image
+        :param mode: one of the MODES of evidenceio
+        :param readAhead: size of each read
+        :param depth: chunks queued for each stage
+        :type filePath: str
+        :type mode: str
+        :type readAhead: int
+        :type depth: int
+        """
+        self.filePath = filePath
+        self.mode = mode
+        self.readAhead = readAhead
+        self.depth = depth
+        self.stages = []
+
+    def add(self, stage):
+        """
+        Register a stage.
+        :type stage: Stage
+        :return stage: the same stage, to read its result after run
+        :rtype stage: Stage
+        """
+        self.stages.append(stage)
+        return stage
+
+    def consume(self, stage, chunks, errors):
+        """
+        Helper function running a stage in its thread. After an error the
+        chunks are still taken, so the reader is not blocked.
+        """
+        busy = 0.0
+        while True:
+            item = chunks.get()
+            if item is None:
+                break
+            if errors:
+                continue
+            start = perf_counter()
+            try:
+                stage.feed(*item)
+            except Exception as err:
+                errors.append(err)
+            busy += perf_counter() - start
+
+        start = perf_counter()
+        try:
+            stage.result = stage.finish()
+        except Exception as err:
+            errors.append(err)
+        metrics.observe("pipeline:" + stage.name, busy + perf_counter() - start, bytes=stage.length)
+
+    def run(self, onProgress=None):
+        """
+        Read the file once and feed every stage. Only the span covering
+        the ranges of the stages is read.
+        :param onProgress: function called with the bytes read and the
+                           length of the span
+        :type onProgress: function
+        :return done: number of bytes read
+        :rtype done: int
+        """
+        size = os.path.getsize(self.filePath)
+        for stage in self.stages:
+            stage.bind(size)
+        first = min([stage.offset for stage in self.stages] or [0])
+        last = max([stage.offset + stage.length for stage in self.stages] or [0])
+        span = max(0, last - first)
+
+        errors = []
+        queues = [Queue(maxsize=self.depth) for stage in self.stages]
+        threads = [threading.Thread(target=self.consume, args=(stage, q, errors), daemon=True)
+                   for stage, q in zip(self.stages, queues)]
+        for thread in threads:
+            thread.start()
+
+        done = 0
+        # The chunks queued, the one read and the ones being processed, and
+        # the buffers of the reader, in one reservation: two pipelines
+        # holding a first one could wait for each other's second one
+        with metrics.stage("pipeline") as m:
+            try:
+                with EvidenceReader(self.filePath, self.mode, self.readAhead) as reader, \
+                        governor.reserve(self.readAhead * (self.depth + 2) + reader.memory(),
+                                         "pipeline of " + self.filePath):
+                    for chunk in reader.read(first, span, reserved=True):
+                        # A full queue blocks the reader: back-pressure
+                        for q in queues:
+                            q.put((first + done, chunk))
+                        done += len(chunk)
+                        m["Bytes"] = done
+                        if errors:
+                            break
+                        if onProgress is not None:
+                            onProgress(done, span)
+            finally:
+                for q in queues:
+                    q.put(None)
+                for thread in threads:
+                    thread.join()
+
+        if errors:
+            raise errors[0]
+        if done != span:
+            raise IOError("Could only read %d of the %d bytes of %s" % (done, span, self.filePath))
+        return done
@@ -0,0 +1,414 @@
+"""
+Keyword and regular expression search of disk images and partitions.
+
+Many literal keywords and regexes are searched in one pass. The file is
+cut in chunks that are scanned by a pool of processes, each mapping only
+its chunk (and an overlap past its end, so a hit across the boundary is
+found by the chunk where it starts) with mmap. Every term is searched as
+    ascii:    the bytes of the term (UTF-8 for other characters)
+    utf-16le: the term in UTF-16LE, as written by Windows
+The keywords of both encodings are joined in one regex, run on the chunk
+in lower case. The regexes run on the raw bytes for ascii, and on the
+even and odd bytes of the chunk, where the other bytes are zeros, for
+utf-16le.
+
+The hits (offset, term, encoding and the bytes around it) are stored in
+a SQLite index with the partition of the disk image they fall in.
+
+Usage:
+    index = HitIndex(path.join(outFolder, "hits.sqlite"))
+    searchFile(imagePath, ["invoice", "password"], [r"\\d{4}-\\d{4}-\\d{4}-\\d{4}"],
+               onHits=lambda hits: index.addHits(imagePath, hits, partitions, bs))
+"""
+
+import re
+import mmap
+import bisect
+import sqlite3
+import threading
+from os import path, cpu_count
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from metrics import metrics
+from governor import governor
+
+
+CHUNK_SIZE = 64 * 1024 * 1024
+
+# Longest hit found across the end of a chunk
+OVERLAP = 4096
+
+# Bytes shown before and after a hit
+CONTEXT = 32
+
+ENCODINGS = ("ascii", "utf-16le")
+
+@lru_cache(maxsize=16)
+def compileTerms(keywords, regexes, ignoreCase):
+    """
+    Helper function to compile the terms once per process.
+    :param keywords: literal keywords
+    :param regexes: regular expressions
+    :param ignoreCase: search without case
+    :type keywords: tuple
+    :type regexes: tuple
+    :type ignoreCase: bool
+    :return literals: regex of all the keywords in every encoding, or None
+    :return encoded: list of (bytes, keyword, encoding), lower case when
+                     ignoreCase
+    :return compiled: list of the compiled regexes
+    :rtype literals: re.Pattern
+    :rtype encoded: list
+    :rtype compiled: list
+    """
+    encoded = []
+    for keyword in keywords:
+        for encoding in ENCODINGS:
+            term = keyword.lower() if ignoreCase else keyword
+            encoded.append((term.encode("utf-8" if encoding == "ascii" else encoding), keyword, encoding))
+
+    # The longest first, when two start at the same offset
+    encoded.sort(key=lambda e: -len(e[0]))
+    literals = re.compile(b"|".join(re.escape(e[0]) for e in encoded)) if encoded else None
+
+    flags = re.IGNORECASE if ignoreCase else 0
+    compiled = [re.compile(regex.encode("utf-8"), flags) for regex in regexes]
+    return literals, encoded, compiled
+
+
+def contextOf(data, start, end, size=CONTEXT):
+    """
+    Helper function to get the bytes around a hit as printable text.
+    :param data: content of the chunk
+    :param start: start of the hit in data
+    :param end: end of the hit in data
+    :param size: bytes before and after the hit
+    :type data: mmap
+    :type start: int
+    :type end: int
+    :type size: int
+    :rtype: str
+    """
+    raw = data[max(0, start - size):end + size]
+    return "".join(chr(b) if 32 <= b < 127 else "." for b in raw)
+
+
+def scanChunk(filePath, start, end, keywords, regexes, ignoreCase=True, overlap=OVERLAP, context=CONTEXT):
+    """
+    Search a chunk of a file, in a worker process. Only the hits starting
+    before end are kept: the others belong to the next chunk.
+    :param filePath: path of the disk image or partition
+    :param start: start of the chunk
+    :param end: end of the chunk
+    :param keywords: literal keywords
+    :param regexes: regular expressions
+    :param ignoreCase: search without case
+    :param overlap: bytes read past the end of the chunk
+    :param context: bytes kept before and after each hit
+    :type filePath: str
+    :type start: int
+    :type end: int
+    :type keywords: tuple
+    :type regexes: tuple
+    :type ignoreCase: bool
+    :type overlap: int
+    :type context: int
+    :return hits: list of (offset, term, encoding, context)
+    :rtype hits: list
+    """
+    size = path.getsize(filePath)
+    base = start - start % mmap.ALLOCATIONGRANULARITY
+    length = min(end + overlap, size) - base
+    if length <= 0:
+        return []
+
+    with open(filePath, "rb") as fp, mmap.mmap(fp.fileno(), length, offset=base, access=mmap.ACCESS_READ) as data:
+        if hasattr(data, "madvise"):
+            data.madvise(mmap.MADV_SEQUENTIAL)
+        return scanBuffer(data, base, start - base, end - base, length, keywords, regexes, ignoreCase, context)
+
+
+def scanBuffer(data, base, first, last, stop, keywords, regexes, ignoreCase=True, context=CONTEXT):
+    """
+    Search data for the hits starting between first and last. The bytes
+    up to stop can be read to match a hit starting before last.
+    :param data: bytes, a mapped chunk of the file or a memoryview
+    :param base: offset of data in the file
+    :param first: start of the hits to keep, in data
+    :param last: end of the hits to keep, in data
+    :param stop: end of the bytes of data that can be read
+    :param keywords: literal keywords
+    :param regexes: regular expressions
+    :param ignoreCase: search without case
+    :param context: bytes kept before and after each hit
+    :type data: bytes
+    :type base: int
+    :type first: int
+    :type last: int
+    :type stop: int
+    :type keywords: tuple
+    :type regexes: tuple
+    :type ignoreCase: bool
+    :type context: int
+    :return hits: list of (offset, term, encoding, context), sorted
+    :rtype hits: list
+    """
+    literals, encoded, compiled = compileTerms(keywords, regexes, ignoreCase)
+    hits = []
+
+    if literals is not None:
+        # Lower case once, instead of a case insensitive regex that
+        # is ten times slower
+        text = bytes(data).lower() if ignoreCase else data
+        for match in literals.finditer(text, first, stop):
+            if match.start() >= last:
+                break
+            # Keywords starting inside the match, e.g. "word" in
+            # "password", are checked here as finditer skips them
+            for pos in range(match.start(), match.end()):
+                for term, keyword, encoding in encoded:
+                    if pos < last and text[pos:pos + len(term)] == term:
+                        hits.append((base + pos, keyword, encoding,
+                                     contextOf(data, pos, pos + len(term), context)))
+
+    for regex in compiled:
+        pattern = regex.pattern.decode("utf-8")
+        for match in regex.finditer(data, first, stop):
+            if match.start() >= last:
+                break
+            hits.append((base + match.start(), pattern, "ascii",
+                         contextOf(data, match.start(), match.end(), context)))
+
+    # UTF-16LE: the regexes run on the even and on the odd bytes, and
+    # the matches are kept where the other bytes are zeros
+    for half in (0, 1) if compiled else ():
+        narrow = bytes(data[first + half:stop:2])
+        for regex in compiled:
+            pattern = regex.pattern.decode("utf-8")
+            for match in regex.finditer(narrow):
+                hitStart = first + half + 2 * match.start()
+                hitEnd = first + half + 2 * match.end()
+                if hitStart >= last:
+                    break
+                if match.end() > match.start() and not bytes(data[hitStart + 1:hitEnd:2]).strip(b"\x00"):
+                    hits.append((base + hitStart, pattern, "utf-16le", contextOf(data, hitStart, hitEnd, context)))
+
+    return sorted(set(hits))
+
+
+def searchFile(filePath, keywords, regexes=(), ignoreCase=True, offset=0, length=None, chunkSize=CHUNK_SIZE,
+               overlap=OVERLAP, workers=None, onHits=None):
+    """
+    Search a range of a file with a pool of processes. At most two chunks
+    per process are queued, so any size of file can be searched.
+    :param filePath: path of the disk image or partition
+    :param keywords: literal keywords
+    :param regexes: regular expressions
+    :param ignoreCase: search without case
+    :param offset: start of the range
+    :param length: length of the range, by default up to the end
+    :param chunkSize: bytes searched by each task
+    :param overlap: longest hit found across the end of a chunk
+    :param workers: number of processes, by default one per CPU
+    :param onHits: function called with the hits of each chunk, in the
+                   order the chunks finish
+    :type filePath: str
+    :type keywords: list
+    :type regexes: list
+    :type ignoreCase: bool
+    :type offset: int
+    :type length: int
+    :type chunkSize: int
+    :type overlap: int
+    :type workers: int
+    :type onHits: function
+    :return count: number of hits
+    :rtype count: int
+    """
+    keywords, regexes = tuple(k for k in keywords if k), tuple(r for r in regexes if r)
+    if not keywords and not regexes:
+        return 0
+    # Checking the regexes before starting the processes
+    compileTerms(keywords, regexes, ignoreCase)
+
+    if length is None:
+        length = path.getsize(filePath) - offset
+    end = offset + length
+    workers = workers or cpu_count() or 1
+
+    # Each process holds a copy of its chunk (in lower case, or the even
+    # and odd bytes) next to the mapped pages
+    count = 0
+    with metrics.stage("search") as m, ProcessPoolExecutor(max_workers=workers) as pool, \
+            governor.reserve(2 * chunkSize * workers, "search of " + filePath):
+        pending = set()
+        for start in range(offset, end, chunkSize):
+            governor.throttle(min(chunkSize, end - start))
+            pending.add(pool.submit(scanChunk, filePath, start, min(start + chunkSize, end), keywords, regexes,
+                                    ignoreCase, overlap))
+            m["Bytes"] += min(chunkSize, end - start)
+
+            while len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                count += handleHits(done, onHits)
+
+        count += handleHits(pending, onHits)
+        m["Items"] = count
+    return count
+
+
+def handleHits(futures, onHits):
+    """
+    Helper function of searchFile: pass the hits of finished chunks on.
+    :param futures: futures of scanChunk
+    :param onHits: function called with the hits of each chunk
+    :type futures: iterable
+    :type onHits: function
+    :return count: number of hits
+    :rtype count: int
+    """
+    count = 0
+    for future in futures:
+        hits = future.result()
+        count += len(hits)
+        if onHits is not None and hits:
+            onHits(hits)
+    return count
+
+
+def partitionOf(offset, partitions, bs, starts=None):
+    """
+    Get the partition of a disk image holding an offset.
+    :param offset: offset in the disk image
+    :param partitions: partitions from mmlsParser
+    :param bs: block size of the image, from mmlsParser
+    :param starts: sorted list of (start, index) of partitionStarts,
+                   to avoid sorting it for each offset
+    :type offset: int
+    :type partitions: list
+    :type bs: str
+    :type starts: list
+    :return index: position of the partition, or None
+    :rtype index: int
+    """
+    if starts is None:
+        starts = partitionStarts(partitions, bs)
+    n = bisect.bisect_right(starts, (offset, len(partitions))) - 1
+    # Partitions may be nested (extended partitions): the innermost one
+    # starting before offset that contains it
+    while n >= 0:
+        start, i = starts[n]
+        if offset < (int(partitions[i]["End"]) + 1) * int(bs):
+            return i
+        n -= 1
+    return None
+
+
+def partitionStarts(partitions, bs):
+    """
+    Helper function to sort the partitions by their first byte, leaving
+    out the partition tables.
+    :rtype: list
+    """
+    return sorted((int(p["Start"]) * int(bs), i) for i, p in enumerate(partitions) if p["Slot"] != "Meta")
+
+
+class HitIndex:
+    """ SQLite index of the hits of the searches. """
+
+    def __init__(self, dbPath=":memory:"):
+        """
+        :param dbPath: path of the database, in memory by default
+        :type dbPath: str
+        """
+        self.dbPath = dbPath
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(dbPath, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS hits (id INTEGER PRIMARY KEY, source TEXT, offset INTEGER, "
+                        "term TEXT, encoding TEXT, context TEXT, partition TEXT, partitionOffset INTEGER)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS hits_term ON hits (term)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS hits_offset ON hits (source, offset)")
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def clear(self, source):
+        """
+        Remove the hits of a file, before it is searched again.
+        :param source: path of the disk image or partition
+        :type source: str
+        """
+        with self.lock:
+            self.db.execute("DELETE FROM hits WHERE source = ?", (source,))
+            self.db.commit()
+
+    def addHits(self, source, hits, partitions=None, bs=None, partition=None):
+        """
+        Add hits of scanChunk. The partition of each hit is found from the
+        partitions of the disk image, or given when a partition was
+        searched.
+        :param source: path of the disk image or partition searched
+        :param hits: list of (offset, term, encoding, context)
+        :param partitions: partitions of the disk image, from mmlsParser
+        :param bs: block size of the disk image
+        :param partition: name of the partition searched
+        :type source: str
+        :type hits: list
+        :type partitions: list
+        :type bs: str
+        :type partition: str
+        """
+        rows = []
+        starts = partitionStarts(partitions, bs) if partitions else None
+        for offset, term, encoding, context in hits:
+            name, partOffset = partition, offset if partition else None
+            if starts:
+                i = partitionOf(offset, partitions, bs, starts)
+                if i is not None:
+                    name = partitions[i]["Name"]
+                    partOffset = offset - int(partitions[i]["Start"]) * int(bs)
+            rows.append((source, offset, term, encoding, context, name, partOffset))
+
+        with self.lock:
+            self.db.executemany("INSERT INTO hits (source, offset, term, encoding, context, partition, "
+                                "partitionOffset) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.db.commit()
+
+    def search(self, term=None, partition=None, limit=None):
+        """
+        Get the hits of a term and/or partition, by offset.
+        :type term: str
+        :type partition: str
+        :type limit: int
+        :return hits: dictionaries with Source, Offset, Term, Encoding,
+                      Context, Partition and PartitionOffset
+        :rtype hits: list
+        """
+        where, params = [], []
+        for clause, value in (("term = ?", term), ("partition = ?", partition)):
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        query = "SELECT source, offset, term, encoding, context, partition, partitionOffset FROM hits"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY source, offset"
+        if limit:
+            query += " LIMIT %d" % limit
+
+        with self.lock:
+            rows = self.db.execute(query, params).fetchall()
+        return [dict(zip(("Source", "Offset", "Term", "Encoding", "Context", "Partition", "PartitionOffset"), r))
+                for r in rows]
+
+    def terms(self):
+        """
+        Get the number of hits of each term.
+        :return counts: term -> number of hits
+        :rtype counts: dict
+        """
+        with self.lock:
+            return dict(self.db.execute("SELECT term, COUNT(*) FROM hits GROUP BY term").fetchall())
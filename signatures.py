@@ -0,0 +1,374 @@
+"""
+Registry of the file signatures used to carve files.
+
+The signatures are read, in this order, from the defaults of PyCarver,
+the configuration of Scalpel (/etc/scalpel/scalpel.conf, where the rules
+are commented out) and the file of the user (~/.pycarver/signatures.conf).
+A type defined in a file replaces the rules of that type read before.
+Every file uses the format of Scalpel:
+
+    extension  case-sensitive(y/n)  max-size  header  [footer]  [REVERSE|NEXT]
+
+The rules are parsed once and cached on disk until one of the files
+changes. The registry writes the Scalpel configuration of each job in a
+private temporary folder and compiles the headers into a matcher used by
+the built-in carver. Types are selected by their exact extension.
+"""
+
+import re
+import json
+import shutil
+import tempfile
+import threading
+from os import path, makedirs, stat, replace
+
+
+# Signatures used when no other file defines the type
+DEFAULT_SIGNATURES = r"""
+jpg     y   20000000    \xff\xd8\xff            \xff\xd9
+png     y   20000000    \x89PNG\x0d\x0a\x1a\x0a IEND\xae\x42\x60\x82
+gif     y   5000000     GIF87a                  \x00\x3b
+gif     y   5000000     GIF89a                  \x00\x3b
+pdf     y   50000000    %PDF-                   %EOF    REVERSE
+"""
+
+SCALPEL_CONF = "/etc/scalpel/scalpel.conf"
+USER_SIGNATURES = path.join(path.expanduser("~"), ".pycarver", "signatures.conf")
+CACHE_PATH = path.join(path.expanduser("~"), ".cache", "pycarver", "signatures.json")
+
+ESCAPES = {"n": b"\n", "r": b"\r", "t": b"\t", "s": b" ", "\\": b"\\", "v": b"\v", "a": b"\a"}
+
+
+def parseBytes(text):
+    """
+    Helper function to convert a header or footer of the Scalpel format
+    to bytes. "?" is a wildcard, its positions are returned in the mask.
+    :param text: header or footer
+    :type text: str
+    :return value: the bytes (wildcards are "?")
+    :return mask: list of positions of the wildcards
+    :rtype value: bytes
+    :rtype mask: list
+    """
+    value = b""
+    mask = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c == "\\" and i + 1 < len(text):
+            n = text[i + 1]
+            if n == "x":
+                value += bytes([int(text[i + 2:i + 4], 16)])
+                i += 4
+                continue
+            if n in ESCAPES:
+                value += ESCAPES[n]
+                i += 2
+                continue
+            if n.isdigit():
+                value += bytes([int(text[i + 1:i + 4], 8)])
+                i += 4
+                continue
+            value += n.encode("latin-1")
+            i += 2
+            continue
+        if c == "?":
+            mask.append(len(value))
+        value += c.encode("latin-1")
+        i += 1
+    return value, mask
+
+
+def parseRule(line):
+    """
+    Parse one line of a signatures file.
+    :param line: the line, without the comment character
+    :type line: str
+    :return rule: the rule or None if the line is not a rule
+    :rtype rule: dict
+    """
+    fields = line.split()
+    if len(fields) < 4 or fields[1].lower() not in ("y", "n") or not fields[2].isdigit():
+        return None
+
+    try:
+        header, headerMask = parseBytes(fields[3])
+        footer, footerMask = parseBytes(fields[4]) if len(fields) > 4 and \
+                                                      fields[4] not in ("REVERSE", "NEXT") else (b"", [])
+    except ValueError:
+        return None
+
+    mode = ""
+    if fields[-1] in ("REVERSE", "NEXT"):
+        mode = fields[-1]
+
+    return {"Type": fields[0], "CaseSensitive": fields[1].lower() == "y", "MaxSize": int(fields[2]),
+            "Header": header.hex(), "HeaderMask": headerMask,
+            "Footer": footer.hex(), "FooterMask": footerMask, "Mode": mode,
+            "Line": " ".join(fields)}
+
+
+def parseRules(text, commented=False):
+    """
+    Parse the rules of a signatures file.
+    :param text: content of the file
+    :param commented: also read the rules that are commented out
+    :type text: str
+    :type commented: bool
+    :return rules: list of rules
+    :rtype rules: list
+    """
+    rules = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#"):
+            if not commented:
+                continue
+            line = line.lstrip("#")
+        rule = parseRule(line)
+        if rule is not None:
+            rules.append(rule)
+    return rules
+
+
+def bytesPattern(value, mask, caseSensitive):
+    """
+    Helper function to build the regular expression of a header.
+    :param value: bytes of the header
+    :param mask: positions of the wildcards
+    :param caseSensitive: False to match letters in any case
+    :type value: bytes
+    :type mask: list
+    :type caseSensitive: bool
+    :rtype: bytes
+    """
+    out = b""
+    for i in range(len(value)):
+        if i in mask:
+            out += b"."
+            continue
+        c = value[i:i + 1]
+        if not caseSensitive and c.isalpha():
+            out += b"[" + re.escape(c.lower()) + re.escape(c.upper()) + b"]"
+        else:
+            out += re.escape(c)
+    return out
+
+
+def groupName(fileType):
+    """
+    Helper function to get the name of the group of a type in a matcher.
+    :param fileType: type of file
+    :type fileType: str
+    :rtype: str
+    """
+    return re.sub(r"\W", "_", "t_" + fileType)
+
+
+class SignatureDB:
+    """ The rules of every type and the matchers compiled from them. """
+
+    def __init__(self, rules):
+        """
+        :param rules: list of rules, as returned by parseRules
+        :type rules: list
+        """
+        self.rules = rules
+        self.matchers = {}
+        self.groups = {groupName(t): t for t in self.types()}
+        self.lock = threading.Lock()
+
+    def types(self, source=None):
+        """
+        Get the types that have at least one rule.
+        :param source: only the types read from this file
+        :type source: str
+        :rtype: list
+        """
+        seen = []
+        for rule in self.rules:
+            if rule["Type"] not in seen and source in (None, rule.get("Source")):
+                seen.append(rule["Type"])
+        return seen
+
+    def select(self, fileTypes):
+        """
+        Get the rules of the given types. A type only matches its own
+        extension, "jpg" does not select "jpeg".
+        :param fileTypes: types of files
+        :type fileTypes: list
+        :rtype: list
+        """
+        return [r for r in self.rules if r["Type"] in fileTypes]
+
+    def maxSize(self, fileType):
+        """
+        Get the maximum size of a type.
+        :param fileType: type of file
+        :type fileType: str
+        :rtype: int
+        """
+        return max([r["MaxSize"] for r in self.rules if r["Type"] == fileType] or [0])
+
+    def footers(self, fileType):
+        """
+        Get the footers of a type with their mode.
+        :param fileType: type of file
+        :type fileType: str
+        :return footers: list of (footer, mode)
+        :rtype footers: list
+        """
+        return [(bytes.fromhex(r["Footer"]), r["Mode"]) for r in self.rules
+                if r["Type"] == fileType and r["Footer"]]
+
+    def matcher(self, fileTypes):
+        """
+        Get the compiled regular expression matching the headers of the
+        given types, with one group per type (see groupType). Matchers
+        are compiled once per selection of types.
+        :param fileTypes: types of files
+        :type fileTypes: list
+        :rtype: re.Pattern
+        """
+        key = tuple(sorted(fileTypes))
+        with self.lock:
+            if key not in self.matchers:
+                groups = []
+                for t in key:
+                    alternatives = [bytesPattern(bytes.fromhex(r["Header"]), r["HeaderMask"], r["CaseSensitive"])
+                                    for r in self.select([t])]
+                    if alternatives:
+                        name = groupName(t).encode("ascii")
+                        groups.append(b"(?P<%s>%s)" % (name, b"|".join(alternatives)))
+                self.matchers[key] = re.compile(b"|".join(groups), re.DOTALL) if groups else None
+            return self.matchers[key]
+
+    def groupType(self, group):
+        """
+        Helper function to get the type of a group of a matcher.
+        :param group: name of the group
+        :type group: str
+        :rtype: str
+        """
+        return self.groups.get(group)
+
+    def scalpelConfig(self, fileTypes):
+        """
+        Get the content of a Scalpel configuration file with the rules of
+        the given types.
+        :param fileTypes: types of files
+        :type fileTypes: list
+        :rtype: str
+        """
+        return "".join(r["Line"] + "\n" for r in self.select(fileTypes))
+
+    def makeJobConfig(self, fileTypes):
+        """
+        Write the Scalpel configuration of a job in a new private
+        temporary folder, so that several carves can run at the same time.
+        The folder must be removed with removeJobConfig.
+        :param fileTypes: types of files
+        :type fileTypes: list
+        :return configPath: path of the configuration file
+        :rtype configPath: str
+        """
+        jobDir = tempfile.mkdtemp(prefix="pycarver_job_")
+        configPath = path.join(jobDir, "scalpel.conf")
+        with open(configPath, "w") as fp:
+            fp.write(self.scalpelConfig(fileTypes))
+        return configPath
+
+
+def removeJobConfig(configPath):
+    """
+    Remove the private folder of a job configuration.
+    :param configPath: path returned by SignatureDB.makeJobConfig
+    :type configPath: str
+    """
+    shutil.rmtree(path.dirname(configPath), ignore_errors=True)
+
+
+def sourceStamp(filePath):
+    """
+    Helper function to identify the version of a signatures file.
+    :param filePath: path of the file
+    :type filePath: str
+    :rtype: list
+    """
+    try:
+        st = stat(filePath)
+        return [filePath, st.st_mtime, st.st_size]
+    except OSError:
+        return [filePath, None, None]
+
+
+def loadRules(sources):
+    """
+    Read the rules of every source. A type defined in a source replaces
+    the rules of that type read before.
+    :param sources: list of (path, commented)
+    :type sources: list
+    :rtype: list
+    """
+    rules = parseRules(DEFAULT_SIGNATURES)
+    for rule in rules:
+        rule["Source"] = "default"
+    for filePath, commented in sources:
+        if not path.isfile(filePath):
+            continue
+        with open(filePath, "r", errors="replace") as fp:
+            newRules = parseRules(fp.read(), commented)
+        for rule in newRules:
+            rule["Source"] = filePath
+        replaced = set(r["Type"] for r in newRules)
+        rules = [r for r in rules if r["Type"] not in replaced] + newRules
+    return rules
+
+
+_db = None
+_dbLock = threading.Lock()
+
+
+def loadSignatures(userPath=USER_SIGNATURES, scalpelPath=SCALPEL_CONF, cachePath=CACHE_PATH):
+    """
+    Get the signature registry. The rules are parsed once per process and
+    cached on disk until one of the signature files changes.
+    :param userPath: signatures file of the user
+    :param scalpelPath: configuration of Scalpel
+    :param cachePath: path of the cache
+    :type userPath: str
+    :type scalpelPath: str
+    :type cachePath: str
+    :rtype: SignatureDB
+    """
+    global _db
+
+    sources = [(scalpelPath, True), (userPath, False)]
+    stamps = [sourceStamp(p) for p, commented in sources]
+
+    with _dbLock:
+        if _db is not None and _db.stamps == stamps:
+            return _db
+
+        rules = None
+        try:
+            with open(cachePath, "r") as fp:
+                cache = json.load(fp)
+            if cache.get("Sources") == stamps and cache.get("Defaults") == DEFAULT_SIGNATURES:
+                rules = cache["Rules"]
+        except (IOError, ValueError):
+            pass
+
+        if rules is None:
+            rules = loadRules(sources)
+            try:
+                makedirs(path.dirname(cachePath), exist_ok=True)
+                with open(cachePath + ".tmp", "w") as fp:
+                    json.dump({"Sources": stamps, "Defaults": DEFAULT_SIGNATURES, "Rules": rules}, fp)
+                replace(cachePath + ".tmp", cachePath)
+            except OSError:
+                pass
+
+        _db = SignatureDB(rules)
+        _db.stamps = stamps
+        return _db
@@ -0,0 +1,358 @@
+"""
+Full-text inverted index of the recovered and carved files.
+
+The text of each file is extracted in a process pool:
+    the printable runs of the file, in ASCII and in UTF-16LE (as strings
+    does), so documents of any format give their text
+    the FlateDecode streams of PDF files, inflated
+    the XML parts of ZIP based documents (docx, xlsx, pptx, odt...)
+and cut in lower case tokens. The index is a SQLite database holding the
+files, the terms and the postings (term, file, count), so a query only
+reads the postings of its terms. Files are indexed again only when their
+size or modification time changed, so an output folder can be indexed
+again each time a tool wrote new results in it.
+
+Terms are runs of 3 to 32 letters and digits. Queries are words that must
+all be in a file, "word*" for a prefix and "-word" for a word that must not
+be in it. The files are ranked by the
+number of times the words are found.
+
+Usage:
+    index = openIndex(path.join(outFolder, "text_index.sqlite"))
+    index.updateFolder(path.join(outFolder, "out_partition"))
+    results = index.search("invoice 2017* -draft")
+"""
+
+import io
+import re
+import zlib
+import sqlite3
+import zipfile
+import threading
+from os import walk, sep, path, stat, cpu_count
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from metrics import metrics
+
+
+# Bytes of a file read to extract its text
+MAX_TEXT_BYTES = 32 * 1024 * 1024
+
+# Distinct terms kept for a file, the most frequent first
+MAX_TERMS = 50000
+
+TOKEN = re.compile(rb"[a-z0-9]{3,32}")
+ASCII_RUN = re.compile(rb"[\x20-\x7e\t\r\n]{4,}")
+UTF16_RUN = re.compile(rb"(?:[\x20-\x7e\t\r\n]\x00){4,}")
+PDF_STREAM = re.compile(rb"stream\r?\n(.*?)endstream", re.DOTALL)
+XML_TAG = re.compile(rb"<[^>]*>")
+
+# Files written at the same time are indexed in one transaction
+BATCH = 500
+
+
+def textParts(data):
+    """
+    Helper function to get the pieces of text of the content of a file.
+    :param data: content of the file
+    :type data: bytes
+    :return parts: generator of bytes
+    """
+    for match in ASCII_RUN.finditer(data):
+        yield match.group()
+    for match in UTF16_RUN.finditer(data):
+        yield match.group()[::2]
+
+    if data.startswith(b"%PDF"):
+        for match in PDF_STREAM.finditer(data):
+            try:
+                inflated = zlib.decompressobj().decompress(match.group(1), MAX_TEXT_BYTES)
+            except zlib.error:
+                continue
+            for run in ASCII_RUN.finditer(inflated):
+                yield run.group()
+
+    elif data.startswith(b"PK\x03\x04"):
+        try:
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for info in archive.infolist():
+                    if info.filename.endswith(".xml") and info.file_size <= MAX_TEXT_BYTES:
+                        yield XML_TAG.sub(b" ", archive.read(info))
+        except (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError, RuntimeError):
+            pass
+
+
+def extractTerms(filePath):
+    """
+    Get the terms of a file, in a worker process.
+    :param filePath: path of the file
+    :type filePath: str
+    :return result: Path, Size, Mtime and Terms (term -> count), or
+                    Error if the file can not be read
+    :rtype result: dict
+    """
+    result = {"Path": filePath, "Terms": {}}
+    try:
+        info = stat(filePath)
+        result["Size"], result["Mtime"] = info.st_size, int(info.st_mtime)
+        with open(filePath, "rb") as fp:
+            data = fp.read(MAX_TEXT_BYTES)
+    except OSError as err:
+        result["Error"] = str(err)
+        return result
+
+    counts = Counter()
+    for part in textParts(data):
+        counts.update(TOKEN.findall(part.lower()))
+    result["Terms"] = {t.decode("ascii"): n for t, n in counts.most_common(MAX_TERMS)}
+    return result
+
+
+def parseQuery(query):
+    """
+    Helper function to split a query in the words to find and to leave
+    out.
+    :param query: words, "word*" and "-word"
+    :type query: str
+    :return include: list of (word, prefix)
+    :return exclude: list of (word, prefix)
+    :rtype include: list
+    :rtype exclude: list
+    """
+    include, exclude = [], []
+    for word in query.lower().split():
+        target = exclude if word.startswith("-") else include
+        word = word.lstrip("-")
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        # The same tokens as the files, e.g. "e-mail" is "mail"
+        for token in TOKEN.findall(word.encode("ascii", "ignore")):
+            target.append((token.decode("ascii"), prefix))
+    return include, exclude
+
+
+class TextIndex:
+    """ Inverted index of the text of files, stored in SQLite. """
+
+    def __init__(self, dbPath):
+        """
+        :param dbPath: path of the database
+        :type dbPath: str
+        """
+        self.dbPath = dbPath
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(dbPath, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, "
+                        "size INTEGER, mtime INTEGER)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS terms (id INTEGER PRIMARY KEY, term TEXT UNIQUE)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS postings (termId INTEGER, fileId INTEGER, count INTEGER, "
+                        "PRIMARY KEY (termId, fileId)) WITHOUT ROWID")
+        self.db.execute("CREATE INDEX IF NOT EXISTS postings_file ON postings (fileId)")
+        self.db.commit()
+
+        # Ids of the terms, loaded when files are added
+        self.termIds = None
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def changed(self, paths):
+        """
+        Get the files that are not in the index or changed since they
+        were indexed.
+        :param paths: paths of the files
+        :type paths: list
+        :rtype: list
+        """
+        with self.lock:
+            known = {p: (s, m) for p, s, m in self.db.execute("SELECT path, size, mtime FROM files")}
+        out = []
+        for p in paths:
+            try:
+                info = stat(p)
+            except OSError:
+                continue
+            if known.get(p) != (info.st_size, int(info.st_mtime)):
+                out.append(p)
+        return out
+
+    def removeFiles(self, paths):
+        """
+        Remove files from the index.
+        :param paths: paths of the files
+        :type paths: list
+        """
+        with self.lock:
+            for p in paths:
+                row = self.db.execute("SELECT id FROM files WHERE path = ?", (p,)).fetchone()
+                if row is not None:
+                    self.db.execute("DELETE FROM postings WHERE fileId = ?", row)
+                    self.db.execute("DELETE FROM files WHERE id = ?", row)
+            self.db.commit()
+
+    def write(self, results):
+        """
+        Helper function to write the terms of files in one transaction,
+        replacing what was indexed before for the same paths.
+        :param results: results of extractTerms
+        :type results: list
+        """
+        with self.lock:
+            if self.termIds is None:
+                self.termIds = dict(self.db.execute("SELECT term, id FROM terms"))
+            for result in results:
+                row = self.db.execute("SELECT id FROM files WHERE path = ?", (result["Path"],)).fetchone()
+                if row is not None:
+                    self.db.execute("DELETE FROM postings WHERE fileId = ?", row)
+                    self.db.execute("DELETE FROM files WHERE id = ?", row)
+                if "Error" in result:
+                    continue
+
+                fileId = self.db.execute("INSERT INTO files (path, size, mtime) VALUES (?, ?, ?)",
+                                         (result["Path"], result["Size"], result["Mtime"])).lastrowid
+                rows = []
+                for term, count in result["Terms"].items():
+                    termId = self.termIds.get(term)
+                    if termId is None:
+                        termId = self.db.execute("INSERT INTO terms (term) VALUES (?)", (term,)).lastrowid
+                        self.termIds[term] = termId
+                    rows.append((termId, fileId, count))
+                self.db.executemany("INSERT INTO postings (termId, fileId, count) VALUES (?, ?, ?)", rows)
+            self.db.commit()
+
+    def addFiles(self, paths, workers=None):
+        """
+        Index the files that are new or changed, with a process pool.
+        :param paths: paths of the files
+        :param workers: number of processes, by default one per CPU
+        :type paths: list
+        :type workers: int
+        :return count: number of files indexed
+        :rtype count: int
+        """
+        paths = self.changed(paths)
+        if not paths:
+            return 0
+
+        with metrics.stage("textIndex") as m:
+            batch = []
+            with ProcessPoolExecutor(max_workers=workers or cpu_count()) as pool:
+                for result in pool.map(extractTerms, paths, chunksize=16):
+                    batch.append(result)
+                    m["Bytes"] += min(result.get("Size", 0), MAX_TEXT_BYTES)
+                    if len(batch) >= BATCH:
+                        self.write(batch)
+                        batch = []
+            self.write(batch)
+            m["Items"] = len(paths)
+        return len(paths)
+
+    def updateFolder(self, folder, workers=None):
+        """
+        Bring the index of a folder up to date: the new and changed files
+        are indexed and the files deleted from the folder are removed.
+        :param folder: output folder of a tool
+        :param workers: number of processes
+        :type folder: str
+        :type workers: int
+        :return count: number of files indexed
+        :rtype count: int
+        """
+        paths = []
+        for (dirpath, dirnames, filenames) in walk(folder):
+            for f in filenames:
+                paths.append(dirpath + sep + f)
+
+        prefix = folder.rstrip(sep) + sep
+        with self.lock:
+            indexed = [p for (p,) in self.db.execute("SELECT path FROM files WHERE path >= ? AND path < ?",
+                                                     (prefix, prefix[:-1] + chr(ord(sep) + 1)))]
+        present = set(paths)
+        self.removeFiles([p for p in indexed if p not in present])
+        return self.addFiles(paths, workers)
+
+    def termIdsOf(self, word, prefix):
+        """
+        Helper function to get the ids of the terms of a query word.
+        :type word: str
+        :type prefix: bool
+        :rtype: list
+        """
+        if prefix:
+            rows = self.db.execute("SELECT id FROM terms WHERE term >= ? AND term < ?",
+                                   (word, word[:-1] + chr(ord(word[-1]) + 1)))
+        else:
+            rows = self.db.execute("SELECT id FROM terms WHERE term = ?", (word,))
+        return [r[0] for r in rows]
+
+    def search(self, query, limit=1000):
+        """
+        Get the files matching a query, the best first.
+        :param query: words, "word*" and "-word"
+        :param limit: maximum number of files
+        :type query: str
+        :type limit: int
+        :return results: dictionaries with Path, Size and Score
+        :rtype results: list
+        """
+        include, exclude = parseQuery(query)
+        if not include:
+            return []
+
+        with self.lock:
+            groups = [self.termIdsOf(word, prefix) for word, prefix in include]
+            if not all(groups):
+                return []
+            excluded = [i for word, prefix in exclude for i in self.termIdsOf(word, prefix)]
+
+            # Postings of the query terms, tagged with the word they match.
+            # CROSS JOIN keeps SQLite from walking every posting in file
+            # order to save the sort of the GROUP BY
+            self.db.execute("CREATE TEMP TABLE IF NOT EXISTS query (termId INTEGER, word INTEGER)")
+            self.db.execute("DELETE FROM query")
+            self.db.executemany("INSERT INTO query VALUES (?, ?)",
+                                [(termId, n) for n, ids in enumerate(groups) for termId in ids])
+
+            sql = ("SELECT f.path, f.size, s.score FROM (SELECT p.fileId, SUM(p.count) AS score "
+                   "FROM query q CROSS JOIN postings p ON p.termId = q.termId GROUP BY p.fileId "
+                   "HAVING COUNT(DISTINCT q.word) = ?) s JOIN files f ON f.id = s.fileId")
+            params = [len(groups)]
+            if excluded:
+                sql += " WHERE s.fileId NOT IN (SELECT fileId FROM postings WHERE termId IN (%s))" % \
+                       ", ".join("?" * len(excluded))
+                params += excluded
+            sql += " ORDER BY s.score DESC LIMIT ?"
+            params.append(limit)
+            rows = self.db.execute(sql, params).fetchall()
+        return [{"Path": p, "Size": s, "Score": score} for p, s, score in rows]
+
+    def stats(self):
+        """
+        Get the number of files, terms and postings of the index.
+        :rtype: dict
+        """
+        with self.lock:
+            return {name: self.db.execute("SELECT COUNT(*) FROM " + name).fetchone()[0]
+                    for name in ("files", "terms", "postings")}
+
+
+# Indexes opened by this process, shared by the GUI and the batch jobs
+indexes = {}
+indexesLock = threading.Lock()
+
+
+def openIndex(dbPath):
+    """
+    Get the index stored at a path, opened once per process.
+    :param dbPath: path of the database
+    :type dbPath: str
+    :rtype: TextIndex
+    """
+    dbPath = path.abspath(dbPath)
+    with indexesLock:
+        if dbPath not in indexes:
+            indexes[dbPath] = TextIndex(dbPath)
+        return indexes[dbPath]
@@ -0,0 +1,290 @@
+"""
+Asyncio based runner for the external forensic tools used by PyCarver
+(scalpel, tsk_recover, mmls, md5sum, dd, fsstat, ...).
+
+All the tools are launched with asyncio.create_subprocess_exec from one
+event loop running in a background thread, so hundreds of tools can run
+at the same time without a thread per process. Each tool has its own
+concurrency limit, all the tools share the process limit of the
+governor (governor.py), and the output of the tools can be streamed line by
+line while they run, or written to a file for the tools writing binary
+data (icat). The tools reading the partition table or the file system
+(mmls, fsstat, fls, ...) and md5 have a default timeout, see TIMEOUTS;
+the tools reading a whole partition to write files (scalpel, tsk_recover,
+dd) have none and are expected to stream their output instead.
+
+The GUI and the worker threads use the blocking runTool function, code
+running in an event loop can await ToolRunner.run directly.
+
+Usage:
+    python toolrunner.py TOOL_PATH [ARGS...]
+"""
+
+import sys
+import time
+import asyncio
+import threading
+from os import cpu_count, path
+
+from metrics import metrics
+from governor import governor
+
+
+# Default number of processes of the same tool running at the same time
+DEFAULT_LIMIT = max(2, cpu_count() or 1)
+
+# Default timeout of the tools in seconds, the others have no timeout
+TIMEOUTS = {"mmls": 300, "fsstat": 300, "fls": 3600, "blkls": 3600, "md5": 12 * 3600}
+
+# Bytes read at once from the output of a tool
+READ_SIZE = 65536
+
+# Longest line passed to onLine, longer lines are passed in pieces
+MAX_LINE = 65536
+
+
+class ToolRunner:
+    """ Launch external tools from an asyncio event loop. """
+
+    def __init__(self, limits=None, timeouts=TIMEOUTS, timeout=None):
+        """
+        Setup the runner.
+        :param limits:  Maximum number of concurrent processes per tool
+        :param timeouts: Default timeout in seconds per tool
+        :param timeout: Default timeout of the other tools, None for no
+                        timeout
+        :type limits:   dict
+        :type timeouts: dict
+        :type timeout:  float
+        """
+        self.limits = dict(limits or {})
+        self.timeouts = dict(timeouts or {})
+        self.timeout = timeout
+        self.semaphores = {}
+        self.loop = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def setLimit(self, tool, limit):
+        """
+        Change the maximum number of concurrent processes of a tool. It
+        applies to the processes launched after the change.
+        :param tool: name of the tool
+        :param limit: maximum number of processes
+        :type tool: str
+        :type limit: int
+        """
+        self.limits[tool] = limit
+        self.semaphores.pop(tool, None)
+
+    def semaphore(self, tool):
+        """
+        Helper function to get the semaphore of a tool.
+        :param tool: name of the tool
+        :type tool: str
+        :rtype: asyncio.Semaphore
+        """
+        if tool not in self.semaphores:
+            self.semaphores[tool] = asyncio.Semaphore(self.limits.get(tool, DEFAULT_LIMIT))
+        return self.semaphores[tool]
+
+    async def run(self, tool, cmd, timeout=None, onLine=None, stdin=None, stdoutPath=None):
+        """
+        Run a tool and wait for it to finish.
+        :param tool:    Name of the tool, used for its concurrency limit
+        :param cmd:     Command to run (path of the tool and arguments)
+        :param timeout: Seconds before the tool is killed, the default
+                        of the tool if None
+        :param onLine:  Function called as onLine(stream, line) for each
+                        line written by the tool, stream is "stdout" or
+                        "stderr". Lines end with "\\n" or "\\r" (progress
+                        lines)
+        :param stdin:   Bytes to write to the standard input of the tool
+        :param stdoutPath: File where the standard output is written,
+                        instead of Stdout
+        :type tool:     str
+        :type cmd:      list
+        :type timeout:  float
+        :type onLine:   function
+        :type stdin:    bytes
+        :type stdoutPath: str
+        :return result: dictionary with Args, ReturnCode, Stdout, Stderr,
+                        TimedOut and Duration
+        :rtype result:  dict
+        """
+        if timeout is None:
+            timeout = self.timeouts.get(tool, self.timeout)
+
+        result = {"Tool": tool, "Args": list(cmd), "ReturnCode": None, "Stdout": "",
+                  "Stderr": "", "TimedOut": False, "Duration": 0.0}
+
+        async with self.semaphore(tool):
+            # The slot of the governor is waited for in a thread, so the
+            # other tools keep running
+            await asyncio.get_running_loop().run_in_executor(None, governor.acquireProcess)
+            try:
+                return await self.runProcess(tool, cmd, timeout, onLine, stdin, result, stdoutPath)
+            finally:
+                governor.releaseProcess()
+
+    async def runProcess(self, tool, cmd, timeout, onLine, stdin, result, stdoutPath=None):
+        """
+        Helper function of run: launch the process and read its output.
+        :return result: see ToolRunner.run
+        :rtype result: dict
+        """
+        start = time.time()
+        out = None
+        try:
+            if stdoutPath is not None:
+                out = open(stdoutPath, "wb")
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdout=out if out is not None else asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                stdin=asyncio.subprocess.PIPE if stdin is not None else asyncio.subprocess.DEVNULL)
+        except OSError as err:
+            if out is not None:
+                out.close()
+            result["Stderr"] = "%s: %s" % (cmd[0], err)
+            return result
+
+        stdoutChunks = []
+        stderrChunks = []
+
+        async def readStream(stream, name, chunks):
+            # Read in blocks rather than with readline: a tool may write
+            # more than the limit of the stream without a newline (the
+            # progress of Scalpel is written with "\r")
+            pending = b""
+            while True:
+                chunk = await stream.read(READ_SIZE)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                if onLine is None:
+                    continue
+                pending += chunk
+                end = max(pending.rfind(b"\n"), pending.rfind(b"\r")) + 1
+                if end == 0 and len(pending) < MAX_LINE:
+                    continue
+                if end == 0:
+                    end = len(pending)
+                for line in pending[:end].splitlines(keepends=True):
+                    onLine(name, line.decode("utf-8", errors="replace"))
+                pending = pending[end:]
+            if pending and onLine is not None:
+                onLine(name, pending.decode("utf-8", errors="replace"))
+
+        async def communicate():
+            if stdin is not None:
+                proc.stdin.write(stdin)
+                await proc.stdin.drain()
+                proc.stdin.close()
+            if out is None:
+                await asyncio.gather(readStream(proc.stdout, "stdout", stdoutChunks),
+                                     readStream(proc.stderr, "stderr", stderrChunks))
+            else:
+                await readStream(proc.stderr, "stderr", stderrChunks)
+            return await proc.wait()
+
+        error = None
+        try:
+            result["ReturnCode"] = await asyncio.wait_for(communicate(), timeout)
+        except asyncio.TimeoutError:
+            result["TimedOut"] = True
+            error = "%s: killed after %d seconds" % (cmd[0], timeout)
+        except Exception as err:
+            # e.g. the tool closed its input, or onLine failed
+            error = "%s: %s" % (cmd[0], err)
+        finally:
+            # The tool never outlives its result, even when the caller is
+            # cancelled
+            if proc.returncode is None:
+                try:
+                    proc.kill()
+                except ProcessLookupError:
+                    pass
+                await proc.wait()
+            if out is not None:
+                out.close()
+
+        result["Stdout"] = b"".join(stdoutChunks).decode("utf-8", errors="replace")
+        result["Stderr"] = b"".join(stderrChunks).decode("utf-8", errors="replace")
+        if error is not None:
+            result["Stderr"] += ("\n" if result["Stderr"] else "") + error
+        result["Duration"] = time.time() - start
+
+        metrics.observe("tool:" + tool, result["Duration"])
+
+        return result
+
+    def getLoop(self):
+        """
+        Get the event loop running in the background thread, starting it
+        if needed.
+        :rtype: asyncio.AbstractEventLoop
+        """
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever,
+                                               name="toolrunner", daemon=True)
+                self.thread.start()
+        return self.loop
+
+    def submit(self, tool, cmd, timeout=None, onLine=None, stdin=None, stdoutPath=None):
+        """
+        Run a tool in the background event loop without waiting for it.
+        :return future: future with the result of ToolRunner.run
+        :rtype future: concurrent.futures.Future
+        """
+        return asyncio.run_coroutine_threadsafe(self.run(tool, cmd, timeout, onLine, stdin, stdoutPath),
+                                                self.getLoop())
+
+    def runSync(self, tool, cmd, timeout=None, onLine=None, stdin=None, stdoutPath=None):
+        """
+        Run a tool in the background event loop and wait for its result.
+        It must not be called from the event loop itself.
+        :return result: see ToolRunner.run
+        :rtype result: dict
+        """
+        return self.submit(tool, cmd, timeout, onLine, stdin, stdoutPath).result()
+
+
+# Runner shared by all of PyCarver, with the default timeouts
+runner = ToolRunner()
+
+
+def runTool(tool, cmd, timeout=None, onLine=None, stdin=None, stdoutPath=None):
+    """
+    Run a tool with the shared runner and wait for its result.
+    :param tool:    Name of the tool, used for its concurrency limit
+    :param cmd:     Command to run (path of the tool and arguments)
+    :param timeout: Seconds before the tool is killed, the default of
+                    the tool (see TIMEOUTS) if None
+    :param onLine:  Function called for each line written by the tool
+    :param stdin:   Bytes to write to the standard input of the tool
+    :param stdoutPath: File where the standard output is written
+    :type tool:     str
+    :type cmd:      list
+    :type timeout:  float
+    :type onLine:   function
+    :type stdin:    bytes
+    :type stdoutPath: str
+    :return result: see ToolRunner.run
+    :rtype result:  dict
+    """
+    return runner.runSync(tool, cmd, timeout, onLine, stdin, stdoutPath)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    def printLine(stream, line):
+        out = sys.stdout if stream == "stdout" else sys.stderr
+        out.write(line)
+        out.flush()
+
+    res = asyncio.run(ToolRunner().run(path.basename(sys.argv[1]), sys.argv[1:], onLine=printLine))
+    sys.exit(res["ReturnCode"] if res["ReturnCode"] is not None else 1)
@@ -0,0 +1,444 @@
+"""
+Unallocated space of a partition, to carve only the deleted data.
+
+Carving the whole partition finds every live file again. The allocation
+bitmap of the file system tells which blocks are not used by any file:
+    ext2/3/4: the block bitmap of each block group
+    FAT12/16/32: the clusters marked free in the first FAT
+    NTFS: the $Bitmap file, found through the MFT
+Other file systems are read with blkls (The Sleuth Kit), which lists the
+unallocated blocks.
+
+The ranges are byte offsets in the partition. The built-in carver
+searches them directly, so its hits are already partition offsets. For
+Scalpel the ranges are copied into one file, as blkls does, and the
+offsets of its audit file are mapped back to the partition.
+"""
+
+import re
+import bisect
+import struct
+from os import path
+
+from toolrunner import runTool
+
+
+class UnknownFileSystem(Exception):
+    """ Raised when no allocation map can be read. """
+
+
+NOT_FULL = re.compile(rb"[^\xff]")
+NOT_EMPTY = re.compile(rb"[^\x00]")
+
+
+def freeRuns(bitmap, count):
+    """
+    Get the runs of free (zero) bits of an allocation bitmap, bit 0 of
+    byte 0 first. Bytes where nothing changes are skipped with a regex.
+    :param bitmap: the bitmap
+    :param count: number of bits used
+    :type bitmap: bytes
+    :type count: int
+    :return runs: list of (first bit, number of bits)
+    :rtype runs: list
+    """
+    runs = []
+    start = None
+    pos = 0
+    size = min(len(bitmap), (count + 7) // 8)
+    while pos < size:
+        match = (NOT_FULL if start is None else NOT_EMPTY).search(bitmap, pos, size)
+        if match is None:
+            break
+        pos = match.start()
+        byte = bitmap[pos]
+        for bit in range(8):
+            n = pos * 8 + bit
+            if n >= count:
+                break
+            free = not (byte >> bit) & 1
+            if free and start is None:
+                start = n
+            elif not free and start is not None:
+                runs.append((start, n - start))
+                start = None
+        pos += 1
+
+    if start is not None:
+        runs.append((start, min(count, size * 8) - start))
+    return runs
+
+
+def mergeRanges(ranges):
+    """
+    Helper function to sort byte ranges and merge the adjacent ones.
+    :param ranges: list of (start, end)
+    :type ranges: list
+    :rtype: list
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        elif end > start:
+            merged.append((start, end))
+    return merged
+
+
+def extRanges(fp):
+    """
+    Unallocated ranges of an ext2/3/4 file system.
+    :param fp: the partition, opened in binary mode
+    :rtype: list
+    """
+    fp.seek(1024)
+    sb = fp.read(1024)
+    if len(sb) < 1024 or struct.unpack_from("<H", sb, 56)[0] != 0xEF53:
+        raise UnknownFileSystem("not ext")
+
+    blocksCount = struct.unpack_from("<I", sb, 4)[0]
+    firstBlock, logSize = struct.unpack_from("<II", sb, 20)
+    perGroup = struct.unpack_from("<I", sb, 32)[0]
+    incompat = struct.unpack_from("<I", sb, 96)[0]
+    is64 = incompat & 0x80
+    descSize = (struct.unpack_from("<H", sb, 254)[0] or 32) if is64 else 32
+    if is64:
+        blocksCount |= struct.unpack_from("<I", sb, 336)[0] << 32
+    blockSize = 1024 << logSize
+
+    groups = -(-(blocksCount - firstBlock) // perGroup)
+    fp.seek((firstBlock + 1) * blockSize)
+    descs = fp.read(groups * max(32, descSize))
+
+    ranges = []
+    for g in range(groups):
+        desc = descs[g * descSize:(g + 1) * descSize]
+        bitmapBlock = struct.unpack_from("<I", desc, 0)[0]
+        if is64 and descSize >= 64:
+            bitmapBlock |= struct.unpack_from("<I", desc, 32)[0] << 32
+        flags = struct.unpack_from("<H", desc, 18)[0]
+
+        first = firstBlock + g * perGroup
+        count = min(perGroup, blocksCount - first)
+
+        # Block bitmap not initialised: no block of the group is used
+        if flags & 0x2:
+            runs = [(0, count)]
+        else:
+            fp.seek(bitmapBlock * blockSize)
+            runs = freeRuns(fp.read(blockSize), count)
+
+        for start, n in runs:
+            ranges.append(((first + start) * blockSize, (first + start + n) * blockSize))
+
+    return ranges
+
+
+def fatRanges(fp):
+    """
+    Unallocated ranges of a FAT12/16/32 file system.
+    :param fp: the partition, opened in binary mode
+    :rtype: list
+    """
+    fp.seek(0)
+    boot = fp.read(512)
+    if len(boot) < 512 or boot[510:512] != b"\x55\xaa" or boot[0] not in (0xEB, 0xE9):
+        raise UnknownFileSystem("not FAT")
+
+    bps, spc, reserved, fats, rootEntries, total16 = struct.unpack_from("<HBHBHH", boot, 11)
+    fatSize16 = struct.unpack_from("<H", boot, 22)[0]
+    total32, fatSize32 = struct.unpack_from("<I", boot, 32)[0], struct.unpack_from("<I", boot, 36)[0]
+    if not bps or not spc or not fats:
+        raise UnknownFileSystem("not FAT")
+
+    fatSize = fatSize16 or fatSize32
+    total = total16 or total32
+    rootSectors = (rootEntries * 32 + bps - 1) // bps
+    firstData = reserved + fats * fatSize + rootSectors
+    clusters = (total - firstData) // spc
+
+    fp.seek(reserved * bps)
+    fat = fp.read(fatSize * bps)
+
+    if clusters < 4085:
+        def entry(c):
+            v = struct.unpack_from("<H", fat, c + c // 2)[0]
+            return v >> 4 if c & 1 else v & 0xFFF
+    elif clusters < 65525:
+        def entry(c):
+            return struct.unpack_from("<H", fat, c * 2)[0]
+    else:
+        def entry(c):
+            return struct.unpack_from("<I", fat, c * 4)[0] & 0x0FFFFFFF
+
+    clusterSize = spc * bps
+    ranges = []
+    start = None
+    for c in range(2, clusters + 2):
+        free = entry(c) == 0
+        if free and start is None:
+            start = c
+        elif not free and start is not None:
+            ranges.append((start, c))
+            start = None
+    if start is not None:
+        ranges.append((start, clusters + 2))
+
+    base = firstData * bps
+    return [(base + (a - 2) * clusterSize, base + (b - 2) * clusterSize) for a, b in ranges]
+
+
+def ntfsRuns(runlist):
+    """
+    Helper function to decode the runlist of a non-resident attribute.
+    :param runlist: the encoded runs
+    :type runlist: bytes
+    :return runs: list of (first cluster, number of clusters), None for
+                  the first cluster of a sparse run
+    :rtype runs: list
+    """
+    runs = []
+    pos = 0
+    lcn = 0
+    while pos < len(runlist) and runlist[pos]:
+        header = runlist[pos]
+        lengthSize, offsetSize = header & 0x0F, header >> 4
+        pos += 1
+        length = int.from_bytes(runlist[pos:pos + lengthSize], "little")
+        pos += lengthSize
+        if offsetSize:
+            lcn += int.from_bytes(runlist[pos:pos + offsetSize], "little", signed=True)
+            runs.append((lcn, length))
+        else:
+            runs.append((None, length))
+        pos += offsetSize
+    return runs
+
+
+def ntfsRanges(fp):
+    """
+    Unallocated ranges of an NTFS file system, from its $Bitmap file.
+    :param fp: the partition, opened in binary mode
+    :rtype: list
+    """
+    fp.seek(0)
+    boot = fp.read(512)
+    if boot[3:11] != b"NTFS    ":
+        raise UnknownFileSystem("not NTFS")
+
+    bps, spc = struct.unpack_from("<HB", boot, 11)
+    if spc > 128:
+        spc = 1 << (256 - spc)
+    clusterSize = bps * spc
+    totalSectors, mftCluster = struct.unpack_from("<QQ", boot, 40)
+    recordValue = struct.unpack_from("<b", boot, 64)[0]
+    recordSize = 1 << -recordValue if recordValue < 0 else recordValue * clusterSize
+    clusters = totalSectors // spc
+
+    # $Bitmap is the record 6 of the MFT, the first records are contiguous
+    fp.seek(mftCluster * clusterSize + 6 * recordSize)
+    record = bytearray(fp.read(recordSize))
+    if record[0:4] != b"FILE":
+        raise UnknownFileSystem("bad MFT record")
+
+    usaOffset, usaCount = struct.unpack_from("<HH", record, 4)
+    for i in range(1, usaCount):
+        end = i * 512
+        record[end - 2:end] = record[usaOffset + 2 * i:usaOffset + 2 * i + 2]
+
+    bitmap = None
+    pos = struct.unpack_from("<H", record, 20)[0]
+    while pos + 16 <= len(record):
+        kind, length = struct.unpack_from("<II", record, pos)
+        if kind == 0xFFFFFFFF or length == 0:
+            break
+        nonResident, nameLength = record[pos + 8], record[pos + 9]
+        if kind == 0x80 and nameLength == 0:
+            if nonResident:
+                runsOffset = struct.unpack_from("<H", record, pos + 32)[0]
+                size = struct.unpack_from("<Q", record, pos + 48)[0]
+                data = b""
+                for lcn, n in ntfsRuns(bytes(record[pos + runsOffset:pos + length])):
+                    if lcn is None:
+                        data += b"\0" * (n * clusterSize)
+                    else:
+                        fp.seek(lcn * clusterSize)
+                        data += fp.read(n * clusterSize)
+                bitmap = data[:size]
+            else:
+                valueLength, valueOffset = struct.unpack_from("<IH", record, pos + 16)
+                bitmap = bytes(record[pos + valueOffset:pos + valueOffset + valueLength])
+            break
+        pos += length
+
+    if bitmap is None:
+        raise UnknownFileSystem("no $Bitmap data")
+
+    return [(start * clusterSize, (start + n) * clusterSize) for start, n in freeRuns(bitmap, clusters)]
+
+
+# NTFS is tried before FAT, their boot sectors look alike
+READERS = (("ext", extRanges), ("ntfs", ntfsRanges), ("fat", fatRanges))
+
+
+def blklsRanges(partitionPath, blklsPath):
+    """
+    Unallocated ranges of any file system known to The Sleuth Kit, from
+    the list of blocks of blkls -l.
+    :param partitionPath: path of the partition
+    :param blklsPath: path of blkls
+    :type partitionPath: str
+    :type blklsPath: str
+    :rtype: list
+    """
+    out = runTool("blkls", [blklsPath, "-l", partitionPath])
+    lines = out["Stdout"].splitlines()
+    if len(lines) < 2:
+        raise UnknownFileSystem(out["Stderr"].strip() or "blkls failed")
+
+    unit = int(lines[1].split("|")[-1])
+    ranges = []
+    for line in lines[2:]:
+        fields = line.split("|")
+        if len(fields) >= 2 and fields[0].isdigit() and fields[1] == "f":
+            block = int(fields[0])
+            if ranges and ranges[-1][1] == block * unit:
+                ranges[-1] = (ranges[-1][0], (block + 1) * unit)
+            else:
+                ranges.append((block * unit, (block + 1) * unit))
+    return ranges
+
+
+def unallocatedRanges(partitionPath, blklsPath=None):
+    """
+    Get the unallocated byte ranges of a partition, with the native
+    readers or with blkls.
+    :param partitionPath: path of the partition
+    :param blklsPath: path of blkls, used when no native reader works
+    :type partitionPath: str
+    :type blklsPath: str
+    :return fsName: name of the reader that was used
+    :return ranges: sorted list of (start, end)
+    :rtype fsName: str
+    :rtype ranges: list
+    """
+    size = path.getsize(partitionPath)
+    with open(partitionPath, "rb") as fp:
+        for name, reader in READERS:
+            try:
+                ranges = reader(fp)
+            except (UnknownFileSystem, struct.error, IndexError, ValueError, OverflowError):
+                continue
+            return name, mergeRanges((start, min(end, size)) for start, end in ranges if start < size)
+
+    if blklsPath:
+        return "blkls", mergeRanges(blklsRanges(partitionPath, blklsPath))
+
+    raise UnknownFileSystem("unknown file system in %s" % partitionPath)
+
+
+def intersectRanges(ranges, allowed):
+    """
+    Keep the parts of ranges that are in allowed, in the order of ranges.
+    :param ranges: list of (start, end), in any order
+    :param allowed: sorted and merged list of (start, end)
+    :type ranges: list
+    :type allowed: list
+    :rtype: list
+    """
+    starts = [a for a, b in allowed]
+    out = []
+    for start, end in ranges:
+        n = max(0, bisect.bisect_right(starts, start) - 1)
+        while n < len(allowed) and allowed[n][0] < end:
+            a, b = max(start, allowed[n][0]), min(end, allowed[n][1])
+            if a < b:
+                out.append((a, b))
+            n += 1
+    return out
+
+
+def extractRanges(partitionPath, ranges, outPath, chunkSize=4 * 1024 * 1024):
+    """
+    Copy the ranges of a partition, one after the other, into a file.
+    :param partitionPath: path of the partition
+    :param ranges: list of (start, end)
+    :param outPath: path of the file to write
+    :type partitionPath: str
+    :type ranges: list
+    :type outPath: str
+    :return size: number of bytes written
+    :rtype size: int
+    """
+    size = 0
+    with open(partitionPath, "rb") as src, open(outPath, "wb") as out:
+        for start, end in ranges:
+            src.seek(start)
+            left = end - start
+            while left > 0:
+                data = src.read(min(left, chunkSize))
+                if not data:
+                    break
+                out.write(data)
+                left -= len(data)
+                size += len(data)
+    return size
+
+
+def toPartitionOffset(ranges, offset, starts=None):
+    """
+    Map an offset in the file written by extractRanges back to the
+    partition.
+    :param ranges: the ranges given to extractRanges
+    :param offset: offset in the extracted file
+    :param starts: offsets of the ranges in the extracted file, computed
+                   if not given
+    :type ranges: list
+    :type offset: int
+    :type starts: list
+    :rtype: int
+    """
+    if starts is None:
+        starts = rangeStarts(ranges)
+    n = bisect.bisect_right(starts, offset) - 1
+    if n < 0:
+        return offset
+    return ranges[n][0] + offset - starts[n]
+
+
+def rangeStarts(ranges):
+    """
+    Helper function to get the offset of each range in the file written
+    by extractRanges.
+    :param ranges: the ranges given to extractRanges
+    :type ranges: list
+    :rtype: list
+    """
+    starts = []
+    pos = 0
+    for start, end in ranges:
+        starts.append(pos)
+        pos += end - start
+    return starts
+
+
+AUDIT_LINE = re.compile(r"^(\s*\S+\s+)(\d+)(\s+\S+\s+\d+)")
+
+
+def remapAudit(auditPath, ranges):
+    """
+    Rewrite the start offsets of a Scalpel audit file, carved from the
+    file written by extractRanges, as partition offsets.
+    :param auditPath: path of audit.txt
+    :param ranges: the ranges given to extractRanges
+    :type auditPath: str
+    :type ranges: list
+    """
+    with open(auditPath, "r", errors="replace") as fp:
+        lines = fp.readlines()
+
+    starts = rangeStarts(ranges)
+    with open(auditPath, "w") as fp:
+        for line in lines:
+            fp.write(AUDIT_LINE.sub(lambda m: m.group(1) + str(toPartitionOffset(ranges, int(m.group(2)), starts)) +
+                                    m.group(3), line))